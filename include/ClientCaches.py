@@ -1,5 +1,6 @@
 import ClientDefaults
 import ClientDownloading
+import ClientFiles
 import ClientNetworking
 import ClientRendering
 import ClientSearch
@@ -14,6 +15,7 @@ import HydrusSessions
 import itertools
 import json
 import os
+import Queue
 import random
 import requests
 import threading
@@ -28,180 +30,6 @@ import collections
 import HydrusTags
 import traceback
 
-# important thing here, and reason why it is recursive, is because we want to preserve the parent-grandparent interleaving
-def BuildServiceKeysToChildrenToParents( service_keys_to_simple_children_to_parents ):
-    
-    def AddParents( simple_children_to_parents, children_to_parents, child, parents ):
-        
-        for parent in parents:
-            
-            if parent not in children_to_parents[ child ]:
-                
-                children_to_parents[ child ].append( parent )
-                
-            
-            if parent in simple_children_to_parents:
-                
-                grandparents = simple_children_to_parents[ parent ]
-                
-                AddParents( simple_children_to_parents, children_to_parents, child, grandparents )
-                
-            
-        
-    
-    service_keys_to_children_to_parents = collections.defaultdict( HydrusData.default_dict_list )
-    
-    for ( service_key, simple_children_to_parents ) in service_keys_to_simple_children_to_parents.items():
-        
-        children_to_parents = service_keys_to_children_to_parents[ service_key ]
-        
-        for ( child, parents ) in simple_children_to_parents.items():
-            
-            AddParents( simple_children_to_parents, children_to_parents, child, parents )
-            
-        
-    
-    return service_keys_to_children_to_parents
-    
-def BuildServiceKeysToSimpleChildrenToParents( service_keys_to_pairs_flat ):
-    
-    service_keys_to_simple_children_to_parents = collections.defaultdict( HydrusData.default_dict_set )
-    
-    for ( service_key, pairs ) in service_keys_to_pairs_flat.items():
-        
-        service_keys_to_simple_children_to_parents[ service_key ] = BuildSimpleChildrenToParents( pairs )
-        
-    
-    return service_keys_to_simple_children_to_parents
-    
-def BuildSimpleChildrenToParents( pairs ):
-    
-    simple_children_to_parents = HydrusData.default_dict_set()
-    
-    for ( child, parent ) in pairs:
-        
-        if child == parent:
-            
-            continue
-            
-        
-        if LoopInSimpleChildrenToParents( simple_children_to_parents, child, parent ): continue
-        
-        simple_children_to_parents[ child ].add( parent )
-        
-    
-    return simple_children_to_parents
-    
-def CollapseTagSiblingPairs( groups_of_pairs ):
-    
-    # This now takes 'groups' of pairs in descending order of precedence
-    
-    # This allows us to mandate that local tags take precedence
-    
-    # a pair is invalid if:
-    # it causes a loop (a->b, b->c, c->a)
-    # there is already a relationship for the 'bad' sibling (a->b, a->c)
-    
-    valid_chains = {}
-    
-    for pairs in groups_of_pairs:
-        
-        pairs = list( pairs )
-        
-        pairs.sort()
-        
-        for ( bad, good ) in pairs:
-            
-            if bad == good:
-                
-                # a->a is a loop!
-                
-                continue
-                
-            
-            if bad not in valid_chains:
-                
-                we_have_a_loop = False
-                
-                current_best = good
-                
-                while current_best in valid_chains:
-                    
-                    current_best = valid_chains[ current_best ]
-                    
-                    if current_best == bad:
-                        
-                        we_have_a_loop = True
-                        
-                        break
-                        
-                    
-                
-                if not we_have_a_loop:
-                    
-                    valid_chains[ bad ] = good
-                    
-                
-            
-        
-    
-    # now we collapse the chains, turning:
-    # a->b, b->c ... e->f
-    # into
-    # a->f, b->f ... e->f
-    
-    siblings = {}
-    
-    for ( bad, good ) in valid_chains.items():
-        
-        # given a->b, want to find f
-        
-        if good in siblings:
-            
-            # f already calculated and added
-            
-            best = siblings[ good ]
-            
-        else:
-            
-            # we don't know f for this chain, so let's figure it out
-            
-            current_best = good
-            
-            while current_best in valid_chains:
-                
-                current_best = valid_chains[ current_best ] # pursue endpoint f
-                
-            
-            best = current_best
-            
-        
-        # add a->f
-        siblings[ bad ] = best
-        
-    
-    return siblings
-    
-def LoopInSimpleChildrenToParents( simple_children_to_parents, child, parent ):
-    
-    potential_loop_paths = { parent }
-    
-    while len( potential_loop_paths.intersection( simple_children_to_parents.keys() ) ) > 0:
-        
-        new_potential_loop_paths = set()
-        
-        for potential_loop_path in potential_loop_paths.intersection( simple_children_to_parents.keys() ):
-            
-            new_potential_loop_paths.update( simple_children_to_parents[ potential_loop_path ] )
-            
-        
-        potential_loop_paths = new_potential_loop_paths
-        
-        if child in potential_loop_paths: return True
-        
-    
-    return False
-    
 class ClientFilesManager( object ):
     
     def __init__( self, controller ):
@@ -215,8 +43,23 @@ class ClientFilesManager( object ):
         self._bad_error_occured = False
         self._missing_locations = set()
         
+        self._thumbnail_blob_store = None
+        self._thumbnail_blob_store_lock = threading.Lock()
+        
         self._Reinit()
         
+        self._controller.sub( self, 'ClearThumbnailBlobStore', 'thumbnail_resize' )
+        
+    
+    def _DiscardStoredThumbnails( self, hashes ):
+        
+        thumbnail_blob_store = self._GetThumbnailBlobStore()
+        
+        if thumbnail_blob_store is not None:
+            
+            thumbnail_blob_store.DiscardThumbnails( hashes )
+            
+        
     
     def _GenerateExpectedFilePath( self, hash, mime ):
         
@@ -290,6 +133,8 @@ class ClientFilesManager( object ):
         
         full_size_path = self._GenerateExpectedFullSizeThumbnailPath( hash )
         
+        self._DiscardStoredThumbnails( ( hash, ) )
+        
         try:
             
             with open( full_size_path, 'wb' ) as f:
@@ -344,6 +189,8 @@ class ClientFilesManager( object ):
         
         resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
         
+        self._DiscardStoredThumbnails( ( hash, ) )
+        
         try:
             
             with open( resized_path, 'wb' ) as f:
@@ -359,6 +206,28 @@ class ClientFilesManager( object ):
             
         
     
+    def _GetThumbnailBlobStore( self ):
+        
+        # this has its own lock, as thumbnail loading should not wait on the big file lock
+        
+        with self._thumbnail_blob_store_lock:
+            
+            if self._thumbnail_blob_store is None:
+                
+                path = os.path.join( self._controller.GetDBDir(), 'client_thumbnail_store' )
+                
+                # if the user has turned the store off, we still want to keep an existing one in sync in case they turn it back on
+                
+                if self._controller.GetNewOptions().GetBoolean( 'use_thumbnail_blob_store' ) or os.path.exists( path ):
+                    
+                    self._thumbnail_blob_store = ClientFiles.ThumbnailBlobStore( path )
+                    
+                
+            
+            return self._thumbnail_blob_store
+            
+        
+    
     def _GetRecoverTuple( self ):
         
         all_locations = { location for location in self._prefixes_to_locations.values() }
@@ -523,6 +392,47 @@ class ClientFilesManager( object ):
         return None
         
     
+    def _ImportFile( self, file_import_job ):
+        
+        hash = file_import_job.GetHash()
+        
+        if file_import_job.IsNewToDB():
+            
+            ( good_to_import, reason ) = file_import_job.IsGoodToImport()
+            
+            if good_to_import:
+                
+                with self._lock:
+                    
+                    ( temp_path, thumbnail ) = file_import_job.GetTempPathAndThumbnail()
+                    
+                    mime = file_import_job.GetMime()
+                    
+                    self.LocklessAddFile( hash, mime, temp_path )
+                    
+                    if thumbnail is not None:
+                        
+                        self.LocklessAddFullSizeThumbnail( hash, thumbnail )
+                        
+                    
+                    import_status = self._controller.WriteSynchronous( 'import_file', file_import_job )
+                    
+                
+            else:
+                
+                raise Exception( reason )
+                
+            
+        else:
+            
+            file_import_job.PubsubContentUpdates()
+            
+            import_status = file_import_job.GetPreImportStatus()
+            
+        
+        return ( import_status, hash )
+        
+    
     def _IterateAllFilePaths( self ):
         
         for ( prefix, location ) in self._prefixes_to_locations.items():
@@ -725,6 +635,8 @@ class ClientFilesManager( object ):
             f.write( thumbnail )
             
         
+        self._DiscardStoredThumbnails( ( hash, ) )
+        
         self._controller.pub( 'new_thumbnails', { hash } )
         
     
@@ -736,6 +648,16 @@ class ClientFilesManager( object ):
             
         
     
+    def ClearThumbnailBlobStore( self ):
+        
+        thumbnail_blob_store = self._GetThumbnailBlobStore()
+        
+        if thumbnail_blob_store is not None:
+            
+            thumbnail_blob_store.Clear()
+            
+        
+    
     def ClearOrphans( self, move_location = None ):
         
         with self._lock:
@@ -980,6 +902,8 @@ class ClientFilesManager( object ):
                 HydrusPaths.DeletePath( resized_path )
                 
             
+            self._DiscardStoredThumbnails( hashes )
+            
         
     
     def GetFilePath( self, hash, mime = None ):
@@ -994,45 +918,25 @@ class ClientFilesManager( object ):
         
         file_import_job.GenerateHashAndStatus()
         
-        hash = file_import_job.GetHash()
-        
         if file_import_job.IsNewToDB():
             
             file_import_job.GenerateInfo()
             
-            ( good_to_import, reason ) = file_import_job.IsGoodToImport()
-            
-            if good_to_import:
-                
-                with self._lock:
-                    
-                    ( temp_path, thumbnail ) = file_import_job.GetTempPathAndThumbnail()
-                    
-                    mime = file_import_job.GetMime()
-                    
-                    self.LocklessAddFile( hash, mime, temp_path )
-                    
-                    if thumbnail is not None:
-                        
-                        self.LocklessAddFullSizeThumbnail( hash, thumbnail )
-                        
-                    
-                    import_status = self._controller.WriteSynchronous( 'import_file', file_import_job )
-                    
-                
-            else:
-                
-                raise Exception( reason )
-                
-            
-        else:
-            
-            file_import_job.PubsubContentUpdates()
+        
+        return self._ImportFile( file_import_job )
+        
+    
+    def ImportPreparedFile( self, file_import_job ):
+        
+        # GenerateHashAndStatus and GenerateInfo have already been called, maybe in another thread
+        # when files are prepared in parallel, a copy of this file may have been imported since its status was checked, so check again
+        
+        if file_import_job.IsNewToDB():
             
-            import_status = file_import_job.GetPreImportStatus()
+            file_import_job.RefreshPreImportStatus()
             
         
-        return ( import_status, hash )
+        return self._ImportFile( file_import_job )
         
     
     def LocklessGetFilePath( self, hash, mime = None ):
@@ -1076,6 +980,18 @@ class ClientFilesManager( object ):
             
         
     
+    def GetStoredThumbnail( self, hash ):
+        
+        if not self._controller.GetNewOptions().GetBoolean( 'use_thumbnail_blob_store' ):
+            
+            return None
+            
+        
+        thumbnail_blob_store = self._GetThumbnailBlobStore()
+        
+        return thumbnail_blob_store.GetThumbnail( hash )
+        
+    
     def GetResizedThumbnailPath( self, hash, mime ):
         
         with self._lock:
@@ -1098,6 +1014,30 @@ class ClientFilesManager( object ):
         return os.path.exists( path )
         
     
+    def MaintainThumbnailBlobStore( self ):
+        
+        thumbnail_blob_store = self._GetThumbnailBlobStore()
+        
+        if thumbnail_blob_store is not None and thumbnail_blob_store.NeedsCompaction():
+            
+            self._controller.pub( 'splash_set_status_text', 'compacting thumbnail store' )
+            
+            thumbnail_blob_store.Compact()
+            
+        
+    
+    def StoreThumbnail( self, hash, lz4_data, size, depth ):
+        
+        if not self._controller.GetNewOptions().GetBoolean( 'use_thumbnail_blob_store' ):
+            
+            return
+            
+        
+        thumbnail_blob_store = self._GetThumbnailBlobStore()
+        
+        thumbnail_blob_store.AddThumbnail( hash, lz4_data, size, depth )
+        
+    
     def Rebalance( self, job_key ):
         
         try:
@@ -1281,17 +1221,29 @@ class ClientFilesManager( object ):
     
 class DataCache( object ):
     
-    def __init__( self, controller, cache_size, timeout = 1200 ):
+    def __init__( self, controller, cache_size, timeout = 1200, max_item_size = None ):
         
         self._controller = controller
         self._cache_size = cache_size
         self._timeout = timeout
+        self._max_item_size = max_item_size
         
+        # key -> ( data, estimated memory footprint ), and key -> last access time in least- to most-recently used order
         self._keys_to_data = {}
         self._keys_fifo = collections.OrderedDict()
         
         self._total_estimated_memory_footprint = 0
         
+        # items bigger than max_item_size would push out a lot of smaller items that are more likely to be wanted again, so the most recent one gets its own slot
+        self._overflow_key = None
+        self._overflow_data = None
+        self._overflow_access_time = 0
+        
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_evictions = 0
+        self._num_overflows = 0
+        
         self._lock = threading.Lock()
         
         self._controller.sub( self, 'MaintainCache', 'memory_maintenance_pulse' )
@@ -1301,16 +1253,56 @@ class DataCache( object ):
         
         ( deletee_key, last_access_time ) = self._keys_fifo.popitem( last = False )
         
-        deletee_data = self._keys_to_data[ deletee_key ]
+        ( deletee_data, memory_footprint ) = self._keys_to_data[ deletee_key ]
         
         del self._keys_to_data[ deletee_key ]
         
-        self._RecalcMemoryUsage()
+        self._total_estimated_memory_footprint -= memory_footprint
+        
+        self._num_evictions += 1
+        
+    
+    def _ClearOverflow( self ):
+        
+        self._overflow_key = None
+        self._overflow_data = None
+        self._overflow_access_time = 0
+        
+    
+    def _GetData( self, key ):
+        
+        if key == self._overflow_key:
+            
+            self._overflow_access_time = HydrusData.GetNow()
+            
+            self._num_hits += 1
+            
+            return self._overflow_data
+            
+        
+        ( data, memory_footprint ) = self._keys_to_data[ key ]
+        
+        # some data, like an image renderer, only knows its true size once it has done some work, so we update as it is used
+        
+        new_memory_footprint = data.GetEstimatedMemoryFootprint()
+        
+        if new_memory_footprint != memory_footprint:
+            
+            self._keys_to_data[ key ] = ( data, new_memory_footprint )
+            
+            self._total_estimated_memory_footprint += new_memory_footprint - memory_footprint
+            
+        
+        self._TouchKey( key )
+        
+        self._num_hits += 1
+        
+        return data
         
     
-    def _RecalcMemoryUsage( self ):
+    def _HasData( self, key ):
         
-        self._total_estimated_memory_footprint = sum( ( data.GetEstimatedMemoryFootprint() for data in self._keys_to_data.values() ) )
+        return key in self._keys_to_data or ( self._overflow_key is not None and key == self._overflow_key )
         
     
     def _TouchKey( self, key ):
@@ -1333,26 +1325,41 @@ class DataCache( object ):
             
             self._total_estimated_memory_footprint = 0
             
+            self._ClearOverflow()
+            
         
     
     def AddData( self, key, data ):
         
         with self._lock:
             
-            if key not in self._keys_to_data:
+            if not self._HasData( key ):
                 
-                options = self._controller.GetOptions()
+                memory_footprint = data.GetEstimatedMemoryFootprint()
                 
-                while self._total_estimated_memory_footprint > self._cache_size:
+                if self._max_item_size is not None and memory_footprint > self._max_item_size:
                     
-                    self._DeleteItem()
+                    # this evicts the previous overflow item immediately, so a big file being repainted is not re-decoded every time but never grows the cache
+                    
+                    self._overflow_key = key
+                    self._overflow_data = data
+                    self._overflow_access_time = HydrusData.GetNow()
+                    
+                    self._num_overflows += 1
+                    
+                    return
                     
                 
-                self._keys_to_data[ key ] = data
+                while len( self._keys_fifo ) > 0 and self._total_estimated_memory_footprint + memory_footprint > self._cache_size:
+                    
+                    self._DeleteItem()
+                    
+                
+                self._keys_to_data[ key ] = ( data, memory_footprint )
                 
                 self._TouchKey( key )
                 
-                self._RecalcMemoryUsage()
+                self._total_estimated_memory_footprint += memory_footprint
                 
             
         
@@ -1361,14 +1368,14 @@ class DataCache( object ):
         
         with self._lock:
             
-            if key not in self._keys_to_data:
+            if not self._HasData( key ):
+                
+                self._num_misses += 1
                 
                 raise Exception( 'Cache error! Looking for ' + HydrusData.ToUnicode( key ) + ', but it was missing.' )
                 
             
-            self._TouchKey( key )
-            
-            return self._keys_to_data[ key ]
+            return self._GetData( key )
             
         
     
@@ -1376,24 +1383,32 @@ class DataCache( object ):
         
         with self._lock:
             
-            if key in self._keys_to_data:
-                
-                self._TouchKey( key )
+            if self._HasData( key ):
                 
-                return self._keys_to_data[ key ]
+                return self._GetData( key )
                 
             else:
                 
+                self._num_misses += 1
+                
                 return None
                 
             
         
     
+    def GetStatistics( self ):
+        
+        with self._lock:
+            
+            return ( len( self._keys_to_data ), self._total_estimated_memory_footprint, self._cache_size, self._num_hits, self._num_misses, self._num_evictions, self._num_overflows )
+            
+        
+    
     def HasData( self, key ):
         
         with self._lock:
             
-            return key in self._keys_to_data
+            return self._HasData( key )
             
         
     
@@ -1401,6 +1416,11 @@ class DataCache( object ):
         
         with self._lock:
             
+            if self._overflow_key is not None and HydrusData.TimeHasPassed( self._overflow_access_time + self._timeout ):
+                
+                self._ClearOverflow()
+                
+            
             while True:
                 
                 if len( self._keys_fifo ) == 0:
@@ -1688,6 +1708,11 @@ class RenderedImageCache( object ):
         self._data_cache.Clear()
         
     
+    def GetCacheStatistics( self ):
+        
+        return self._data_cache.GetStatistics()
+        
+    
     def GetImageRenderer( self, media ):
         
         hash = media.GetHash()
@@ -1727,7 +1752,10 @@ class ThumbnailCache( object ):
         
         cache_size = options[ 'thumbnail_cache_size' ]
         
-        self._data_cache = DataCache( self._controller, cache_size, timeout = 86400 )
+        # thumbnails are all about the same size, so anything much bigger is an oddity we should not flush the cache for
+        max_item_size = cache_size / 10
+        
+        self._data_cache = DataCache( self._controller, cache_size, timeout = 86400, max_item_size = max_item_size )
         
         self._lock = threading.Lock()
         
@@ -1736,12 +1764,22 @@ class ThumbnailCache( object ):
         
         self._waterfall_event = threading.Event()
         
+        self._waterfall_in_progress = set()
+        self._waterfall_decode_queue = Queue.Queue()
+        
+        self._num_waterfall_decode_threads = max( 1, self._controller.GetNewOptions().GetInteger( 'thumbnail_decode_threads' ) )
+        
         self._special_thumbs = {}
         
         self.Clear()
         
         self._controller.CallToThreadLongRunning( self.DAEMONWaterfall )
         
+        for i in range( self._num_waterfall_decode_threads ):
+            
+            self._controller.CallToThreadLongRunning( self.THREADWaterfallDecode )
+            
+        
         self._controller.sub( self, 'Clear', 'thumbnail_resize' )
         
     
@@ -1763,6 +1801,15 @@ class ThumbnailCache( object ):
         hash = display_media.GetHash()
         mime = display_media.GetMime()
         
+        result = self._controller.client_files_manager.GetStoredThumbnail( hash )
+        
+        if result is not None:
+            
+            ( lz4_data, size, depth ) = result
+            
+            return ClientRendering.GenerateHydrusBitmapFromLZ4Data( lz4_data, depth, size )
+            
+        
         locations_manager = display_media.GetLocationsManager()
         
         try:
@@ -1838,6 +1885,8 @@ class ThumbnailCache( object ):
             hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path, mime )
             
         
+        self._controller.client_files_manager.StoreThumbnail( hash, hydrus_bitmap.GetLZ4Data(), hydrus_bitmap.GetSize(), hydrus_bitmap.GetDepth() )
+        
         return hydrus_bitmap
         
     
@@ -1859,7 +1908,12 @@ class ThumbnailCache( object ):
         
         with self._lock:
             
-            self._waterfall_queue_quick.difference_update( ( ( page_key, media ) for media in medias ) )
+            cancelled = { ( page_key, media ) for media in medias }
+            
+            self._waterfall_queue_quick.difference_update( cancelled )
+            
+            # anything already handed to the decode threads will be skipped or not published
+            self._waterfall_in_progress.difference_update( cancelled )
             
             self._RecalcWaterfallQueueRandom()
             
@@ -1908,10 +1962,17 @@ class ThumbnailCache( object ):
         
         with self._lock:
             
-            return len( self._waterfall_queue_random ) > 0
+            # a batch that is decoding or waiting to be published is still work
+            
+            return len( self._waterfall_queue_random ) > 0 or len( self._waterfall_in_progress ) > 0
             
         
     
+    def GetCacheStatistics( self ):
+        
+        return self._data_cache.GetStatistics()
+        
+    
     def GetThumbnail( self, media ):
         
         display_media = media.GetDisplayMedia()
@@ -1984,7 +2045,10 @@ class ThumbnailCache( object ):
     
     def DAEMONWaterfall( self ):
         
-        last_paused = HydrusData.GetNowPrecise()
+        # the decode threads do the actual loading, but we publish here, in queue order
+        # PIL and OpenCV release the GIL while they decode and resize, so threads are enough to spread this over several cores
+        
+        batch_size = self._num_waterfall_decode_threads * 4
         
         while not HG.view_shutdown:
             
@@ -1999,35 +2063,113 @@ class ThumbnailCache( object ):
                 
                 self._waterfall_event.clear()
                 
-                last_paused = HydrusData.GetNowPrecise()
+            
+            with self._lock:
+                
+                batch = self._waterfall_queue_random[ : batch_size ]
+                
+                self._waterfall_queue_random = self._waterfall_queue_random[ batch_size : ]
+                
+                self._waterfall_queue_quick.difference_update( batch )
+                
+                self._waterfall_in_progress.update( batch )
                 
             
-            start_time = HydrusData.GetNowPrecise()
-            stop_time = start_time + 0.005 # a bit of a typical frame
+            if len( batch ) == 0:
+                
+                continue
+                
+            
+            results_queue = Queue.Queue()
+            
+            for ( index, result ) in enumerate( batch ):
+                
+                self._waterfall_decode_queue.put( ( results_queue, index, result ) )
+                
             
-            page_keys_to_rendered_medias = collections.defaultdict( list )
+            loaded = [ None ] * len( batch )
+            next_index_to_publish = 0
             
-            while not HydrusData.TimeHasPassedPrecise( stop_time ):
+            while next_index_to_publish < len( batch ) and not HG.view_shutdown:
+                
+                try:
+                    
+                    ( index, success ) = results_queue.get( timeout = 0.005 ) # a bit of a typical frame
+                    
+                    loaded[ index ] = success
+                    
+                    while not results_queue.empty():
+                        
+                        ( index, success ) = results_queue.get()
+                        
+                        loaded[ index ] = success
+                        
+                    
+                except Queue.Empty:
+                    
+                    continue
+                    
+                
+                page_keys_to_rendered_medias = collections.defaultdict( list )
                 
                 with self._lock:
                     
-                    if len( self._waterfall_queue_random ) == 0:
+                    while next_index_to_publish < len( batch ) and loaded[ next_index_to_publish ] is not None:
                         
-                        break
+                        result = batch[ next_index_to_publish ]
+                        
+                        if loaded[ next_index_to_publish ] and result in self._waterfall_in_progress:
+                            
+                            ( page_key, media ) = result
+                            
+                            page_keys_to_rendered_medias[ page_key ].append( media )
+                            
+                        
+                        self._waterfall_in_progress.discard( result )
+                        
+                        next_index_to_publish += 1
                         
                     
-                    result = self._waterfall_queue_random.pop( 0 )
+                
+                for ( page_key, rendered_medias ) in page_keys_to_rendered_medias.items():
                     
-                    self._waterfall_queue_quick.discard( result )
+                    self._controller.pub( 'waterfall_thumbnails', page_key, rendered_medias )
                     
                 
+            
+            time.sleep( 0.00001 )
+            
+        
+    
+    def THREADWaterfallDecode( self ):
+        
+        while not HG.view_shutdown:
+            
+            try:
+                
+                ( results_queue, index, result ) = self._waterfall_decode_queue.get( timeout = 1 )
+                
+            except Queue.Empty:
+                
+                continue
+                
+            
+            with self._lock:
+                
+                still_wanted = result in self._waterfall_in_progress
+                
+            
+            success = False
+            
+            if still_wanted:
+                
                 ( page_key, media ) = result
                 
                 try:
                     
                     self.GetThumbnail( media ) # to load it
                     
-                    page_keys_to_rendered_medias[ page_key ].append( media )
+                    success = True
                     
                 except Exception as e:
                     
@@ -2035,12 +2177,7 @@ class ThumbnailCache( object ):
                     
                 
             
-            for ( page_key, rendered_medias ) in page_keys_to_rendered_medias.items():
-                
-                self._controller.pub( 'waterfall_thumbnails', page_key, rendered_medias )
-                
-            
-            time.sleep( 0.00001 )
+            results_queue.put( ( index, success ) )
             
         
     
@@ -2373,131 +2510,110 @@ class TagCensorshipManager( object ):
         return tags
         
     
-class TagParentsManager( object ):
+class TagLookupCache( object ):
     
-    def __init__( self, controller ):
+    # a bounded, least-recently-used map of ( service_key, tag ) to what the db says about that tag's siblings or parents
+    # a lookup that was running when the cache was cleared may have read the old data, so we only keep results from the current generation
+    
+    def __init__( self, max_size = 100000 ):
         
-        self._controller = controller
+        self._max_size = max_size
         
-        self._service_keys_to_children_to_parents = collections.defaultdict( HydrusData.default_dict_list )
+        self._keys_to_values = collections.OrderedDict()
         
-        self._RefreshParents()
+        self._generation = 0
         
         self._lock = threading.Lock()
         
-        self._controller.sub( self, 'RefreshParents', 'notify_new_parents' )
-        
     
-    def _RefreshParents( self ):
+    def AddValues( self, generation, keys_to_values ):
         
-        service_keys_to_statuses_to_pairs = self._controller.Read( 'tag_parents' )
-        
-        # first collapse siblings
-        
-        sibling_manager = self._controller.GetManager( 'tag_siblings' )
-        
-        collapsed_service_keys_to_statuses_to_pairs = collections.defaultdict( HydrusData.default_dict_set )
-        
-        for ( service_key, statuses_to_pairs ) in service_keys_to_statuses_to_pairs.items():
+        with self._lock:
             
-            if service_key == CC.COMBINED_TAG_SERVICE_KEY: continue
+            if generation != self._generation:
+                
+                return
+                
             
-            for ( status, pairs ) in statuses_to_pairs.items():
+            for ( key, value ) in keys_to_values.items():
                 
-                pairs = sibling_manager.CollapsePairs( service_key, pairs )
+                # have to delete first, rather than overwriting, so the ordereddict updates its internal order
+                if key in self._keys_to_values:
+                    
+                    del self._keys_to_values[ key ]
+                    
                 
-                collapsed_service_keys_to_statuses_to_pairs[ service_key ][ status ] = pairs
+                self._keys_to_values[ key ] = value
                 
             
-        
-        # now collapse current and pending
-        
-        service_keys_to_pairs_flat = HydrusData.default_dict_set()
-        
-        for ( service_key, statuses_to_pairs ) in collapsed_service_keys_to_statuses_to_pairs.items():
-            
-            pairs_flat = statuses_to_pairs[ HC.CONTENT_STATUS_CURRENT ].union( statuses_to_pairs[ HC.CONTENT_STATUS_PENDING ] )
-            
-            service_keys_to_pairs_flat[ service_key ] = pairs_flat
+            while len( self._keys_to_values ) > self._max_size:
+                
+                self._keys_to_values.popitem( last = False )
+                
             
         
-        # now create the combined tag service
-        
-        combined_pairs_flat = set()
+    
+    def Clear( self ):
         
-        for pairs_flat in service_keys_to_pairs_flat.values():
+        with self._lock:
             
-            combined_pairs_flat.update( pairs_flat )
+            self._keys_to_values = collections.OrderedDict()
+            
+            self._generation += 1
             
-        
-        service_keys_to_pairs_flat[ CC.COMBINED_TAG_SERVICE_KEY ] = combined_pairs_flat
-        
-        #
-        
-        service_keys_to_simple_children_to_parents = BuildServiceKeysToSimpleChildrenToParents( service_keys_to_pairs_flat )
-        
-        self._service_keys_to_children_to_parents = BuildServiceKeysToChildrenToParents( service_keys_to_simple_children_to_parents )
         
     
-    def ExpandPredicates( self, service_key, predicates ):
-        
-        new_options = self._controller.GetNewOptions()
+    def GetGeneration( self ):
         
-        if new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
+        with self._lock:
             
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            return self._generation
             
         
-        results = []
+    
+    def GetValues( self, keys ):
         
         with self._lock:
             
-            for predicate in predicates:
-                
-                results.append( predicate )
+            keys_to_values = {}
+            missing_keys = set()
+            
+            for key in keys:
                 
-                if predicate.GetType() == HC.PREDICATE_TYPE_TAG:
+                if key in self._keys_to_values:
                     
-                    tag = predicate.GetValue()
+                    # move it to the most recently used end
                     
-                    parents = self._service_keys_to_children_to_parents[ service_key ][ tag ]
+                    value = self._keys_to_values.pop( key )
                     
-                    for parent in parents:
-                        
-                        parent_predicate = ClientSearch.Predicate( HC.PREDICATE_TYPE_PARENT, parent )
-                        
-                        results.append( parent_predicate )
-                        
+                    self._keys_to_values[ key ] = value
+                    
+                    keys_to_values[ key ] = value
+                    
+                else:
+                    
+                    missing_keys.add( key )
                     
                 
             
-            return results
+            return ( keys_to_values, missing_keys )
             
         
     
-    def ExpandTags( self, service_key, tags ):
+class TagParentsManager( object ):
+    
+    def __init__( self, controller ):
         
-        new_options = self._controller.GetNewOptions()
+        self._controller = controller
         
-        if new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
-            
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
-            
+        # the db keeps the sibling-collapsed parent closure up to date, so we only ask it about the tags we see
         
-        with self._lock:
-            
-            tags_results = set( tags )
-            
-            for tag in tags:
-                
-                tags_results.update( self._service_keys_to_children_to_parents[ service_key ][ tag ] )
-                
-            
-            return tags_results
-            
+        self._lookup_cache = TagLookupCache()
+        
+        self._controller.sub( self, 'RefreshParents', 'notify_new_parents' )
         
     
-    def GetParents( self, service_key, tag ):
+    def _GetTagsToParents( self, service_key, tags ):
         
         new_options = self._controller.GetNewOptions()
         
@@ -2506,218 +2622,106 @@ class TagParentsManager( object ):
             service_key = CC.COMBINED_TAG_SERVICE_KEY
             
         
-        with self._lock:
-            
-            return self._service_keys_to_children_to_parents[ service_key ][ tag ]
-            
+        tags = set( tags )
         
-    
-    def RefreshParents( self ):
+        ( keys_to_parents, missing_keys ) = self._lookup_cache.GetValues( ( ( service_key, tag ) for tag in tags ) )
         
-        with self._lock:
+        if len( missing_keys ) > 0:
             
-            self._RefreshParents()
+            generation = self._lookup_cache.GetGeneration()
             
-        
-    
-class TagSiblingsManager( object ):
-    
-    def __init__( self, controller ):
-        
-        self._controller = controller
-        
-        self._service_keys_to_siblings = collections.defaultdict( dict )
-        self._service_keys_to_reverse_lookup = collections.defaultdict( dict )
-        
-        self._RefreshSiblings()
-        
-        self._lock = threading.Lock()
-        
-        self._controller.sub( self, 'RefreshSiblings', 'notify_new_siblings_data' )
-        
-    
-    def _CollapseTags( self, service_key, tags ):
-    
-        siblings = self._service_keys_to_siblings[ service_key ]
-        
-        return { siblings[ tag ] if tag in siblings else tag for tag in tags }
-        
-    
-    def _RefreshSiblings( self ):
-        
-        self._service_keys_to_siblings = collections.defaultdict( dict )
-        self._service_keys_to_reverse_lookup = collections.defaultdict( dict )
-        
-        local_tags_pairs = set()
-        
-        tag_repo_pairs = set()
-        
-        service_keys_to_statuses_to_pairs = self._controller.Read( 'tag_siblings' )
-        
-        for ( service_key, statuses_to_pairs ) in service_keys_to_statuses_to_pairs.items():
+            missing_tags = [ tag for ( service_key, tag ) in missing_keys ]
             
-            all_pairs = statuses_to_pairs[ HC.CONTENT_STATUS_CURRENT ].union( statuses_to_pairs[ HC.CONTENT_STATUS_PENDING ] )
+            service_keys_to_children_to_parents = self._controller.Read( 'tag_parents_lookup', service_key, missing_tags )
             
-            if service_key == CC.LOCAL_TAG_SERVICE_KEY:
-                
-                local_tags_pairs = set( all_pairs )
-                
-            else:
-                
-                tag_repo_pairs.update( all_pairs )
-                
+            children_to_parents = service_keys_to_children_to_parents.get( service_key, {} )
             
-            siblings = CollapseTagSiblingPairs( [ all_pairs ] )
+            fetched_keys_to_parents = { ( service_key, tag ) : tuple( children_to_parents.get( tag, () ) ) for tag in missing_tags }
             
-            self._service_keys_to_siblings[ service_key ] = siblings
+            self._lookup_cache.AddValues( generation, fetched_keys_to_parents )
             
-            reverse_lookup = collections.defaultdict( list )
+            keys_to_parents.update( fetched_keys_to_parents )
             
-            for ( bad, good ) in siblings.items():
-                
-                reverse_lookup[ good ].append( bad )
-                
-            
-            self._service_keys_to_reverse_lookup[ service_key ] = reverse_lookup
-            
-        
-        combined_siblings = CollapseTagSiblingPairs( [ local_tags_pairs, tag_repo_pairs ] )
-        
-        self._service_keys_to_siblings[ CC.COMBINED_TAG_SERVICE_KEY ] = combined_siblings
         
-        combined_reverse_lookup = collections.defaultdict( list )
-        
-        for ( bad, good ) in combined_siblings.items():
-            
-            combined_reverse_lookup[ good ].append( bad )
-            
-        
-        self._service_keys_to_reverse_lookup[ CC.COMBINED_TAG_SERVICE_KEY ] = combined_reverse_lookup
-        
-        self._controller.pub( 'new_siblings_gui' )
+        return { tag : keys_to_parents[ ( service_key, tag ) ] for tag in tags }
         
     
-    def GetAutocompleteSiblings( self, service_key, search_text, exact_match = False ):
+    def ExpandPredicates( self, service_key, predicates ):
         
-        new_options = self._controller.GetNewOptions()
+        tags = [ predicate.GetValue() for predicate in predicates if predicate.GetType() == HC.PREDICATE_TYPE_TAG ]
         
-        if new_options.GetBoolean( 'apply_all_siblings_to_all_services' ):
-            
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
-            
+        tags_to_parents = self._GetTagsToParents( service_key, tags )
         
-        with self._lock:
+        results = []
+        
+        for predicate in predicates:
             
-            siblings = self._service_keys_to_siblings[ service_key ]
-            reverse_lookup = self._service_keys_to_reverse_lookup[ service_key ]
+            results.append( predicate )
             
-            if exact_match:
+            if predicate.GetType() == HC.PREDICATE_TYPE_TAG:
                 
-                key_based_matching_values = set()
+                tag = predicate.GetValue()
                 
-                if search_text in siblings:
-                    
-                    key_based_matching_values = { siblings[ search_text ] }
+                parents = tags_to_parents[ tag ]
+                
+                for parent in parents:
                     
-                else:
+                    parent_predicate = ClientSearch.Predicate( HC.PREDICATE_TYPE_PARENT, parent )
                     
-                    key_based_matching_values = set()
+                    results.append( parent_predicate )
                     
                 
-                value_based_matching_values = { value for value in siblings.values() if value == search_text }
-                
-            else:
-                
-                matching_keys = ClientSearch.FilterTagsBySearchText( service_key, search_text, siblings.keys(), search_siblings = False )
-                
-                key_based_matching_values = { siblings[ key ] for key in matching_keys }
-                
-                value_based_matching_values = ClientSearch.FilterTagsBySearchText( service_key, search_text, siblings.values(), search_siblings = False )
-                
-            
-            matching_values = key_based_matching_values.union( value_based_matching_values )
-            
-            # all the matching values have a matching sibling somewhere in their network
-            # so now fetch the networks
-            
-            lists_of_matching_keys = [ reverse_lookup[ value ] for value in matching_values ]
-            
-            matching_keys = itertools.chain.from_iterable( lists_of_matching_keys )
-            
-            matches = matching_values.union( matching_keys )
-            
-            return matches
             
         
+        return results
+        
     
-    def GetSibling( self, service_key, tag ):
+    def ExpandTags( self, service_key, tags ):
         
-        new_options = self._controller.GetNewOptions()
+        tags_results = set( tags )
         
-        if new_options.GetBoolean( 'apply_all_siblings_to_all_services' ):
+        for parents in self._GetTagsToParents( service_key, tags ).values():
             
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            tags_results.update( parents )
             
         
-        with self._lock:
-            
-            siblings = self._service_keys_to_siblings[ service_key ]
-            
-            if tag in siblings:
-                
-                return siblings[ tag ]
-                
-            else:
-                
-                return None
-                
-            
+        return tags_results
         
     
-    def GetAllSiblings( self, service_key, tag ):
+    def GetParents( self, service_key, tag ):
         
-        new_options = self._controller.GetNewOptions()
+        tags_to_parents = self._GetTagsToParents( service_key, ( tag, ) )
         
-        if new_options.GetBoolean( 'apply_all_siblings_to_all_services' ):
-            
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
-            
+        return list( tags_to_parents[ tag ] )
         
-        with self._lock:
-            
-            siblings = self._service_keys_to_siblings[ service_key ]
-            reverse_lookup = self._service_keys_to_reverse_lookup[ service_key ]
-            
-            if tag in siblings:
-                
-                best_tag = siblings[ tag ]
-                
-            elif tag in reverse_lookup:
-                
-                best_tag = tag
-                
-            else:
-                
-                return [ tag ]
-                
-            
-            all_siblings = list( reverse_lookup[ best_tag ] )
-            
-            all_siblings.append( best_tag )
-            
-            return all_siblings
-            
+    
+    def RefreshParents( self ):
+        
+        self._lookup_cache.Clear()
         
     
-    def RefreshSiblings( self ):
+class TagSiblingsManager( object ):
+    
+    def __init__( self, controller ):
         
-        with self._lock:
-            
-            self._RefreshSiblings()
-            
+        self._controller = controller
+        
+        # the db keeps the collapsed siblings up to date, so we only ask it about the tags we see
+        # for each tag, we keep what it collapses to, or None, and every tag in its sibling network
+        
+        self._lookup_cache = TagLookupCache()
+        
+        self._controller.sub( self, 'RefreshSiblings', 'notify_new_siblings_data' )
         
     
-    def CollapsePredicates( self, service_key, predicates ):
+    def _GetTagsToIdealTags( self, service_key, tags ):
+        
+        tags_to_sibling_info = self._GetTagsToSiblingInfo( service_key, tags )
+        
+        return { tag : tag if ideal_tag is None else ideal_tag for ( tag, ( ideal_tag, all_siblings ) ) in tags_to_sibling_info.items() }
+        
+    
+    def _GetTagsToSiblingInfo( self, service_key, tags ):
         
         new_options = self._controller.GetNewOptions()
         
@@ -2726,181 +2730,190 @@ class TagSiblingsManager( object ):
             service_key = CC.COMBINED_TAG_SERVICE_KEY
             
         
-        with self._lock:
+        tags = set( tags )
+        
+        ( keys_to_sibling_info, missing_keys ) = self._lookup_cache.GetValues( ( ( service_key, tag ) for tag in tags ) )
+        
+        if len( missing_keys ) > 0:
             
-            siblings = self._service_keys_to_siblings[ service_key ]
+            generation = self._lookup_cache.GetGeneration()
             
-            results = [ predicate for predicate in predicates if predicate.GetType() != HC.PREDICATE_TYPE_TAG ]
+            missing_tags = [ tag for ( service_key, tag ) in missing_keys ]
             
-            tag_predicates = [ predicate for predicate in predicates if predicate.GetType() == HC.PREDICATE_TYPE_TAG ]
+            # this gets every pair in the missing tags' sibling networks
             
-            tags_to_predicates = { predicate.GetValue() : predicate for predicate in predicates if predicate.GetType() == HC.PREDICATE_TYPE_TAG }
+            service_keys_to_siblings = self._controller.Read( 'tag_siblings_lookup', service_key, missing_tags )
             
-            tags = tags_to_predicates.keys()
+            siblings = service_keys_to_siblings.get( service_key, {} )
             
-            tags_to_include_in_results = set()
+            reverse_lookup = collections.defaultdict( list )
             
-            for tag in tags:
+            for ( bad, good ) in siblings.items():
+                
+                reverse_lookup[ good ].append( bad )
+                
+            
+            fetched_keys_to_sibling_info = {}
+            
+            for tag in missing_tags:
                 
                 if tag in siblings:
                     
-                    old_tag = tag
-                    old_predicate = tags_to_predicates[ old_tag ]
+                    ideal_tag = siblings[ tag ]
                     
-                    new_tag = siblings[ old_tag ]
+                    all_siblings = tuple( reverse_lookup[ ideal_tag ] ) + ( ideal_tag, )
                     
-                    if new_tag not in tags_to_predicates:
-                        
-                        ( old_pred_type, old_value, old_inclusive ) = old_predicate.GetInfo()
-                        
-                        new_predicate = ClientSearch.Predicate( old_pred_type, new_tag, old_inclusive )
-                        
-                        tags_to_predicates[ new_tag ] = new_predicate
-                        
-                        tags_to_include_in_results.add( new_tag )
-                        
+                elif tag in reverse_lookup:
                     
-                    new_predicate = tags_to_predicates[ new_tag ]
+                    ideal_tag = None
                     
-                    new_predicate.AddCounts( old_predicate )
+                    all_siblings = tuple( reverse_lookup[ tag ] ) + ( tag, )
                     
                 else:
                     
-                    tags_to_include_in_results.add( tag )
+                    ideal_tag = None
                     
+                    all_siblings = ( tag, )
+                    
+                
+                fetched_keys_to_sibling_info[ ( service_key, tag ) ] = ( ideal_tag, all_siblings )
                 
             
-            results.extend( [ tags_to_predicates[ tag ] for tag in tags_to_include_in_results ] )
+            self._lookup_cache.AddValues( generation, fetched_keys_to_sibling_info )
             
-            return results
+            keys_to_sibling_info.update( fetched_keys_to_sibling_info )
             
         
+        return { tag : keys_to_sibling_info[ ( service_key, tag ) ] for tag in tags }
+        
     
     def CollapsePairs( self, service_key, pairs ):
         
-        new_options = self._controller.GetNewOptions()
+        tags_to_ideal_tags = self._GetTagsToIdealTags( service_key, itertools.chain.from_iterable( pairs ) )
         
-        if new_options.GetBoolean( 'apply_all_siblings_to_all_services' ):
-            
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
-            
+        return { ( tags_to_ideal_tags[ a ], tags_to_ideal_tags[ b ] ) for ( a, b ) in pairs }
         
-        with self._lock:
-            
-            siblings = self._service_keys_to_siblings[ service_key ]
+    
+    def CollapsePredicates( self, service_key, predicates ):
+        
+        results = [ predicate for predicate in predicates if predicate.GetType() != HC.PREDICATE_TYPE_TAG ]
+        
+        tags_to_predicates = { predicate.GetValue() : predicate for predicate in predicates if predicate.GetType() == HC.PREDICATE_TYPE_TAG }
+        
+        tags = tags_to_predicates.keys()
+        
+        tags_to_ideal_tags = self._GetTagsToIdealTags( service_key, tags )
+        
+        tags_to_include_in_results = set()
+        
+        for tag in tags:
             
-            result = set()
+            new_tag = tags_to_ideal_tags[ tag ]
             
-            for ( a, b ) in pairs:
+            if new_tag != tag:
                 
-                if a in siblings:
+                old_tag = tag
+                old_predicate = tags_to_predicates[ old_tag ]
+                
+                if new_tag not in tags_to_predicates:
                     
-                    a = siblings[ a ]
+                    ( old_pred_type, old_value, old_inclusive ) = old_predicate.GetInfo()
                     
-                
-                if b in siblings:
+                    new_predicate = ClientSearch.Predicate( old_pred_type, new_tag, old_inclusive )
+                    
+                    tags_to_predicates[ new_tag ] = new_predicate
                     
-                    b = siblings[ b ]
+                    tags_to_include_in_results.add( new_tag )
                     
                 
-                result.add( ( a, b ) )
+                new_predicate = tags_to_predicates[ new_tag ]
+                
+                new_predicate.AddCounts( old_predicate )
+                
+            else:
+                
+                tags_to_include_in_results.add( tag )
                 
             
-            return result
-            
+        
+        results.extend( [ tags_to_predicates[ tag ] for tag in tags_to_include_in_results ] )
+        
+        return results
         
     
     def CollapseStatusesToTags( self, service_key, statuses_to_tags ):
         
-        new_options = self._controller.GetNewOptions()
+        tags_to_ideal_tags = self._GetTagsToIdealTags( service_key, itertools.chain.from_iterable( statuses_to_tags.values() ) )
         
-        if new_options.GetBoolean( 'apply_all_siblings_to_all_services' ):
-            
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
-            
+        new_statuses_to_tags = HydrusData.default_dict_set()
         
-        with self._lock:
-            
-            statuses = statuses_to_tags.keys()
-            
-            new_statuses_to_tags = HydrusData.default_dict_set()
-            
-            for status in statuses:
-                
-                new_statuses_to_tags[ status ] = self._CollapseTags( service_key, statuses_to_tags[ status ] )
-                
+        for ( status, tags ) in statuses_to_tags.items():
             
-            return new_statuses_to_tags
+            new_statuses_to_tags[ status ] = { tags_to_ideal_tags[ tag ] for tag in tags }
             
         
+        return new_statuses_to_tags
+        
     
     def CollapseTag( self, service_key, tag ):
         
-        new_options = self._controller.GetNewOptions()
+        tags_to_ideal_tags = self._GetTagsToIdealTags( service_key, ( tag, ) )
         
-        if new_options.GetBoolean( 'apply_all_siblings_to_all_services' ):
-            
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
-            
-        
-        with self._lock:
-            
-            siblings = self._service_keys_to_siblings[ service_key ]
-            
-            if tag in siblings:
-                
-                return siblings[ tag ]
-                
-            else:
-                
-                return tag
-                
-            
+        return tags_to_ideal_tags[ tag ]
         
     
     def CollapseTags( self, service_key, tags ):
         
-        new_options = self._controller.GetNewOptions()
+        tags_to_ideal_tags = self._GetTagsToIdealTags( service_key, tags )
         
-        if new_options.GetBoolean( 'apply_all_siblings_to_all_services' ):
-            
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
-            
-        
-        with self._lock:
-            
-            return self._CollapseTags( service_key, tags )
-            
+        return set( tags_to_ideal_tags.values() )
         
     
     def CollapseTagsToCount( self, service_key, tags_to_count ):
         
-        new_options = self._controller.GetNewOptions()
+        tags_to_ideal_tags = self._GetTagsToIdealTags( service_key, tags_to_count.keys() )
         
-        if new_options.GetBoolean( 'apply_all_siblings_to_all_services' ):
-            
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
-            
+        results = collections.Counter()
         
-        with self._lock:
-            
-            siblings = self._service_keys_to_siblings[ service_key ]
-            
-            results = collections.Counter()
-            
-            for ( tag, count ) in tags_to_count.items():
-                
-                if tag in siblings:
-                    
-                    tag = siblings[ tag ]
-                    
-                
-                results[ tag ] += count
-                
+        for ( tag, count ) in tags_to_count.items():
             
-            return results
+            results[ tags_to_ideal_tags[ tag ] ] += count
             
         
+        return results
+        
+    
+    def GetAllSiblings( self, service_key, tag ):
+        
+        tags_to_sibling_info = self._GetTagsToSiblingInfo( service_key, ( tag, ) )
+        
+        ( ideal_tag, all_siblings ) = tags_to_sibling_info[ tag ]
+        
+        return list( all_siblings )
+        
+    
+    def GetSibling( self, service_key, tag ):
+        
+        tags_to_sibling_info = self._GetTagsToSiblingInfo( service_key, ( tag, ) )
+        
+        ( ideal_tag, all_siblings ) = tags_to_sibling_info[ tag ]
+        
+        return ideal_tag
+        
+    
+    def GetTagsToAllSiblings( self, service_key, tags ):
+        
+        tags_to_sibling_info = self._GetTagsToSiblingInfo( service_key, tags )
+        
+        return { tag : list( all_siblings ) for ( tag, ( ideal_tag, all_siblings ) ) in tags_to_sibling_info.items() }
+        
+    
+    def RefreshSiblings( self ):
+        
+        self._lookup_cache.Clear()
+        
+        self._controller.pub( 'new_siblings_gui' )
+        
     
 class UndoManager( object ):
     
@@ -35,6 +35,9 @@ if not HG.twisted_is_broke:
     
     from twisted.internet import reactor, defer
     
+# how many media results a file search loads before it shows its page. the thumbnail panel fetches the rest as it is scrolled
+FILE_QUERY_CHUNK_SIZE = 256
+
 class Controller( HydrusController.HydrusController ):
     
     pubsub_binding_errors_to_ignore = [ wx.PyDeadObjectError ]
@@ -795,6 +798,22 @@ class Controller( HydrusController.HydrusController ):
             self.WriteInterruptable( 'maintain_similar_files_duplicate_pairs', search_distance, stop_time = search_stop_time, abandon_if_other_work_to_do = True )
             
         
+        if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
+            
+            mappings_stop_time = stop_time
+            
+            if mappings_stop_time is None:
+                
+                mappings_stop_time = HydrusData.GetNow() + 120
+                
+            
+            # no stop_time means this is normal idle maintenance, which should stop as soon as the user comes back
+            
+            only_when_idle = stop_time is None
+            
+            self.WriteInterruptable( 'maintain_mappings_caches', stop_time = mappings_stop_time, only_when_idle = only_when_idle )
+            
+        
         if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
             
             self.WriteInterruptable( 'vacuum', stop_time = stop_time )
@@ -805,6 +824,11 @@ class Controller( HydrusController.HydrusController ):
             self.WriteInterruptable( 'analyze', stop_time = stop_time )
             
         
+        if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
+            
+            self.client_files_manager.MaintainThumbnailBlobStore()
+            
+        
         if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
             
             if HydrusData.TimeHasPassed( self._timestamps[ 'last_service_info_cache_fatten' ] + ( 60 * 20 ) ):
@@ -1160,9 +1184,9 @@ class Controller( HydrusController.HydrusController ):
         HydrusController.HydrusController.ShutdownView( self )
         
     
-    def StartFileQuery( self, page_key, job_key, search_context ):
+    def StartFileQuery( self, page_key, job_key, search_context, media_sort = None ):
         
-        self.CallToThread( self.THREADDoFileQuery, page_key, job_key, search_context )
+        self.CallToThread( self.THREADDoFileQuery, page_key, job_key, search_context, media_sort )
         
     
     def SystemBusy( self ):
@@ -1222,33 +1246,26 @@ class Controller( HydrusController.HydrusController ):
         return False
         
     
-    def THREADDoFileQuery( self, page_key, job_key, search_context ):
-        
-        QUERY_CHUNK_SIZE = 256
+    def THREADDoFileQuery( self, page_key, job_key, search_context, media_sort = None ):
         
-        query_hash_ids = self.Read( 'file_query_ids', search_context )
+        query_hash_ids = self.Read( 'file_query_ids', search_context, media_sort = media_sort )
         
-        media_results = []
-        
-        for sub_query_hash_ids in HydrusData.SplitListIntoChunks( query_hash_ids, QUERY_CHUNK_SIZE ):
-            
-            if job_key.IsCancelled():
-                
-                return
-                
+        if job_key.IsCancelled():
             
-            more_media_results = self.Read( 'media_results_from_ids', sub_query_hash_ids )
-            
-            media_results.extend( more_media_results )
-            
-            self.pub( 'set_num_query_results', page_key, len( media_results ), len( query_hash_ids ) )
-            
-            self.WaitUntilViewFree()
+            return
             
         
+        # only the first chunk is loaded here, so a big search shows as quickly as a small one
+        # the rest of the ids go to the thumbnail panel, which fetches their media results a couple of screens at a time as it is scrolled down
+        # the db has put the ids in the page's sort where it can, so those screens come in the right order
+        
+        media_results = self.Read( 'media_results_from_ids', query_hash_ids[ : FILE_QUERY_CHUNK_SIZE ] )
+        
+        unloaded_hash_ids = query_hash_ids[ FILE_QUERY_CHUNK_SIZE : ]
+        
         search_context.SetComplete()
         
-        self.pub( 'file_query_done', page_key, job_key, media_results )
+        self.pub( 'file_query_done', page_key, job_key, media_results, unloaded_hash_ids )
         
     
     def THREADBootEverything( self ):
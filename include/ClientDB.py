@@ -7,6 +7,7 @@ import ClientNetworkingDomain
 import ClientRatings
 import ClientSearch
 import ClientServices
+import ClientSimilarFiles
 import ClientThreading
 import collections
 import gc
@@ -26,6 +27,7 @@ import HydrusPaths
 import HydrusSerialisable
 import HydrusTagArchive
 import HydrusTags
+import HydrusThreading
 import HydrusVideoHandling
 import ClientConstants as CC
 import os
@@ -51,6 +53,25 @@ YAML_DUMP_ID_LOCAL_BOORU = 8
 MIN_CACHED_INTEGER = -99999999
 MAX_CACHED_INTEGER = 99999999
 
+# how many repository update files to load and decode ahead of the one being processed
+REPOSITORY_UPDATE_PREFETCH = 4
+
+# sqlite limits how many selects we can chain with INTERSECT, and a handful of trigrams narrows it down plenty
+MAX_WILDCARD_TRIGRAMS = 16
+
+# when a wildcard has more trigrams than that, we keep the rarest. counting stops here, as anything this common is no use to us anyway
+WILDCARD_TRIGRAM_COUNT_LIMIT = 10000
+
+# how many hash->hash_id and tag->tag_id lookups to remember. each entry is a couple hundred bytes
+MAX_CACHED_HASH_IDS = 100000
+MAX_CACHED_TAG_IDS = 100000
+
+# below this many uncached values, a few single selects are quicker than setting up a temp table
+MIN_TEMP_TABLE_ID_LOOKUP = 64
+
+# the url bloom filter is built with room for at least this many urls, or twice what we have, whichever is bigger. each url costs about ten bits
+MIN_URL_BLOOM_FILTER_CAPACITY = 100000
+
 def CanCacheInteger( num ):
     
     return MIN_CACHED_INTEGER <= num and num <= MAX_CACHED_INTEGER
@@ -110,6 +131,37 @@ def GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id ):
     
     return ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name )
     
+def GenerateSubtagTrigrams( subtag ):
+    
+    # LIKE is case-insensitive, so we index in lowercase to keep the trigrams a superset of what it will match
+    
+    subtag = subtag.lower()
+    
+    return { subtag[ i : i + 3 ] for i in range( len( subtag ) - 2 ) }
+    
+def GetWildcardTrigrams( wildcard ):
+    
+    # any subtag that matches the wildcard must contain every trigram of its literal parts
+    # '_' and '%' are wildcards to LIKE, so trigrams that include them are no use
+    
+    trigrams = set()
+    
+    for literal in wildcard.lower().split( '*' ):
+        
+        trigrams.update( ( trigram for trigram in GenerateSubtagTrigrams( literal ) if '_' not in trigram and '%' not in trigram ) )
+        
+    
+    return trigrams
+    
+def LoadRepositoryUpdate( path ):
+    
+    with open( path, 'rb' ) as f:
+        
+        update_network_string = f.read()
+        
+    
+    return HydrusSerialisable.CreateFromNetworkString( update_network_string )
+    
 def report_content_speed_to_job_key( job_key, rows_done, total_rows, precise_timestamp, num_rows, row_name ):
     
     it_took = HydrusData.GetNowPrecise() - precise_timestamp
@@ -121,6 +173,15 @@ def report_content_speed_to_job_key( job_key, rows_done, total_rows, precise_tim
     HG.client_controller.pub( 'splash_set_status_text', popup_message, print_to_log = False )
     job_key.SetVariable( 'popup_text_2', popup_message )
     
+def report_prefetch_wait_to_log( prefetcher, update_type ):
+    
+    time_spent_waiting = prefetcher.GetTimeSpentWaiting()
+    
+    if time_spent_waiting > 1:
+        
+        HydrusData.Print( 'spent ' + HydrusData.ConvertTimeDeltaToPrettyString( time_spent_waiting ) + ' waiting for ' + update_type + ' update files to load' )
+        
+    
 def report_speed_to_job_key( job_key, precise_timestamp, num_rows, row_name ):
     
     it_took = HydrusData.GetNowPrecise() - precise_timestamp
@@ -145,13 +206,40 @@ def report_speed_to_log( precise_timestamp, num_rows, row_name ):
 class DB( HydrusDB.HydrusDB ):
     
     READ_WRITE_ACTIONS = [ 'service_info', 'system_predicates', 'missing_thumbnail_hashes' ]
+    COALESCABLE_WRITE_ACTIONS = [ 'content_updates', 'import_file' ]
+    # only reads that go purely to the db can go here--anything that touches the id caches, the phash index, the inbox or other in-memory state has to stay on the main connection
+    CONCURRENT_READ_ACTIONS = [ 'md5_status', 'url_status' ]
+    # searches, the media results they load and the ui's sibling and parent lookups can run from the last commit while a big write is going on, so the ui does not freeze behind repository processing
+    # they do not keep services or search results from a stale read, and anything that needs the phash index is passed back to the main connection
+    STALE_TOLERANT_READ_ACTIONS = [ 'autocomplete_predicates', 'file_query_ids', 'media_results', 'media_results_from_ids', 'tag_parents_lookup', 'tag_siblings_lookup' ]
+    
+    # how much of a tag mappings cache maintenance regenerates before it checks whether it should stop
+    MAPPINGS_CACHE_REGENERATION_TAG_CHUNK_SIZE = 10000
+    MAPPINGS_CACHE_REGENERATION_FILE_CHUNK_SIZE = 1000
+    
+    # these change files or mappings without going through content updates, so any cached file search may be stale afterwards
+    FILE_SEARCH_CACHE_CLEARING_WRITE_ACTIONS = [ 'associate_repository_update_hashes', 'delete_pending', 'delete_unknown_duplicate_pairs', 'duplicate_pair_status', 'file_integrity', 'import_update', 'maintain_mappings_caches', 'maintain_similar_files_duplicate_pairs', 'maintain_similar_files_phashes', 'maintain_similar_files_tree', 'process_repository', 'recheck_video_metadata', 'regenerate_ac_cache', 'regenerate_similar_files', 'repair_client_files', 'reset_repository', 'tag_censorship', 'update_services' ]
     
     def __init__( self, controller, db_dir, db_name, no_wal = False ):
         
         self._initial_messages = []
         
+        self._phash_index = ClientSimilarFiles.PHashIndex()
+        
+        self._file_search_cache = ClientSearch.FileSearchResultCache()
+        
+        self._hash_ids_cache = HydrusDB.IdLookupCache( MAX_CACHED_HASH_IDS )
+        self._namespace_ids_cache = HydrusDB.IdLookupCache( MAX_CACHED_TAG_IDS )
+        self._tag_ids_cache = HydrusDB.IdLookupCache( MAX_CACHED_TAG_IDS )
+        
+        self._url_bloom_filter = None
+        
         HydrusDB.HydrusDB.__init__( self, controller, db_dir, db_name, no_wal = no_wal )
         
+        # tag searches use the siblings manager, which only picks up new siblings a little after we commit them
+        
+        self._controller.sub( self, 'ClearFileSearchCache', 'new_siblings_gui' )
+        
     
     def _AddFilesInfo( self, rows, overwrite = False ):
         
@@ -326,6 +414,34 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _AddSubtagsSearchData( self, subtag_ids_and_subtags ):
+        
+        self._c.executemany( 'REPLACE INTO subtags_fts4 ( docid, subtag ) VALUES ( ?, ? );', ( ( subtag_id, ClientSearch.ConvertTagToSearchable( subtag ) ) for ( subtag_id, subtag ) in subtag_ids_and_subtags ) )
+        
+        self._c.executemany( 'INSERT OR IGNORE INTO subtag_trigrams ( trigram, subtag_id ) VALUES ( ?, ? );', ( ( trigram, subtag_id ) for ( subtag_id, subtag ) in subtag_ids_and_subtags for trigram in GenerateSubtagTrigrams( subtag ) ) )
+        
+        integer_subtag_inserts = []
+        
+        for ( subtag_id, subtag ) in subtag_ids_and_subtags:
+            
+            try:
+                
+                integer_subtag = int( subtag )
+                
+                if CanCacheInteger( integer_subtag ):
+                    
+                    integer_subtag_inserts.append( ( subtag_id, integer_subtag ) )
+                    
+                
+            except ValueError:
+                
+                pass
+                
+            
+        
+        self._c.executemany( 'INSERT OR IGNORE INTO integer_subtags ( subtag_id, integer_subtag ) VALUES ( ?, ? );', integer_subtag_inserts )
+        
+    
     def _AddTagParents( self, service_id, pairs, make_content_updates = False ):
         
         self._c.executemany( 'DELETE FROM tag_parents WHERE service_id = ? AND child_tag_id = ? AND parent_tag_id = ?;', ( ( service_id, child_tag_id, parent_tag_id ) for ( child_tag_id, parent_tag_id ) in pairs ) )
@@ -333,6 +449,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO tag_parents ( service_id, child_tag_id, parent_tag_id, status ) VALUES ( ?, ?, ?, ? );', ( ( service_id, child_tag_id, parent_tag_id, HC.CONTENT_STATUS_CURRENT ) for ( child_tag_id, parent_tag_id ) in pairs ) )
         
+        self._CacheTagLookupsUpdateParents( service_id, { child_tag_id for ( child_tag_id, parent_tag_id ) in pairs } )
+        
         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( service_id )
         
         mappings_ids = []
@@ -371,6 +489,28 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO tag_siblings ( service_id, bad_tag_id, good_tag_id, status ) VALUES ( ?, ?, ?, ? );', ( ( service_id, bad_tag_id, good_tag_id, HC.CONTENT_STATUS_CURRENT ) for ( bad_tag_id, good_tag_id ) in pairs ) )
         
+        self._CacheTagLookupsUpdateSiblings( service_id, set( itertools.chain.from_iterable( pairs ) ) )
+        
+    
+    def _AddURLsToBloomFilter( self, urls ):
+        
+        # if the filter has not been built yet, it will pick these up from the db when it is
+        
+        if self._url_bloom_filter is None:
+            
+            return
+            
+        
+        for url in urls:
+            
+            self._url_bloom_filter.Add( url )
+            
+        
+        if self._url_bloom_filter.IsFull():
+            
+            self._url_bloom_filter = None
+            
+        
     
     def _AnalyzeStaleBigTables( self, stop_time = None, only_when_idle = False, force_reanalyze = False ):
         
@@ -567,6 +707,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'DROP TABLE IF EXISTS ' + ac_cache_table_name + ';' )
         
+        self._c.execute( 'DELETE FROM combined_files_ac_cache_regeneration WHERE service_id = ?;', ( service_id, ) )
+        
     
     def _CacheCombinedFilesMappingsGenerate( self, service_id ):
         
@@ -583,52 +725,9 @@ class DB( HydrusDB.HydrusDB ):
         
         if current_mappings_exist or pending_mappings_exist:
             
-            all_known_ids = [ tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM tags;' ) ]
+            # this can take hours for a big service, so maintenance fills it in a chunk at a time
             
-            for group_of_ids in HydrusData.SplitListIntoChunks( all_known_ids, 10000 ):
-                
-                current_counter = collections.Counter()
-                
-                if current_mappings_exist:
-                    
-                    select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + current_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
-                    
-                    for ( tag_id, count ) in self._SelectFromList( select_statement, group_of_ids ):
-                        
-                        if count > 0:
-                            
-                            current_counter[ tag_id ] = count
-                            
-                        
-                    
-                
-                #
-                
-                pending_counter = collections.Counter()
-                
-                if pending_mappings_exist:
-                    
-                    select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + pending_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
-                    
-                    for ( tag_id, count ) in self._SelectFromList( select_statement, group_of_ids ):
-                        
-                        if count > 0:
-                            
-                            pending_counter[ tag_id ] = count
-                            
-                        
-                    
-                
-                all_ids_seen = set( current_counter.keys() )
-                all_ids_seen.update( pending_counter.keys() )
-                
-                count_ids = [ ( tag_id, current_counter[ tag_id ], pending_counter[ tag_id ] ) for tag_id in all_ids_seen ]
-                
-                if len( count_ids ) > 0:
-                    
-                    self._CacheCombinedFilesMappingsUpdate( service_id, count_ids )
-                    
-                
+            self._c.execute( 'REPLACE INTO combined_files_ac_cache_regeneration ( service_id, last_tag_id ) VALUES ( ?, ? );', ( service_id, 0 ) )
             
         
     
@@ -641,10 +740,81 @@ class DB( HydrusDB.HydrusDB ):
         return self._SelectFromListFetchAll( select_statement, tag_ids )
         
     
+    def _CacheCombinedFilesMappingsRegenerateChunk( self, service_id, last_tag_id ):
+        
+        ac_cache_table_name = GenerateCombinedFilesMappingsCacheTableName( service_id )
+        
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( service_id )
+        
+        group_of_ids = self._STL( self._c.execute( 'SELECT tag_id FROM tags WHERE tag_id > ? ORDER BY tag_id LIMIT ?;', ( last_tag_id, self.MAPPINGS_CACHE_REGENERATION_TAG_CHUNK_SIZE ) ) )
+        
+        if len( group_of_ids ) == 0:
+            
+            self._c.execute( 'DELETE FROM combined_files_ac_cache_regeneration WHERE service_id = ?;', ( service_id, ) )
+            
+            return None
+            
+        
+        current_counter = collections.Counter()
+        
+        select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + current_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
+        
+        for ( tag_id, count ) in self._SelectFromList( select_statement, group_of_ids ):
+            
+            if count > 0:
+                
+                current_counter[ tag_id ] = count
+                
+            
+        
+        #
+        
+        pending_counter = collections.Counter()
+        
+        select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + pending_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
+        
+        for ( tag_id, count ) in self._SelectFromList( select_statement, group_of_ids ):
+            
+            if count > 0:
+                
+                pending_counter[ tag_id ] = count
+                
+            
+        
+        all_ids_seen = set( current_counter.keys() )
+        all_ids_seen.update( pending_counter.keys() )
+        
+        count_ids = [ ( tag_id, current_counter[ tag_id ], pending_counter[ tag_id ] ) for tag_id in all_ids_seen ]
+        
+        last_tag_id = group_of_ids[ -1 ]
+        
+        # move the marker first, so the update counts these tags
+        
+        self._c.execute( 'UPDATE combined_files_ac_cache_regeneration SET last_tag_id = ? WHERE service_id = ?;', ( last_tag_id, service_id ) )
+        
+        if len( count_ids ) > 0:
+            
+            self._CacheCombinedFilesMappingsUpdate( service_id, count_ids )
+            
+        
+        return last_tag_id
+        
+    
     def _CacheCombinedFilesMappingsUpdate( self, service_id, count_ids ):
         
         ac_cache_table_name = GenerateCombinedFilesMappingsCacheTableName( service_id )
         
+        result = self._c.execute( 'SELECT last_tag_id FROM combined_files_ac_cache_regeneration WHERE service_id = ?;', ( service_id, ) ).fetchone()
+        
+        if result is not None:
+            
+            # this cache is being regenerated. anything past the marker will be counted from scratch when the regeneration gets to it
+            
+            ( last_tag_id, ) = result
+            
+            count_ids = [ ( tag_id, current_delta, pending_delta ) for ( tag_id, current_delta, pending_delta ) in count_ids if tag_id <= last_tag_id ]
+            
+        
         self._c.executemany( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( tag_id, current_count, pending_count ) VALUES ( ?, ?, ? );', ( ( tag_id, 0, 0 ) for ( tag_id, current_delta, pending_delta ) in count_ids ) )
         
         self._c.executemany( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count + ? WHERE tag_id = ?;', ( ( current_delta, pending_delta, tag_id ) for ( tag_id, current_delta, pending_delta ) in count_ids ) )
@@ -652,6 +822,107 @@ class DB( HydrusDB.HydrusDB ):
         self._c.executemany( 'DELETE FROM ' + ac_cache_table_name + ' WHERE tag_id = ? AND current_count = ? AND pending_count = ?;', ( ( tag_id, 0, 0 ) for ( tag_id, current_delta, pending_delta ) in count_ids ) )
         
     
+    def _CacheMappingsMaintainRegeneration( self, job_key = None, stop_time = None, only_when_idle = False ):
+        
+        combined_rows = self._c.execute( 'SELECT service_id, last_tag_id FROM combined_files_ac_cache_regeneration;' ).fetchall()
+        specific_rows = self._c.execute( 'SELECT file_service_id, tag_service_id, last_hash_id FROM specific_mappings_cache_regeneration;' ).fetchall()
+        
+        if len( combined_rows ) + len( specific_rows ) == 0:
+            
+            return
+            
+        
+        time_started = HydrusData.GetNow()
+        pub_job_key = False
+        job_key_pubbed = False
+        
+        if job_key is None:
+            
+            job_key = ClientThreading.JobKey( cancellable = True )
+            
+            pub_job_key = True
+            
+        
+        # each chunk is committed with its marker, so an interruption loses at most a few chunks
+        
+        time_last_committed = HydrusData.GetNow()
+        
+        try:
+            
+            job_key.SetVariable( 'popup_title', 'regenerating tag caches' )
+            
+            jobs = [ ( 'combined', ( service_id, ), last_id ) for ( service_id, last_id ) in combined_rows ]
+            jobs.extend( ( ( 'specific', ( file_service_id, tag_service_id ), last_id ) for ( file_service_id, tag_service_id, last_id ) in specific_rows ) )
+            
+            for ( i, ( cache_type, service_ids, last_id ) ) in enumerate( jobs ):
+                
+                while last_id is not None:
+                    
+                    if pub_job_key and not job_key_pubbed and HydrusData.TimeHasPassed( time_started + 5 ):
+                        
+                        self._controller.pub( 'modal_message', job_key )
+                        
+                        job_key_pubbed = True
+                        
+                    
+                    ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                    
+                    should_stop = stop_time is not None and HydrusData.TimeHasPassed( stop_time )
+                    should_wait = only_when_idle and not self._controller.CurrentlyIdle()
+                    
+                    if should_quit or should_stop or should_wait:
+                        
+                        return
+                        
+                    
+                    text = 'regenerating ' + cache_type + ' tag cache ' + HydrusData.ConvertValueRangeToPrettyString( i + 1, len( jobs ) ) + ' - done up to id ' + HydrusData.ConvertIntToPrettyString( last_id )
+                    
+                    HG.client_controller.pub( 'splash_set_status_text', text )
+                    job_key.SetVariable( 'popup_text_1', text )
+                    
+                    if cache_type == 'combined':
+                        
+                        last_id = self._CacheCombinedFilesMappingsRegenerateChunk( service_ids[0], last_id )
+                        
+                    else:
+                        
+                        last_id = self._CacheSpecificMappingsRegenerateChunk( service_ids[0], service_ids[1], last_id )
+                        
+                    
+                    if HydrusData.TimeHasPassed( time_last_committed + 10 ):
+                        
+                        self._Commit()
+                        
+                        self._BeginImmediate()
+                        
+                        time_last_committed = HydrusData.GetNow()
+                        
+                    
+                
+            
+            job_key.SetVariable( 'popup_text_1', 'done!' )
+            
+        finally:
+            
+            if pub_job_key:
+                
+                job_key.Finish()
+                
+                job_key.Delete( 5 )
+                
+            
+        
+    
+    def _CacheMappingsRegenerationDue( self ):
+        
+        if self._c.execute( 'SELECT 1 FROM combined_files_ac_cache_regeneration;' ).fetchone() is not None:
+            
+            return True
+            
+        
+        return self._c.execute( 'SELECT 1 FROM specific_mappings_cache_regeneration;' ).fetchone() is not None
+        
+    
     def _CacheRepositoryAddHashes( self, service_id, service_hash_ids_to_hashes ):
         
         ( hash_id_map_table_name, tag_id_map_table_name ) = GenerateRepositoryMasterCacheTableNames( service_id )
@@ -756,19 +1027,21 @@ class DB( HydrusDB.HydrusDB ):
     
     def _CacheSimilarFilesAddLeaf( self, phash_id, phash ):
         
-        result = self._c.execute( 'SELECT phash_id FROM shape_vptree WHERE parent_id IS NULL;' ).fetchone()
+        phash_index = self._CacheSimilarFilesGetPHashIndex()
         
-        if result is None:
+        root_node_phash_id = phash_index.GetRootPHashId()
+        
+        parent_radius = None
+        
+        ancestors_we_are_inside = []
+        ancestors_we_are_outside = []
+        
+        if root_node_phash_id is None:
             
             parent_id = None
             
         else:
             
-            ( root_node_phash_id, ) = result
-            
-            ancestors_we_are_inside = []
-            ancestors_we_are_outside = []
-            
             an_ancestor_is_unbalanced = False
             
             next_ancestor_id = root_node_phash_id
@@ -777,7 +1050,7 @@ class DB( HydrusDB.HydrusDB ):
                 
                 ancestor_id = next_ancestor_id
                 
-                ( ancestor_phash, ancestor_radius, ancestor_inner_id, ancestor_inner_population, ancestor_outer_id, ancestor_outer_population ) = self._c.execute( 'SELECT phash, radius, inner_id, inner_population, outer_id, outer_population FROM shape_perceptual_hashes NATURAL JOIN shape_vptree WHERE phash_id = ?;', ( ancestor_id, ) ).fetchone()
+                ( ancestor_phash, ancestor_radius, ancestor_inner_id, ancestor_inner_population, ancestor_outer_id, ancestor_outer_population ) = phash_index.GetNode( ancestor_id )
                 
                 distance_to_ancestor = HydrusData.Get64BitHammingDistance( phash, ancestor_phash )
                 
@@ -792,6 +1065,7 @@ class DB( HydrusDB.HydrusDB ):
                         self._c.execute( 'UPDATE shape_vptree SET inner_id = ?, radius = ? WHERE phash_id = ?;', ( phash_id, distance_to_ancestor, ancestor_id ) )
                         
                         parent_id = ancestor_id
+                        parent_radius = distance_to_ancestor
                         
                     
                 else:
@@ -836,6 +1110,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'INSERT INTO shape_vptree ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) )
         
+        phash_index.AddLeaf( phash_id, phash, parent_id, parent_radius, ancestors_we_are_inside, ancestors_we_are_outside )
+        
     
     def _CacheSimilarFilesAssociatePHashes( self, hash_id, phashes ):
         
@@ -850,6 +1126,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO shape_perceptual_hash_map ( phash_id, hash_id ) VALUES ( ?, ? );', ( ( phash_id, hash_id ) for phash_id in phash_ids ) )
         
+        self._phash_index.SetUseful( phash_ids, True )
+        
         if self._GetRowCount() > 0:
             
             self._c.execute( 'REPLACE INTO shape_search_cache ( hash_id, searched_distance ) VALUES ( ?, ? );', ( hash_id, None ) )
@@ -893,6 +1171,10 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO shape_maintenance_branch_regen ( phash_id ) VALUES ( ? );', ( ( phash_id, ) for phash_id in useless_phash_ids ) )
         
+        # these nodes stay in the tree until their branch is regenerated, but searches no longer need to report them
+        
+        self._phash_index.SetUseful( useless_phash_ids, False )
+        
     
     def _CacheSimilarFilesGenerateBranch( self, job_key, parent_id, phash_id, phash, children ):
         
@@ -980,6 +1262,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT INTO shape_vptree ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', insert_rows )
         
+        self._phash_index.Invalidate()
+        
     
     def _CacheSimilarFilesGetDuplicateHashes( self, file_service_key, hash, duplicate_type ):
         
@@ -1233,6 +1517,25 @@ class DB( HydrusDB.HydrusDB ):
         return ( num_phashes_to_regen, num_branches_to_regen, searched_distances_to_count, duplicate_types_to_count )
         
     
+    def _CacheSimilarFilesGetPHashIndex( self ):
+        
+        if self._IsReadConnection():
+            
+            # the index is changed by maintenance as it goes, so only the main connection can use it
+            
+            raise HydrusExceptions.DBAccessException( 'The phash index is not available to read connections!' )
+            
+        
+        if not self._phash_index.IsLoaded():
+            
+            rows = self._c.execute( 'SELECT phash_id, phash, IFNULL( parent_id, ? ), IFNULL( radius, ? ), IFNULL( inner_id, ? ), inner_population, IFNULL( outer_id, ? ), outer_population FROM shape_perceptual_hashes NATURAL JOIN shape_vptree;', ( ClientSimilarFiles.NULL_ID, ) * 4 ).fetchall()
+            
+            self._phash_index.Load( rows )
+            
+        
+        return self._phash_index
+        
+    
     def _CacheSimilarFilesGetPHashId( self, phash ):
         
         result = self._c.execute( 'SELECT phash_id FROM shape_perceptual_hashes WHERE phash = ?;', ( sqlite3.Binary( phash ), ) ).fetchone()
@@ -1384,7 +1687,11 @@ class DB( HydrusDB.HydrusDB ):
             
             total_done_previously = total_num_hash_ids_in_cache - len( hash_ids )
             
-            for ( i, hash_id ) in enumerate( hash_ids ):
+            # searching many files at once lets us walk the upper tree once per level for the whole block
+            
+            BLOCK_SIZE = 1000
+            
+            for ( i, block_of_hash_ids ) in enumerate( HydrusData.SplitListIntoChunks( hash_ids, BLOCK_SIZE ) ):
                 
                 job_key.SetVariable( 'popup_title', 'similar files duplicate pair discovery' )
                 
@@ -1404,25 +1711,24 @@ class DB( HydrusDB.HydrusDB ):
                     return
                     
                 
-                if i % 25 == 0:
-                    
-                    text = 'searched ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + i, total_num_hash_ids_in_cache ) + ' files'
-                    
-                    job_key.SetVariable( 'popup_text_1', text )
-                    job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + i, total_num_hash_ids_in_cache ) )
-                    
-                    HG.client_controller.pub( 'splash_set_status_text', text )
-                    
+                num_done = total_done_previously + i * BLOCK_SIZE
+                
+                text = 'searched ' + HydrusData.ConvertValueRangeToPrettyString( num_done, total_num_hash_ids_in_cache ) + ' files'
+                
+                job_key.SetVariable( 'popup_text_1', text )
+                job_key.SetVariable( 'popup_gauge_1', ( num_done, total_num_hash_ids_in_cache ) )
+                
+                HG.client_controller.pub( 'splash_set_status_text', text )
                 
-                duplicate_hash_ids = [ duplicate_hash_id for duplicate_hash_id in self._CacheSimilarFilesSearch( hash_id, search_distance ) if duplicate_hash_id != hash_id ]
+                pairs_of_hash_ids = self._CacheSimilarFilesSearchBatch( block_of_hash_ids, search_distance )
                 
                 # double-check the files exist in shape_search_cache, as I think stale branches are producing deleted file pairs here
                 
-                self._c.executemany( 'INSERT OR IGNORE INTO duplicate_pairs ( smaller_hash_id, larger_hash_id, duplicate_type ) VALUES ( ?, ?, ? );', ( ( min( hash_id, duplicate_hash_id ), max( hash_id, duplicate_hash_id ), HC.DUPLICATE_UNKNOWN ) for duplicate_hash_id in duplicate_hash_ids ) )
+                self._c.executemany( 'INSERT OR IGNORE INTO duplicate_pairs ( smaller_hash_id, larger_hash_id, duplicate_type ) VALUES ( ?, ?, ? );', ( ( smaller_hash_id, larger_hash_id, HC.DUPLICATE_UNKNOWN ) for ( smaller_hash_id, larger_hash_id ) in pairs_of_hash_ids ) )
                 
                 pairs_found += self._GetRowCount()
                 
-                self._c.execute( 'UPDATE shape_search_cache SET searched_distance = ? WHERE hash_id = ?;', ( search_distance, hash_id ) )
+                self._c.executemany( 'UPDATE shape_search_cache SET searched_distance = ? WHERE hash_id = ?;', ( ( search_distance, hash_id ) for hash_id in block_of_hash_ids ) )
                 
             
         finally:
@@ -1771,6 +2077,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'DELETE FROM shape_vptree WHERE phash_id = ?;', ( ( p_id, ) for p_id in unbalanced_phash_ids ) )
         
+        self._phash_index.Invalidate()
+        
         self._c.executemany( 'DELETE FROM shape_maintenance_branch_regen WHERE phash_id = ?;', ( ( p_id, ) for p_id in unbalanced_phash_ids ) )
         
         select_statement = 'SELECT phash_id FROM shape_perceptual_hash_map WHERE phash_id IN %s;'
@@ -1832,6 +2140,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'DELETE FROM shape_vptree;' )
             
+            self._phash_index.Invalidate()
+            
             all_nodes = self._c.execute( 'SELECT phash_id, phash FROM shape_perceptual_hashes;' ).fetchall()
             
             job_key.SetVariable( 'popup_text_1', HydrusData.ConvertIntToPrettyString( len( all_nodes ) ) + ' leaves found, now regenerating' )
@@ -1871,15 +2181,6 @@ class DB( HydrusDB.HydrusDB ):
             
             search_radius = max_hamming_distance
             
-            result = self._c.execute( 'SELECT phash_id FROM shape_vptree WHERE parent_id IS NULL;' ).fetchone()
-            
-            if result is None:
-                
-                return []
-                
-            
-            ( root_node_phash_id, ) = result
-            
             search_phashes = [ phash for ( phash, ) in self._c.execute( 'SELECT phash FROM shape_perceptual_hashes NATURAL JOIN shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) ]
             
             if len( search_phashes ) == 0:
@@ -1887,76 +2188,17 @@ class DB( HydrusDB.HydrusDB ):
                 return []
                 
             
-            next_potentials = { root_node_phash_id : tuple( search_phashes ) }
-            similar_phash_ids = set()
+            phash_index = self._CacheSimilarFilesGetPHashIndex()
             
-            num_cycles = 0
+            # the index walks each level of the tree in one go. for every node, we test the two spheres--node and search--their centers separated by node_hamming_distance
+            # we want to search inside/outside the node_sphere if the search_sphere intersects with those spaces
+            # there are four possibles:
+            # (----N----)-(--S--)    intersects with outer only - distance between N and S > their radii
+            # (----N---(-)-S--)      intersects with both
+            # (----N-(--S-)-)        intersects with both
+            # (---(-N-S--)-)         intersects with inner only - distance between N and S + radius_S does not exceed radius_N
             
-            while len( next_potentials ) > 0:
-                
-                current_potentials = next_potentials
-                next_potentials = {}
-                
-                num_cycles += 1
-                
-                select_statement = 'SELECT phash_id, phash, radius, inner_id, outer_id FROM shape_perceptual_hashes NATURAL JOIN shape_vptree WHERE phash_id IN %s;'
-                
-                for ( node_phash_id, node_phash, node_radius, inner_phash_id, outer_phash_id ) in self._SelectFromList( select_statement, current_potentials.keys() ):
-                    
-                    search_phashes = current_potentials[ node_phash_id ]
-                    
-                    inner_search_phashes = []
-                    outer_search_phashes = []
-                    
-                    for search_phash in search_phashes:
-                        
-                        # first check the node--is it similar?
-                        
-                        node_hamming_distance = HydrusData.Get64BitHammingDistance( search_phash, node_phash )
-                        
-                        if node_hamming_distance <= search_radius:
-                            
-                            similar_phash_ids.add( node_phash_id )
-                            
-                        
-                        # now how about its children?
-                        
-                        if node_radius is not None:
-                            
-                            # we have two spheres--node and search--their centers separated by node_hamming_distance
-                            # we want to search inside/outside the node_sphere if the search_sphere intersects with those spaces
-                            # there are four possibles:
-                            # (----N----)-(--S--)    intersects with outer only - distance between N and S > their radii
-                            # (----N---(-)-S--)      intersects with both
-                            # (----N-(--S-)-)        intersects with both
-                            # (---(-N-S--)-)         intersects with inner only - distance between N and S + radius_S does not exceed radius_N
-                            
-                            spheres_disjoint = node_hamming_distance > ( node_radius + search_radius )
-                            search_sphere_subset_of_node_sphere = ( node_hamming_distance + search_radius ) <= node_radius
-                            
-                            if not spheres_disjoint: # i.e. they intersect at some point
-                                
-                                inner_search_phashes.append( search_phash )
-                                
-                            
-                            if not search_sphere_subset_of_node_sphere: # i.e. search sphere intersects with non-node sphere space at some point
-                                
-                                outer_search_phashes.append( search_phash )
-                                
-                            
-                        
-                    
-                    if inner_phash_id is not None and len( inner_search_phashes ) > 0:
-                        
-                        next_potentials[ inner_phash_id ] = tuple( inner_search_phashes )
-                        
-                    
-                    if outer_phash_id is not None and len( outer_search_phashes ) > 0:
-                        
-                        next_potentials[ outer_phash_id ] = tuple( outer_search_phashes )
-                        
-                    
-                
+            ( similar_phash_ids, num_cycles ) = phash_index.Search( search_phashes, search_radius )
             
             if HG.db_report_mode:
                 
@@ -1971,6 +2213,41 @@ class DB( HydrusDB.HydrusDB ):
         return similar_hash_ids
         
     
+    def _CacheSimilarFilesSearchBatch( self, hash_ids, max_hamming_distance ):
+        
+        select_statement = 'SELECT hash_id, phash FROM shape_perceptual_hash_map NATURAL JOIN shape_perceptual_hashes WHERE hash_id IN %s;'
+        
+        hash_ids_and_search_phashes = self._SelectFromListFetchAll( select_statement, hash_ids )
+        
+        phash_index = self._CacheSimilarFilesGetPHashIndex()
+        
+        ( hash_ids_and_similar_phash_ids, num_cycles ) = phash_index.SearchBatch( hash_ids_and_search_phashes, max_hamming_distance )
+        
+        if HG.db_report_mode:
+            
+            HydrusData.ShowText( 'Similar file batch search for ' + HydrusData.ConvertIntToPrettyString( len( hash_ids ) ) + ' files completed in ' + HydrusData.ConvertIntToPrettyString( num_cycles ) + ' cycles.' )
+            
+        
+        similar_phash_ids = { phash_id for ( hash_id, phash_id ) in hash_ids_and_similar_phash_ids }
+        
+        phash_ids_to_hash_ids = HydrusData.BuildKeyToListDict( self._SelectFromList( 'SELECT phash_id, hash_id FROM shape_perceptual_hash_map WHERE phash_id IN %s;', similar_phash_ids ) )
+        
+        pairs_of_hash_ids = set()
+        
+        for ( hash_id, similar_phash_id ) in hash_ids_and_similar_phash_ids:
+            
+            for similar_hash_id in phash_ids_to_hash_ids[ similar_phash_id ]:
+                
+                if similar_hash_id != hash_id:
+                    
+                    pairs_of_hash_ids.add( ( min( hash_id, similar_hash_id ), max( hash_id, similar_hash_id ) ) )
+                    
+                
+            
+        
+        return pairs_of_hash_ids
+        
+    
     def _CacheSimilarFilesSetDuplicatePairStatus( self, pair_info ):
         
         for ( duplicate_type, hash_a, hash_b, list_of_service_keys_to_content_updates ) in pair_info:
@@ -2307,6 +2584,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'DROP TABLE IF EXISTS ' + ac_cache_table_name + ';' )
         
+        self._c.execute( 'DELETE FROM specific_mappings_cache_regeneration WHERE file_service_id = ? AND tag_service_id = ?;', ( file_service_id, tag_service_id ) )
+        
     
     def _CacheSpecificMappingsDeleteFiles( self, file_service_id, tag_service_id, hash_ids ):
         
@@ -2434,11 +2713,33 @@ class DB( HydrusDB.HydrusDB ):
         
         #
         
-        hash_ids = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( file_service_id, ) ) ]
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
         
-        if len( hash_ids ) > 0:
+        mappings_exist = False
+        
+        for mappings_table_name in ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name ):
             
-            self._CacheSpecificMappingsAddFiles( file_service_id, tag_service_id, hash_ids )
+            if self._c.execute( 'SELECT 1 FROM ' + mappings_table_name + ' LIMIT 1;' ).fetchone() is not None:
+                
+                mappings_exist = True
+                
+            
+        
+        if mappings_exist:
+            
+            if self._c.execute( 'SELECT 1 FROM current_files WHERE service_id = ? LIMIT 1;', ( file_service_id, ) ).fetchone() is not None:
+                
+                # this can take hours for a big service, so maintenance fills it in a chunk at a time
+                # until it is done, the cache is correct for the files it has so far
+                
+                self._c.execute( 'REPLACE INTO specific_mappings_cache_regeneration ( file_service_id, tag_service_id, last_hash_id ) VALUES ( ?, ?, ? );', ( file_service_id, tag_service_id, 0 ) )
+                
+            
+        else:
+            
+            # no mappings to copy, so we can do all the files at once
+            
+            self._c.execute( 'INSERT INTO ' + cache_files_table_name + ' ( hash_id ) SELECT hash_id FROM current_files WHERE service_id = ?;', ( file_service_id, ) )
             
         
     
@@ -2476,6 +2777,39 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CacheSpecificMappingsRegenerateChunk( self, file_service_id, tag_service_id, last_hash_id ):
+        
+        ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        hash_ids = self._STL( self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ? AND hash_id > ? ORDER BY hash_id LIMIT ?;', ( file_service_id, last_hash_id, self.MAPPINGS_CACHE_REGENERATION_FILE_CHUNK_SIZE ) ) )
+        
+        if len( hash_ids ) == 0:
+            
+            self._c.execute( 'DELETE FROM specific_mappings_cache_regeneration WHERE file_service_id = ? AND tag_service_id = ?;', ( file_service_id, tag_service_id ) )
+            
+            return None
+            
+        
+        last_hash_id = hash_ids[ -1 ]
+        
+        # files imported since the regeneration started were added as normal
+        
+        select_statement = 'SELECT hash_id FROM ' + cache_files_table_name + ' WHERE hash_id IN %s;'
+        
+        existing_hash_ids = self._STS( self._SelectFromList( select_statement, hash_ids ) )
+        
+        hash_ids = [ hash_id for hash_id in hash_ids if hash_id not in existing_hash_ids ]
+        
+        if len( hash_ids ) > 0:
+            
+            self._CacheSpecificMappingsAddFiles( file_service_id, tag_service_id, hash_ids )
+            
+        
+        self._c.execute( 'UPDATE specific_mappings_cache_regeneration SET last_hash_id = ? WHERE file_service_id = ? AND tag_service_id = ?;', ( last_hash_id, file_service_id, tag_service_id ) )
+        
+        return last_hash_id
+        
+    
     def _CacheSpecificMappingsRescindPendingMappings( self, file_service_id, tag_service_id, mappings_ids ):
         
         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
@@ -2500,6 +2834,480 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CacheTagLookupsFilterCensoredPairIds( self, service_id, pair_ids, tag_ids_to_tags ):
+        
+        # the censorship manager only catches up after this job, so we go to the table
+        
+        for censorship_service_id in ( self._combined_tag_service_id, service_id ):
+            
+            result = self._c.execute( 'SELECT blacklist, tags FROM tag_censorship WHERE service_id = ?;', ( censorship_service_id, ) ).fetchone()
+            
+            if result is None:
+                
+                continue
+                
+            
+            ( blacklist, censorships ) = result
+            
+            if blacklist:
+                
+                pair_ids = [ ( a, b ) for ( a, b ) in pair_ids if not HydrusTags.CensorshipMatch( tag_ids_to_tags[ a ], censorships ) and not HydrusTags.CensorshipMatch( tag_ids_to_tags[ b ], censorships ) ]
+                
+            else:
+                
+                pair_ids = [ ( a, b ) for ( a, b ) in pair_ids if HydrusTags.CensorshipMatch( tag_ids_to_tags[ a ], censorships ) and HydrusTags.CensorshipMatch( tag_ids_to_tags[ b ], censorships ) ]
+                
+            
+        
+        return pair_ids
+        
+    
+    def _CacheTagLookupsGetApplyAllSiblingsToAllServices( self ):
+        
+        result = self._c.execute( 'SELECT apply_all_siblings_to_all_services FROM tag_lookup_cache_options;' ).fetchone()
+        
+        if result is None:
+            
+            return False
+            
+        
+        ( apply_all_siblings_to_all_services, ) = result
+        
+        return bool( apply_all_siblings_to_all_services )
+        
+    
+    def _CacheTagLookupsGetCollapsedParentPairIds( self, service_id, tag_ids = None ):
+        
+        # the sibling-collapsed parent pairs the service's closure is built from--either all of them, or just those reachable going up from tag_ids
+        
+        apply_all_siblings_to_all_services = self._CacheTagLookupsGetApplyAllSiblingsToAllServices()
+        
+        if service_id == self._combined_tag_service_id:
+            
+            parent_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
+        else:
+            
+            parent_service_ids = [ service_id ]
+            
+        
+        parent_service_ids_to_sibling_service_ids = { parent_service_id : self._combined_tag_service_id if apply_all_siblings_to_all_services else parent_service_id for parent_service_id in parent_service_ids }
+        
+        collapsed_pair_ids = set()
+        
+        if tag_ids is None:
+            
+            for ( parent_service_id, sibling_service_id ) in parent_service_ids_to_sibling_service_ids.items():
+                
+                pair_ids = self._CacheTagLookupsGetPairIds( HC.CONTENT_TYPE_TAG_PARENTS, parent_service_id )
+                
+                siblings = dict( self._c.execute( 'SELECT bad_tag_id, ideal_tag_id FROM tag_sibling_lookup_cache WHERE service_id = ?;', ( sibling_service_id, ) ) )
+                
+                collapsed_pair_ids.update( ( ( siblings.get( child_tag_id, child_tag_id ), siblings.get( parent_tag_id, parent_tag_id ) ) for ( child_tag_id, parent_tag_id ) in pair_ids ) )
+                
+            
+            return collapsed_pair_ids
+            
+        
+        # the combined closure can go up one service's pairs and then another's, so every service walks the same frontier
+        
+        seen_tag_ids = set()
+        next_tag_ids = set( tag_ids )
+        
+        while len( next_tag_ids ) > 0:
+            
+            seen_tag_ids.update( next_tag_ids )
+            
+            new_pair_ids = set()
+            
+            for ( parent_service_id, sibling_service_id ) in parent_service_ids_to_sibling_service_ids.items():
+                
+                # a collapsed tag gets the pairs of all the tags that collapse to it, but a 'bad' tag has none of its own
+                
+                bad_tag_ids = self._STS( self._SelectFromList( 'SELECT bad_tag_id FROM tag_sibling_lookup_cache WHERE service_id = ' + str( sibling_service_id ) + ' AND bad_tag_id IN %s;', next_tag_ids ) )
+                
+                raw_tag_ids_to_collapsed_tag_ids = { tag_id : tag_id for tag_id in next_tag_ids if tag_id not in bad_tag_ids }
+                
+                raw_tag_ids_to_collapsed_tag_ids.update( self._SelectFromListFetchAll( 'SELECT bad_tag_id, ideal_tag_id FROM tag_sibling_lookup_cache WHERE service_id = ' + str( sibling_service_id ) + ' AND ideal_tag_id IN %s;', next_tag_ids ) )
+                
+                pair_ids = self._CacheTagLookupsGetPairIds( HC.CONTENT_TYPE_TAG_PARENTS, parent_service_id, raw_tag_ids_to_collapsed_tag_ids.keys() )
+                
+                parent_tag_ids = { parent_tag_id for ( child_tag_id, parent_tag_id ) in pair_ids }
+                
+                siblings = dict( self._SelectFromListFetchAll( 'SELECT bad_tag_id, ideal_tag_id FROM tag_sibling_lookup_cache WHERE service_id = ' + str( sibling_service_id ) + ' AND bad_tag_id IN %s;', parent_tag_ids ) )
+                
+                new_pair_ids.update( ( ( raw_tag_ids_to_collapsed_tag_ids[ child_tag_id ], siblings.get( parent_tag_id, parent_tag_id ) ) for ( child_tag_id, parent_tag_id ) in pair_ids ) )
+                
+            
+            collapsed_pair_ids.update( new_pair_ids )
+            
+            next_tag_ids = { parent_tag_id for ( child_tag_id, parent_tag_id ) in new_pair_ids }.difference( seen_tag_ids )
+            
+        
+        return collapsed_pair_ids
+        
+    
+    def _CacheTagLookupsGetIdealTagIds( self, service_id, tag_ids ):
+        
+        return self._STS( self._SelectFromList( 'SELECT ideal_tag_id FROM tag_sibling_lookup_cache WHERE service_id = ' + str( service_id ) + ' AND bad_tag_id IN %s;', tag_ids ) )
+        
+    
+    def _CacheTagLookupsGetPairIds( self, content_type, service_id, tag_ids = None, both_ways = False ):
+        
+        # current and pending pairs, censored, just as the managers have always used them
+        
+        if content_type == HC.CONTENT_TYPE_TAG_SIBLINGS:
+            
+            ( table_name, petitions_table_name, column_names ) = ( 'tag_siblings', 'tag_sibling_petitions', ( 'bad_tag_id', 'good_tag_id' ) )
+            
+        else:
+            
+            ( table_name, petitions_table_name, column_names ) = ( 'tag_parents', 'tag_parent_petitions', ( 'child_tag_id', 'parent_tag_id' ) )
+            
+        
+        select_statements = []
+        
+        select_statements.append( 'SELECT ' + ', '.join( column_names ) + ' FROM ' + table_name + ' WHERE service_id = ' + str( service_id ) + ' AND status = ' + str( HC.CONTENT_STATUS_CURRENT ) )
+        select_statements.append( 'SELECT ' + ', '.join( column_names ) + ' FROM ' + petitions_table_name + ' WHERE service_id = ' + str( service_id ) + ' AND status = ' + str( HC.CONTENT_STATUS_PENDING ) )
+        
+        if tag_ids is None:
+            
+            pair_ids = set( self._c.execute( ' UNION '.join( select_statements ) + ';' ) )
+            
+        else:
+            
+            if both_ways:
+                
+                search_column_names = column_names
+                
+            else:
+                
+                search_column_names = column_names[:1]
+                
+            
+            pair_ids = set()
+            
+            for select_statement in select_statements:
+                
+                for column_name in search_column_names:
+                    
+                    pair_ids.update( self._SelectFromList( select_statement + ' AND ' + column_name + ' IN %s;', tag_ids ) )
+                    
+                
+            
+        
+        if len( pair_ids ) == 0:
+            
+            return []
+            
+        
+        tag_ids_to_tags = self._GetTagIdsToTags( set( itertools.chain.from_iterable( pair_ids ) ) )
+        
+        return self._CacheTagLookupsFilterCensoredPairIds( service_id, pair_ids, tag_ids_to_tags )
+        
+    
+    def _CacheTagLookupsGetParents( self, service_key, tags ):
+        
+        # the parents manager asks for just the tags it needs, so we do not send it the whole closure
+        
+        try:
+            
+            service_id = self._GetServiceId( service_key )
+            
+        except HydrusExceptions.DataMissing:
+            
+            return {}
+            
+        
+        tags_to_tag_ids = self._CacheTagLookupsGetTagsToExistingTagIds( tags )
+        
+        child_tag_ids_to_tags = { tag_id : tag for ( tag, tag_id ) in tags_to_tag_ids.items() }
+        
+        rows = self._SelectFromListFetchAll( 'SELECT child_tag_id, ancestor_index, ancestor_tag_id FROM tag_parent_lookup_cache WHERE service_id = ' + str( service_id ) + ' AND child_tag_id IN %s;', child_tag_ids_to_tags.keys() )
+        
+        ancestor_tag_ids_to_tags = self._GetTagIdsToTags( { ancestor_tag_id for ( child_tag_id, ancestor_index, ancestor_tag_id ) in rows } )
+        
+        # the ancestor_index keeps the parent-grandparent interleaving
+        
+        rows.sort()
+        
+        children_to_parents = collections.defaultdict( list )
+        
+        for ( child_tag_id, ancestor_index, ancestor_tag_id ) in rows:
+            
+            children_to_parents[ child_tag_ids_to_tags[ child_tag_id ] ].append( ancestor_tag_ids_to_tags[ ancestor_tag_id ] )
+            
+        
+        return { service_key : dict( children_to_parents ) }
+        
+    
+    def _CacheTagLookupsGetSiblingNetworkPairIds( self, service_id, tag_ids ):
+        
+        # every ( bad, ideal ) pair in the sibling networks the tag_ids are in
+        
+        ideal_tag_ids = self._CacheTagLookupsGetIdealTagIds( service_id, tag_ids )
+        
+        ideal_tag_ids.update( tag_ids )
+        
+        return self._SelectFromListFetchAll( 'SELECT bad_tag_id, ideal_tag_id FROM tag_sibling_lookup_cache WHERE service_id = ' + str( service_id ) + ' AND ideal_tag_id IN %s;', ideal_tag_ids )
+        
+    
+    def _CacheTagLookupsGetSiblings( self, service_key, tags ):
+        
+        # the siblings manager asks for just the tags it needs, so we send the pairs in their networks and not the whole table
+        
+        try:
+            
+            service_id = self._GetServiceId( service_key )
+            
+        except HydrusExceptions.DataMissing:
+            
+            return {}
+            
+        
+        tags_to_tag_ids = self._CacheTagLookupsGetTagsToExistingTagIds( tags )
+        
+        pair_ids = self._CacheTagLookupsGetSiblingNetworkPairIds( service_id, set( tags_to_tag_ids.values() ) )
+        
+        tag_ids_to_tags = self._GetTagIdsToTags( set( itertools.chain.from_iterable( pair_ids ) ) )
+        
+        return { service_key : { tag_ids_to_tags[ bad_tag_id ] : tag_ids_to_tags[ ideal_tag_id ] for ( bad_tag_id, ideal_tag_id ) in pair_ids } }
+        
+    
+    def _CacheTagLookupsGetTagsToExistingTagIds( self, tags ):
+        
+        # a tag nothing has used has no siblings or parents, and looking it up should not make it
+        
+        existing_tags = [ tag for tag in tags if self._TagExists( tag ) ]
+        
+        return self._GetTagsToTagIds( existing_tags )
+        
+    
+    def _CacheTagLookupsRegenerate( self ):
+        
+        self._c.execute( 'DELETE FROM tag_sibling_lookup_cache;' )
+        self._c.execute( 'DELETE FROM tag_parent_lookup_cache;' )
+        
+        service_ids = self._GetServiceIds( HC.TAG_SERVICES ) + [ self._combined_tag_service_id ]
+        
+        # every service's parents may be collapsed by the combined siblings, so do all the siblings first
+        
+        for service_id in service_ids:
+            
+            self._CacheTagLookupsRegenerateSiblings( service_id )
+            
+        
+        for service_id in service_ids:
+            
+            self._CacheTagLookupsRegenerateParents( service_id )
+            
+        
+    
+    def _CacheTagLookupsRegenerateParents( self, service_id, tag_ids = None ):
+        
+        # regenerates the closure for tag_ids and everything under them, or for the whole service
+        # nothing else can have one of the changed tags as an ancestor, so nothing else can change
+        
+        if tag_ids is None:
+            
+            self._c.execute( 'DELETE FROM tag_parent_lookup_cache WHERE service_id = ?;', ( service_id, ) )
+            
+            child_tag_ids = None
+            
+        else:
+            
+            if len( tag_ids ) == 0:
+                
+                return
+                
+            
+            child_tag_ids = set( tag_ids )
+            
+            child_tag_ids.update( self._STL( self._SelectFromList( 'SELECT child_tag_id FROM tag_parent_lookup_cache WHERE service_id = ' + str( service_id ) + ' AND ancestor_tag_id IN %s;', tag_ids ) ) )
+            
+            self._c.executemany( 'DELETE FROM tag_parent_lookup_cache WHERE service_id = ? AND child_tag_id = ?;', ( ( service_id, child_tag_id ) for child_tag_id in child_tag_ids ) )
+            
+        
+        collapsed_pair_ids = self._CacheTagLookupsGetCollapsedParentPairIds( service_id, child_tag_ids )
+        
+        simple_children_to_parents = ClientData.BuildSimpleChildrenToParents( collapsed_pair_ids )
+        
+        children_to_parents = ClientData.BuildServiceKeysToChildrenToParents( { service_id : simple_children_to_parents } )[ service_id ]
+        
+        inserts = []
+        
+        for ( child_tag_id, parent_tag_ids ) in children_to_parents.items():
+            
+            if child_tag_ids is not None and child_tag_id not in child_tag_ids:
+                
+                continue
+                
+            
+            # the ancestor_index keeps the parent-grandparent interleaving
+            
+            inserts.extend( ( ( service_id, child_tag_id, ancestor_index, parent_tag_id ) for ( ancestor_index, parent_tag_id ) in enumerate( parent_tag_ids ) ) )
+            
+        
+        self._c.executemany( 'INSERT INTO tag_parent_lookup_cache ( service_id, child_tag_id, ancestor_index, ancestor_tag_id ) VALUES ( ?, ?, ?, ? );', inserts )
+        
+    
+    def _CacheTagLookupsRegenerateSiblings( self, service_id, tag_ids = None ):
+        
+        # regenerates the collapsed siblings for everything connected to tag_ids, or for the whole service
+        # chains never cross between unconnected groups of pairs, so each group can be collapsed on its own
+        # returns the tags whose ideal changed, and their old and new ideals, which is what the parents will need to redo
+        
+        if service_id == self._combined_tag_service_id:
+            
+            sibling_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
+        else:
+            
+            sibling_service_ids = [ service_id ]
+            
+        
+        if tag_ids is None:
+            
+            self._c.execute( 'DELETE FROM tag_sibling_lookup_cache WHERE service_id = ?;', ( service_id, ) )
+            
+            sibling_service_ids_to_pair_ids = { sibling_service_id : self._CacheTagLookupsGetPairIds( HC.CONTENT_TYPE_TAG_SIBLINGS, sibling_service_id ) for sibling_service_id in sibling_service_ids }
+            
+            old_siblings = {}
+            
+        else:
+            
+            # the cache still has the old chains, so start with everything they connected
+            
+            group_tag_ids = set( tag_ids )
+            
+            group_tag_ids.update( self._CacheTagLookupsGetIdealTagIds( service_id, tag_ids ) )
+            
+            group_tag_ids.update( self._STL( self._SelectFromList( 'SELECT bad_tag_id FROM tag_sibling_lookup_cache WHERE service_id = ' + str( service_id ) + ' AND ideal_tag_id IN %s;', list( group_tag_ids ) ) ) )
+            
+            sibling_service_ids_to_pair_ids = collections.defaultdict( set )
+            
+            next_tag_ids = set( group_tag_ids )
+            
+            while len( next_tag_ids ) > 0:
+                
+                new_tag_ids = set()
+                
+                for sibling_service_id in sibling_service_ids:
+                    
+                    pair_ids = self._CacheTagLookupsGetPairIds( HC.CONTENT_TYPE_TAG_SIBLINGS, sibling_service_id, next_tag_ids, both_ways = True )
+                    
+                    sibling_service_ids_to_pair_ids[ sibling_service_id ].update( pair_ids )
+                    
+                    new_tag_ids.update( itertools.chain.from_iterable( pair_ids ) )
+                    
+                
+                next_tag_ids = new_tag_ids.difference( group_tag_ids )
+                
+                group_tag_ids.update( next_tag_ids )
+                
+            
+            old_siblings = dict( self._SelectFromListFetchAll( 'SELECT bad_tag_id, ideal_tag_id FROM tag_sibling_lookup_cache WHERE service_id = ' + str( service_id ) + ' AND bad_tag_id IN %s;', group_tag_ids ) )
+            
+            self._c.executemany( 'DELETE FROM tag_sibling_lookup_cache WHERE service_id = ? AND bad_tag_id = ?;', ( ( service_id, bad_tag_id ) for bad_tag_id in old_siblings.keys() ) )
+            
+        
+        # the collapse sorts, so it has to work on the tags themselves
+        
+        all_pair_ids = list( itertools.chain.from_iterable( sibling_service_ids_to_pair_ids.values() ) )
+        
+        tag_ids_to_tags = self._GetTagIdsToTags( set( itertools.chain.from_iterable( all_pair_ids ) ) )
+        
+        tags_to_tag_ids = { tag : tag_id for ( tag_id, tag ) in tag_ids_to_tags.items() }
+        
+        if service_id == self._combined_tag_service_id:
+            
+            # local siblings take precedence
+            
+            local_pair_ids = sibling_service_ids_to_pair_ids.get( self._local_tag_service_id, [] )
+            tag_repo_pair_ids = itertools.chain.from_iterable( ( pair_ids for ( sibling_service_id, pair_ids ) in sibling_service_ids_to_pair_ids.items() if sibling_service_id != self._local_tag_service_id ) )
+            
+            groups_of_pair_ids = [ local_pair_ids, tag_repo_pair_ids ]
+            
+        else:
+            
+            groups_of_pair_ids = [ all_pair_ids ]
+            
+        
+        groups_of_pairs = [ { ( tag_ids_to_tags[ bad_tag_id ], tag_ids_to_tags[ good_tag_id ] ) for ( bad_tag_id, good_tag_id ) in pair_ids } for pair_ids in groups_of_pair_ids ]
+        
+        siblings = ClientData.CollapseTagSiblingPairs( groups_of_pairs )
+        
+        new_siblings = { tags_to_tag_ids[ bad ] : tags_to_tag_ids[ ideal ] for ( bad, ideal ) in siblings.items() }
+        
+        self._c.executemany( 'INSERT INTO tag_sibling_lookup_cache ( service_id, bad_tag_id, ideal_tag_id ) VALUES ( ?, ?, ? );', ( ( service_id, bad_tag_id, ideal_tag_id ) for ( bad_tag_id, ideal_tag_id ) in new_siblings.items() ) )
+        
+        if tag_ids is None:
+            
+            return None
+            
+        
+        changed_tag_ids = { tag_id for tag_id in set( old_siblings.keys() ).union( new_siblings.keys() ) if old_siblings.get( tag_id ) != new_siblings.get( tag_id ) }
+        
+        changed_tag_ids.update( [ old_siblings[ tag_id ] for tag_id in changed_tag_ids if tag_id in old_siblings ] + [ new_siblings[ tag_id ] for tag_id in changed_tag_ids if tag_id in new_siblings ] )
+        
+        return changed_tag_ids
+        
+    
+    def _CacheTagLookupsUpdateParents( self, service_id, child_tag_ids ):
+        
+        if len( child_tag_ids ) == 0:
+            
+            return
+            
+        
+        # the service's pairs are collapsed the same way for its own closure and the combined one
+        
+        if self._CacheTagLookupsGetApplyAllSiblingsToAllServices():
+            
+            sibling_service_id = self._combined_tag_service_id
+            
+        else:
+            
+            sibling_service_id = service_id
+            
+        
+        tag_ids = set( child_tag_ids )
+        
+        tag_ids.update( self._CacheTagLookupsGetIdealTagIds( sibling_service_id, child_tag_ids ) )
+        
+        for parent_service_id in ( service_id, self._combined_tag_service_id ):
+            
+            self._CacheTagLookupsRegenerateParents( parent_service_id, tag_ids )
+            
+        
+    
+    def _CacheTagLookupsUpdateSiblings( self, service_id, tag_ids ):
+        
+        if len( tag_ids ) == 0:
+            
+            return
+            
+        
+        changed_tag_ids = self._CacheTagLookupsRegenerateSiblings( service_id, tag_ids )
+        
+        combined_changed_tag_ids = self._CacheTagLookupsRegenerateSiblings( self._combined_tag_service_id, tag_ids )
+        
+        if self._CacheTagLookupsGetApplyAllSiblingsToAllServices():
+            
+            for parent_service_id in self._GetServiceIds( HC.TAG_SERVICES ) + [ self._combined_tag_service_id ]:
+                
+                self._CacheTagLookupsRegenerateParents( parent_service_id, combined_changed_tag_ids )
+                
+            
+        else:
+            
+            for parent_service_id in ( service_id, self._combined_tag_service_id ):
+                
+                self._CacheTagLookupsRegenerateParents( parent_service_id, changed_tag_ids )
+                
+            
+        
+    
     def _CheckDBIntegrity( self ):
         
         prefix_string = 'checking db integrity: '
@@ -2748,8 +3556,10 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'CREATE TABLE tag_parent_petitions ( service_id INTEGER REFERENCES services ON DELETE CASCADE, child_tag_id INTEGER, parent_tag_id INTEGER, status INTEGER, reason_id INTEGER, PRIMARY KEY ( service_id, child_tag_id, parent_tag_id, status ) );' )
         
         self._c.execute( 'CREATE TABLE tag_siblings ( service_id INTEGER REFERENCES services ON DELETE CASCADE, bad_tag_id INTEGER, good_tag_id INTEGER, status INTEGER, PRIMARY KEY ( service_id, bad_tag_id, status ) );' )
+        self._CreateIndex( 'tag_siblings', [ 'good_tag_id' ] )
         
         self._c.execute( 'CREATE TABLE tag_sibling_petitions ( service_id INTEGER REFERENCES services ON DELETE CASCADE, bad_tag_id INTEGER, good_tag_id INTEGER, status INTEGER, reason_id INTEGER, PRIMARY KEY ( service_id, bad_tag_id, status ) );' )
+        self._CreateIndex( 'tag_sibling_petitions', [ 'good_tag_id' ] )
         
         self._c.execute( 'CREATE TABLE urls ( hash_id INTEGER, url TEXT, PRIMARY KEY ( hash_id, url ) );' )
         self._CreateIndex( 'urls', [ 'url' ] )
@@ -2781,6 +3591,17 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'CREATE TABLE external_caches.integer_subtags ( subtag_id INTEGER PRIMARY KEY, integer_subtag INTEGER );' )
         self._CreateIndex( 'external_caches.integer_subtags', [ 'integer_subtag' ] )
         
+        self._c.execute( 'CREATE TABLE external_caches.combined_files_ac_cache_regeneration ( service_id INTEGER PRIMARY KEY, last_tag_id INTEGER );' )
+        self._c.execute( 'CREATE TABLE external_caches.specific_mappings_cache_regeneration ( file_service_id INTEGER, tag_service_id INTEGER, last_hash_id INTEGER, PRIMARY KEY ( file_service_id, tag_service_id ) );' )
+        
+        self._c.execute( 'CREATE TABLE external_caches.tag_lookup_cache_options ( apply_all_siblings_to_all_services INTEGER_BOOLEAN );' )
+        self._c.execute( 'CREATE TABLE external_caches.tag_parent_lookup_cache ( service_id INTEGER, child_tag_id INTEGER, ancestor_index INTEGER, ancestor_tag_id INTEGER, PRIMARY KEY ( service_id, child_tag_id, ancestor_index ) );' )
+        self._CreateIndex( 'external_caches.tag_parent_lookup_cache', [ 'ancestor_tag_id' ] )
+        self._c.execute( 'CREATE TABLE external_caches.tag_sibling_lookup_cache ( service_id INTEGER, bad_tag_id INTEGER, ideal_tag_id INTEGER, PRIMARY KEY ( service_id, bad_tag_id ) );' )
+        self._CreateIndex( 'external_caches.tag_sibling_lookup_cache', [ 'ideal_tag_id' ] )
+        
+        self._c.execute( 'INSERT INTO tag_lookup_cache_options ( apply_all_siblings_to_all_services ) VALUES ( ? );', ( False, ) )
+        
         # master
         
         self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.hashes ( hash_id INTEGER PRIMARY KEY, hash BLOB_BYTES UNIQUE );' )
@@ -2796,6 +3617,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'CREATE VIRTUAL TABLE IF NOT EXISTS external_master.subtags_fts4 USING fts4( subtag );' )
         
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.subtag_trigrams ( trigram TEXT, subtag_id INTEGER, PRIMARY KEY ( trigram, subtag_id ) ) WITHOUT ROWID;' )
+        
         self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.tags ( tag_id INTEGER PRIMARY KEY, namespace_id INTEGER, subtag_id INTEGER );' )
         self._CreateIndex( 'external_master.tags', [ 'subtag_id', 'namespace_id' ] )
         
@@ -3019,9 +3842,15 @@ class DB( HydrusDB.HydrusDB ):
             
             self._UpdateMappings( service_id, pending_rescinded_mappings_ids = pending_rescinded_mappings_ids, petitioned_rescinded_mappings_ids = petitioned_rescinded_mappings_ids )
             
+            sibling_tag_ids = set( itertools.chain.from_iterable( self._c.execute( 'SELECT bad_tag_id, good_tag_id FROM tag_sibling_petitions WHERE service_id = ?;', ( service_id, ) ) ) )
+            child_tag_ids = self._STS( self._c.execute( 'SELECT child_tag_id FROM tag_parent_petitions WHERE service_id = ?;', ( service_id, ) ) )
+            
             self._c.execute( 'DELETE FROM tag_sibling_petitions WHERE service_id = ?;', ( service_id, ) )
             self._c.execute( 'DELETE FROM tag_parent_petitions WHERE service_id = ?;', ( service_id, ) )
             
+            self._CacheTagLookupsUpdateSiblings( service_id, sibling_tag_ids )
+            self._CacheTagLookupsUpdateParents( service_id, child_tag_ids )
+            
         elif service.GetServiceType() in ( HC.FILE_REPOSITORY, HC.IPFS ):
             
             self._c.execute( 'DELETE FROM file_transfers WHERE service_id = ?;', ( service_id, ) )
@@ -3107,6 +3936,8 @@ class DB( HydrusDB.HydrusDB ):
                 self._CacheSpecificMappingsDrop( file_service_id, service_id )
                 
             
+            self._CacheTagLookupsRegenerate()
+            
         
         if service_type in HC.AUTOCOMPLETE_CACHE_SPECIFIC_FILE_SERVICES:
             
@@ -3152,6 +3983,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO tag_parents ( service_id, child_tag_id, parent_tag_id, status ) VALUES ( ?, ?, ?, ? );', ( ( service_id, child_tag_id, parent_tag_id, HC.CONTENT_STATUS_DELETED ) for ( child_tag_id, parent_tag_id ) in pairs ) )
         
+        self._CacheTagLookupsUpdateParents( service_id, { child_tag_id for ( child_tag_id, parent_tag_id ) in pairs } )
+        
     
     def _DeleteTagSiblings( self, service_id, pairs ):
         
@@ -3160,6 +3993,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO tag_siblings ( service_id, bad_tag_id, good_tag_id, status ) VALUES ( ?, ?, ?, ? );', ( ( service_id, bad_tag_id, good_tag_id, HC.CONTENT_STATUS_DELETED ) for ( bad_tag_id, good_tag_id ) in pairs ) )
         
+        self._CacheTagLookupsUpdateSiblings( service_id, set( itertools.chain.from_iterable( pairs ) ) )
+        
     
     def _DeleteYAMLDump( self, dump_type, dump_name = None ):
         
@@ -3422,9 +4257,7 @@ class DB( HydrusDB.HydrusDB ):
                 
                 if ClientSearch.IsComplexWildcard( half_complete_subtag ):
                     
-                    like_param = ConvertWildcardToSQLiteLikeParameter( half_complete_subtag )
-                    
-                    return self._STL( self._c.execute( 'SELECT subtag_id FROM subtags WHERE subtag LIKE ?;', ( like_param, ) ) )
+                    return self._GetSubtagIdsFromWildcard( half_complete_subtag )
                     
                 else:
                     
@@ -3492,19 +4325,21 @@ class DB( HydrusDB.HydrusDB ):
         
         tag_ids = self._STS( self._c.execute( 'SELECT tag_id FROM tags WHERE ' + predicates_phrase + ';' ) )
         
-        # now fetch siblings, add to set
+        # now add the siblings of everything that matched, so a search for a bad tag finds its ideal and the other way around
         
-        siblings_manager = self._controller.GetManager( 'tag_siblings' )
-        
-        all_associated_sibling_tags = siblings_manager.GetAutocompleteSiblings( service_key, search_text, exact_match )
-        
-        for sibling_tag in all_associated_sibling_tags:
+        if self._CacheTagLookupsGetApplyAllSiblingsToAllServices():
+            
+            sibling_service_id = self._combined_tag_service_id
             
-            tag_id = self._GetTagId( sibling_tag )
+        else:
             
-            tag_ids.add( tag_id )
+            sibling_service_id = self._GetServiceId( service_key )
             
         
+        pair_ids = self._CacheTagLookupsGetSiblingNetworkPairIds( sibling_service_id, tag_ids )
+        
+        tag_ids.update( itertools.chain.from_iterable( pair_ids ) )
+        
         return tag_ids
         
     
@@ -3786,8 +4621,52 @@ class DB( HydrusDB.HydrusDB ):
         return [ hash for ( hash, ) in self._c.execute( 'SELECT hash FROM hashes WHERE hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';' ) ]
         
     
+    def _GetHashesToHashIds( self, hashes ):
+        
+        ( hashes_to_hash_ids, uncached_hashes ) = self._hash_ids_cache.GetIds( ( hash for hash in hashes if hash is not None ) )
+        
+        if len( uncached_hashes ) < MIN_TEMP_TABLE_ID_LOOKUP:
+            
+            for hash in uncached_hashes:
+                
+                hashes_to_hash_ids[ hash ] = self._GetHashId( hash )
+                
+            
+            return hashes_to_hash_ids
+            
+        
+        with HydrusDB.TemporaryValueTable( self._c, ( sqlite3.Binary( hash ) for hash in uncached_hashes ), 'hash', 'BLOB' ) as temp_table_name:
+            
+            select_statement = 'SELECT hash, hash_id FROM hashes WHERE hash IN ( SELECT hash FROM ' + temp_table_name + ' );'
+            
+            uncached_hashes_to_hash_ids = dict( self._c.execute( select_statement ) )
+            
+            # we only insert if we have to, as read connections can still come through here for hashes they know exist
+            
+            if len( uncached_hashes_to_hash_ids ) < len( uncached_hashes ):
+                
+                self._c.execute( 'INSERT OR IGNORE INTO hashes ( hash ) SELECT hash FROM ' + temp_table_name + ';' )
+                
+                uncached_hashes_to_hash_ids = dict( self._c.execute( select_statement ) )
+                
+            
+        
+        self._hash_ids_cache.AddIds( uncached_hashes_to_hash_ids )
+        
+        hashes_to_hash_ids.update( uncached_hashes_to_hash_ids )
+        
+        return hashes_to_hash_ids
+        
+    
     def _GetHashId( self, hash ):
         
+        hash_id = self._hash_ids_cache.GetId( hash )
+        
+        if hash_id is not None:
+            
+            return hash_id
+            
+        
         result = self._c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
         
         if result is None:
@@ -3801,51 +4680,57 @@ class DB( HydrusDB.HydrusDB ):
             ( hash_id, ) = result
             
         
+        self._hash_ids_cache.AddId( hash, hash_id )
+        
         return hash_id
         
     
     def _GetHashIds( self, hashes ):
         
-        hash_ids = set()
-        hashes_not_in_db = set()
+        return set( self._GetHashesToHashIds( hashes ).values() )
         
-        for hash in hashes:
+    
+    def _GetHashIdsFromMappingsSelects( self, current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids = None ):
+        
+        # the selects are ( mappings_table_name, tags_predicate ) pairs
+        # if we are given hash_ids, we only check those files, which is much cheaper than fetching everything for a broad tag
+        
+        selects = []
+        
+        if include_current_tags:
             
-            if hash is None:
-                
-                continue
-                
+            selects.extend( current_selects )
             
-            result = self._c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
+        
+        if include_pending_tags:
             
-            if result is None:
-                
-                hashes_not_in_db.add( hash )
-                
-            else:
-                
-                ( hash_id, ) = result
-                
-                hash_ids.add( hash_id )
-                
+            selects.extend( pending_selects )
             
         
-        if len( hashes_not_in_db ) > 0:
-            
-            self._c.executemany( 'INSERT INTO hashes ( hash ) VALUES ( ? );', ( ( sqlite3.Binary( hash ), ) for hash in hashes_not_in_db ) )
+        result_hash_ids = set()
+        
+        if hash_ids is None:
             
-            for hash in hashes_not_in_db:
+            for ( mappings_table_name, tags_predicate ) in selects:
+                
+                result_hash_ids.update( self._STI( self._c.execute( 'SELECT hash_id FROM ' + mappings_table_name + ' NATURAL JOIN tags WHERE ' + tags_predicate + ';' ) ) )
                 
-                ( hash_id, ) = self._c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
+            
+        elif len( hash_ids ) > 0 and len( selects ) > 0:
+            
+            with HydrusDB.TemporaryIntegerTable( self._c, hash_ids, 'hash_id' ) as temp_table_name:
                 
-                hash_ids.add( hash_id )
+                for ( mappings_table_name, tags_predicate ) in selects:
+                    
+                    result_hash_ids.update( self._STI( self._c.execute( 'SELECT hash_id FROM ' + temp_table_name + ' NATURAL JOIN ' + mappings_table_name + ' NATURAL JOIN tags WHERE ' + tags_predicate + ';' ) ) )
+                    
                 
             
         
-        return hash_ids
+        return result_hash_ids
         
     
-    def _GetHashIdsFromNamespace( self, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromNamespace( self, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags, hash_ids = None ):
         
         if not self._NamespaceExists( namespace ):
             
@@ -3874,40 +4759,22 @@ class DB( HydrusDB.HydrusDB ):
                 
                 ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ';' )
+                current_selects.append( ( current_mappings_table_name, 'namespace_id = ' + str( namespace_id ) ) )
+                pending_selects.append( ( pending_mappings_table_name, 'namespace_id = ' + str( namespace_id ) ) )
                 
             else:
                 
                 ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ';' )
+                current_selects.append( ( cache_current_mappings_table_name, 'namespace_id = ' + str( namespace_id ) ) )
+                pending_selects.append( ( cache_pending_mappings_table_name, 'namespace_id = ' + str( namespace_id ) ) )
                 
             
         
-        hash_ids = set()
-        
-        if include_current_tags:
-            
-            for current_select in current_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                
-            
-        
-        if include_pending_tags:
-            
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                
-            
-        
-        return hash_ids
+        return self._GetHashIdsFromMappingsSelects( current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids = hash_ids )
         
     
-    def _GetHashIdsFromNamespaceIdsSubtagIds( self, file_service_key, tag_service_key, namespace_ids, subtag_ids, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromNamespaceIdsSubtagIds( self, file_service_key, tag_service_key, namespace_ids, subtag_ids, include_current_tags, include_pending_tags, hash_ids = None ):
         
         file_service_id = self._GetServiceId( file_service_key )
         
@@ -3929,42 +4796,66 @@ class DB( HydrusDB.HydrusDB ):
                 
                 ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
+                current_selects.append( ( current_mappings_table_name, 'namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
+                pending_selects.append( ( pending_mappings_table_name, 'namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
                 
             else:
                 
                 ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
+                current_selects.append( ( cache_current_mappings_table_name, 'namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
+                pending_selects.append( ( cache_pending_mappings_table_name, 'namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
                 
             
         
-        hash_ids = set()
+        return self._GetHashIdsFromMappingsSelects( current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids = hash_ids )
         
-        if include_current_tags:
+    
+    def _GetHashIdsFromQuery( self, search_context, media_sort = None ):
+        
+        self._controller.ResetIdleTimer()
+        
+        if not self._file_search_cache.IsCacheable( search_context ):
+            
+            query_hash_ids = self._GetHashIdsFromQueryUncached( search_context )
+            
+        else:
             
-            for current_select in current_selects:
+            query_hash_ids = self._file_search_cache.GetHashIds( search_context )
+            
+            if query_hash_ids is None:
                 
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
+                # if anything changes while we search, the cache will know not to keep this result
+                
+                generation = self._file_search_cache.GetGeneration()
+                
+                # and a read connection working from before a write that is going on now may already be out of date
+                
+                result_is_current = not self._ReadMayBeStale()
+                
+                query_hash_ids = self._GetHashIdsFromQueryUncached( search_context )
+                
+                if result_is_current:
+                    
+                    self._file_search_cache.AddHashIds( search_context, generation, query_hash_ids )
+                    
                 
             
-        
-        if include_pending_tags:
-            
-            for pending_select in pending_selects:
+            if HG.db_report_mode:
                 
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
+                HydrusData.ShowText( self._file_search_cache.GetReport() )
                 
             
         
-        return hash_ids
+        if media_sort is not None:
+            
+            query_hash_ids = self._SortHashIds( search_context.GetFileServiceKey(), query_hash_ids, media_sort )
+            
         
-    
-    def _GetHashIdsFromQuery( self, search_context ):
+        return query_hash_ids
         
-        self._controller.ResetIdleTimer()
+    
+    def _GetHashIdsFromQueryUncached( self, search_context ):
         
         system_predicates = search_context.GetSystemPredicates()
         
@@ -4122,40 +5013,55 @@ class DB( HydrusDB.HydrusDB ):
         
         if len( tags_to_include ) > 0 or len( namespaces_to_include ) > 0 or len( wildcards_to_include ) > 0:
             
-            query_hash_ids = None
+            # we run the most selective searches first, and then the later searches only have to check the files we still have
+            # we have no cheap estimate for namespaces and wildcards, but they are usually broad, so they go last
             
-            if len( tags_to_include ) > 0:
-                
-                query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) for tag in tags_to_include ) )
-                
+            tags_to_estimates = self._GetTagSearchEstimates( file_service_key, tag_service_key, tags_to_include, include_current_tags, include_pending_tags )
+            
+            include_jobs = [ ( tags_to_estimates[ tag ], self._GetHashIdsFromTag, tag ) for tag in tags_to_include ]
             
-            if len( namespaces_to_include ) > 0:
-                
-                namespace_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) for namespace in namespaces_to_include ) )
-                
-                if query_hash_ids is None: query_hash_ids = namespace_query_hash_ids
-                else: query_hash_ids.intersection_update( namespace_query_hash_ids )
-                
+            include_jobs.sort()
             
-            if len( wildcards_to_include ) > 0:
-                
-                wildcard_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) for wildcard in wildcards_to_include ) )
-                
-                if query_hash_ids is None: query_hash_ids = wildcard_query_hash_ids
-                else: query_hash_ids.intersection_update( wildcard_query_hash_ids )
-                
+            include_jobs.extend( ( ( None, self._GetHashIdsFromNamespace, namespace ) for namespace in namespaces_to_include ) )
+            include_jobs.extend( ( ( None, self._GetHashIdsFromWildcard, wildcard ) for wildcard in wildcards_to_include ) )
+            
+            query_hash_ids = None
             
-            if len( files_info_predicates ) > 0:
+            for ( estimate, search_call, search_item ) in include_jobs:
                 
-                if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                if query_hash_ids is None:
                     
-                    query_hash_ids.intersection_update( self._STI( self._c.execute( 'SELECT hash_id FROM files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) ) )
+                    query_hash_ids = search_call( file_service_key, tag_service_key, search_item, include_current_tags, include_pending_tags )
+                    
+                elif estimate is not None and estimate <= len( query_hash_ids ):
+                    
+                    query_hash_ids.intersection_update( search_call( file_service_key, tag_service_key, search_item, include_current_tags, include_pending_tags ) )
                     
                 else:
                     
-                    files_info_predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
+                    query_hash_ids = search_call( file_service_key, tag_service_key, search_item, include_current_tags, include_pending_tags, hash_ids = query_hash_ids )
+                    
+                
+                if len( query_hash_ids ) == 0:
+                    
+                    break
+                    
+                
+            
+            if len( files_info_predicates ) > 0 and len( query_hash_ids ) > 0:
+                
+                with HydrusDB.TemporaryIntegerTable( self._c, query_hash_ids, 'hash_id' ) as temp_table_name:
                     
-                    query_hash_ids.intersection_update( self._STI( self._c.execute( 'SELECT hash_id FROM current_files NATURAL JOIN files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) ) )
+                    if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                        
+                        query_hash_ids = self._STS( self._c.execute( 'SELECT hash_id FROM ' + temp_table_name + ' NATURAL JOIN files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) )
+                        
+                    else:
+                        
+                        files_info_predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
+                        
+                        query_hash_ids = self._STS( self._c.execute( 'SELECT hash_id FROM ' + temp_table_name + ' NATURAL JOIN current_files NATURAL JOIN files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) )
+                        
                     
                 
             
@@ -4253,24 +5159,32 @@ class DB( HydrusDB.HydrusDB ):
         
         #
         
-        exclude_query_hash_ids = set()
+        # we only need to know which of our current results to exclude, so if they are fewer than the exclude search would fetch, we only check them
         
-        for tag in tags_to_exclude:
-            
-            exclude_query_hash_ids.update( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) )
-            
+        tags_to_estimates = self._GetTagSearchEstimates( file_service_key, tag_service_key, tags_to_exclude, include_current_tags, include_pending_tags )
         
-        for namespace in namespaces_to_exclude:
-            
-            exclude_query_hash_ids.update( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) )
-            
+        exclude_jobs = [ ( tags_to_estimates[ tag ], self._GetHashIdsFromTag, tag ) for tag in tags_to_exclude ]
         
-        for wildcard in wildcards_to_exclude:
+        exclude_jobs.extend( ( ( None, self._GetHashIdsFromNamespace, namespace ) for namespace in namespaces_to_exclude ) )
+        exclude_jobs.extend( ( ( None, self._GetHashIdsFromWildcard, wildcard ) for wildcard in wildcards_to_exclude ) )
+        
+        for ( estimate, search_call, search_item ) in exclude_jobs:
+            
+            if len( query_hash_ids ) == 0:
+                
+                break
+                
             
-            exclude_query_hash_ids.update( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) )
+            if estimate is not None and estimate <= len( query_hash_ids ):
+                
+                query_hash_ids.difference_update( search_call( file_service_key, tag_service_key, search_item, include_current_tags, include_pending_tags ) )
+                
+            else:
+                
+                query_hash_ids.difference_update( search_call( file_service_key, tag_service_key, search_item, include_current_tags, include_pending_tags, hash_ids = query_hash_ids ) )
+                
             
         
-        query_hash_ids.difference_update( exclude_query_hash_ids )
         
         #
         
@@ -4529,7 +5443,7 @@ class DB( HydrusDB.HydrusDB ):
         return query_hash_ids
         
     
-    def _GetHashIdsFromSubtagIds( self, file_service_key, tag_service_key, subtag_ids, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromSubtagIds( self, file_service_key, tag_service_key, subtag_ids, include_current_tags, include_pending_tags, hash_ids = None ):
         
         file_service_id = self._GetServiceId( file_service_key )
         
@@ -4551,40 +5465,22 @@ class DB( HydrusDB.HydrusDB ):
                 
                 ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
+                current_selects.append( ( current_mappings_table_name, 'subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
+                pending_selects.append( ( pending_mappings_table_name, 'subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
                 
             else:
                 
                 ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                
-            
-        
-        hash_ids = set()
-        
-        if include_current_tags:
-            
-            for current_select in current_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
+                current_selects.append( ( cache_current_mappings_table_name, 'subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
+                pending_selects.append( ( cache_pending_mappings_table_name, 'subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
                 
             
         
-        if include_pending_tags:
-            
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                
-            
-        
-        return hash_ids
+        return self._GetHashIdsFromMappingsSelects( current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids = hash_ids )
         
     
-    def _GetHashIdsFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, hash_ids = None ):
         
         siblings_manager = self._controller.GetManager( 'tag_siblings' )
         
@@ -4601,13 +5497,11 @@ class DB( HydrusDB.HydrusDB ):
             search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
             
         
-        hash_ids = set()
+        current_selects = []
+        pending_selects = []
         
         for tag in tags:
             
-            current_selects = []
-            pending_selects = []
-            
             ( namespace, subtag ) = HydrusTags.SplitTag( tag )
             
             if namespace != '':
@@ -4626,15 +5520,15 @@ class DB( HydrusDB.HydrusDB ):
                         
                         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
+                        current_selects.append( ( current_mappings_table_name, 'namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) ) )
+                        pending_selects.append( ( pending_mappings_table_name, 'namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) ) )
                         
                     else:
                         
                         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
+                        current_selects.append( ( cache_current_mappings_table_name, 'namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) ) )
+                        pending_selects.append( ( cache_pending_mappings_table_name, 'namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) ) )
                         
                     
                 
@@ -4653,40 +5547,24 @@ class DB( HydrusDB.HydrusDB ):
                         
                         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
+                        current_selects.append( ( current_mappings_table_name, 'subtag_id = ' + str( subtag_id ) ) )
+                        pending_selects.append( ( pending_mappings_table_name, 'subtag_id = ' + str( subtag_id ) ) )
                         
                     else:
                         
                         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
+                        current_selects.append( ( cache_current_mappings_table_name, 'subtag_id = ' + str( subtag_id ) ) )
+                        pending_selects.append( ( cache_pending_mappings_table_name, 'subtag_id = ' + str( subtag_id ) ) )
                         
                     
                 
             
-            if include_current_tags:
-                
-                for current_select in current_selects:
-                    
-                    hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                    
-                
-            
-            if include_pending_tags:
-                
-                for pending_select in pending_selects:
-                    
-                    hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                    
-                
-            
         
-        return hash_ids
+        return self._GetHashIdsFromMappingsSelects( current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids = hash_ids )
         
     
-    def _GetHashIdsFromWildcard( self, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromWildcard( self, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags, hash_ids = None ):
         
         def GetNamespaceIdsFromWildcard( w ):
             
@@ -4715,9 +5593,7 @@ class DB( HydrusDB.HydrusDB ):
             
             if '*' in w:
                 
-                like_param = ConvertWildcardToSQLiteLikeParameter( w )
-                
-                return [ subtag_id for ( subtag_id, ) in self._c.execute( 'SELECT subtag_id FROM subtags WHERE subtag LIKE ?;', ( like_param, ) ) ]
+                return self._GetSubtagIdsFromWildcard( w )
                 
             else:
                 
@@ -4742,11 +5618,11 @@ class DB( HydrusDB.HydrusDB ):
             
             possible_namespace_ids = GetNamespaceIdsFromWildcard( namespace_wildcard )
             
-            return self._GetHashIdsFromNamespaceIdsSubtagIds( file_service_key, tag_service_key, possible_namespace_ids, possible_subtag_ids, include_current_tags, include_pending_tags )
+            return self._GetHashIdsFromNamespaceIdsSubtagIds( file_service_key, tag_service_key, possible_namespace_ids, possible_subtag_ids, include_current_tags, include_pending_tags, hash_ids = hash_ids )
             
         else:
             
-            return self._GetHashIdsFromSubtagIds( file_service_key, tag_service_key, possible_subtag_ids, include_current_tags, include_pending_tags )
+            return self._GetHashIdsFromSubtagIds( file_service_key, tag_service_key, possible_subtag_ids, include_current_tags, include_pending_tags, hash_ids = hash_ids )
             
         
     
@@ -5238,6 +6114,71 @@ class DB( HydrusDB.HydrusDB ):
         return self._GetMediaResults( query_hash_ids )
         
     
+    def _GetMediaSortOrderTerm( self, file_service_key, media_sort ):
+        
+        # this matches the sort keys in MediaSort.GetSortKeyAndReverse, including sorting a missing value as -1
+        
+        ( sort_metatype, sort_data ) = media_sort.sort_type
+        
+        if sort_metatype != 'system':
+            
+            return None
+            
+        
+        if sort_data == CC.SORT_FILES_BY_FILESIZE:
+            
+            order_term = 'IFNULL( size, -1 )'
+            
+        elif sort_data == CC.SORT_FILES_BY_DURATION:
+            
+            order_term = 'IFNULL( duration, -1 )'
+            
+        elif sort_data == CC.SORT_FILES_BY_HEIGHT:
+            
+            order_term = 'IFNULL( height, -1 )'
+            
+        elif sort_data == CC.SORT_FILES_BY_WIDTH:
+            
+            order_term = 'IFNULL( width, -1 )'
+            
+        elif sort_data == CC.SORT_FILES_BY_RATIO:
+            
+            order_term = 'CASE WHEN width IS NULL OR height IS NULL OR width = 0 OR height = 0 THEN -1 ELSE CAST( width AS REAL ) / height END'
+            
+        elif sort_data == CC.SORT_FILES_BY_NUM_PIXELS:
+            
+            order_term = 'IFNULL( width * height, -1 )'
+            
+        elif sort_data == CC.SORT_FILES_BY_MIME:
+            
+            order_term = 'IFNULL( mime, ' + str( HC.APPLICATION_UNKNOWN ) + ' )'
+            
+        elif sort_data == CC.SORT_FILES_BY_IMPORT_TIME:
+            
+            file_service_id = self._GetServiceId( file_service_key )
+            
+            file_service = self._GetService( file_service_id )
+            
+            if file_service.GetServiceType() == HC.LOCAL_FILE_DOMAIN:
+                
+                file_service_id = self._GetServiceId( CC.COMBINED_LOCAL_FILE_SERVICE_KEY )
+                
+            
+            order_term = 'IFNULL( ( SELECT timestamp FROM current_files WHERE service_id = ' + str( file_service_id ) + ' AND current_files.hash_id = sort_hash_ids.hash_id ), -1 )'
+            
+        else:
+            
+            return None
+            
+        
+        if media_sort.sort_asc == CC.SORT_DESC:
+            
+            order_term += ' DESC'
+            
+        
+        return order_term
+        
+    
     def _GetMime( self, hash_id ):
         
         result = self._c.execute( 'SELECT mime FROM files_info WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
@@ -5259,6 +6200,13 @@ class DB( HydrusDB.HydrusDB ):
             return self._null_namespace_id
             
         
+        namespace_id = self._namespace_ids_cache.GetId( namespace )
+        
+        if namespace_id is not None:
+            
+            return namespace_id
+            
+        
         result = self._c.execute( 'SELECT namespace_id FROM namespaces WHERE namespace = ?;', ( namespace, ) ).fetchone()
         
         if result is None:
@@ -5272,6 +6220,8 @@ class DB( HydrusDB.HydrusDB ):
             ( namespace_id, ) = result
             
         
+        self._namespace_ids_cache.AddId( namespace, namespace_id )
+        
         return namespace_id
         
     
@@ -5710,11 +6660,9 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetService( self, service_id ):
         
-        if service_id in self._service_cache:
-            
-            service = self._service_cache[ service_id ]
-            
-        else:
+        service = self._service_cache.get( service_id, None )
+        
+        if service is None:
             
             result = self._c.execute( 'SELECT service_key, service_type, name, dictionary_string FROM services WHERE service_id = ?;', ( service_id, ) ).fetchone()
             
@@ -5729,7 +6677,12 @@ class DB( HydrusDB.HydrusDB ):
             
             service = ClientServices.GenerateService( service_key, service_type, name, dictionary )
             
-            self._service_cache[ service_id ] = service
+            # a read connection may be looking at the service from before an update that is going on now
+            
+            if not self._IsReadConnection():
+                
+                self._service_cache[ service_id ] = service
+                
             
         
         return service
@@ -5982,30 +6935,44 @@ class DB( HydrusDB.HydrusDB ):
             
             subtag_id = self._c.lastrowid
             
-            subtag_searchable = ClientSearch.ConvertTagToSearchable( subtag )
+            self._AddSubtagsSearchData( ( ( subtag_id, subtag ), ) )
             
-            self._c.execute( 'REPLACE INTO subtags_fts4 ( docid, subtag ) VALUES ( ?, ? );', ( subtag_id, subtag_searchable ) )
+        else:
             
-            try:
-                
-                integer_subtag = int( subtag )
+            ( subtag_id, ) = result
+            
+        
+        return subtag_id
+        
+    
+    def _GetSubtagsToSubtagIds( self, subtags ):
+        
+        subtags = set( subtags )
+        
+        if len( subtags ) < MIN_TEMP_TABLE_ID_LOOKUP:
+            
+            return { subtag : self._GetSubtagId( subtag ) for subtag in subtags }
+            
+        
+        with HydrusDB.TemporaryValueTable( self._c, subtags, 'subtag', 'TEXT' ) as temp_table_name:
+            
+            select_statement = 'SELECT subtag, subtag_id FROM subtags WHERE subtag IN ( SELECT subtag FROM ' + temp_table_name + ' );'
+            
+            subtags_to_subtag_ids = dict( self._c.execute( select_statement ) )
+            
+            new_subtags = [ subtag for subtag in subtags if subtag not in subtags_to_subtag_ids ]
+            
+            if len( new_subtags ) > 0:
                 
-                if CanCacheInteger( integer_subtag ):
-                    
-                    self._c.execute( 'INSERT OR IGNORE INTO integer_subtags ( subtag_id, integer_subtag ) VALUES ( ?, ? );', ( subtag_id, integer_subtag ) )
-                    
+                self._c.executemany( 'INSERT INTO subtags ( subtag ) VALUES ( ? );', ( ( subtag, ) for subtag in new_subtags ) )
                 
-            except ValueError:
+                subtags_to_subtag_ids = dict( self._c.execute( select_statement ) )
                 
-                pass
+                self._AddSubtagsSearchData( [ ( subtags_to_subtag_ids[ subtag ], subtag ) for subtag in new_subtags ] )
                 
             
-        else:
-            
-            ( subtag_id, ) = result
-            
         
-        return subtag_id
+        return subtags_to_subtag_ids
         
     
     def _GetTag( self, tag_id ):
@@ -6052,57 +7019,186 @@ class DB( HydrusDB.HydrusDB ):
             
             for ( service_id, blacklist, tags ) in self._c.execute( 'SELECT service_id, blacklist, tags FROM tag_censorship;' ).fetchall():
                 
-                service = self._GetService( service_id )
+                service = self._GetService( service_id )
+                
+                service_key = service.GetServiceKey()
+                
+                result.append( ( service_key, blacklist, tags ) )
+                
+            
+        else:
+            
+            service_id = self._GetServiceId( service_key )
+            
+            result = self._c.execute( 'SELECT blacklist, tags FROM tag_censorship WHERE service_id = ?;', ( service_id, ) ).fetchone()
+            
+            if result is None: result = ( True, [] )
+            
+        
+        return result
+        
+    
+    def _GetSubtagIdsFromWildcard( self, wildcard ):
+        
+        like_param = ConvertWildcardToSQLiteLikeParameter( wildcard )
+        
+        trigrams = list( GetWildcardTrigrams( wildcard ) )
+        
+        if len( trigrams ) == 0:
+            
+            # something like '*a*' or 'ab*', so we have to check every subtag
+            
+            return self._STL( self._c.execute( 'SELECT subtag_id FROM subtags WHERE subtag LIKE ?;', ( like_param, ) ) )
+            
+        
+        # no need to intersect every trigram of a very long wildcard--LIKE checks the candidates anyway
+        # the rarest trigrams narrow it down the most, and sorting on the trigram too keeps the choice the same every time
+        
+        if len( trigrams ) > MAX_WILDCARD_TRIGRAMS:
+            
+            trigram_counts = []
+            
+            for trigram in trigrams:
+                
+                ( count, ) = self._c.execute( 'SELECT COUNT( * ) FROM ( SELECT 1 FROM subtag_trigrams WHERE trigram = ? LIMIT ? );', ( trigram, WILDCARD_TRIGRAM_COUNT_LIMIT ) ).fetchone()
+                
+                if count == 0:
+                    
+                    return []
+                    
+                
+                trigram_counts.append( ( count, trigram ) )
+                
+            
+            trigram_counts.sort()
+            
+            trigrams = [ trigram for ( count, trigram ) in trigram_counts[ : MAX_WILDCARD_TRIGRAMS ] ]
+            
+        else:
+            
+            trigrams.sort()
+            
+        
+        trigrams_select = ' INTERSECT '.join( ( 'SELECT subtag_id FROM subtag_trigrams WHERE trigram = ?' for trigram in trigrams ) )
+        
+        return self._STL( self._c.execute( 'SELECT subtag_id FROM subtags WHERE subtag_id IN ( ' + trigrams_select + ' ) AND subtag LIKE ?;', trigrams + [ like_param ] ) )
+        
+    
+    def _GetTagId( self, tag ):
+        
+        tag_id = self._tag_ids_cache.GetId( tag )
+        
+        if tag_id is not None:
+            
+            return tag_id
+            
+        
+        clean_tag = HydrusTags.CleanTag( tag )
+        
+        HydrusTags.CheckTagNotEmpty( clean_tag )
+        
+        ( namespace, subtag ) = HydrusTags.SplitTag( clean_tag )
+        
+        result = self._c.execute( 'SELECT tag_id FROM tags NATURAL JOIN namespaces NATURAL JOIN subtags WHERE namespace = ? AND subtag = ?;', ( namespace, subtag ) ).fetchone()
+        
+        if result is None:
+            
+            namespace_id = self._GetNamespaceId( namespace )
+            subtag_id = self._GetSubtagId( subtag )
+            
+            self._c.execute( 'INSERT INTO tags ( namespace_id, subtag_id ) VALUES ( ?, ? );', ( namespace_id, subtag_id ) )
+            
+            tag_id = self._c.lastrowid
+            
+        else:
+            
+            ( tag_id, ) = result
+            
+        
+        self._tag_ids_cache.AddId( tag, tag_id )
+        
+        return tag_id
+        
+    
+    def _GetTagIdsToTags( self, tag_ids ):
+        
+        select_statement = 'SELECT tag_id, namespace, subtag FROM tags NATURAL JOIN namespaces NATURAL JOIN subtags WHERE tag_id IN %s;'
+        
+        return { tag_id : HydrusTags.CombineTag( namespace, subtag ) for ( tag_id, namespace, subtag ) in self._SelectFromList( select_statement, tag_ids ) }
+        
+    
+    def _GetTagsToTagIds( self, tags ):
+        
+        # tags that clean to nothing are left out, just as _GetTagId raises SizeException for them
+        
+        ( tags_to_tag_ids, uncached_tags ) = self._tag_ids_cache.GetIds( tags )
+        
+        if len( uncached_tags ) < MIN_TEMP_TABLE_ID_LOOKUP:
+            
+            for tag in uncached_tags:
+                
+                try:
+                    
+                    tags_to_tag_ids[ tag ] = self._GetTagId( tag )
+                    
+                except HydrusExceptions.SizeException:
+                    
+                    continue
+                    
+                
+            
+            return tags_to_tag_ids
+            
+        
+        tags_to_namespaces_and_subtags = {}
+        
+        for tag in uncached_tags:
+            
+            clean_tag = HydrusTags.CleanTag( tag )
+            
+            try:
+                
+                HydrusTags.CheckTagNotEmpty( clean_tag )
                 
-                service_key = service.GetServiceKey()
+            except HydrusExceptions.SizeException:
                 
-                result.append( ( service_key, blacklist, tags ) )
+                continue
                 
             
-        else:
-            
-            service_id = self._GetServiceId( service_key )
-            
-            result = self._c.execute( 'SELECT blacklist, tags FROM tag_censorship WHERE service_id = ?;', ( service_id, ) ).fetchone()
-            
-            if result is None: result = ( True, [] )
+            tags_to_namespaces_and_subtags[ tag ] = HydrusTags.SplitTag( clean_tag )
             
         
-        return result
-        
-    
-    def _GetTagId( self, tag ):
-        
-        tag = HydrusTags.CleanTag( tag )
-        
-        HydrusTags.CheckTagNotEmpty( tag )
+        namespaces_to_namespace_ids = { namespace : self._GetNamespaceId( namespace ) for ( namespace, subtag ) in tags_to_namespaces_and_subtags.itervalues() }
         
-        ( namespace, subtag ) = HydrusTags.SplitTag( tag )
+        subtags_to_subtag_ids = self._GetSubtagsToSubtagIds( ( subtag for ( namespace, subtag ) in tags_to_namespaces_and_subtags.itervalues() ) )
         
-        result = self._c.execute( 'SELECT tag_id FROM tags NATURAL JOIN namespaces NATURAL JOIN subtags WHERE namespace = ? AND subtag = ?;', ( namespace, subtag ) ).fetchone()
+        tags_to_namespace_ids_and_subtag_ids = { tag : ( namespaces_to_namespace_ids[ namespace ], subtags_to_subtag_ids[ subtag ] ) for ( tag, ( namespace, subtag ) ) in tags_to_namespaces_and_subtags.iteritems() }
         
-        if result is None:
+        with HydrusDB.TemporaryIntegerTable( self._c, set( subtags_to_subtag_ids.values() ), 'subtag_id' ) as temp_table_name:
             
-            namespace_id = self._GetNamespaceId( namespace )
-            subtag_id = self._GetSubtagId( subtag )
+            # tags is indexed on subtag_id first, and any one subtag only has a handful of namespaces
             
-            self._c.execute( 'INSERT INTO tags ( namespace_id, subtag_id ) VALUES ( ?, ? );', ( namespace_id, subtag_id ) )
+            select_statement = 'SELECT namespace_id, subtag_id, tag_id FROM ' + temp_table_name + ' CROSS JOIN tags USING ( subtag_id );'
             
-            tag_id = self._c.lastrowid
+            namespace_ids_and_subtag_ids_to_tag_ids = { ( namespace_id, subtag_id ) : tag_id for ( namespace_id, subtag_id, tag_id ) in self._c.execute( select_statement ) }
             
-        else:
+            new_namespace_ids_and_subtag_ids = set( tags_to_namespace_ids_and_subtag_ids.itervalues() ).difference( namespace_ids_and_subtag_ids_to_tag_ids.iterkeys() )
             
-            ( tag_id, ) = result
+            if len( new_namespace_ids_and_subtag_ids ) > 0:
+                
+                self._c.executemany( 'INSERT INTO tags ( namespace_id, subtag_id ) VALUES ( ?, ? );', new_namespace_ids_and_subtag_ids )
+                
+                namespace_ids_and_subtag_ids_to_tag_ids = { ( namespace_id, subtag_id ) : tag_id for ( namespace_id, subtag_id, tag_id ) in self._c.execute( select_statement ) }
+                
             
         
-        return tag_id
+        uncached_tags_to_tag_ids = { tag : namespace_ids_and_subtag_ids_to_tag_ids[ namespace_id_and_subtag_id ] for ( tag, namespace_id_and_subtag_id ) in tags_to_namespace_ids_and_subtag_ids.iteritems() }
         
-    
-    def _GetTagIdsToTags( self, tag_ids ):
+        self._tag_ids_cache.AddIds( uncached_tags_to_tag_ids )
         
-        select_statement = 'SELECT tag_id, namespace, subtag FROM tags NATURAL JOIN namespaces NATURAL JOIN subtags WHERE tag_id IN %s;'
+        tags_to_tag_ids.update( uncached_tags_to_tag_ids )
         
-        return { tag_id : HydrusTags.CombineTag( namespace, subtag ) for ( tag_id, namespace, subtag ) in self._SelectFromList( select_statement, tag_ids ) }
+        return tags_to_tag_ids
         
     
     def _GetTagParents( self, service_key = None ):
@@ -6154,6 +7250,74 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _GetTagSearchEstimates( self, file_service_key, tag_service_key, tags, include_current_tags, include_pending_tags ):
+        
+        # the autocomplete counts are an upper bound on how many files a tag search will fetch, which is good enough to order the searches
+        
+        if len( tags ) == 0:
+            
+            return {}
+            
+        
+        file_service_id = self._GetServiceId( file_service_key )
+        tag_service_id = self._GetServiceId( tag_service_key )
+        
+        if tag_service_id == self._combined_tag_service_id:
+            
+            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
+        else:
+            
+            search_tag_service_ids = [ tag_service_id ]
+            
+        
+        siblings_manager = self._controller.GetManager( 'tag_siblings' )
+        
+        tags_to_tag_ids = {}
+        
+        for tag in tags:
+            
+            tag_ids = set()
+            
+            for sibling in siblings_manager.GetAllSiblings( tag_service_key, tag ):
+                
+                ( namespace, subtag ) = HydrusTags.SplitTag( sibling )
+                
+                if namespace != '':
+                    
+                    if self._TagExists( sibling ):
+                        
+                        tag_ids.add( self._GetTagId( sibling ) )
+                        
+                    
+                elif self._SubtagExists( subtag ):
+                    
+                    subtag_id = self._GetSubtagId( subtag )
+                    
+                    tag_ids.update( self._STI( self._c.execute( 'SELECT tag_id FROM tags WHERE subtag_id = ?;', ( subtag_id, ) ) ) )
+                    
+                
+            
+            tags_to_tag_ids[ tag ] = tag_ids
+            
+        
+        all_tag_ids = set( itertools.chain.from_iterable( tags_to_tag_ids.values() ) )
+        
+        tag_ids_to_estimates = collections.Counter()
+        
+        for search_tag_service_id in search_tag_service_ids:
+            
+            ids_to_count = self._GetAutocompleteCounts( search_tag_service_id, file_service_id, all_tag_ids, include_current_tags, include_pending_tags )
+            
+            for ( tag_id, ( current_min, current_max, pending_min, pending_max ) ) in ids_to_count.items():
+                
+                tag_ids_to_estimates[ tag_id ] += current_min + pending_min
+                
+            
+        
+        return { tag : sum( ( tag_ids_to_estimates[ tag_id ] for tag_id in tag_ids ) ) for ( tag, tag_ids ) in tags_to_tag_ids.items() }
+        
+    
     def _GetTagSiblings( self, service_key = None ):
         
         tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
@@ -6287,6 +7451,27 @@ class DB( HydrusDB.HydrusDB ):
         return self._GetHashes( hash_ids )
         
     
+    def _GetURLBloomFilter( self ):
+        
+        # this has to be built on the main connection. a read connection cannot see urls that are not yet committed, so it would make false negatives
+        
+        if self._url_bloom_filter is None:
+            
+            ( num_urls, ) = self._c.execute( 'SELECT COUNT( * ) FROM urls;' ).fetchone()
+            
+            url_bloom_filter = HydrusDB.BloomFilter( max( num_urls * 2, MIN_URL_BLOOM_FILTER_CAPACITY ) )
+            
+            for ( url, ) in self._c.execute( 'SELECT url FROM urls;' ):
+                
+                url_bloom_filter.Add( url )
+                
+            
+            self._url_bloom_filter = url_bloom_filter
+            
+        
+        return self._url_bloom_filter
+        
+    
     def _GetURLStatus( self, url ):
         
         search_urls = ClientData.GetSearchURLs( url )
@@ -6306,6 +7491,48 @@ class DB( HydrusDB.HydrusDB ):
         return ( CC.STATUS_NEW, None, '' )
         
     
+    def _GetURLStatuses( self, urls ):
+        
+        # a whole page of urls at once. most new urls are ruled out by the bloom filter, and the rest are found in one select
+        
+        url_bloom_filter = self._GetURLBloomFilter()
+        
+        urls_to_search_urls = { url : [ search_url for search_url in ClientData.GetSearchURLs( url ) if url_bloom_filter.MightContain( search_url ) ] for url in urls }
+        
+        all_search_urls = list( set( itertools.chain.from_iterable( urls_to_search_urls.values() ) ) )
+        
+        search_urls_to_hash_ids = dict( self._SelectFromList( 'SELECT url, hash_id FROM urls WHERE url IN %s;', all_search_urls ) )
+        
+        hash_ids_to_statuses = {}
+        urls_to_statuses = {}
+        
+        for ( url, search_urls ) in urls_to_search_urls.items():
+            
+            status = ( CC.STATUS_NEW, None, '' )
+            
+            for search_url in search_urls:
+                
+                if search_url in search_urls_to_hash_ids:
+                    
+                    hash_id = search_urls_to_hash_ids[ search_url ]
+                    
+                    if hash_id not in hash_ids_to_statuses:
+                        
+                        hash_ids_to_statuses[ hash_id ] = self._GetHashIdStatus( hash_id )
+                        
+                    
+                    status = hash_ids_to_statuses[ hash_id ]
+                    
+                    break
+                    
+                
+            
+            urls_to_statuses[ url ] = status
+            
+        
+        return urls_to_statuses
+        
+    
     def _GetYAMLDump( self, dump_type, dump_name = None ):
         
         if dump_name is None:
@@ -6405,6 +7632,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self.pub_content_updates_after_commit( { CC.LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
             
+            self._file_search_cache.ProcessContentUpdates( CC.LOCAL_FILE_SERVICE_KEY, [ content_update ] )
+            
             ( md5, sha1, sha512 ) = file_import_job.GetExtraHashes()
             
             self._c.execute( 'INSERT OR IGNORE INTO local_hashes ( hash_id, md5, sha1, sha512 ) VALUES ( ?, ?, ?, ? );', ( hash_id, sqlite3.Binary( md5 ), sqlite3.Binary( sha1 ), sqlite3.Binary( sha512 ) ) )
@@ -6715,6 +7944,11 @@ class DB( HydrusDB.HydrusDB ):
             return True
             
         
+        if self._CacheMappingsRegenerationDue():
+            
+            return True
+            
+        
         return self._CacheSimilarFilesMaintenanceDue()
         
     
@@ -6791,6 +8025,8 @@ class DB( HydrusDB.HydrusDB ):
                 continue
                 
             
+            self._file_search_cache.ProcessContentUpdates( service_key, content_updates )
+            
             service = self._GetService( service_id )
             
             service_type = service.GetServiceType()
@@ -6804,6 +8040,22 @@ class DB( HydrusDB.HydrusDB ):
             ultimate_petitioned_mappings_ids = []
             ultimate_petitioned_rescinded_mappings_ids = []
             
+            tags_to_tag_ids = {}
+            hashes_to_hash_ids = {}
+            
+            if service_type in HC.TAG_SERVICES:
+                
+                # resolve every mapping's tag and hashes in two bulk lookups, rather than a couple of selects per row
+                
+                mappings_rows = [ row for ( data_type, action, row ) in ( content_update.ToTuple() for content_update in content_updates ) if data_type == HC.CONTENT_TYPE_MAPPINGS and action != HC.CONTENT_UPDATE_ADVANCED ]
+                
+                if len( mappings_rows ) > 0:
+                    
+                    tags_to_tag_ids = self._GetTagsToTagIds( { row[0] for row in mappings_rows } )
+                    hashes_to_hash_ids = self._GetHashesToHashIds( { hash for row in mappings_rows for hash in row[1] } )
+                    
+                
+            
             for content_update in content_updates:
                 
                 ( data_type, action, row ) = content_update.ToTuple()
@@ -6955,6 +8207,8 @@ class DB( HydrusDB.HydrusDB ):
                             
                             self._c.executemany( 'INSERT OR IGNORE INTO urls ( hash_id, url ) VALUES ( ?, ? );', ( ( hash_id, url ) for url in urls ) )
                             
+                            self._AddURLsToBloomFilter( urls )
+                            
                         elif action == HC.CONTENT_UPDATE_DELETE:
                             
                             ( hash, urls ) = row
@@ -7129,16 +8383,16 @@ class DB( HydrusDB.HydrusDB ):
                                 ( tag, hashes ) = row
                                 
                             
-                            try:
+                            if tag not in tags_to_tag_ids:
                                 
-                                tag_id = self._GetTagId( tag )
-                                
-                            except HydrusExceptions.SizeException:
+                                # the tag was empty once cleaned
                                 
                                 continue
                                 
                             
-                            hash_ids = self._GetHashIds( hashes )
+                            tag_id = tags_to_tag_ids[ tag ]
+                            
+                            hash_ids = { hashes_to_hash_ids[ hash ] for hash in hashes if hash is not None }
                             
                             if action == HC.CONTENT_UPDATE_ADD:
                                 
@@ -7228,6 +8482,8 @@ class DB( HydrusDB.HydrusDB ):
                             
                             self._c.execute( 'INSERT OR IGNORE INTO tag_parent_petitions ( service_id, child_tag_id, parent_tag_id, reason_id, status ) VALUES ( ?, ?, ?, ?, ? );', ( service_id, child_tag_id, parent_tag_id, reason_id, new_status ) )
                             
+                            self._CacheTagLookupsUpdateParents( service_id, ( child_tag_id, ) )
+                            
                             notify_new_pending = True
                             
                         elif action in ( HC.CONTENT_UPDATE_RESCIND_PEND, HC.CONTENT_UPDATE_RESCIND_PETITION ):
@@ -7256,6 +8512,8 @@ class DB( HydrusDB.HydrusDB ):
                             
                             self._c.execute( 'DELETE FROM tag_parent_petitions WHERE service_id = ? AND child_tag_id = ? AND parent_tag_id = ? AND status = ?;', ( service_id, child_tag_id, parent_tag_id, deletee_status ) )
                             
+                            self._CacheTagLookupsUpdateParents( service_id, ( child_tag_id, ) )
+                            
                             notify_new_pending = True
                             
                         
@@ -7319,6 +8577,8 @@ class DB( HydrusDB.HydrusDB ):
                             
                             self._c.execute( 'INSERT OR IGNORE INTO tag_sibling_petitions ( service_id, bad_tag_id, good_tag_id, reason_id, status ) VALUES ( ?, ?, ?, ?, ? );', ( service_id, bad_tag_id, good_tag_id, reason_id, new_status ) )
                             
+                            self._CacheTagLookupsUpdateSiblings( service_id, ( bad_tag_id, good_tag_id ) )
+                            
                             notify_new_pending = True
                             
                         elif action in ( HC.CONTENT_UPDATE_RESCIND_PEND, HC.CONTENT_UPDATE_RESCIND_PETITION ):
@@ -7345,6 +8605,10 @@ class DB( HydrusDB.HydrusDB ):
                             
                             self._c.execute( 'DELETE FROM tag_sibling_petitions WHERE service_id = ? AND bad_tag_id = ? AND status = ?;', ( service_id, bad_tag_id, deletee_status ) )
                             
+                            # the old chain is still in the cache, so the bad tag is enough to find everything it touched
+                            
+                            self._CacheTagLookupsUpdateSiblings( service_id, ( bad_tag_id, ) )
+                            
                             notify_new_pending = True
                             
                         
@@ -7799,15 +9063,31 @@ class DB( HydrusDB.HydrusDB ):
                 
                 definition_hash_ids = [ hash_id for ( hash_id, ) in self._SelectFromList( select_statement, hash_ids_i_can_process ) ]
                 
+                # the files are read and decoded in another thread while we process, so the db is not waiting on zlib and json
+                
+                def load_update( ( hash_id, update_path ) ):
+                    
+                    return LoadRepositoryUpdate( update_path )
+                    
+                
+                def get_hash_ids_and_paths( hash_ids ):
+                    
+                    hash_ids_to_hashes = self._GetHashIdsToHashes( hash_ids )
+                    
+                    return [ ( hash_id, client_files_manager.LocklessGetFilePath( hash_ids_to_hashes[ hash_id ], HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS ) ) for hash_id in hash_ids ]
+                    
+                
                 if len( definition_hash_ids ) > 0:
                     
                     larger_precise_timestamp = HydrusData.GetNowPrecise()
                     
                     total_definitions_rows = 0
                     
+                    prefetcher = HydrusThreading.BackgroundPrefetcher( self._controller, load_update, get_hash_ids_and_paths( definition_hash_ids ), num_to_prefetch = REPOSITORY_UPDATE_PREFETCH )
+                    
                     try:
                         
-                        for hash_id in definition_hash_ids:
+                        for ( ( hash_id, update_path ), definition_update ) in prefetcher:
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                             
@@ -7821,17 +9101,6 @@ class DB( HydrusDB.HydrusDB ):
                             job_key.SetVariable( 'popup_text_1', status )
                             job_key.SetVariable( 'popup_gauge_1', ( num_updates_done, num_updates_to_do ) )
                             
-                            update_hash = self._GetHash( hash_id )
-                            
-                            update_path = client_files_manager.LocklessGetFilePath( update_hash, HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS )
-                            
-                            with open( update_path, 'rb' ) as f:
-                                
-                                update_network_string = f.read()
-                                
-                            
-                            definition_update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
-                            
                             precise_timestamp = HydrusData.GetNowPrecise()
                             
                             self._ProcessRepositoryDefinitionUpdate( service_id, definition_update )
@@ -7860,8 +9129,12 @@ class DB( HydrusDB.HydrusDB ):
                         
                     finally:
                         
+                        prefetcher.Cancel()
+                        
                         report_speed_to_log( larger_precise_timestamp, total_definitions_rows, 'definitions' )
                         
+                        report_prefetch_wait_to_log( prefetcher, 'definition' )
+                        
                     
                 
                 select_statement = 'SELECT hash_id FROM files_info WHERE mime = ' + str( HC.APPLICATION_HYDRUS_UPDATE_CONTENT ) + ' AND hash_id IN %s;'
@@ -7874,9 +9147,11 @@ class DB( HydrusDB.HydrusDB ):
                     
                     total_content_rows = 0
                     
+                    prefetcher = HydrusThreading.BackgroundPrefetcher( self._controller, load_update, get_hash_ids_and_paths( content_hash_ids ), num_to_prefetch = REPOSITORY_UPDATE_PREFETCH )
+                    
                     try:
                         
-                        for hash_id in content_hash_ids:
+                        for ( ( hash_id, update_path ), content_update ) in prefetcher:
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                             
@@ -7890,17 +9165,6 @@ class DB( HydrusDB.HydrusDB ):
                             job_key.SetVariable( 'popup_text_1', status )
                             job_key.SetVariable( 'popup_gauge_1', ( num_updates_done, num_updates_to_do ) )
                             
-                            update_hash = self._GetHash( hash_id )
-                            
-                            update_path = client_files_manager.LocklessGetFilePath( update_hash, HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS )
-                            
-                            with open( update_path, 'rb' ) as f:
-                                
-                                update_network_string = f.read()
-                                
-                            
-                            content_update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
-                            
                             did_whole_update = self._ProcessRepositoryContentUpdate( job_key, service_id, content_update )
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
@@ -7921,8 +9185,12 @@ class DB( HydrusDB.HydrusDB ):
                         
                     finally:
                         
+                        prefetcher.Cancel()
+                        
                         report_speed_to_log( precise_timestamp, total_content_rows, 'content rows' )
                         
+                        report_prefetch_wait_to_log( prefetcher, 'content' )
+                        
                     
                 
             finally:
@@ -8012,8 +9280,11 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'related_tags': result = self._GetRelatedTags( *args, **kwargs )
         elif action == 'tag_censorship': result = self._GetTagCensorship( *args, **kwargs )
         elif action == 'tag_parents': result = self._GetTagParents( *args, **kwargs )
+        elif action == 'tag_parents_lookup': result = self._CacheTagLookupsGetParents( *args, **kwargs )
         elif action == 'tag_siblings': result = self._GetTagSiblings( *args, **kwargs )
+        elif action == 'tag_siblings_lookup': result = self._CacheTagLookupsGetSiblings( *args, **kwargs )
         elif action == 'url_status': result = self._GetURLStatus( *args, **kwargs )
+        elif action == 'url_statuses': result = self._GetURLStatuses( *args, **kwargs )
         else: raise Exception( 'db received an unknown read command: ' + action )
         
         return result
@@ -8108,12 +9379,7 @@ class DB( HydrusDB.HydrusDB ):
             
             for ( file_service_id, tag_service_id ) in itertools.product( file_service_ids, tag_service_ids ):
                 
-                if job_key.IsCancelled():
-                    
-                    break
-                    
-                
-                job_key.SetVariable( 'popup_text_1', 'generating specific ac_cache ' + str( file_service_id ) + '_' + str( tag_service_id ) )
+                job_key.SetVariable( 'popup_text_1', 'resetting specific ac_cache ' + str( file_service_id ) + '_' + str( tag_service_id ) )
                 
                 self._CacheSpecificMappingsDrop( file_service_id, tag_service_id )
                 
@@ -8122,18 +9388,17 @@ class DB( HydrusDB.HydrusDB ):
             
             for tag_service_id in tag_service_ids:
                 
-                if job_key.IsCancelled():
-                    
-                    break
-                    
-                
-                job_key.SetVariable( 'popup_text_1', 'generating combined files ac_cache ' + str( tag_service_id ) )
+                job_key.SetVariable( 'popup_text_1', 'resetting combined files ac_cache ' + str( tag_service_id ) )
                 
                 self._CacheCombinedFilesMappingsDrop( tag_service_id )
                 
                 self._CacheCombinedFilesMappingsGenerate( tag_service_id )
                 
             
+            # if this is cancelled, idle maintenance will pick it up where it left off
+            
+            self._CacheMappingsMaintainRegeneration( job_key = job_key )
+            
         finally:
             
             job_key.SetVariable( 'popup_text_1', 'done!' )
@@ -8204,6 +9469,21 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _Rollback( self ):
+        
+        HydrusDB.HydrusDB._Rollback( self )
+        
+        # the in-memory phash tree, file search cache and id lookups may have seen changes that just got undone
+        
+        self._phash_index.Invalidate()
+        
+        self._file_search_cache.Clear()
+        
+        self._hash_ids_cache.Clear()
+        self._namespace_ids_cache.Clear()
+        self._tag_ids_cache.Clear()
+        
+    
     def _SaveDirtyServices( self, dirty_services ):
         
         # if allowed to save objects
@@ -8289,6 +9569,26 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'INSERT INTO json_dumps ( dump_type, version, dump ) VALUES ( ?, ?, ? );', ( dump_type, version, sqlite3.Binary( dump ) ) )
             
+            if dump_type == HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS:
+                
+                apply_all_siblings_to_all_services = obj.GetBoolean( 'apply_all_siblings_to_all_services' )
+                
+                if apply_all_siblings_to_all_services != self._CacheTagLookupsGetApplyAllSiblingsToAllServices():
+                    
+                    # every service's parents are now collapsed by different siblings
+                    
+                    self._c.execute( 'UPDATE tag_lookup_cache_options SET apply_all_siblings_to_all_services = ?;', ( apply_all_siblings_to_all_services, ) )
+                    
+                    self._CacheTagLookupsRegenerate()
+                    
+                    self._file_search_cache.Clear()
+                    
+                    self.pub_after_job( 'notify_new_siblings_data' )
+                    self.pub_after_job( 'notify_new_siblings_gui' )
+                    self.pub_after_job( 'notify_new_parents' )
+                    
+                
+            
         
     
     def _SetJSONSimple( self, name, value ):
@@ -8364,6 +9664,8 @@ class DB( HydrusDB.HydrusDB ):
             self._c.execute( 'INSERT OR IGNORE INTO tag_censorship ( service_id, blacklist, tags ) VALUES ( ?, ?, ? );', ( service_id, blacklist, tags ) )
             
         
+        self._CacheTagLookupsRegenerate()
+        
         self.pub_after_job( 'notify_new_tag_censorship' )
         
     
@@ -8391,6 +9693,34 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _SortHashIds( self, file_service_key, hash_ids, media_sort ):
+        
+        # the page still sorts the media itself, but getting them in order means big pages show their first thumbnails in the right place
+        
+        order_term = self._GetMediaSortOrderTerm( file_service_key, media_sort )
+        
+        if order_term is None:
+            
+            return hash_ids
+            
+        
+        order_terms = [ order_term ]
+        
+        media_sort_fallback = self._controller.GetNewOptions().GetFallbackSort()
+        
+        fallback_order_term = self._GetMediaSortOrderTerm( file_service_key, media_sort_fallback )
+        
+        if fallback_order_term is not None:
+            
+            order_terms.append( fallback_order_term )
+            
+        
+        with HydrusDB.TemporaryIntegerTable( self._c, hash_ids, 'hash_id' ) as temp_table_name:
+            
+            return [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT sort_hash_ids.hash_id FROM ' + temp_table_name + ' AS sort_hash_ids LEFT JOIN files_info USING ( hash_id ) ORDER BY ' + ', '.join( order_terms ) + ';' ) ]
+            
+        
+    
     def _SubtagExists( self, subtag ):
         
         try:
@@ -8422,12 +9752,17 @@ class DB( HydrusDB.HydrusDB ):
         
         content_updates = []
         
+        if hash_type != HydrusTagArchive.HASH_TYPE_SHA256:
+            
+            hashes_to_hash_ids = self._GetHashesToHashIds( hashes )
+            
+        
         for hash in hashes:
             
             if hash_type == HydrusTagArchive.HASH_TYPE_SHA256: archive_hash = hash
             else:
                 
-                hash_id = self._GetHashId( hash )
+                hash_id = hashes_to_hash_ids[ hash ]
                 
                 if hash_type == HydrusTagArchive.HASH_TYPE_MD5: h = 'md5'
                 elif hash_type == HydrusTagArchive.HASH_TYPE_SHA1: h = 'sha1'
@@ -10056,6 +11391,63 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
+        if version == 284:
+            
+            self._c.execute( 'CREATE TABLE external_caches.combined_files_ac_cache_regeneration ( service_id INTEGER PRIMARY KEY, last_tag_id INTEGER );' )
+            self._c.execute( 'CREATE TABLE external_caches.specific_mappings_cache_regeneration ( file_service_id INTEGER, tag_service_id INTEGER, last_hash_id INTEGER, PRIMARY KEY ( file_service_id, tag_service_id ) );' )
+            
+        
+        if version == 285:
+            
+            self._InitCaches()
+            
+            self._CreateIndex( 'tag_siblings', [ 'good_tag_id' ] )
+            self._CreateIndex( 'tag_sibling_petitions', [ 'good_tag_id' ] )
+            
+            self._c.execute( 'CREATE TABLE external_caches.tag_lookup_cache_options ( apply_all_siblings_to_all_services INTEGER_BOOLEAN );' )
+            self._c.execute( 'CREATE TABLE external_caches.tag_parent_lookup_cache ( service_id INTEGER, child_tag_id INTEGER, ancestor_index INTEGER, ancestor_tag_id INTEGER, PRIMARY KEY ( service_id, child_tag_id, ancestor_index ) );' )
+            self._CreateIndex( 'external_caches.tag_parent_lookup_cache', [ 'ancestor_tag_id' ] )
+            self._c.execute( 'CREATE TABLE external_caches.tag_sibling_lookup_cache ( service_id INTEGER, bad_tag_id INTEGER, ideal_tag_id INTEGER, PRIMARY KEY ( service_id, bad_tag_id ) );' )
+            self._CreateIndex( 'external_caches.tag_sibling_lookup_cache', [ 'ideal_tag_id' ] )
+            
+            new_options = self._GetJSONDump( HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+            
+            self._c.execute( 'INSERT INTO tag_lookup_cache_options ( apply_all_siblings_to_all_services ) VALUES ( ? );', ( new_options.GetBoolean( 'apply_all_siblings_to_all_services' ), ) )
+            
+            self._controller.pub( 'splash_set_status_text', 'generating tag sibling and parent lookups' )
+            
+            self._CacheTagLookupsRegenerate()
+            
+        
+        if version == 286:
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.subtag_trigrams ( trigram TEXT, subtag_id INTEGER, PRIMARY KEY ( trigram, subtag_id ) ) WITHOUT ROWID;' )
+            
+            num_subtags = self._c.execute( 'SELECT COUNT( * ) FROM subtags;' ).fetchone()[0]
+            
+            num_done = 0
+            last_subtag_id = -1
+            
+            while True:
+                
+                rows = self._c.execute( 'SELECT subtag_id, subtag FROM subtags WHERE subtag_id > ? ORDER BY subtag_id LIMIT 10000;', ( last_subtag_id, ) ).fetchall()
+                
+                if len( rows ) == 0:
+                    
+                    break
+                    
+                
+                inserts = [ ( trigram, subtag_id ) for ( subtag_id, subtag ) in rows for trigram in GenerateSubtagTrigrams( subtag ) ]
+                
+                self._c.executemany( 'INSERT OR IGNORE INTO subtag_trigrams ( trigram, subtag_id ) VALUES ( ?, ? );', inserts )
+                
+                num_done += len( rows )
+                last_subtag_id = rows[-1][0]
+                
+                self._controller.pub( 'splash_set_status_text', 'indexing tags for wildcard search: ' + HydrusData.ConvertValueRangeToPrettyString( num_done, num_subtags ) )
+                
+            
+        
         self._controller.pub( 'splash_set_title_text', 'updated db to v' + str( version + 1 ) )
         
         self._c.execute( 'UPDATE version SET version = ?;', ( version + 1, ) )
@@ -10639,6 +12031,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'import_file': result = self._ImportFile( *args, **kwargs )
         elif action == 'import_update': result = self._ImportUpdate( *args, **kwargs )
         elif action == 'local_booru_share': result = self._SetYAMLDump( YAML_DUMP_ID_LOCAL_BOORU, *args, **kwargs )
+        elif action == 'maintain_mappings_caches': result = self._CacheMappingsMaintainRegeneration( *args, **kwargs )
         elif action == 'maintain_similar_files_duplicate_pairs': result = self._CacheSimilarFilesMaintainDuplicatePairs( *args, **kwargs )
         elif action == 'maintain_similar_files_phashes': result = self._CacheSimilarFilesMaintainFiles( *args, **kwargs )
         elif action == 'maintain_similar_files_tree': result = self._CacheSimilarFilesMaintainTree( *args, **kwargs )
@@ -10664,6 +12057,11 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'vacuum': result = self._Vacuum( *args, **kwargs )
         else: raise Exception( 'db received an unknown write command: ' + action )
         
+        if action in self.FILE_SEARCH_CACHE_CLEARING_WRITE_ACTIONS:
+            
+            self._file_search_cache.Clear()
+            
+        
         return result
         
     
@@ -10689,6 +12087,11 @@ class DB( HydrusDB.HydrusDB ):
         self._controller.pubimmediate( 'refresh_status' )
         
     
+    def ClearFileSearchCache( self ):
+        
+        self._file_search_cache.Clear()
+        
+    
     def GetInitialMessages( self ):
         
         return self._initial_messages
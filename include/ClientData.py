@@ -26,6 +26,153 @@ def AddPaddingToDimensions( dimensions, padding ):
     
     return ( x + padding, y + padding )
     
+# important thing here, and reason why it is recursive, is because we want to preserve the parent-grandparent interleaving
+def BuildServiceKeysToChildrenToParents( service_keys_to_simple_children_to_parents ):
+    
+    def AddParents( simple_children_to_parents, children_to_parents, child, parents ):
+        
+        for parent in parents:
+            
+            if parent not in children_to_parents[ child ]:
+                
+                children_to_parents[ child ].append( parent )
+                
+            
+            if parent in simple_children_to_parents:
+                
+                grandparents = simple_children_to_parents[ parent ]
+                
+                AddParents( simple_children_to_parents, children_to_parents, child, grandparents )
+                
+            
+        
+    
+    service_keys_to_children_to_parents = collections.defaultdict( HydrusData.default_dict_list )
+    
+    for ( service_key, simple_children_to_parents ) in service_keys_to_simple_children_to_parents.items():
+        
+        children_to_parents = service_keys_to_children_to_parents[ service_key ]
+        
+        for ( child, parents ) in simple_children_to_parents.items():
+            
+            AddParents( simple_children_to_parents, children_to_parents, child, parents )
+            
+        
+    
+    return service_keys_to_children_to_parents
+    
+def BuildServiceKeysToParents( service_keys_to_statuses_to_pairs, service_keys_to_siblings, apply_all_siblings_to_all_services ):
+    
+    # first collapse siblings
+    
+    collapsed_service_keys_to_statuses_to_pairs = collections.defaultdict( HydrusData.default_dict_set )
+    
+    for ( service_key, statuses_to_pairs ) in service_keys_to_statuses_to_pairs.items():
+        
+        if service_key == CC.COMBINED_TAG_SERVICE_KEY: continue
+        
+        if apply_all_siblings_to_all_services:
+            
+            siblings = service_keys_to_siblings.get( CC.COMBINED_TAG_SERVICE_KEY, {} )
+            
+        else:
+            
+            siblings = service_keys_to_siblings.get( service_key, {} )
+            
+        
+        for ( status, pairs ) in statuses_to_pairs.items():
+            
+            pairs = { ( siblings.get( a, a ), siblings.get( b, b ) ) for ( a, b ) in pairs }
+            
+            collapsed_service_keys_to_statuses_to_pairs[ service_key ][ status ] = pairs
+            
+        
+    
+    # now collapse current and pending
+    
+    service_keys_to_pairs_flat = HydrusData.default_dict_set()
+    
+    for ( service_key, statuses_to_pairs ) in collapsed_service_keys_to_statuses_to_pairs.items():
+        
+        pairs_flat = statuses_to_pairs[ HC.CONTENT_STATUS_CURRENT ].union( statuses_to_pairs[ HC.CONTENT_STATUS_PENDING ] )
+        
+        service_keys_to_pairs_flat[ service_key ] = pairs_flat
+        
+    
+    # now create the combined tag service
+    
+    combined_pairs_flat = set()
+    
+    for pairs_flat in service_keys_to_pairs_flat.values():
+        
+        combined_pairs_flat.update( pairs_flat )
+        
+    
+    service_keys_to_pairs_flat[ CC.COMBINED_TAG_SERVICE_KEY ] = combined_pairs_flat
+    
+    #
+    
+    service_keys_to_simple_children_to_parents = BuildServiceKeysToSimpleChildrenToParents( service_keys_to_pairs_flat )
+    
+    return BuildServiceKeysToChildrenToParents( service_keys_to_simple_children_to_parents )
+    
+def BuildServiceKeysToSiblings( service_keys_to_statuses_to_pairs ):
+    
+    service_keys_to_siblings = {}
+    
+    local_tags_pairs = set()
+    
+    tag_repo_pairs = set()
+    
+    for ( service_key, statuses_to_pairs ) in service_keys_to_statuses_to_pairs.items():
+        
+        all_pairs = statuses_to_pairs[ HC.CONTENT_STATUS_CURRENT ].union( statuses_to_pairs[ HC.CONTENT_STATUS_PENDING ] )
+        
+        if service_key == CC.LOCAL_TAG_SERVICE_KEY:
+            
+            local_tags_pairs = set( all_pairs )
+            
+        else:
+            
+            tag_repo_pairs.update( all_pairs )
+            
+        
+        service_keys_to_siblings[ service_key ] = CollapseTagSiblingPairs( [ all_pairs ] )
+        
+    
+    service_keys_to_siblings[ CC.COMBINED_TAG_SERVICE_KEY ] = CollapseTagSiblingPairs( [ local_tags_pairs, tag_repo_pairs ] )
+    
+    return service_keys_to_siblings
+    
+def BuildServiceKeysToSimpleChildrenToParents( service_keys_to_pairs_flat ):
+    
+    service_keys_to_simple_children_to_parents = collections.defaultdict( HydrusData.default_dict_set )
+    
+    for ( service_key, pairs ) in service_keys_to_pairs_flat.items():
+        
+        service_keys_to_simple_children_to_parents[ service_key ] = BuildSimpleChildrenToParents( pairs )
+        
+    
+    return service_keys_to_simple_children_to_parents
+    
+def BuildSimpleChildrenToParents( pairs ):
+    
+    simple_children_to_parents = HydrusData.default_dict_set()
+    
+    for ( child, parent ) in pairs:
+        
+        if child == parent:
+            
+            continue
+            
+        
+        if LoopInSimpleChildrenToParents( simple_children_to_parents, child, parent ): continue
+        
+        simple_children_to_parents[ child ].add( parent )
+        
+    
+    return simple_children_to_parents
+    
 def CatchExceptionClient( etype, value, tb ):
     
     try:
@@ -96,6 +243,96 @@ def CatchExceptionClient( etype, value, tb ):
     
     time.sleep( 1 )
     
+def CollapseTagSiblingPairs( groups_of_pairs ):
+    
+    # This now takes 'groups' of pairs in descending order of precedence
+    
+    # This allows us to mandate that local tags take precedence
+    
+    # a pair is invalid if:
+    # it causes a loop (a->b, b->c, c->a)
+    # there is already a relationship for the 'bad' sibling (a->b, a->c)
+    
+    valid_chains = {}
+    
+    for pairs in groups_of_pairs:
+        
+        pairs = list( pairs )
+        
+        pairs.sort()
+        
+        for ( bad, good ) in pairs:
+            
+            if bad == good:
+                
+                # a->a is a loop!
+                
+                continue
+                
+            
+            if bad not in valid_chains:
+                
+                we_have_a_loop = False
+                
+                current_best = good
+                
+                while current_best in valid_chains:
+                    
+                    current_best = valid_chains[ current_best ]
+                    
+                    if current_best == bad:
+                        
+                        we_have_a_loop = True
+                        
+                        break
+                        
+                    
+                
+                if not we_have_a_loop:
+                    
+                    valid_chains[ bad ] = good
+                    
+                
+            
+        
+    
+    # now we collapse the chains, turning:
+    # a->b, b->c ... e->f
+    # into
+    # a->f, b->f ... e->f
+    
+    siblings = {}
+    
+    for ( bad, good ) in valid_chains.items():
+        
+        # given a->b, want to find f
+        
+        if good in siblings:
+            
+            # f already calculated and added
+            
+            best = siblings[ good ]
+            
+        else:
+            
+            # we don't know f for this chain, so let's figure it out
+            
+            current_best = good
+            
+            while current_best in valid_chains:
+                
+                current_best = valid_chains[ current_best ] # pursue endpoint f
+                
+            
+            best = current_best
+            
+        
+        # add a->f
+        siblings[ bad ] = best
+        
+    
+    return siblings
+    
 def ColourIsBright( colour ):
     
     ( r, g, b ) = colour.Get()
@@ -406,6 +643,26 @@ def GetSortTypeChoices():
     
     return sort_choices
     
+def LoopInSimpleChildrenToParents( simple_children_to_parents, child, parent ):
+    
+    potential_loop_paths = { parent }
+    
+    while len( potential_loop_paths.intersection( simple_children_to_parents.keys() ) ) > 0:
+        
+        new_potential_loop_paths = set()
+        
+        for potential_loop_path in potential_loop_paths.intersection( simple_children_to_parents.keys() ):
+            
+            new_potential_loop_paths.update( simple_children_to_parents[ potential_loop_path ] )
+            
+        
+        potential_loop_paths = new_potential_loop_paths
+        
+        if child in potential_loop_paths: return True
+        
+    
+    return False
+    
 def MergeCounts( min_a, max_a, min_b, max_b ):
     
     # 100-None and 100-None returns 100-200
@@ -859,6 +1116,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'booleans' ][ 'thumbnail_fill' ] = False
         
+        self._dictionary[ 'booleans' ][ 'use_thumbnail_blob_store' ] = False
+        
         #
         
         self._dictionary[ 'colours' ] = HydrusSerialisable.SerialisableDictionary()
@@ -924,6 +1183,7 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         self._dictionary[ 'integers' ][ 'network_timeout' ] = 10
         
         self._dictionary[ 'integers' ][ 'thumbnail_visibility_scroll_percent' ] = 75
+        self._dictionary[ 'integers' ][ 'thumbnail_decode_threads' ] = 4
         
         self._dictionary[ 'integers' ][ 'last_session_save_period_minutes' ] = 5
         
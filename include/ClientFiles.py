@@ -1,7 +1,11 @@
 import gc
 import HydrusExceptions
 import HydrusGlobals as HG
+import HydrusPaths
+import mmap
 import os
+import struct
+import threading
 
 def GetAllPaths( raw_paths ):
     
@@ -39,3 +43,325 @@ def GetAllPaths( raw_paths ):
     
     return file_paths
     
+class ThumbnailBlobStore( object ):
+    
+    # packs rendered thumbnails into a few big append-only segment files, so a cold page of thumbnails is a handful of mmap reads rather than thousands of file opens
+    # the index is an append-only log of fixed-size records--a zero length record means the hash was discarded
+    
+    INDEX_FILENAME = 'thumbnails.index'
+    SEGMENT_FILENAME_TEMPLATE = 'thumbnails_{:04d}.segment'
+    
+    MAX_SEGMENT_SIZE = 256 * 1048576
+    
+    # overwritten and discarded thumbnails leave dead bytes behind, so we rewrite the live ones once the waste is big enough to bother
+    MIN_COMPACTION_DEAD_BYTES = 16 * 1048576
+    COMPACTION_DEAD_FRACTION = 0.25
+    
+    INDEX_RECORD = struct.Struct( '!32sHQIHHB' ) # hash, segment_id, offset, length, width, height, depth
+    
+    def __init__( self, path ):
+        
+        self._path = path
+        
+        self._lock = threading.Lock()
+        
+        self._Load()
+        
+    
+    def _AppendIndexRecord( self, hash, segment_id, offset, length, width, height, depth ):
+        
+        self._index_file.write( self.INDEX_RECORD.pack( hash, segment_id, offset, length, width, height, depth ) )
+        self._index_file.flush()
+        
+    
+    def _Close( self ):
+        
+        for segment_mmap in self._segment_ids_to_mmaps.values():
+            
+            segment_mmap.close()
+            
+        
+        self._segment_ids_to_mmaps = {}
+        
+        if self._index_file is not None:
+            
+            self._index_file.close()
+            
+            self._index_file = None
+            
+        
+        if self._segment_file is not None:
+            
+            self._segment_file.close()
+            
+            self._segment_file = None
+            
+        
+    
+    def _GetNumLiveBytes( self ):
+        
+        return sum( ( length for ( segment_id, offset, length, size, depth ) in self._hashes_to_locations.itervalues() ) )
+        
+    
+    def _GetSegmentPath( self, segment_id ):
+        
+        return os.path.join( self._path, self.SEGMENT_FILENAME_TEMPLATE.format( segment_id ) )
+        
+    
+    def _Load( self ):
+        
+        HydrusPaths.MakeSureDirectoryExists( self._path )
+        
+        self._hashes_to_locations = {}
+        self._segment_ids_to_mmaps = {}
+        
+        self._num_dead_bytes = 0
+        
+        segment_ids_to_sizes = {}
+        
+        segment_id = 0
+        
+        while os.path.exists( self._GetSegmentPath( segment_id ) ):
+            
+            segment_ids_to_sizes[ segment_id ] = os.path.getsize( self._GetSegmentPath( segment_id ) )
+            
+            segment_id += 1
+            
+        
+        self._current_segment_id = max( segment_id - 1, 0 )
+        
+        index_path = os.path.join( self._path, self.INDEX_FILENAME )
+        
+        record_size = self.INDEX_RECORD.size
+        
+        if os.path.exists( index_path ):
+            
+            with open( index_path, 'rb' ) as f:
+                
+                index_data = f.read()
+                
+            
+            # a partial record at the end means we were cut off mid-write
+            
+            num_good_bytes = len( index_data ) - ( len( index_data ) % record_size )
+            
+            for i in xrange( 0, num_good_bytes, record_size ):
+                
+                ( hash, segment_id, offset, length, width, height, depth ) = self.INDEX_RECORD.unpack_from( index_data, i )
+                
+                if hash in self._hashes_to_locations:
+                    
+                    self._num_dead_bytes += self._hashes_to_locations[ hash ][2]
+                    
+                    del self._hashes_to_locations[ hash ]
+                    
+                
+                if length > 0 and offset + length <= segment_ids_to_sizes.get( segment_id, 0 ):
+                    
+                    self._hashes_to_locations[ hash ] = ( segment_id, offset, length, ( width, height ), depth )
+                    
+                
+            
+            if num_good_bytes < len( index_data ):
+                
+                with open( index_path, 'r+b' ) as f:
+                    
+                    f.truncate( num_good_bytes )
+                    
+                
+            
+        
+        self._index_file = open( index_path, 'ab' )
+        self._segment_file = open( self._GetSegmentPath( self._current_segment_id ), 'ab' )
+        
+    
+    def _ReadData( self, segment_id, offset, length ):
+        
+        segment_mmap = self._segment_ids_to_mmaps.get( segment_id, None )
+        
+        if segment_mmap is None or offset + length > len( segment_mmap ):
+            
+            # the current segment grows as we write to it, so remap if this is new data
+            
+            if segment_mmap is not None:
+                
+                segment_mmap.close()
+                
+            
+            with open( self._GetSegmentPath( segment_id ), 'rb' ) as f:
+                
+                segment_mmap = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+                
+            
+            self._segment_ids_to_mmaps[ segment_id ] = segment_mmap
+            
+        
+        return segment_mmap[ offset : offset + length ]
+        
+    
+    def AddThumbnail( self, hash, data, size, depth ):
+        
+        with self._lock:
+            
+            if hash in self._hashes_to_locations:
+                
+                return
+                
+            
+            self._segment_file.seek( 0, os.SEEK_END )
+            
+            offset = self._segment_file.tell()
+            
+            if offset > 0 and offset + len( data ) > self.MAX_SEGMENT_SIZE:
+                
+                self._segment_file.close()
+                
+                self._current_segment_id += 1
+                
+                self._segment_file = open( self._GetSegmentPath( self._current_segment_id ), 'ab' )
+                
+                offset = 0
+                
+            
+            self._segment_file.write( data )
+            self._segment_file.flush()
+            
+            ( width, height ) = size
+            
+            self._AppendIndexRecord( hash, self._current_segment_id, offset, len( data ), width, height, depth )
+            
+            self._hashes_to_locations[ hash ] = ( self._current_segment_id, offset, len( data ), size, depth )
+            
+        
+    
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._Close()
+            
+            HydrusPaths.DeletePath( self._path )
+            
+            self._Load()
+            
+        
+    
+    def Close( self ):
+        
+        with self._lock:
+            
+            self._Close()
+            
+        
+    
+    def Compact( self ):
+        
+        with self._lock:
+            
+            if self._num_dead_bytes == 0:
+                
+                return
+                
+            
+            # we write the live thumbnails to a fresh store in segment order, so the copy is a sequential read, and only swap it in once it is complete
+            
+            compacted_path = self._path + '_compacting'
+            old_path = self._path + '_old'
+            
+            HydrusPaths.DeletePath( compacted_path )
+            HydrusPaths.DeletePath( old_path )
+            
+            compacted_store = ThumbnailBlobStore( compacted_path )
+            
+            compacted_store.MAX_SEGMENT_SIZE = self.MAX_SEGMENT_SIZE
+            
+            sorted_locations = sorted( ( ( segment_id, offset, length, size, depth, hash ) for ( hash, ( segment_id, offset, length, size, depth ) ) in self._hashes_to_locations.iteritems() ) )
+            
+            for ( segment_id, offset, length, size, depth, hash ) in sorted_locations:
+                
+                data = self._ReadData( segment_id, offset, length )
+                
+                compacted_store.AddThumbnail( hash, data, size, depth )
+                
+            
+            compacted_store.Close()
+            
+            self._Close()
+            
+            os.rename( self._path, old_path )
+            os.rename( compacted_path, self._path )
+            
+            HydrusPaths.DeletePath( old_path )
+            
+            self._Load()
+            
+        
+    
+    def DiscardThumbnails( self, hashes ):
+        
+        with self._lock:
+            
+            for hash in hashes:
+                
+                if hash in self._hashes_to_locations:
+                    
+                    ( segment_id, offset, length, size, depth ) = self._hashes_to_locations[ hash ]
+                    
+                    self._AppendIndexRecord( hash, segment_id, offset, 0, 0, 0, 0 )
+                    
+                    self._num_dead_bytes += length
+                    
+                    del self._hashes_to_locations[ hash ]
+                    
+                
+            
+        
+    
+    def GetNumDeadBytes( self ):
+        
+        with self._lock:
+            
+            return self._num_dead_bytes
+            
+        
+    
+    def GetThumbnail( self, hash ):
+        
+        with self._lock:
+            
+            if hash not in self._hashes_to_locations:
+                
+                return None
+                
+            
+            ( segment_id, offset, length, size, depth ) = self._hashes_to_locations[ hash ]
+            
+            data = self._ReadData( segment_id, offset, length )
+            
+            return ( data, size, depth )
+            
+        
+    
+    def HasThumbnail( self, hash ):
+        
+        with self._lock:
+            
+            return hash in self._hashes_to_locations
+            
+        
+    
+    def NeedsCompaction( self ):
+        
+        with self._lock:
+            
+            if self._num_dead_bytes < self.MIN_COMPACTION_DEAD_BYTES:
+                
+                return False
+                
+            
+            total_bytes = self._num_dead_bytes + self._GetNumLiveBytes()
+            
+            return self._num_dead_bytes > total_bytes * self.COMPACTION_DEAD_FRACTION
+            
+        
+    
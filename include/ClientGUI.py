@@ -792,6 +792,20 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
         HydrusData.Print( 'uncollectable garbage: ' + HydrusData.ToUnicode( gc.garbage ) )
         
     
+    def _DebugShowCacheStatistics( self ):
+        
+        for ( name, cache_name ) in ( ( 'thumbnail', 'thumbnail' ), ( 'image rendering', 'images' ) ):
+            
+            ( num_items, total_size, cache_size, num_hits, num_misses, num_evictions, num_overflows ) = self._controller.GetCache( cache_name ).GetCacheStatistics()
+            
+            text = name + ' cache: ' + HydrusData.ConvertIntToPrettyString( num_items ) + ' items using ' + HydrusData.ConvertValueRangeToBytes( total_size, cache_size )
+            text += os.linesep
+            text += HydrusData.ConvertIntToPrettyString( num_hits ) + ' hits, ' + HydrusData.ConvertIntToPrettyString( num_misses ) + ' misses, ' + HydrusData.ConvertIntToPrettyString( num_evictions ) + ' evictions, ' + HydrusData.ConvertIntToPrettyString( num_overflows ) + ' too large for the main cache'
+            
+            HydrusData.ShowText( text )
+            
+        
+    
     def _DeleteGUISession( self, name ):
         
         message = 'Delete session "' + name + '"?'
@@ -1500,6 +1514,7 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             ClientGUIMenus.AppendMenuItem( self, debug, 'make a popup in five seconds', 'Throw a delayed popup at the message manager, giving you time to minimise or otherwise alter the client before it arrives.', wx.CallLater, 5000, HydrusData.ShowText, 'This is a delayed popup message.' )
             ClientGUIMenus.AppendMenuItem( self, debug, 'force a gui layout now', 'Tell the gui to relayout--useful to test some gui bootup layout issues.', self.Layout )
             ClientGUIMenus.AppendMenuItem( self, debug, 'print garbage', 'Print some information about the python garbage to the log.', self._DebugPrintGarbage )
+            ClientGUIMenus.AppendMenuItem( self, debug, 'show image cache statistics', 'Show how full the thumbnail and image rendering caches are and how often they have been hit.', self._DebugShowCacheStatistics )
             ClientGUIMenus.AppendMenuItem( self, debug, 'clear image rendering cache', 'Tell the image rendering system to forget all current images. This will often free up a bunch of memory immediately.', self._controller.ClearCaches )
             ClientGUIMenus.AppendMenuItem( self, debug, 'clear db service info cache', 'Delete all cached service info like total number of mappings or files, in case it has become desynchronised. Some parts of the gui may be laggy immediately after this as these numbers are recalculated.', self._DeleteServiceInfo )
             ClientGUIMenus.AppendMenuItem( self, debug, 'load whole db in disk cache', 'Contiguously read as much of the db as will fit into memory. This will massively speed up any subsequent big job.', self._controller.CallToThread, self._controller.Read, 'load_into_disk_cache' )
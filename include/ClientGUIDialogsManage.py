@@ -3921,9 +3921,9 @@ class DialogManageTagParents( ClientGUIDialogs.Dialog ):
             
             if potential_parent in current_children:
                 
-                simple_children_to_parents = ClientCaches.BuildSimpleChildrenToParents( current_pairs )
+                simple_children_to_parents = ClientData.BuildSimpleChildrenToParents( current_pairs )
                 
-                if ClientCaches.LoopInSimpleChildrenToParents( simple_children_to_parents, potential_child, potential_parent ):
+                if ClientData.LoopInSimpleChildrenToParents( simple_children_to_parents, potential_child, potential_parent ):
                     
                     wx.MessageBox( 'Adding ' + potential_child + '->' + potential_parent + ' would create a loop!' )
                     
@@ -3274,7 +3274,7 @@ class ManagementPanelQuery( ManagementPanel ):
                 
                 if len( current_predicates ) > 0:
                     
-                    self._controller.StartFileQuery( self._page_key, self._query_job_key, file_search_context )
+                    self._controller.StartFileQuery( self._page_key, self._query_job_key, file_search_context, media_sort = self._sort_by.GetSort() )
                     
                     panel = ClientGUIMedia.MediaPanelLoading( self._page, self._page_key, file_service_key )
                     
@@ -3378,7 +3378,7 @@ class ManagementPanelQuery( ManagementPanel ):
             
         
     
-    def ShowQuery( self, page_key, query_job_key, media_results ):
+    def ShowQuery( self, page_key, query_job_key, media_results, unloaded_hash_ids ):
         
         if page_key == self._page_key and query_job_key == self._query_job_key:
             
@@ -3392,6 +3392,10 @@ class ManagementPanelQuery( ManagementPanel ):
             
             panel.Sort( self._page_key, self._sort_by.GetSort() )
             
+            # after the sort and collect, or they would fetch everything
+            
+            panel.SetUnloadedHashIds( unloaded_hash_ids )
+            
             self._controller.pub( 'swap_media_panel', self._page_key, panel )
             
         
@@ -1709,29 +1709,12 @@ class MediaPanelLoading( MediaPanel ):
     
     def __init__( self, parent, page_key, file_service_key ):
         
-        self._current = None
-        self._max = None
-        
         MediaPanel.__init__( self, parent, page_key, file_service_key, [] )
         
-        HG.client_controller.sub( self, 'SetNumQueryResults', 'set_num_query_results' )
-        
     
     def _GetPrettyStatus( self ):
         
-        s = u'Loading\u2026'
-        
-        if self._current is not None:
-            
-            s += u' ' + HydrusData.ConvertIntToPrettyString( self._current )
-            
-            if self._max is not None:
-                
-                s += u' of ' + HydrusData.ConvertIntToPrettyString( self._max )
-                
-            
-        
-        return s
+        return u'Loading\u2026'
         
     
     def GetSortedMedia( self ):
@@ -1739,18 +1722,6 @@ class MediaPanelLoading( MediaPanel ):
         return []
         
     
-    def SetNumQueryResults( self, page_key, num_current, num_max ):
-        
-        if page_key == self._page_key:
-            
-            self._current = num_current
-            
-            self._max = num_max
-            
-            self._PublishSelectionChange()
-            
-        
-    
 class MediaPanelThumbnails( MediaPanel ):
     
     def __init__( self, parent, page_key, file_service_key, media_results ):
@@ -1760,6 +1731,10 @@ class MediaPanelThumbnails( MediaPanel ):
         self._dirty_canvas_pages = []
         self._num_rows_per_canvas_page = 1
         
+        self._unloaded_hash_ids = []
+        self._currently_fetching_media_results = False
+        self._fetch_all_media_results = False
+        
         MediaPanel.__init__( self, parent, page_key, file_service_key, media_results )
         
         self._last_client_size = ( 0, 0 )
@@ -2000,6 +1975,54 @@ class MediaPanelThumbnails( MediaPanel ):
             
         
     
+    def _FetchAllMediaResults( self ):
+        
+        # sorting and collecting work on the whole page, so the files that have not been scrolled to yet are needed now
+        
+        if len( self._unloaded_hash_ids ) > 0:
+            
+            self._fetch_all_media_results = True
+            
+            self._FetchMoreMediaResults()
+            
+        
+    
+    def _FetchMoreMediaResults( self ):
+        
+        if self._currently_fetching_media_results or len( self._unloaded_hash_ids ) == 0:
+            
+            return
+            
+        
+        thumbnails_per_page = self._num_columns * self._num_rows_per_canvas_page
+        
+        if self._fetch_all_media_results:
+            
+            num_to_fetch = len( self._unloaded_hash_ids )
+            
+        else:
+            
+            # paint draws one canvas page past the view, so fetch once that page is not full
+            
+            last_page_index_to_draw = max( self._CalculateVisiblePageIndices() ) + 1
+            
+            if ( last_page_index_to_draw + 1 ) * thumbnails_per_page <= len( self._sorted_media ):
+                
+                return
+                
+            
+            num_to_fetch = thumbnails_per_page * 2
+            
+        
+        hash_ids = self._unloaded_hash_ids[ : num_to_fetch ]
+        
+        self._unloaded_hash_ids = self._unloaded_hash_ids[ num_to_fetch : ]
+        
+        self._currently_fetching_media_results = True
+        
+        HG.client_controller.CallToThread( self.THREADFetchMediaResults, self._page_key, hash_ids )
+        
+    
     def _GenerateMediaCollection( self, media_results ):
         
         return ThumbnailMediaCollection( self._file_service_key, media_results )
@@ -2034,6 +2057,18 @@ class MediaPanelThumbnails( MediaPanel ):
         return page_index
         
     
+    def _GetPrettyStatus( self ):
+        
+        s = MediaPanel._GetPrettyStatus( self )
+        
+        if len( self._unloaded_hash_ids ) > 0:
+            
+            s += u' (' + HydrusData.ConvertIntToPrettyString( len( self._unloaded_hash_ids ) ) + u' more to load as you scroll)'
+            
+        
+        return s
+        
+    
     def _GetThumbnailSpanDimensions( self ):
         
         return ClientData.AddPaddingToDimensions( HC.options[ 'thumbnail_dimensions' ], ( CC.THUMBNAIL_BORDER + CC.THUMBNAIL_MARGIN ) * 2 )
@@ -2411,6 +2446,16 @@ class MediaPanelThumbnails( MediaPanel ):
             
         
     
+    def Collect( self, page_key, collect_by = -1 ):
+        
+        MediaPanel.Collect( self, page_key, collect_by )
+        
+        if page_key == self._page_key:
+            
+            self._FetchAllMediaResults()
+            
+        
+    
     def EventDrag( self, event ):
         
         if event.Dragging() and self._drag_init_coordinates is not None:
@@ -2695,6 +2740,8 @@ class MediaPanelThumbnails( MediaPanel ):
                 
             
         
+        self._FetchMoreMediaResults()
+        
     
     def EventResize( self, event ):
         
@@ -2704,6 +2751,8 @@ class MediaPanelThumbnails( MediaPanel ):
         
         self._last_client_size = self.GetClientSize()
         
+        self._FetchMoreMediaResults()
+        
     
     def EventSelection( self, event ):
         
@@ -3634,15 +3683,61 @@ class MediaPanelThumbnails( MediaPanel ):
             
         
     
+    def SetUnloadedHashIds( self, hash_ids ):
+        
+        # a big search only loads its first chunk, and the rest of its ids, in search order, are fetched a couple of screens at a time as we scroll down
+        
+        self._unloaded_hash_ids = list( hash_ids )
+        
+        self._PublishSelectionChange()
+        
+    
     def Sort( self, page_key, media_sort = None ):
         
         MediaPanel.Sort( self, page_key, media_sort )
         
+        if page_key == self._page_key:
+            
+            self._FetchAllMediaResults()
+            
+        
         self._DirtyAllPages()
         
         self.Refresh()
         
     
+    def THREADFetchMediaResults( self, page_key, hash_ids ):
+        
+        def wx_continue( media_results ):
+            
+            if not self or page_key != self._page_key:
+                
+                return
+                
+            
+            self._currently_fetching_media_results = False
+            
+            # inserted, not appended, so they go into any collections and into the page's sort, which the db could not always do
+            
+            self.AddMediaResults( page_key, media_results, append = False )
+            
+            if len( self._selected_media ) > 0 and HG.client_controller.gui.IsCurrentPage( self._page_key ):
+                
+                HG.client_controller.pub( 'new_page_status', self._page_key, self._GetPrettyStatus() )
+                
+            
+            self._DirtyAllPages()
+            
+            self.Refresh()
+            
+            self._FetchMoreMediaResults()
+            
+        
+        media_results = HG.client_controller.Read( 'media_results_from_ids', hash_ids )
+        
+        wx.CallAfter( wx_continue, media_results )
+        
+    
     def ThumbnailsResized( self ):
         
         ( thumbnail_span_width, thumbnail_span_height ) = self._GetThumbnailSpanDimensions()
@@ -3236,6 +3236,12 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._estimated_number_fullscreens = wx.StaticText( media_panel, label = '' )
             
+            self._thumbnail_decode_threads = wx.SpinCtrl( media_panel, min = 1, max = 64 )
+            self._thumbnail_decode_threads.SetToolTipString( 'How many threads will load and decode thumbnails at once. If you have a fast drive and many cores, more threads will fill large pages faster. This takes effect on restart.' )
+            
+            self._use_thumbnail_blob_store = wx.CheckBox( media_panel )
+            self._use_thumbnail_blob_store.SetToolTipString( 'Keep rendered thumbnails packed in a few large files in the db directory. This can make first thumbnail loads much faster on a slow or fragmented hard drive.' )
+            
             #
             
             buffer_panel = ClientGUICommon.StaticBox( self, 'video buffer' )
@@ -3285,6 +3291,10 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._fullscreen_cache_size.SetValue( int( HC.options[ 'fullscreen_cache_size' ] / 1048576 ) )
             
+            self._thumbnail_decode_threads.SetValue( self._new_options.GetInteger( 'thumbnail_decode_threads' ) )
+            
+            self._use_thumbnail_blob_store.SetValue( self._new_options.GetBoolean( 'use_thumbnail_blob_store' ) )
+            
             self._video_buffer_size_mb.SetValue( self._new_options.GetInteger( 'video_buffer_size_mb' ) )
             
             self._num_autocomplete_chars.SetValue( HC.options[ 'num_autocomplete_chars' ] )
@@ -3344,6 +3354,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             rows.append( ( 'Thumbnail height: ', self._thumbnail_height ) )
             rows.append( ( 'MB memory reserved for thumbnail cache: ', thumbnails_sizer ) )
             rows.append( ( 'MB memory reserved for media viewer cache: ', fullscreens_sizer ) )
+            rows.append( ( 'Thumbnail loading threads (requires restart): ', self._thumbnail_decode_threads ) )
+            rows.append( ( 'Keep a packed store of rendered thumbnails (experimental): ', self._use_thumbnail_blob_store ) )
             
             gridbox = ClientGUICommon.WrapInGrid( media_panel, rows )
             
@@ -3483,6 +3495,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             HC.options[ 'thumbnail_cache_size' ] = self._thumbnail_cache_size.GetValue() * 1048576
             HC.options[ 'fullscreen_cache_size' ] = self._fullscreen_cache_size.GetValue() * 1048576
             
+            self._new_options.SetInteger( 'thumbnail_decode_threads', self._thumbnail_decode_threads.GetValue() )
+            self._new_options.SetBoolean( 'use_thumbnail_blob_store', self._use_thumbnail_blob_store.GetValue() )
+            
             self._new_options.SetInteger( 'video_buffer_size_mb', self._video_buffer_size_mb.GetValue() )
             
             self._new_options.SetNoneableInteger( 'forced_search_limit', self._forced_search_limit.GetValue() )
@@ -130,9 +130,12 @@ def GenerateNumPyImageFromPILImage( pil_image ):
     
     return numpy.fromstring( s, dtype = 'uint8' ).reshape( ( h, w, len( s ) // ( w * h ) ) )
     
-def GenerateShapePerceptualHashes( path, mime ):
+def GenerateShapePerceptualHashes( path, mime, numpy_image = None ):
     
-    numpy_image = GenerateNumpyImage( path, mime )
+    if numpy_image is None:
+        
+        numpy_image = GenerateNumpyImage( path, mime )
+        
     
     ( y, x, depth ) = numpy_image.shape
     
@@ -241,7 +244,7 @@ def GenerateShapePerceptualHashes( path, mime ):
     
     return phashes
     
-def GenerateThumbnailFromStaticImageCV( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS, mime = None ):
+def GenerateThumbnailFromStaticImageCV( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS, mime = None, numpy_image = None ):
     
     if mime is None:
         
@@ -253,7 +256,10 @@ def GenerateThumbnailFromStaticImageCV( path, dimensions = HC.UNSCALED_THUMBNAIL
         return HydrusFileHandling.GenerateThumbnailFromStaticImagePIL( path, dimensions, mime )
         
     
-    numpy_image = GenerateNumpyImage( path, mime )
+    if numpy_image is None:
+        
+        numpy_image = GenerateNumpyImage( path, mime )
+        
     
     thumbnail_numpy_image = EfficientlyThumbnailNumpyImage( numpy_image, dimensions )
     
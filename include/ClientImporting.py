@@ -19,6 +19,7 @@ import HydrusPaths
 import HydrusSerialisable
 import HydrusTags
 import json
+import multiprocessing
 import os
 import random
 import re
@@ -36,6 +37,56 @@ CHECKER_STATUS_404 = 2
 
 DID_FILE_WORK_MINIMUM_SLEEP_TIME = 0.1
 
+# local imports prepare this many files at once, in as many threads as we have cores, up to the prefetcher's cap, and then commit their tags and show them in a batch
+FILE_IMPORT_BATCH_SIZE = 64
+NUM_FILE_IMPORT_THREADS = min( multiprocessing.cpu_count(), HydrusThreading.MAX_NUM_PREFETCH_THREADS )
+
+def ResolveKnownURLSeeds( seeds, file_import_options, tag_import_options, get_tags_if_url_known_and_file_redundant ):
+    
+    # checks a gallery page's worth of new url seeds in one db read, so seeds for files we already have or have deleted are done before they are queued
+    # anything that still needs a download or a tag fetch is left unknown for the normal file work to do
+    
+    if len( seeds ) == 0:
+        
+        return []
+        
+    
+    urls_to_statuses = HG.client_controller.Read( 'url_statuses', [ seed.seed_data for seed in seeds ] )
+    
+    fetch_tags_for_redundant = get_tags_if_url_known_and_file_redundant and tag_import_options.InterestedInTags()
+    
+    seeds_statuses_and_hashes = []
+    
+    for seed in seeds:
+        
+        ( status, hash, note ) = urls_to_statuses[ seed.seed_data ]
+        
+        if status == CC.STATUS_REDUNDANT:
+            
+            if fetch_tags_for_redundant:
+                
+                continue
+                
+            
+        elif status == CC.STATUS_DELETED:
+            
+            if not file_import_options.GetExcludeDeleted():
+                
+                continue
+                
+            
+        else:
+            
+            continue
+            
+        
+        seed.SetStatus( status, note = note )
+        
+        seeds_statuses_and_hashes.append( ( seed, status, hash ) )
+        
+    
+    return seeds_statuses_and_hashes
+    
 def THREADDownloadURL( job_key, url, url_string ):
     
     job_key.SetVariable( 'popup_title', url_string )
@@ -47,6 +98,7 @@ def THREADDownloadURL( job_key, url, url_string ):
         
         network_job = ClientNetworking.NetworkJob( 'GET', url, temp_path = temp_path )
         
+        network_job.SetHashWhileDownloading( True )
         network_job.OverrideBandwidth()
         
         HG.client_controller.network_engine.AddJob( network_job )
@@ -74,7 +126,7 @@ def THREADDownloadURL( job_key, url, url_string ):
         
         job_key.SetVariable( 'popup_text_1', 'importing' )
         
-        file_import_job = FileImportJob( temp_path )
+        file_import_job = FileImportJob( temp_path, stream_hasher = network_job.GetStreamHasher() )
         
         client_files_manager = HG.client_controller.client_files_manager
         
@@ -135,6 +187,7 @@ def THREADDownloadURLs( job_key, urls, title ):
             
             network_job = ClientNetworking.NetworkJob( 'GET', url, temp_path = temp_path )
             
+            network_job.SetHashWhileDownloading( True )
             network_job.OverrideBandwidth()
             
             HG.client_controller.network_engine.AddJob( network_job )
@@ -154,7 +207,7 @@ def THREADDownloadURLs( job_key, urls, title ):
                 
                 job_key.SetVariable( 'popup_text_2', 'importing' )
                 
-                file_import_job = FileImportJob( temp_path )
+                file_import_job = FileImportJob( temp_path, stream_hasher = network_job.GetStreamHasher() )
                 
                 client_files_manager = HG.client_controller.client_files_manager
                 
@@ -234,7 +287,7 @@ def THREADDownloadURLs( job_key, urls, title ):
     
 class FileImportJob( object ):
     
-    def __init__( self, temp_path, file_import_options = None ):
+    def __init__( self, temp_path, file_import_options = None, stream_hasher = None ):
         
         if file_import_options is None:
             
@@ -243,6 +296,7 @@ class FileImportJob( object ):
         
         self._temp_path = temp_path
         self._file_import_options = file_import_options
+        self._stream_hasher = stream_hasher
         
         self._hash = None
         self._pre_import_status = None
@@ -360,18 +414,50 @@ class FileImportJob( object ):
         return False
         
     
+    def RefreshPreImportStatus( self ):
+        
+        self._pre_import_status = HG.client_controller.Read( 'hash_status', self._hash )
+        
+    
     def GenerateHashAndStatus( self ):
         
-        HydrusImageHandling.ConvertToPngIfBmp( self._temp_path )
+        stream_hasher_ok = self._stream_hasher is not None and self._stream_hasher.GetHeaderMime() != HC.IMAGE_BMP and self._stream_hasher.GetNumBytes() == os.path.getsize( self._temp_path )
         
-        self._hash = HydrusFileHandling.GetHashFromPath( self._temp_path )
+        if stream_hasher_ok:
+            
+            # the network job hashed the file as it came in, so we can check the db without reading it again
+            
+            ( self._hash, md5, sha1, sha512 ) = self._stream_hasher.GetHashes()
+            
+        else:
+            
+            self._stream_hasher = None
+            
+            HydrusImageHandling.ConvertToPngIfBmp( self._temp_path )
+            
+            # we get the extra hashes now as well, so a new file does not have to be read from disk a second time in GenerateInfo
+            
+            ( self._hash, md5, sha1, sha512 ) = HydrusFileHandling.GetAllHashesFromPath( self._temp_path )
+            
+        
+        self._extra_hashes = ( md5, sha1, sha512 )
         
         self._pre_import_status = HG.client_controller.Read( 'hash_status', self._hash )
         
     
     def GenerateInfo( self ):
         
-        mime = HydrusFileHandling.GetMime( self._temp_path )
+        mime = None
+        
+        if self._stream_hasher is not None:
+            
+            mime = self._stream_hasher.GetMime()
+            
+        
+        if mime is None:
+            
+            mime = HydrusFileHandling.GetMime( self._temp_path )
+            
         
         new_options = HG.client_controller.GetNewOptions()
         
@@ -383,21 +469,42 @@ class FileImportJob( object ):
                 
             
         
-        self._file_info = HydrusFileHandling.GetFileInfo( self._temp_path, mime )
-        
-        ( size, mime, width, height, duration, num_frames, num_words ) = self._file_info
-        
-        if mime in HC.MIMES_WITH_THUMBNAILS:
+        if mime in HC.MIMES_WE_CAN_PHASH:
             
-            self._thumbnail = HydrusFileHandling.GenerateThumbnail( self._temp_path, mime )
+            # decode the image just once, and use that for its resolution, thumbnail and phashes
             
-        
-        if mime in HC.MIMES_WE_CAN_PHASH:
+            numpy_image = ClientImageHandling.GenerateNumpyImage( self._temp_path, mime )
             
-            self._phashes = ClientImageHandling.GenerateShapePerceptualHashes( self._temp_path, mime )
+            if mime == HC.IMAGE_JPEG:
+                
+                # old versions of cv2 do not apply exif rotation when they decode, so the array may be on its side
+                # the stored resolution has always been the rotated one, which the header can tell us without another decode
+                
+                ( width, height ) = HydrusImageHandling.GetResolution( self._temp_path )
+                
+            else:
+                
+                ( height, width ) = numpy_image.shape[:2]
+                
+            
+            
+            size = os.path.getsize( self._temp_path )
+            
+            self._file_info = ( size, mime, width, height, None, None, None )
+            
+            self._thumbnail = ClientImageHandling.GenerateThumbnailFromStaticImageCV( self._temp_path, HC.UNSCALED_THUMBNAIL_DIMENSIONS, mime, numpy_image = numpy_image )
+            
+            self._phashes = ClientImageHandling.GenerateShapePerceptualHashes( self._temp_path, mime, numpy_image = numpy_image )
+            
+        else:
+            
+            self._file_info = HydrusFileHandling.GetFileInfo( self._temp_path, mime )
+            
+            if mime in HC.MIMES_WITH_THUMBNAILS:
+                
+                self._thumbnail = HydrusFileHandling.GenerateThumbnail( self._temp_path, mime )
+                
             
-        
-        self._extra_hashes = HydrusFileHandling.GetExtraHashesFromPath( self._temp_path )
         
     
 class GalleryImport( HydrusSerialisable.SerialisableBase ):
@@ -792,6 +899,13 @@ class GalleryImport( HydrusSerialisable.SerialisableBase ):
             
             for url in page_of_urls:
                 
+                if url in new_urls:
+                    
+                    # some galleries list the same file twice on a page
+                    
+                    continue
+                    
+                
                 if self._seed_cache.HasURL( url ):
                     
                     num_already_in_seed_cache += 1
@@ -816,7 +930,53 @@ class GalleryImport( HydrusSerialisable.SerialisableBase ):
                     
                 
             
-            self._seed_cache.AddURLs( new_urls )
+            seeds = [ Seed( SEED_TYPE_URL, url ) for url in new_urls ]
+            
+            presentation_hashes = []
+            
+            try:
+                
+                service_keys_to_content_updates = collections.defaultdict( list )
+                
+                for ( seed, status, hash ) in ResolveKnownURLSeeds( seeds, self._file_import_options, self._tag_import_options, self._get_tags_if_url_known_and_file_redundant ):
+                    
+                    service_keys_to_content_updates[ CC.COMBINED_LOCAL_FILE_SERVICE_KEY ].append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_URLS, HC.CONTENT_UPDATE_ADD, ( hash, ( seed.seed_data, ) ) ) )
+                    
+                    if status == CC.STATUS_REDUNDANT:
+                        
+                        for ( service_key, content_updates ) in self._tag_import_options.GetServiceKeysToContentUpdates( hash, [] ).items():
+                            
+                            service_keys_to_content_updates[ service_key ].extend( content_updates )
+                            
+                        
+                        presentation_hashes.append( hash )
+                        
+                    
+                
+                if len( service_keys_to_content_updates ) > 0:
+                    
+                    HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
+                    
+                
+            except Exception as e:
+                
+                # the page's urls are not lost--they go in unresolved, and the file work checks them one at a time
+                
+                HydrusData.PrintException( e )
+                
+                seeds = [ Seed( SEED_TYPE_URL, url ) for url in new_urls ]
+                
+                presentation_hashes = []
+                
+            
+            self._seed_cache.AddSeeds( seeds )
+            
+            if len( presentation_hashes ) > 0:
+                
+                media_results = HG.client_controller.Read( 'media_results', presentation_hashes )
+                
+                HG.client_controller.pub( 'add_media_results', page_key, media_results )
+                
             
             if len( new_urls ) > 0:
                 
@@ -1524,6 +1684,34 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
         self._new_files_event = threading.Event()
         
     
+    def _DeletePaths( self, paths ):
+        
+        for path in paths:
+            
+            txt_path = path + '.txt'
+            
+            paths_to_delete = [ path ]
+            
+            if os.path.exists( txt_path ):
+                
+                paths_to_delete.append( txt_path )
+                
+            
+            for path_to_delete in paths_to_delete:
+                
+                try:
+                    
+                    ClientData.DeletePath( path_to_delete )
+                    
+                except Exception as e:
+                    
+                    HydrusData.ShowText( 'While attempting to delete ' + path_to_delete + ', the following error occured:' )
+                    HydrusData.ShowException( e )
+                    
+                
+            
+        
+    
     def _GetSerialisableInfo( self ):
         
         serialisable_url_cache = self._paths_cache.GetSerialisableTuple()
@@ -1544,107 +1732,126 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
     
     def _WorkOnFiles( self, page_key ):
         
-        seed = self._paths_cache.GetNextSeed( CC.STATUS_UNKNOWN )
+        seeds = self._paths_cache.GetNextSeeds( CC.STATUS_UNKNOWN, FILE_IMPORT_BATCH_SIZE )
         
-        if seed is None:
+        if len( seeds ) == 0:
             
             return False
             
         
-        path = seed.seed_data
-        
         with self._lock:
             
-            if path in self._paths_to_tags:
+            self._current_action = 'importing'
+            
+        
+        prepare_file_import = lambda seed: PreparedFileImport( seed.seed_data, self._file_import_options ).Prepare()
+        
+        prefetcher = HydrusThreading.BackgroundPrefetcher( HG.client_controller, prepare_file_import, seeds, num_to_prefetch = NUM_FILE_IMPORT_THREADS * 2, num_threads = NUM_FILE_IMPORT_THREADS, discard_func = PreparedFileImport.CleanUp )
+        
+        presentation_hashes = []
+        service_keys_to_content_updates = collections.defaultdict( list )
+        paths_to_delete = []
+        
+        try:
+            
+            for ( seed, prepared_file_import ) in prefetcher:
                 
-                service_keys_to_tags = self._paths_to_tags[ path ]
+                self._WorkOnPreparedFile( seed, prepared_file_import, presentation_hashes, service_keys_to_content_updates, paths_to_delete )
                 
-            else:
+                if self._paused or HG.view_shutdown or HG.client_controller.PageClosedButNotDestroyed( page_key ) or HG.client_controller.PageCompletelyDestroyed( page_key ):
+                    
+                    break
+                    
                 
-                service_keys_to_tags = {}
+                HG.client_controller.WaitUntilViewFree()
                 
             
-        
-        try:
+        finally:
+            
+            prefetcher.Cancel()
             
-            if not os.path.exists( path ):
+            # the tags and media results for the whole batch go in one go, and before we delete any of its files
+            # if the tags do not go in, the files and their .txt sidecars stay where they are, so nothing is lost
+            
+            try:
                 
-                raise Exception( 'Source file does not exist!' )
+                if len( service_keys_to_content_updates ) > 0:
+                    
+                    HG.client_controller.WriteSynchronous( 'content_updates', dict( service_keys_to_content_updates ) )
+                    
+                
+                self._DeletePaths( paths_to_delete )
+                
+            except Exception as e:
+                
+                HydrusData.ShowText( 'While attempting to add the tags for a batch of imported files, the following error occured, so none of the batch\'s files were deleted:' )
+                HydrusData.ShowException( e )
+                
+            
+            if len( presentation_hashes ) > 0:
+                
+                media_results = HG.client_controller.Read( 'media_results', presentation_hashes )
+                
+                HG.client_controller.pub( 'add_media_results', page_key, media_results )
                 
             
             with self._lock:
                 
-                self._current_action = 'preparing to import'
+                self._current_action = ''
                 
             
-            ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+        
+        return True
+        
+    
+    def _WorkOnPreparedFile( self, seed, prepared_file_import, presentation_hashes, service_keys_to_content_updates, paths_to_delete ):
+        
+        path = seed.seed_data
+        
+        with self._lock:
             
-            try:
+            if path in self._paths_to_tags:
                 
-                copied = HydrusPaths.MirrorFile( path, temp_path )
+                service_keys_to_tags = self._paths_to_tags[ path ]
                 
-                if not copied:
-                    
-                    raise Exception( 'File failed to copy--see log for error.' )
-                    
+            else:
                 
-                with self._lock:
-                    
-                    self._current_action = 'importing'
-                    
+                service_keys_to_tags = {}
                 
-                file_import_job = FileImportJob( temp_path, self._file_import_options )
+            
+        
+        try:
+            
+            try:
+                
+                file_import_job = prepared_file_import.GetFileImportJob()
                 
                 client_files_manager = HG.client_controller.client_files_manager
                 
-                ( status, hash ) = client_files_manager.ImportFile( file_import_job )
+                ( status, hash ) = client_files_manager.ImportPreparedFile( file_import_job )
                 
             finally:
                 
-                HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+                prepared_file_import.CleanUp()
                 
             
             seed.SetStatus( status )
             
             if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
                 
-                service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
-                
-                if len( service_keys_to_content_updates ) > 0:
+                for ( service_key, content_updates ) in ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags ).items():
                     
-                    HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
+                    service_keys_to_content_updates[ service_key ].extend( content_updates )
                     
                 
-                ( media_result, ) = HG.client_controller.Read( 'media_results', ( hash, ) )
-                
-                HG.client_controller.pub( 'add_media_results', page_key, ( media_result, ) )
-                
-                if self._delete_after_success:
+                if hash not in presentation_hashes:
                     
-                    try:
-                        
-                        ClientData.DeletePath( path )
-                        
-                    except Exception as e:
-                        
-                        HydrusData.ShowText( 'While attempting to delete ' + path + ', the following error occured:' )
-                        HydrusData.ShowException( e )
-                        
+                    presentation_hashes.append( hash )
                     
-                    txt_path = path + '.txt'
+                
+                if self._delete_after_success:
                     
-                    if os.path.exists( txt_path ):
-                        
-                        try:
-                            
-                            ClientData.DeletePath( txt_path )
-                            
-                        except Exception as e:
-                            
-                            HydrusData.ShowText( 'While attempting to delete ' + txt_path + ', the following error occured:' )
-                            HydrusData.ShowException( e )
-                            
-                        
+                    paths_to_delete.append( path )
                     
                 
             
@@ -1664,13 +1871,6 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
             
             self._paths_cache.NotifySeedsUpdated( ( seed, ) )
             
-            with self._lock:
-                
-                self._current_action = ''
-                
-            
-        
-        return True
         
     
     def _THREADWork( self, page_key ):
@@ -2020,6 +2220,88 @@ class ImportFolder( HydrusSerialisable.SerialisableBaseNamed ):
             
         
     
+    def _WorkOnPreparedFile( self, seed, prepared_file_import, successful_hashes, service_keys_to_content_updates ):
+        
+        path = seed.seed_data
+        
+        if prepared_file_import.MimeIsUnwanted():
+            
+            seed.SetStatus( CC.STATUS_UNINTERESTING_MIME )
+            
+            return
+            
+        
+        try:
+            
+            try:
+                
+                file_import_job = prepared_file_import.GetFileImportJob()
+                
+                client_files_manager = HG.client_controller.client_files_manager
+                
+                ( status, hash ) = client_files_manager.ImportPreparedFile( file_import_job )
+                
+            finally:
+                
+                prepared_file_import.CleanUp()
+                
+            
+            seed.SetStatus( status )
+            
+            if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
+                
+                downloaded_tags = []
+                
+                for ( service_key, content_updates ) in self._tag_import_options.GetServiceKeysToContentUpdates( hash, downloaded_tags ).items(): # explicit tags
+                    
+                    service_keys_to_content_updates[ service_key ].extend( content_updates )
+                    
+                
+                service_keys_to_tags = {}
+                
+                for ( tag_service_key, filename_tagging_options ) in self._tag_service_keys_to_filename_tagging_options.items():
+                    
+                    if not HG.client_controller.services_manager.ServiceExists( tag_service_key ):
+                        
+                        continue
+                        
+                    
+                    try:
+                        
+                        tags = filename_tagging_options.GetTags( tag_service_key, path )
+                        
+                        if len( tags ) > 0:
+                            
+                            service_keys_to_tags[ tag_service_key ] = tags
+                            
+                        
+                    except Exception as e:
+                        
+                        HydrusData.ShowText( 'Trying to parse filename tags in the import folder "' + self._name + '" threw an error!' )
+                        
+                        HydrusData.ShowException( e )
+                        
+                    
+                
+                for ( service_key, content_updates ) in ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags ).items():
+                    
+                    service_keys_to_content_updates[ service_key ].extend( content_updates )
+                    
+                
+            
+            if status == CC.STATUS_SUCCESSFUL:
+                
+                successful_hashes.add( hash )
+                
+            
+        except Exception as e:
+            
+            HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
+            
+            seed.SetStatus( CC.STATUS_FAILED, exception = e )
+            
+        
+    
     def CheckNow( self ):
         
         self._check_now = True
@@ -2066,122 +2348,55 @@ class ImportFolder( HydrusSerialisable.SerialisableBaseNamed ):
                 
                 successful_hashes = set()
                 
-                i = 0
-                
                 while True:
                     
-                    seed = self._path_cache.GetNextSeed( CC.STATUS_UNKNOWN )
-                    
                     p1 = HC.options[ 'pause_import_folders_sync' ]
                     p2 = HG.view_shutdown
                     
-                    if seed is None or p1 or p2:
+                    if p1 or p2:
                         
                         break
                         
                     
-                    path = seed.seed_data
+                    seeds = self._path_cache.GetNextSeeds( CC.STATUS_UNKNOWN, FILE_IMPORT_BATCH_SIZE )
                     
-                    try:
+                    if len( seeds ) == 0:
                         
-                        mime = HydrusFileHandling.GetMime( path )
+                        break
                         
-                        if mime in self._mimes:
-                            
-                            ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
-                            
-                            try:
-                                
-                                copied = HydrusPaths.MirrorFile( path, temp_path )
-                                
-                                if not copied:
-                                    
-                                    raise Exception( 'File failed to copy--see log for error.' )
-                                    
-                                
-                                file_import_job = FileImportJob( temp_path, self._file_import_options )
-                                
-                                client_files_manager = HG.client_controller.client_files_manager
-                                
-                                ( status, hash ) = client_files_manager.ImportFile( file_import_job )
-                                
-                            finally:
-                                
-                                HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
-                                
+                    
+                    prepare_file_import = lambda seed: PreparedFileImport( seed.seed_data, self._file_import_options, allowed_mimes = self._mimes ).Prepare()
+                    
+                    prefetcher = HydrusThreading.BackgroundPrefetcher( HG.client_controller, prepare_file_import, seeds, num_to_prefetch = NUM_FILE_IMPORT_THREADS * 2, num_threads = NUM_FILE_IMPORT_THREADS, discard_func = PreparedFileImport.CleanUp )
+                    
+                    service_keys_to_content_updates = collections.defaultdict( list )
+                    
+                    try:
+                        
+                        for ( seed, prepared_file_import ) in prefetcher:
                             
-                            seed.SetStatus( status )
+                            self._WorkOnPreparedFile( seed, prepared_file_import, successful_hashes, service_keys_to_content_updates )
                             
-                            if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
+                            if HC.options[ 'pause_import_folders_sync' ] or HG.view_shutdown:
                                 
-                                downloaded_tags = []
+                                break
                                 
-                                service_keys_to_content_updates = self._tag_import_options.GetServiceKeysToContentUpdates( hash, downloaded_tags ) # explicit tags
-                                
-                                if len( service_keys_to_content_updates ) > 0:
-                                    
-                                    HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
-                                    
-                                
-                                service_keys_to_tags = {}
-                                
-                                for ( tag_service_key, filename_tagging_options ) in self._tag_service_keys_to_filename_tagging_options.items():
-                                    
-                                    if not HG.client_controller.services_manager.ServiceExists( tag_service_key ):
-                                        
-                                        continue
-                                        
-                                    
-                                    try:
-                                        
-                                        tags = filename_tagging_options.GetTags( tag_service_key, path )
-                                        
-                                        if len( tags ) > 0:
-                                            
-                                            service_keys_to_tags[ tag_service_key ] = tags
-                                            
-                                        
-                                    except Exception as e:
-                                        
-                                        HydrusData.ShowText( 'Trying to parse filename tags in the import folder "' + self._name + '" threw an error!' )
-                                        
-                                        HydrusData.ShowException( e )
-                                        
-                                    
-                                
-                                if len( service_keys_to_tags ) > 0:
-                                    
-                                    service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
-                                    
-                                    HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
-                                    
-                                
-                            
-                            if status == CC.STATUS_SUCCESSFUL:
-                                
-                                successful_hashes.add( hash )
-                                
-                            
-                        else:
-                            
-                            seed.SetStatus( CC.STATUS_UNINTERESTING_MIME )
                             
                         
-                    except Exception as e:
+                    finally:
                         
-                        error_text = traceback.format_exc()
+                        prefetcher.Cancel()
                         
-                        HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
+                        # the whole batch's tags go in one go, and before we move or delete any of its files
+                        # this used to happen every ten files, so if the client dies mid-batch, more files are left in the folder. they come up redundant next time
                         
-                        seed.SetStatus( CC.STATUS_FAILED, exception = e )
+                        if len( service_keys_to_content_updates ) > 0:
+                            
+                            HG.client_controller.WriteSynchronous( 'content_updates', dict( service_keys_to_content_updates ) )
+                            
                         
                     
-                    i += 1
-                    
-                    if i % 10 == 0:
-                        
-                        self._ActionPaths()
-                        
+                    self._ActionPaths()
                     
                 
                 if len( successful_hashes ) > 0:
@@ -2365,6 +2580,8 @@ class PageOfImagesImport( HydrusSerialisable.SerialisableBase ):
                     
                     network_job = ClientNetworking.NetworkJob( 'GET', file_url, temp_path = temp_path )
                     
+                    network_job.SetHashWhileDownloading( True )
+                    
                     HG.client_controller.network_engine.AddJob( network_job )
                     
                     with self._lock:
@@ -2425,7 +2642,7 @@ class PageOfImagesImport( HydrusSerialisable.SerialisableBase ):
                         self._current_action = 'importing file'
                         
                     
-                    file_import_job = FileImportJob( temp_path, self._file_import_options )
+                    file_import_job = FileImportJob( temp_path, self._file_import_options, stream_hasher = network_job.GetStreamHasher() )
                     
                     ( status, hash ) = HG.client_controller.client_files_manager.ImportFile( file_import_job )
                     
@@ -2863,6 +3080,104 @@ HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIAL
 SEED_TYPE_HDD = 0
 SEED_TYPE_URL = 1
 
+class PreparedFileImport( object ):
+    
+    # the slow part of a file import--copy to temp, hash, status lookup, thumbnail and phash--done in a worker thread, so several files can be prepared at once
+    # any error is kept and raised from GetFileImportJob, in the thread that deals with the seed
+    # a file with an unwanted mime is not an error, so it is not raised, and import folders can still mark it as uninteresting
+    # two copies of the same file in one batch are both prepared as new, but ImportPreparedFile checks again, so the second is redundant, just as it was one at a time
+    
+    def __init__( self, path, file_import_options, allowed_mimes = None ):
+        
+        self._path = path
+        self._file_import_options = file_import_options
+        self._allowed_mimes = allowed_mimes
+        
+        self._os_file_handle = None
+        self._temp_path = None
+        
+        self._file_import_job = None
+        self._exception = None
+        self._mime_is_unwanted = False
+        
+    
+    def CleanUp( self ):
+        
+        if self._temp_path is not None:
+            
+            HydrusPaths.CleanUpTempPath( self._os_file_handle, self._temp_path )
+            
+            self._os_file_handle = None
+            self._temp_path = None
+            
+        
+    
+    def GetFileImportJob( self ):
+        
+        if self._exception is not None:
+            
+            raise self._exception
+            
+        
+        return self._file_import_job
+        
+    
+    def MimeIsUnwanted( self ):
+        
+        return self._mime_is_unwanted
+        
+    
+    def Prepare( self ):
+        
+        try:
+            
+            if not os.path.exists( self._path ):
+                
+                raise Exception( 'Source file does not exist!' )
+                
+            
+            if self._allowed_mimes is not None:
+                
+                mime = HydrusFileHandling.GetMime( self._path )
+                
+                if mime not in self._allowed_mimes:
+                    
+                    self._mime_is_unwanted = True
+                    
+                    return self
+                    
+                
+            
+            ( self._os_file_handle, self._temp_path ) = HydrusPaths.GetTempPath()
+            
+            copied = HydrusPaths.MirrorFile( self._path, self._temp_path )
+            
+            if not copied:
+                
+                raise Exception( 'File failed to copy--see log for error.' )
+                
+            
+            file_import_job = FileImportJob( self._temp_path, self._file_import_options )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            if file_import_job.IsNewToDB():
+                
+                file_import_job.GenerateInfo()
+                
+            
+            self._file_import_job = file_import_job
+            
+        except Exception as e:
+            
+            self._exception = e
+            
+            self.CleanUp()
+            
+        
+        return self
+        
+    
 class Seed( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_SEED
@@ -3503,6 +3818,29 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         return None
         
     
+    def GetNextSeeds( self, status, num_seeds ):
+        
+        seeds = []
+        
+        with self._lock:
+            
+            for seed in self._seeds:
+                
+                if seed.status == status:
+                    
+                    seeds.append( seed )
+                    
+                    if len( seeds ) == num_seeds:
+                        
+                        break
+                        
+                    
+                
+            
+        
+        return seeds
+        
+    
     def GetNumNewFilesSince( self, since ):
         
         num_files = 0
@@ -4310,7 +4648,35 @@ class Subscription( HydrusSerialisable.SerialisableBaseNamed ):
             
             new_urls = [ url for url in urls_to_add_ordered if not seed_cache.HasURL( url ) ]
             
-            seed_cache.AddURLs( new_urls )
+            seeds = [ Seed( SEED_TYPE_URL, url ) for url in new_urls ]
+            
+            try:
+                
+                service_keys_to_content_updates = collections.defaultdict( list )
+                
+                for ( seed, status, hash ) in ResolveKnownURLSeeds( seeds, self._file_import_options, self._tag_import_options, self._get_tags_if_url_known_and_file_redundant ):
+                    
+                    for ( service_key, content_updates ) in self._tag_import_options.GetServiceKeysToContentUpdates( hash, [] ).items():
+                        
+                        service_keys_to_content_updates[ service_key ].extend( content_updates )
+                        
+                    
+                
+                if len( service_keys_to_content_updates ) > 0:
+                    
+                    HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
+                    
+                
+            except Exception as e:
+                
+                # the query's urls are not lost--they go in unresolved, and the file work checks them one at a time
+                
+                HydrusData.PrintException( e )
+                
+                seeds = [ Seed( SEED_TYPE_URL, url ) for url in new_urls ]
+                
+            
+            seed_cache.AddSeeds( seeds )
             
             query.RegisterSyncComplete()
             query.UpdateNextCheckTime( self._checker_options )
@@ -5332,6 +5698,8 @@ class ThreadWatcherImport( HydrusSerialisable.SerialisableBase ):
                     
                     network_job = ClientNetworking.NetworkJobThreadWatcher( self._thread_key, 'GET', file_url, temp_path = temp_path )
                     
+                    network_job.SetHashWhileDownloading( True )
+                    
                     HG.client_controller.network_engine.AddJob( network_job )
                     
                     with self._lock:
@@ -5381,7 +5749,7 @@ class ThreadWatcherImport( HydrusSerialisable.SerialisableBase ):
                         self._current_action = 'importing file'
                         
                     
-                    file_import_job = FileImportJob( temp_path, self._file_import_options )
+                    file_import_job = FileImportJob( temp_path, self._file_import_options, stream_hasher = network_job.GetStreamHasher() )
                     
                     ( status, hash ) = HG.client_controller.client_files_manager.ImportFile( file_import_job )
                     
@@ -5814,6 +6182,8 @@ class URLsImport( HydrusSerialisable.SerialisableBase ):
                     
                     network_job = ClientNetworking.NetworkJob( 'GET', file_url, temp_path = temp_path )
                     
+                    network_job.SetHashWhileDownloading( True )
+                    
                     HG.client_controller.network_engine.AddJob( network_job )
                     
                     with self._lock:
@@ -5855,7 +6225,7 @@ class URLsImport( HydrusSerialisable.SerialisableBase ):
                             
                         
                     
-                    file_import_job = FileImportJob( temp_path, self._file_import_options )
+                    file_import_job = FileImportJob( temp_path, self._file_import_options, stream_hasher = network_job.GetStreamHasher() )
                     
                     ( status, hash ) = HG.client_controller.client_files_manager.ImportFile( file_import_job )
                     
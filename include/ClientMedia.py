@@ -19,6 +19,43 @@ import HydrusGlobals as HG
 import HydrusSerialisable
 import itertools
 
+# a page of files shares the same few location states and many of the same tags, so media results point to one copy of each
+# the tag copies are forgotten past this many distinct tags, which stops the table growing forever but only costs some sharing
+
+MAX_INTERNED_TAGS = 500000
+
+EMPTY_LOCATIONS = frozenset()
+EMPTY_TAGS = frozenset()
+EMPTY_URLS = frozenset()
+
+shared_locations = {}
+interned_tags = {}
+
+def CompactServiceKeysToStatusesToTags( service_keys_to_statuses_to_tags ):
+    
+    compact_service_keys_to_statuses_to_tags = {}
+    
+    for ( service_key, statuses_to_tags ) in service_keys_to_statuses_to_tags.items():
+        
+        if isinstance( statuses_to_tags, StatusesToTags ):
+            
+            # already compact, as when a tags manager is duplicated, so the frozen tag sets can be shared
+            
+            compact_statuses_to_tags = StatusesToTags( statuses_to_tags )
+            
+        else:
+            
+            compact_statuses_to_tags = StatusesToTags( ( ( status, InternTags( tags ) ) for ( status, tags ) in statuses_to_tags.items() if len( tags ) > 0 ) )
+            
+        
+        if len( compact_statuses_to_tags ) > 0:
+            
+            compact_service_keys_to_statuses_to_tags[ service_key ] = compact_statuses_to_tags
+            
+        
+    
+    return compact_service_keys_to_statuses_to_tags
+    
 def FlattenMedia( media_list ):
     
     flat_media = []
@@ -181,6 +218,21 @@ def GetDuplicateComparisonStatements( shown_media, comparison_media ):
     
     return ( statements, score )
     
+def GetSharedLocations( service_keys ):
+    
+    service_keys = frozenset( service_keys )
+    
+    return shared_locations.setdefault( service_keys, service_keys )
+    
+def InternTags( tags ):
+    
+    if len( interned_tags ) > MAX_INTERNED_TAGS:
+        
+        interned_tags.clear()
+        
+    
+    return frozenset( ( interned_tags.setdefault( tag, tag ) for tag in tags ) )
+    
 def MergeTagsManagers( tags_managers ):
     
     def CurrentAndPendingFilter( items ):
@@ -244,6 +296,8 @@ class DuplicatesManager( object ):
     
 class FileInfoManager( object ):
     
+    __slots__ = ( '_hash', '_size', '_mime', '_width', '_height', '_duration', '_num_frames', '_num_words' )
+    
     def __init__( self, hash, size = None, mime = None, width = None, height = None, duration = None, num_frames = None, num_words = None ):
         
         if mime is None:
@@ -310,6 +364,8 @@ class LocationsManager( object ):
     
     LOCAL_LOCATIONS = { CC.LOCAL_FILE_SERVICE_KEY, CC.TRASH_SERVICE_KEY, CC.COMBINED_LOCAL_FILE_SERVICE_KEY }
     
+    __slots__ = ( '_current', '_deleted', '_pending', '_petitioned', '_inbox', '_urls', '_service_keys_to_filenames', '_current_to_timestamps' )
+    
     def __init__( self, current, deleted, pending, petitioned, inbox = False, urls = None, service_keys_to_filenames = None, current_to_timestamps = None ):
         
         self._current = current
@@ -317,11 +373,13 @@ class LocationsManager( object ):
         self._pending = pending
         self._petitioned = petitioned
         
+        self._ShareLocations()
+        
         self._inbox = inbox
         
-        if urls is None:
+        if urls is None or len( urls ) == 0:
             
-            urls = set()
+            urls = EMPTY_URLS
             
         
         self._urls = urls
@@ -341,23 +399,38 @@ class LocationsManager( object ):
         self._current_to_timestamps = current_to_timestamps
         
     
+    def _ShareLocations( self ):
+        
+        self._current = GetSharedLocations( self._current )
+        self._deleted = GetSharedLocations( self._deleted )
+        self._pending = GetSharedLocations( self._pending )
+        self._petitioned = GetSharedLocations( self._petitioned )
+        
+    
+    def _UnshareLocations( self ):
+        
+        self._current = set( self._current )
+        self._deleted = set( self._deleted )
+        self._pending = set( self._pending )
+        self._petitioned = set( self._petitioned )
+        
+    
     def DeletePending( self, service_key ):
         
+        self._UnshareLocations()
+        
         self._pending.discard( service_key )
         self._petitioned.discard( service_key )
         
+        self._ShareLocations()
+        
     
     def Duplicate( self ):
         
-        current = set( self._current )
-        deleted = set( self._deleted )
-        pending = set( self._pending )
-        petitioned = set( self._petitioned )
-        urls = set( self._urls )
         service_keys_to_filenames = dict( self._service_keys_to_filenames )
         current_to_timestamps = dict( self._current_to_timestamps )
         
-        return LocationsManager( current, deleted, pending, petitioned, self._inbox, urls, service_keys_to_filenames, current_to_timestamps )
+        return LocationsManager( self._current, self._deleted, self._pending, self._petitioned, self._inbox, self._urls, service_keys_to_filenames, current_to_timestamps )
         
     
     def GetCDPP( self ): return ( self._current, self._deleted, self._pending, self._petitioned )
@@ -478,6 +551,8 @@ class LocationsManager( object ):
         
         if data_type == HC.CONTENT_TYPE_FILES:
             
+            self._UnshareLocations()
+            
             if action == HC.CONTENT_UPDATE_ARCHIVE:
                 
                 self._inbox = False
@@ -554,19 +629,21 @@ class LocationsManager( object ):
                 self._petitioned.discard( service_key )
                 
             
+            self._ShareLocations()
+            
         elif data_type == HC.CONTENT_TYPE_URLS:
             
             if action == HC.CONTENT_UPDATE_ADD:
                 
                 ( hash, urls ) = row
                 
-                self._urls.update( urls )
+                self._urls = self._urls.union( urls )
                 
             elif action == HC.CONTENT_UPDATE_DELETE:
                 
                 ( hash, urls ) = row
                 
-                self._urls.difference_update( urls )
+                self._urls = self._urls.difference( urls )
                 
                 
             
@@ -574,11 +651,15 @@ class LocationsManager( object ):
     
     def ResetService( self, service_key ):
         
+        self._UnshareLocations()
+        
         self._current.discard( service_key )
         self._pending.discard( service_key )
         self._deleted.discard( service_key )
         self._petitioned.discard( service_key )
         
+        self._ShareLocations()
+        
     
     def ShouldHaveThumbnail( self ):
         
@@ -870,7 +951,7 @@ class MediaList( object ):
                         
                         singleton_media = self._collect_map_singletons[ key ]
                         
-                        self._sorted_media.remove_items( singleton_media )
+                        self._sorted_media.remove_items( ( singleton_media, ) )
                         self._singleton_media.discard( singleton_media )
                         del self._collect_map_singletons[ key ]
                         
@@ -889,7 +970,7 @@ class MediaList( object ):
                         
                         collected_media = self._collect_map_collected[ key ]
                         
-                        self._sorted_media.remove_items( collected_media )
+                        self._sorted_media.remove_items( ( collected_media, ) )
                         
                         collected_media.AddMedia( medias )
                         
@@ -1824,6 +1905,8 @@ class MediaSingleton( Media ):
 
 class MediaResult( object ):
     
+    __slots__ = ( '_file_info_manager', '_tags_manager', '_locations_manager', '_ratings_manager' )
+    
     def __init__( self, file_info_manager, tags_manager, locations_manager, ratings_manager ):
         
         self._file_info_manager = file_info_manager
@@ -2260,11 +2343,21 @@ class SortedList( object ):
         
         self._sorted_list = list( initial_items )
         
+        self._has_unsorted_items = False
+        
+        # the keys of this are always the items in the list, but indices at or after _indices_dirty_from may be stale until the next lookup
+        
         self._items_to_indices = None
+        self._indices_dirty_from = None
         
     
     def __contains__( self, item ):
         
+        if self._items_to_indices is None:
+            
+            self._RecalcIndices()
+            
+        
         return self._items_to_indices.__contains__( item )
         
     
@@ -2283,15 +2376,79 @@ class SortedList( object ):
         return len( self._sorted_list )
         
     
-    def _DirtyIndices( self ):
+    def _DirtyIndices( self, from_index = 0 ):
         
-        self._items_to_indices = None
+        if self._items_to_indices is None:
+            
+            return
+            
+        
+        if self._indices_dirty_from is None or from_index < self._indices_dirty_from:
+            
+            self._indices_dirty_from = from_index
+            
+        
+    
+    def _GetInsertionIndex( self, item ):
+        
+        # a stable sort puts a new item after any existing items with an equal key, so we do the same
+        
+        sort_key = self._sort_key( item )
+        
+        low = 0
+        high = len( self._sorted_list )
+        
+        while low < high:
+            
+            middle = ( low + high ) // 2
+            
+            middle_sort_key = self._sort_key( self._sorted_list[ middle ] )
+            
+            if self._sort_reverse:
+                
+                goes_after_middle = sort_key <= middle_sort_key
+                
+            else:
+                
+                goes_after_middle = middle_sort_key <= sort_key
+                
+            
+            if goes_after_middle:
+                
+                low = middle + 1
+                
+            else:
+                
+                high = middle
+                
+            
+        
+        return low
         
     
     def _RecalcIndices( self ):
         
         self._items_to_indices = { item : index for ( index, item ) in enumerate( self._sorted_list ) }
         
+        self._indices_dirty_from = None
+        
+    
+    def _RepairIndices( self ):
+        
+        if self._items_to_indices is None:
+            
+            self._RecalcIndices()
+            
+        elif self._indices_dirty_from is not None:
+            
+            for index in range( self._indices_dirty_from, len( self._sorted_list ) ):
+                
+                self._items_to_indices[ self._sorted_list[ index ] ] = index
+                
+            
+            self._indices_dirty_from = None
+            
+        
     
     def append_items( self, items ):
         
@@ -2307,13 +2464,12 @@ class SortedList( object ):
         
         self._sorted_list.extend( items )
         
+        self._has_unsorted_items = True
+        
     
     def index( self, item ):
         
-        if self._items_to_indices is None:
-            
-            self._RecalcIndices()
-            
+        self._RepairIndices()
         
         try:
             
@@ -2329,25 +2485,69 @@ class SortedList( object ):
     
     def insert_items( self, items ):
         
-        self.append_items( items )
+        items = list( items )
+        
+        num_items = len( self._sorted_list )
+        
+        # each bisect insertion calls the sort key about log2( n ) times and shifts the tail of the list, while a full sort calls it for every item
+        
+        if self._sort_key is None or self._has_unsorted_items or len( items ) * ( num_items.bit_length() + 1 ) > num_items:
+            
+            self.append_items( items )
+            
+            self.sort()
+            
+            return
+            
+        
+        if self._items_to_indices is None:
+            
+            self._RecalcIndices()
+            
         
-        self.sort()
+        for item in items:
+            
+            index = self._GetInsertionIndex( item )
+            
+            self._sorted_list.insert( index, item )
+            
+            self._items_to_indices[ item ] = index
+            
+            self._DirtyIndices( index )
+            
         
     
     def remove_items( self, items ):
         
         deletee_indices = [ self.index( item ) for item in items ]
         
-        deletee_indices.sort()
+        if len( deletee_indices ) == 0:
+            
+            return
+            
         
-        deletee_indices.reverse()
+        # deleting from a python list shifts everything after it, so many deletes are cheaper as one rebuild
         
-        for index in deletee_indices:
+        if len( deletee_indices ) * 4 > len( self._sorted_list ):
+            
+            deletee_indices = set( deletee_indices )
             
-            del self._sorted_list[ index ]
+            self._sorted_list = [ item for ( index, item ) in enumerate( self._sorted_list ) if index not in deletee_indices ]
+            
+        else:
+            
+            for index in sorted( deletee_indices, reverse = True ):
+                
+                del self._sorted_list[ index ]
+                
             
         
-        self._DirtyIndices()
+        for item in items:
+            
+            del self._items_to_indices[ item ]
+            
+        
+        self._DirtyIndices( min( deletee_indices ) )
         
     
     def sort( self, sort_key = None, reverse = False ):
@@ -2365,18 +2565,65 @@ class SortedList( object ):
         
         self._sorted_list.sort( key = sort_key, reverse = reverse )
         
+        self._has_unsorted_items = False
+        
         self._DirtyIndices()
         
     
+class StatusesToTags( dict ):
+    
+    # tags are held in frozensets, and a status with no tags reads as empty without being stored
+    
+    __slots__ = ()
+    
+    def __missing__( self, status ):
+        
+        return EMPTY_TAGS
+        
+    
+    def AddTag( self, status, tag ):
+        
+        self[ status ] = self[ status ].union( InternTags( ( tag, ) ) )
+        
+    
+    def DiscardTag( self, status, tag ):
+        
+        if tag in self[ status ]:
+            
+            tags = self[ status ].difference( ( tag, ) )
+            
+            if len( tags ) == 0:
+                
+                del self[ status ]
+                
+            else:
+                
+                self[ status ] = tags
+                
+            
+        
+    
 class TagsManagerSimple( object ):
     
+    __slots__ = ( '_service_keys_to_statuses_to_tags', '_combined_namespaces_cache', '__weakref__' )
+    
     def __init__( self, service_keys_to_statuses_to_tags ):
         
-        self._service_keys_to_statuses_to_tags = service_keys_to_statuses_to_tags
+        self._service_keys_to_statuses_to_tags = CompactServiceKeysToStatusesToTags( service_keys_to_statuses_to_tags )
         
         self._combined_namespaces_cache = None
         
     
+    def _GetStatusesToTags( self, service_key ):
+        
+        if service_key in self._service_keys_to_statuses_to_tags:
+            
+            return self._service_keys_to_statuses_to_tags[ service_key ]
+            
+        
+        return StatusesToTags()
+        
+    
     def _RecalcCombinedIfNeeded( self ):
         
         pass
@@ -2384,19 +2631,9 @@ class TagsManagerSimple( object ):
     
     def Duplicate( self ):
         
-        dupe_service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
+        # the tag sets are frozen, so the dupe can share them
         
-        for ( service_key, statuses_to_tags ) in self._service_keys_to_statuses_to_tags.items():
-            
-            dupe_statuses_to_tags = HydrusData.default_dict_set()
-            
-            for ( status, tags ) in statuses_to_tags.items():
-                
-                dupe_statuses_to_tags[ status ] = set( tags )
-                
-            
-            dupe_service_keys_to_statuses_to_tags[ service_key ] = dupe_statuses_to_tags
-            
+        dupe_service_keys_to_statuses_to_tags = { service_key : StatusesToTags( statuses_to_tags ) for ( service_key, statuses_to_tags ) in self._service_keys_to_statuses_to_tags.items() }
         
         return TagsManagerSimple( dupe_service_keys_to_statuses_to_tags )
         
@@ -2407,7 +2644,7 @@ class TagsManagerSimple( object ):
         
         if self._combined_namespaces_cache is None:
     
-            combined_statuses_to_tags = self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ]
+            combined_statuses_to_tags = self._GetStatusesToTags( CC.COMBINED_TAG_SERVICE_KEY )
             
             combined_current = combined_statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]
             combined_pending = combined_statuses_to_tags[ HC.CONTENT_STATUS_PENDING ]
@@ -2426,7 +2663,7 @@ class TagsManagerSimple( object ):
         
         self._RecalcCombinedIfNeeded()
         
-        combined_statuses_to_tags = self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ]
+        combined_statuses_to_tags = self._GetStatusesToTags( CC.COMBINED_TAG_SERVICE_KEY )
         
         combined_current = combined_statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]
         combined_pending = combined_statuses_to_tags[ HC.CONTENT_STATUS_PENDING ]
@@ -2456,7 +2693,7 @@ class TagsManagerSimple( object ):
             self._RecalcCombinedIfNeeded()
             
         
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
+        statuses_to_tags = self._GetStatusesToTags( service_key )
         
         return set( statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ] )
         
@@ -2468,7 +2705,7 @@ class TagsManagerSimple( object ):
             self._RecalcCombinedIfNeeded()
             
         
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
+        statuses_to_tags = self._GetStatusesToTags( service_key )
         
         return set( statuses_to_tags[ HC.CONTENT_STATUS_DELETED ] )
         
@@ -2477,7 +2714,7 @@ class TagsManagerSimple( object ):
         
         self._RecalcCombinedIfNeeded()
         
-        combined_statuses_to_tags = self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ]
+        combined_statuses_to_tags = self._GetStatusesToTags( CC.COMBINED_TAG_SERVICE_KEY )
         
         combined_current = combined_statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]
         combined_pending = combined_statuses_to_tags[ HC.CONTENT_STATUS_PENDING ]
@@ -2498,7 +2735,7 @@ class TagsManagerSimple( object ):
             self._RecalcCombinedIfNeeded()
             
         
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
+        statuses_to_tags = self._GetStatusesToTags( service_key )
         
         return set( statuses_to_tags[ HC.CONTENT_STATUS_PENDING ] )
         
@@ -2510,13 +2747,15 @@ class TagsManagerSimple( object ):
             self._RecalcCombinedIfNeeded()
             
         
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
+        statuses_to_tags = self._GetStatusesToTags( service_key )
         
         return set( statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ] )
         
     
 class TagsManager( TagsManagerSimple ):
     
+    __slots__ = ( '_combined_is_calculated', )
+    
     def __init__( self, service_keys_to_statuses_to_tags ):
         
         TagsManagerSimple.__init__( self, service_keys_to_statuses_to_tags )
@@ -2551,7 +2790,7 @@ class TagsManager( TagsManagerSimple ):
                 combined_statuses_to_tags[ HC.CONTENT_STATUS_DELETED ].update( statuses_to_tags[ HC.CONTENT_STATUS_DELETED ] )
                 
             
-            self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ] = combined_statuses_to_tags
+            self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ] = StatusesToTags( ( ( status, frozenset( tags ) ) for ( status, tags ) in combined_statuses_to_tags.items() if len( tags ) > 0 ) )
             
             self._combined_namespaces_cache = None
             
@@ -2561,12 +2800,12 @@ class TagsManager( TagsManagerSimple ):
     
     def DeletePending( self, service_key ):
         
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
+        statuses_to_tags = self._GetStatusesToTags( service_key )
         
         if len( statuses_to_tags[ HC.CONTENT_STATUS_PENDING ] ) + len( statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ] ) > 0:
             
-            statuses_to_tags[ HC.CONTENT_STATUS_PENDING ] = set()
-            statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ] = set()
+            statuses_to_tags.pop( HC.CONTENT_STATUS_PENDING, None )
+            statuses_to_tags.pop( HC.CONTENT_STATUS_PETITIONED, None )
             
             self._combined_is_calculated = False
             
@@ -2574,19 +2813,7 @@ class TagsManager( TagsManagerSimple ):
     
     def Duplicate( self ):
         
-        dupe_service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
-        
-        for ( service_key, statuses_to_tags ) in self._service_keys_to_statuses_to_tags.items():
-            
-            dupe_statuses_to_tags = HydrusData.default_dict_set()
-            
-            for ( status, tags ) in statuses_to_tags.items():
-                
-                dupe_statuses_to_tags[ status ] = set( tags )
-                
-            
-            dupe_service_keys_to_statuses_to_tags[ service_key ] = dupe_statuses_to_tags
-            
+        dupe_service_keys_to_statuses_to_tags = { service_key : StatusesToTags( statuses_to_tags ) for ( service_key, statuses_to_tags ) in self._service_keys_to_statuses_to_tags.items() }
         
         return TagsManager( dupe_service_keys_to_statuses_to_tags )
         
@@ -2622,14 +2849,14 @@ class TagsManager( TagsManagerSimple ):
             self._RecalcCombinedIfNeeded()
             
         
-        return self._service_keys_to_statuses_to_tags[ service_key ]
+        return self._GetStatusesToTags( service_key )
         
     
     def HasTag( self, tag ):
         
         self._RecalcCombinedIfNeeded()
         
-        combined_statuses_to_tags = self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ]
+        combined_statuses_to_tags = self._GetStatusesToTags( CC.COMBINED_TAG_SERVICE_KEY )
         
         return tag in combined_statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ] or tag in combined_statuses_to_tags[ HC.CONTENT_STATUS_PENDING ]
         
@@ -2641,7 +2868,7 @@ class TagsManager( TagsManagerSimple ):
     
     def ProcessContentUpdate( self, service_key, content_update ):
         
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
+        statuses_to_tags = self._service_keys_to_statuses_to_tags.setdefault( service_key, StatusesToTags() )
         
         ( data_type, action, row ) = content_update.ToTuple()
         
@@ -2656,37 +2883,37 @@ class TagsManager( TagsManagerSimple ):
         
         if action == HC.CONTENT_UPDATE_ADD:
             
-            statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ].add( tag )
+            statuses_to_tags.AddTag( HC.CONTENT_STATUS_CURRENT, tag )
             
-            statuses_to_tags[ HC.CONTENT_STATUS_DELETED ].discard( tag )
-            statuses_to_tags[ HC.CONTENT_STATUS_PENDING ].discard( tag )
+            statuses_to_tags.DiscardTag( HC.CONTENT_STATUS_DELETED, tag )
+            statuses_to_tags.DiscardTag( HC.CONTENT_STATUS_PENDING, tag )
             
         elif action == HC.CONTENT_UPDATE_DELETE:
             
-            statuses_to_tags[ HC.CONTENT_STATUS_DELETED ].add( tag )
+            statuses_to_tags.AddTag( HC.CONTENT_STATUS_DELETED, tag )
             
-            statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ].discard( tag )
-            statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ].discard( tag )
+            statuses_to_tags.DiscardTag( HC.CONTENT_STATUS_CURRENT, tag )
+            statuses_to_tags.DiscardTag( HC.CONTENT_STATUS_PETITIONED, tag )
             
         elif action == HC.CONTENT_UPDATE_PEND:
             
             if tag not in statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]:
                 
-                statuses_to_tags[ HC.CONTENT_STATUS_PENDING ].add( tag )
+                statuses_to_tags.AddTag( HC.CONTENT_STATUS_PENDING, tag )
                 
             
         elif action == HC.CONTENT_UPDATE_RESCIND_PEND:
             
-            statuses_to_tags[ HC.CONTENT_STATUS_PENDING ].discard( tag )
+            statuses_to_tags.DiscardTag( HC.CONTENT_STATUS_PENDING, tag )
             
         elif action == HC.CONTENT_UPDATE_PETITION:
             
             if tag in statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]:
                 
-                statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ].add( tag )
+                statuses_to_tags.AddTag( HC.CONTENT_STATUS_PETITIONED, tag )
                 
             
-        elif action == HC.CONTENT_UPDATE_RESCIND_PETITION: statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ].discard( tag )
+        elif action == HC.CONTENT_UPDATE_RESCIND_PETITION: statuses_to_tags.DiscardTag( HC.CONTENT_STATUS_PETITIONED, tag )
         
         self._combined_is_calculated = False
         
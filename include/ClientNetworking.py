@@ -6,11 +6,13 @@ import cStringIO
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
+import HydrusFileHandling
 import HydrusGlobals as HG
 import HydrusNetwork
 import HydrusNetworking
 import HydrusPaths
 import HydrusSerialisable
+import heapq
 import itertools
 import os
 import random
@@ -26,6 +28,12 @@ import yaml
 
 urllib3.disable_warnings( InsecureRequestWarning )
 
+# the engine starts the lowest number first
+JOB_PRIORITY_INTERACTIVE = 0
+JOB_PRIORITY_WATCHER = 1
+JOB_PRIORITY_SUBSCRIPTION = 2
+JOB_PRIORITY_REPOSITORY = 3
+
 def CombineGETURLWithParameters( url, params_dict ):
     
     def make_safe( text ):
@@ -269,6 +277,11 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
             self._SetDirty()
             
         
+        if self.engine is not None:
+            
+            self.engine.NotifyBandwidthChanged()
+            
+        
     
     def DeleteHistory( self, network_contexts ):
         
@@ -481,6 +494,11 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
             self._SetDirty()
             
         
+        if self.engine is not None:
+            
+            self.engine.NotifyBandwidthChanged()
+            
+        
     
     def TryToStartRequest( self, network_contexts ):
         
@@ -664,6 +682,13 @@ GLOBAL_NETWORK_CONTEXT = NetworkContext( CC.NETWORK_CONTEXT_GLOBAL )
 class NetworkEngine( object ):
     
     MAX_JOBS = 10 # turn this into an option
+    MAX_JOBS_PER_CONTEXT = 3
+    
+    # lower priority jobs cannot take the last slot or two, so a big subscription run leaves room for a download page to get going
+    PRIORITIES_TO_MAX_JOBS = { JOB_PRIORITY_INTERACTIVE : MAX_JOBS, JOB_PRIORITY_WATCHER : MAX_JOBS - 1, JOB_PRIORITY_SUBSCRIPTION : MAX_JOBS - 2, JOB_PRIORITY_REPOSITORY : MAX_JOBS - 2 }
+    
+    # we are woken when jobs are added or finish, or bandwidth frees up, but a model shutdown does not tell us, so we check in this often regardless
+    MAX_IDLE_WAIT = 5.0
     
     def __init__( self, controller, bandwidth_manager, session_manager, domain_manager, login_manager ):
         
@@ -683,19 +708,122 @@ class NetworkEngine( object ):
         
         self._new_work_to_do = threading.Event()
         
+        self._bandwidth_changed = False
+        
+        # the heaps hold ( wake_time or priority, job_number, job ), so ties go to the oldest job and jobs themselves are never compared
+        self._job_numbers = itertools.count()
+        
         self._jobs_awaiting_validity = []
         self._current_validation_process = None
         self._jobs_bandwidth_throttled = []
         self._jobs_login_throttled = []
         self._current_login_process = None
         self._jobs_ready_to_start = []
-        self._jobs_downloading = []
+        self._jobs_downloading = set()
+        
+        self._network_contexts_to_num_jobs_downloading = collections.Counter()
         
         self._is_running = False
         self._is_shutdown = False
         self._local_shutdown = False
         
     
+    def _AddBandwidthThrottledJob( self, job ):
+        
+        heapq.heappush( self._jobs_bandwidth_throttled, ( job.GetWakeTime(), next( self._job_numbers ), job ) )
+        
+    
+    def _AddReadyJob( self, job ):
+        
+        job.SetStatus( u'waiting for download slot\u2026' )
+        
+        heapq.heappush( self._jobs_ready_to_start, ( job.PRIORITY, next( self._job_numbers ), job ) )
+        
+    
+    def _CanStartJob( self, job ):
+        
+        if len( self._jobs_downloading ) >= self.PRIORITIES_TO_MAX_JOBS[ job.PRIORITY ]:
+            
+            return False
+            
+        
+        # one slow host, or one busy subscription, cannot take all the slots
+        
+        for network_context in job.GetNetworkContexts():
+            
+            if network_context == GLOBAL_NETWORK_CONTEXT:
+                
+                continue
+                
+            
+            if self._network_contexts_to_num_jobs_downloading[ network_context ] >= self.MAX_JOBS_PER_CONTEXT:
+                
+                return False
+                
+            
+        
+        return True
+        
+    
+    def _GetWaitTime( self ):
+        
+        # validation and login processes do not tell us when they are done, so we check on them every second
+        
+        if len( self._jobs_awaiting_validity ) > 0 or len( self._jobs_login_throttled ) > 0:
+            
+            return 1.0
+            
+        
+        if len( self._jobs_bandwidth_throttled ) > 0:
+            
+            ( wake_time, job_number, job ) = self._jobs_bandwidth_throttled[0]
+            
+            # wake times are whole seconds, and a job is awake once the second after its wake time has begun
+            
+            wait_time = ( wake_time + 1 ) - time.time()
+            
+            return max( 0.0, min( wait_time, self.MAX_IDLE_WAIT ) )
+            
+        
+        return self.MAX_IDLE_WAIT
+        
+    
+    def _RunJob( self, job ):
+        
+        try:
+            
+            job.Start()
+            
+        finally:
+            
+            with self._lock:
+                
+                self._jobs_downloading.discard( job )
+                
+                for network_context in job.GetNetworkContexts():
+                    
+                    self._network_contexts_to_num_jobs_downloading[ network_context ] -= 1
+                    
+                    if self._network_contexts_to_num_jobs_downloading[ network_context ] <= 0:
+                        
+                        del self._network_contexts_to_num_jobs_downloading[ network_context ]
+                        
+                    
+                
+            
+            self._new_work_to_do.set()
+            
+        
+    
+    def _StartJob( self, job ):
+        
+        self._jobs_downloading.add( job )
+        
+        self._network_contexts_to_num_jobs_downloading.update( job.GetNetworkContexts() )
+        
+        self.controller.CallToThread( self._RunJob, job )
+        
+    
     def AddJob( self, job ):
         
         with self._lock:
@@ -770,7 +898,7 @@ class NetworkEngine( object ):
                 
             else:
                 
-                self._jobs_bandwidth_throttled.append( job )
+                self._AddBandwidthThrottledJob( job )
                 
                 return False
                 
@@ -787,25 +915,37 @@ class NetworkEngine( object ):
                 
             
         
-        def ProcessBandwidthJob( job ):
+        def ProcessBandwidthJobs():
             
-            if job.IsDone():
+            if self._bandwidth_changed:
                 
-                return False
+                # rules have changed or a job has been overridden, so everything is worth asking again
                 
-            elif job.IsAsleep():
-                
-                return True
+                self._bandwidth_changed = False
                 
-            elif not job.BandwidthOK():
+                self._jobs_bandwidth_throttled = [ ( 0, job_number, job ) for ( wake_time, job_number, job ) in self._jobs_bandwidth_throttled ]
                 
-                return True
+                heapq.heapify( self._jobs_bandwidth_throttled )
                 
-            else:
+            
+            # we only look at the jobs that are due, and a job that fails its bandwidth check sleeps until it is worth asking again
+            
+            while len( self._jobs_bandwidth_throttled ) > 0 and HydrusData.TimeHasPassed( self._jobs_bandwidth_throttled[0][0] ):
                 
-                self._jobs_login_throttled.append( job )
+                ( wake_time, job_number, job ) = heapq.heappop( self._jobs_bandwidth_throttled )
                 
-                return False
+                if job.IsDone():
+                    
+                    continue
+                    
+                elif not job.BandwidthOK():
+                    
+                    heapq.heappush( self._jobs_bandwidth_throttled, ( job.GetWakeTime(), job_number, job ) )
+                    
+                else:
+                    
+                    self._jobs_login_throttled.append( job )
+                    
                 
             
         
@@ -853,7 +993,7 @@ class NetworkEngine( object ):
                 
             else:
                 
-                self._jobs_ready_to_start.append( job )
+                self._AddReadyJob( job )
                 
                 return False
                 
@@ -870,37 +1010,35 @@ class NetworkEngine( object ):
                 
             
         
-        def ProcessReadyJob( job ):
+        def ProcessReadyJobs():
             
-            if job.IsDone():
-                
-                return False
-                
-            elif len( self._jobs_downloading ) < self.MAX_JOBS:
-                
-                self.controller.CallToThread( job.Start )
-                
-                self._jobs_downloading.append( job )
+            # highest priority first. a job that is over its domain's limit waits, but does not hold up the jobs behind it
+            
+            waiting_rows = []
+            
+            while len( self._jobs_ready_to_start ) > 0 and len( self._jobs_downloading ) < self.MAX_JOBS:
                 
-                return False
+                row = heapq.heappop( self._jobs_ready_to_start )
                 
-            else:
+                ( priority, job_number, job ) = row
                 
-                job.SetStatus( u'waiting for download slot\u2026' )
-                
-                return True
+                if job.IsDone():
+                    
+                    continue
+                    
+                elif self._CanStartJob( job ):
+                    
+                    self._StartJob( job )
+                    
+                else:
+                    
+                    waiting_rows.append( row )
+                    
                 
             
-        
-        def ProcessDownloadingJob( job ):
-            
-            if job.IsDone():
-                
-                return False
+            for row in waiting_rows:
                 
-            else:
-                
-                return True
+                heapq.heappush( self._jobs_ready_to_start, row )
                 
             
         
@@ -908,33 +1046,28 @@ class NetworkEngine( object ):
         
         while not ( self._local_shutdown or self.controller.ModelIsShutdown() ):
             
+            # clear before we look, so anything that turns up while we work gets us straight back here
+            
+            self._new_work_to_do.clear()
+            
             with self._lock:
                 
                 self._jobs_awaiting_validity = filter( ProcessValidationJob, self._jobs_awaiting_validity )
                 
                 ProcessCurrentValidationJob()
                 
-                self._jobs_bandwidth_throttled = filter( ProcessBandwidthJob, self._jobs_bandwidth_throttled )
+                ProcessBandwidthJobs()
                 
                 self._jobs_login_throttled = filter( ProcessLoginJob, self._jobs_login_throttled )
                 
                 ProcessCurrentLoginJob()
                 
-                self._jobs_ready_to_start = filter( ProcessReadyJob, self._jobs_ready_to_start )
+                ProcessReadyJobs()
                 
-                self._jobs_downloading = filter( ProcessDownloadingJob, self._jobs_downloading )
+                wait_time = self._GetWaitTime()
                 
             
-            # we want to catch the rollover of the second for bandwidth jobs
-            
-            now_with_subsecond = time.time()
-            subsecond_part = now_with_subsecond % 1
-            
-            time_until_next_second = 1.0 - subsecond_part
-            
-            self._new_work_to_do.wait( time_until_next_second )
-            
-            self._new_work_to_do.clear()
+            self._new_work_to_do.wait( wait_time )
             
         
         self._is_running = False
@@ -942,6 +1075,15 @@ class NetworkEngine( object ):
         self._is_shutdown = True
         
     
+    def NotifyBandwidthChanged( self ):
+        
+        # this is called from inside other objects' locks, so it does not take ours
+        
+        self._bandwidth_changed = True
+        
+        self._new_work_to_do.set()
+        
+    
     def Shutdown( self ):
         
         self._local_shutdown = True
@@ -952,6 +1094,7 @@ class NetworkEngine( object ):
 class NetworkJob( object ):
     
     IS_HYDRUS_SERVICE = False
+    PRIORITY = JOB_PRIORITY_INTERACTIVE
     
     def __init__( self, method, url, body = None, referral_url = None, temp_path = None ):
         
@@ -973,6 +1116,9 @@ class NetworkJob( object ):
         self._files = None
         self._for_login = False
         
+        self._hash_while_downloading = False
+        self._stream_hasher = None
+        
         self._current_connection_attempt_number = 1
         
         self._additional_headers = {}
@@ -1150,7 +1296,7 @@ class NetworkJob( object ):
             
         
     
-    def _ReadResponse( self, response, stream_dest, max_allowed = None ):
+    def _ReadResponse( self, response, stream_dest, max_allowed = None, stream_hasher = None ):
         
         with self._lock:
             
@@ -1178,6 +1324,11 @@ class NetworkJob( object ):
             
             stream_dest.write( chunk )
             
+            if stream_hasher is not None:
+                
+                stream_hasher.Update( chunk )
+                
+            
             chunk_length = len( chunk )
             
             with self._lock:
@@ -1262,6 +1413,10 @@ class NetworkJob( object ):
                     
                     self._bandwidth_tracker.ReportRequestUsed()
                     
+                    # we may have been asked early because the rules changed, so we are not waiting on anything any more
+                    
+                    self._wake_time = 0
+                    
                 else:
                     
                     waiting_duration = self.engine.bandwidth_manager.GetWaitingEstimate( self._network_contexts )
@@ -1279,18 +1434,9 @@ class NetworkJob( object ):
                         self._status_text = u'bandwidth free in ' + waiting_str + u'\u2026'
                         
                     
-                    if waiting_duration > 1200:
-                        
-                        self._Sleep( 30 )
-                        
-                    elif waiting_duration > 120:
-                        
-                        self._Sleep( 10 )
-                        
-                    elif waiting_duration > 10:
-                        
-                        self._Sleep( 1 )
-                        
+                    # the engine will not ask again until we wake, so sleep until the bandwidth should be free, but check back now and then in case things change
+                    
+                    self._Sleep( max( 1, min( waiting_duration, 30 ) ) )
                     
                 
                 return result
@@ -1420,6 +1566,14 @@ class NetworkJob( object ):
             
         
     
+    def GetStreamHasher( self ):
+        
+        with self._lock:
+            
+            return self._stream_hasher
+            
+        
+    
     def GetTotalDataUsed( self ):
         
         with self._lock:
@@ -1428,6 +1582,14 @@ class NetworkJob( object ):
             
         
     
+    def GetWakeTime( self ):
+        
+        with self._lock:
+            
+            return self._wake_time
+            
+        
+    
     def HasError( self ):
         
         with self._lock:
@@ -1501,6 +1663,11 @@ class NetworkJob( object ):
             
             self._wake_time = 0
             
+            if self.engine is not None:
+                
+                self.engine.NotifyBandwidthChanged()
+                
+            
         
     
     def SetError( self, e, error ):
@@ -1527,6 +1694,14 @@ class NetworkJob( object ):
             
         
     
+    def SetHashWhileDownloading( self, hash_while_downloading ):
+        
+        with self._lock:
+            
+            self._hash_while_downloading = hash_while_downloading
+            
+        
+    
     def SetStatus( self, text ):
         
         with self._lock:
@@ -1576,9 +1751,25 @@ class NetworkJob( object ):
                             
                         else:
                             
+                            # a retry starts the file again, so it gets a fresh hasher
+                            
+                            if self._hash_while_downloading:
+                                
+                                stream_hasher = HydrusFileHandling.StreamHasher()
+                                
+                            else:
+                                
+                                stream_hasher = None
+                                
+                            
                             with open( self._temp_path, 'wb' ) as f:
                                 
-                                self._ReadResponse( response, f )
+                                self._ReadResponse( response, f, stream_hasher = stream_hasher )
+                                
+                            
+                            with self._lock:
+                                
+                                self._stream_hasher = stream_hasher
                                 
                             
                         
@@ -1772,6 +1963,8 @@ class NetworkJobDownloaderQueryTemporary( NetworkJob ):
     
 class NetworkJobSubscription( NetworkJobDownloader ):
     
+    PRIORITY = JOB_PRIORITY_SUBSCRIPTION
+    
     def __init__( self, subscription_key, downloader_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._subscription_key = subscription_key
@@ -1792,6 +1985,8 @@ class NetworkJobSubscriptionTemporary( NetworkJob ):
     
     # temporary because we will move to the downloader_key stuff when that is available
     
+    PRIORITY = JOB_PRIORITY_SUBSCRIPTION
+    
     def __init__( self, subscription_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._subscription_key = subscription_key
@@ -1811,6 +2006,7 @@ class NetworkJobSubscriptionTemporary( NetworkJob ):
 class NetworkJobHydrus( NetworkJob ):
     
     IS_HYDRUS_SERVICE = True
+    PRIORITY = JOB_PRIORITY_REPOSITORY
     
     def __init__( self, service_key, method, url, body = None, referral_url = None, temp_path = None ):
         
@@ -1911,6 +2107,8 @@ class NetworkJobHydrus( NetworkJob ):
     
 class NetworkJobThreadWatcher( NetworkJob ):
     
+    PRIORITY = JOB_PRIORITY_WATCHER
+    
     def __init__( self, thread_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._thread_key = thread_key
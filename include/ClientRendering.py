@@ -35,6 +35,19 @@ def GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = True ):
     
     return HydrusBitmap( numpy_image.data, buffer_format, ( x, y ), compressed = compressed )
     
+def GenerateHydrusBitmapFromLZ4Data( lz4_data, depth, size ):
+    
+    if depth == 4:
+        
+        buffer_format = wx.BitmapBufferFormat_RGBA
+        
+    else:
+        
+        buffer_format = wx.BitmapBufferFormat_RGB
+        
+    
+    return HydrusBitmap( lz4_data, buffer_format, size, compressed = True, data_is_lz4 = True )
+    
 def GenerateHydrusBitmapFromPILImage( pil_image, compressed = True ):
     
     pil_image = HydrusImageHandling.Dequantize( pil_image )
@@ -584,11 +597,15 @@ class RasterContainerVideo( RasterContainer ):
     
 class HydrusBitmap( object ):
     
-    def __init__( self, data, format, size, compressed = True ):
+    def __init__( self, data, format, size, compressed = True, data_is_lz4 = False ):
         
         self._compressed = compressed
         
-        if self._compressed:
+        if self._compressed and data_is_lz4:
+            
+            self._data = data
+            
+        elif self._compressed:
             
             self._data = lz4.block.compress( data )
             
@@ -669,6 +686,18 @@ class HydrusBitmap( object ):
         return len( self._data )
         
     
+    def GetLZ4Data( self ):
+        
+        if self._compressed:
+            
+            return self._data
+            
+        else:
+            
+            return lz4.block.compress( self._data )
+            
+        
+    
     def GetSize( self ):
         
         return self._size
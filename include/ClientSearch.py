@@ -6,12 +6,20 @@ import HydrusData
 import HydrusGlobals as HG
 import HydrusSerialisable
 import HydrusTags
+import collections
 import re
+import threading
 import wx
 
 IGNORED_TAG_SEARCH_CHARACTERS = u'[](){}"\''
 IGNORED_TAG_SEARCH_CHARACTERS_UNICODE_TRANSLATE = { ord( char ) : None for char in IGNORED_TAG_SEARCH_CHARACTERS }
 
+# files added to or deleted from one of these move through the others
+LOCAL_FILE_SERVICE_KEYS = { CC.LOCAL_FILE_SERVICE_KEY, CC.TRASH_SERVICE_KEY, CC.COMBINED_LOCAL_FILE_SERVICE_KEY }
+
+# these system predicates are answered from the mappings, not the file info
+TAG_COUNT_SIMPLE_PREDICATE_NAMES = ( 'min_num_tags', 'num_tags', 'max_num_tags', 'min_tag_as_number', 'max_tag_as_number' )
+
 def ConvertTagToSearchable( tag ):
     
     if tag == '':
@@ -103,7 +111,18 @@ def FilterTagsBySearchText( service_key, search_text, tags, search_siblings = Tr
     
     re_predicate = compile_re( search_text )
     
-    sibling_manager = HG.client_controller.GetManager( 'tag_siblings' )
+    # this may be a one-use iterator
+    
+    tags = list( tags )
+    
+    if search_siblings:
+        
+        sibling_manager = HG.client_controller.GetManager( 'tag_siblings' )
+        
+        # one lookup for all of them, rather than going to the db for each tag
+        
+        tags_to_all_siblings = sibling_manager.GetTagsToAllSiblings( service_key, tags )
+        
     
     result = []
     
@@ -111,7 +130,7 @@ def FilterTagsBySearchText( service_key, search_text, tags, search_siblings = Tr
         
         if search_siblings:
             
-            possible_tags = sibling_manager.GetAllSiblings( service_key, tag )
+            possible_tags = tags_to_all_siblings[ tag ]
             
         else:
             
@@ -404,6 +423,385 @@ class FileSearchContext( HydrusSerialisable.SerialisableBase ):
     
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_FILE_SEARCH_CONTEXT ] = FileSearchContext
 
+class FileSearchResultCache( object ):
+    
+    # the db keeps the results of recent file searches here, so refreshing a page or reopening a search does not run it again
+    # each entry remembers what it depends on, so a content update only clears the searches it could have changed
+    
+    def __init__( self, max_hash_ids = 1000000 ):
+        
+        self._lock = threading.Lock()
+        
+        self._max_hash_ids = max_hash_ids
+        
+        self._search_keys_to_entries = collections.OrderedDict()
+        
+        self._num_hash_ids = 0
+        
+        # a search that was running while something was invalidated may have read the old data, so we only keep results from the current generation
+        
+        self._generation = 0
+        
+        self._num_hits = 0
+        self._num_misses = 0
+        
+    
+    def _GetDependencies( self, search_context ):
+        
+        file_service_key = search_context.GetFileServiceKey()
+        tag_service_key = search_context.GetTagServiceKey()
+        
+        system_predicates = search_context.GetSystemPredicates()
+        
+        simple_preds = system_predicates.GetSimpleInfo()
+        
+        flags = set()
+        
+        # the file domains whose adds and deletes can change the results
+        
+        file_service_keys = set()
+        
+        if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+            
+            # this domain is searched through the mappings, but file info, similar files and duplicates are checked against whatever files we know about
+            
+            if True in ( name not in TAG_COUNT_SIMPLE_PREDICATE_NAMES for name in simple_preds ) or system_predicates.HasSimilarTo() or len( system_predicates.GetDuplicateRelationshipsPredicates() ) > 0:
+                
+                flags.add( 'all_files' )
+                
+            
+        else:
+            
+            file_service_keys.add( file_service_key )
+            
+        
+        if system_predicates.MustBeLocal() or system_predicates.MustNotBeLocal() or system_predicates.HasSimilarTo():
+            
+            file_service_keys.add( CC.COMBINED_LOCAL_FILE_SERVICE_KEY )
+            
+        
+        if len( search_context.GetNamespacesToInclude() ) + len( search_context.GetNamespacesToExclude() ) + len( search_context.GetWildcardsToInclude() ) + len( search_context.GetWildcardsToExclude() ) > 0:
+            
+            flags.add( 'all_tags' )
+            
+        
+        if True in ( name in simple_preds for name in TAG_COUNT_SIMPLE_PREDICATE_NAMES ):
+            
+            flags.add( 'all_tags' )
+            
+        
+        if search_context.GetFileServiceKey() == CC.COMBINED_FILE_SERVICE_KEY and len( search_context.GetTagsToInclude() ) == 0:
+            
+            # this searches every file that has any tag
+            
+            flags.add( 'all_tags' )
+            
+        
+        if system_predicates.MustBeInbox() or system_predicates.MustBeArchive():
+            
+            flags.add( 'inbox' )
+            
+            # new imports go in the inbox
+            
+            file_service_keys.add( CC.COMBINED_LOCAL_FILE_SERVICE_KEY )
+            
+        
+        if len( system_predicates.GetRatingsPredicates() ) > 0:
+            
+            flags.add( 'ratings' )
+            
+        
+        ( file_services_to_include_current, file_services_to_include_pending, file_services_to_exclude_current, file_services_to_exclude_pending ) = system_predicates.GetFileServiceInfo()
+        
+        file_service_keys.update( file_services_to_include_current )
+        file_service_keys.update( file_services_to_exclude_current )
+        
+        if len( file_services_to_include_pending ) + len( file_services_to_exclude_pending ) > 0:
+            
+            flags.add( 'file_transfers' )
+            
+        
+        # a tag search matches all of its siblings, and an unnamespaced tag matches that subtag in any namespace
+        
+        siblings_manager = HG.client_controller.GetManager( 'tag_siblings' )
+        
+        tags = set()
+        subtags = set()
+        
+        for tag in search_context.GetTagsToInclude() + search_context.GetTagsToExclude():
+            
+            for sibling in siblings_manager.GetAllSiblings( tag_service_key, tag ):
+                
+                ( namespace, subtag ) = HydrusTags.SplitTag( sibling )
+                
+                if namespace == '':
+                    
+                    subtags.add( subtag )
+                    
+                else:
+                    
+                    tags.add( sibling )
+                    
+                
+            
+        
+        return ( tag_service_key, file_service_keys, tags, subtags, flags )
+        
+    
+    def _GetSearchKey( self, search_context ):
+        
+        # the order of the predicates and whether the search has been run do not change the results
+        
+        serialised_predicates = frozenset( ( predicate.DumpToString() for predicate in search_context.GetPredicates() ) )
+        
+        return ( search_context.GetFileServiceKey(), search_context.GetTagServiceKey(), search_context.IncludeCurrentTags(), search_context.IncludePendingTags(), serialised_predicates )
+        
+    
+    def _Invalidate( self, should_invalidate ):
+        
+        bad_search_keys = [ search_key for ( search_key, ( dependencies, hash_ids ) ) in self._search_keys_to_entries.items() if should_invalidate( dependencies ) ]
+        
+        for search_key in bad_search_keys:
+            
+            self._RemoveEntry( search_key )
+            
+        
+        self._generation += 1
+        
+    
+    def _RemoveEntry( self, search_key ):
+        
+        ( dependencies, hash_ids ) = self._search_keys_to_entries.pop( search_key )
+        
+        self._num_hash_ids -= len( hash_ids )
+        
+    
+    def AddHashIds( self, search_context, generation, hash_ids ):
+        
+        with self._lock:
+            
+            if generation != self._generation:
+                
+                return
+                
+            
+            # one giant search should not push everything else out
+            
+            if len( hash_ids ) > self._max_hash_ids / 4:
+                
+                return
+                
+            
+            search_key = self._GetSearchKey( search_context )
+            
+            if search_key in self._search_keys_to_entries:
+                
+                self._RemoveEntry( search_key )
+                
+            
+            self._search_keys_to_entries[ search_key ] = ( self._GetDependencies( search_context ), tuple( hash_ids ) )
+            
+            self._num_hash_ids += len( hash_ids )
+            
+            while self._num_hash_ids > self._max_hash_ids:
+                
+                oldest_search_key = next( iter( self._search_keys_to_entries ) )
+                
+                self._RemoveEntry( oldest_search_key )
+                
+            
+        
+    
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._Invalidate( lambda dependencies: True )
+            
+        
+    
+    def GetGeneration( self ):
+        
+        with self._lock:
+            
+            return self._generation
+            
+        
+    
+    def GetHashIds( self, search_context ):
+        
+        with self._lock:
+            
+            search_key = self._GetSearchKey( search_context )
+            
+            if search_key not in self._search_keys_to_entries:
+                
+                self._num_misses += 1
+                
+                return None
+                
+            
+            self._num_hits += 1
+            
+            # move it to the most recently used end
+            
+            entry = self._search_keys_to_entries.pop( search_key )
+            
+            self._search_keys_to_entries[ search_key ] = entry
+            
+            ( dependencies, hash_ids ) = entry
+            
+            return list( hash_ids )
+            
+        
+    
+    def GetReport( self ):
+        
+        with self._lock:
+            
+            num_lookups = self._num_hits + self._num_misses
+            
+            if num_lookups == 0:
+                
+                hit_rate = 0.0
+                
+            else:
+                
+                hit_rate = float( self._num_hits ) / num_lookups
+                
+            
+            return 'File search cache: ' + HydrusData.ConvertIntToPrettyString( self._num_hits ) + ' hits from ' + HydrusData.ConvertIntToPrettyString( num_lookups ) + ' lookups (' + HydrusData.ConvertFloatToPercentage( hit_rate ) + '), holding ' + HydrusData.ConvertIntToPrettyString( len( self._search_keys_to_entries ) ) + ' searches of ' + HydrusData.ConvertIntToPrettyString( self._num_hash_ids ) + ' files.'
+            
+        
+    
+    def IsCacheable( self, search_context ):
+        
+        system_predicates = search_context.GetSystemPredicates()
+        
+        simple_preds = system_predicates.GetSimpleInfo()
+        
+        # a limit is a random sample, and system:age is relative to now, so the same search gives different results later
+        
+        if system_predicates.GetLimit() is not None:
+            
+            return False
+            
+        
+        if 'min_timestamp' in simple_preds or 'max_timestamp' in simple_preds:
+            
+            return False
+            
+        
+        return True
+        
+    
+    def ProcessContentUpdates( self, service_key, content_updates ):
+        
+        def depends_on_files( dependencies, touched_file_service_keys ):
+            
+            ( tag_service_key, file_service_keys, tags, subtags, flags ) = dependencies
+            
+            return 'all_files' in flags or not file_service_keys.isdisjoint( touched_file_service_keys )
+            
+        
+        def depends_on_tag( dependencies, tag ):
+            
+            ( tag_service_key, file_service_keys, tags, subtags, flags ) = dependencies
+            
+            if tag_service_key not in ( service_key, CC.COMBINED_TAG_SERVICE_KEY ):
+                
+                return False
+                
+            
+            if 'all_tags' in flags:
+                
+                return True
+                
+            
+            ( namespace, subtag ) = HydrusTags.SplitTag( tag )
+            
+            return tag in tags or subtag in subtags
+            
+        
+        with self._lock:
+            
+            if len( self._search_keys_to_entries ) == 0:
+                
+                self._generation += 1
+                
+                return
+                
+            
+            for content_update in content_updates:
+                
+                ( data_type, action, row ) = content_update.ToTuple()
+                
+                if data_type == HC.CONTENT_TYPE_FILES:
+                    
+                    if action in ( HC.CONTENT_UPDATE_ARCHIVE, HC.CONTENT_UPDATE_INBOX ):
+                        
+                        self._Invalidate( lambda dependencies: 'inbox' in dependencies[4] )
+                        
+                    elif action in ( HC.CONTENT_UPDATE_PEND, HC.CONTENT_UPDATE_PETITION, HC.CONTENT_UPDATE_RESCIND_PEND, HC.CONTENT_UPDATE_RESCIND_PETITION ):
+                        
+                        self._Invalidate( lambda dependencies: 'file_transfers' in dependencies[4] )
+                        
+                    else:
+                        
+                        # files moving in or out of a local domain move between the others too, through the trash
+                        
+                        if service_key in LOCAL_FILE_SERVICE_KEYS:
+                            
+                            touched_file_service_keys = LOCAL_FILE_SERVICE_KEYS
+                            
+                        else:
+                            
+                            touched_file_service_keys = { service_key }
+                            
+                        
+                        self._Invalidate( lambda dependencies: depends_on_files( dependencies, touched_file_service_keys ) )
+                        
+                    
+                elif data_type == HC.CONTENT_TYPE_MAPPINGS:
+                    
+                    # petitions do not change what a search sees until they are processed
+                    
+                    if action in ( HC.CONTENT_UPDATE_PETITION, HC.CONTENT_UPDATE_RESCIND_PETITION ):
+                        
+                        continue
+                        
+                    
+                    if action == HC.CONTENT_UPDATE_ADVANCED:
+                        
+                        self._Invalidate( lambda dependencies: dependencies[0] in ( service_key, CC.COMBINED_TAG_SERVICE_KEY ) )
+                        
+                    else:
+                        
+                        ( tag, hashes ) = row
+                        
+                        self._Invalidate( lambda dependencies: depends_on_tag( dependencies, tag ) )
+                        
+                    
+                elif data_type == HC.CONTENT_TYPE_TAG_SIBLINGS:
+                    
+                    # siblings can apply across services, so anything that searched a tag may have changed
+                    
+                    self._Invalidate( lambda dependencies: len( dependencies[2] ) + len( dependencies[3] ) > 0 or 'all_tags' in dependencies[4] )
+                    
+                elif data_type == HC.CONTENT_TYPE_TAG_PARENTS:
+                    
+                    # a new parent is added to every file that has the child, and pending parents are searched as pending tags
+                    
+                    self._Invalidate( lambda dependencies: dependencies[0] in ( service_key, CC.COMBINED_TAG_SERVICE_KEY ) and ( len( dependencies[2] ) + len( dependencies[3] ) > 0 or 'all_tags' in dependencies[4] ) )
+                    
+                elif data_type == HC.CONTENT_TYPE_RATINGS:
+                    
+                    self._Invalidate( lambda dependencies: 'ratings' in dependencies[4] )
+                    
+                
+            
+        
+    
 class FileSystemPredicates( object ):
     
     def __init__( self, system_predicates ):
@@ -1337,7 +1735,7 @@ class Predicate( HydrusSerialisable.SerialisableBase ):
         
         self._inclusive = inclusive
         
-
+    
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_PREDICATE ] = Predicate
 
 SYSTEM_PREDICATE_INBOX = Predicate( HC.PREDICATE_TYPE_SYSTEM_INBOX, None )
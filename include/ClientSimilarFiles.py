@@ -0,0 +1,365 @@
+import HydrusExceptions
+import numpy
+import struct
+
+# numpy has no popcount ufunc for us, so we count the set bits of each byte of the xor with a lookup table
+BYTE_POPCOUNTS = numpy.array( [ bin( i ).count( '1' ) for i in range( 256 ) ], dtype = numpy.uint8 )
+
+NULL_ID = -1
+
+def ConvertPHashesToArray( phashes ):
+    
+    # phashes are 8-byte big-endian strings, which is the same order Get64BitHammingDistance unpacks them in
+    
+    return numpy.frombuffer( ''.join( phashes ), dtype = '>u8' ).astype( numpy.uint64 )
+    
+def ConvertPHashIntToPHash( phash_int ):
+    
+    return struct.pack( '!Q', int( phash_int ) )
+    
+def GetHammingDistances( phashes_a, phashes_b ):
+    
+    xor = numpy.bitwise_xor( phashes_a, phashes_b )
+    
+    return BYTE_POPCOUNTS[ xor.view( numpy.uint8 ) ].reshape( ( -1, 8 ) ).sum( axis = 1, dtype = numpy.int32 )
+    
+class PHashIndex( object ):
+    
+    # an in-memory copy of shape_vptree, stored as parallel arrays so we can walk a whole level of the tree at once
+    # nodes live in 'slots', which are in phash_id order, so we can find a phash_id's slot with a binary search and no giant dict
+    
+    def __init__( self ):
+        
+        self._Clear()
+        
+    
+    def _Clear( self ):
+        
+        self._loaded = False
+        
+        self._num_nodes = 0
+        self._root_slot = None
+        
+        self._phash_ids = numpy.zeros( 0, dtype = numpy.int64 )
+        self._phashes = numpy.zeros( 0, dtype = numpy.uint64 )
+        self._radii = numpy.zeros( 0, dtype = numpy.int32 )
+        self._inner_slots = numpy.zeros( 0, dtype = numpy.int64 )
+        self._inner_populations = numpy.zeros( 0, dtype = numpy.int64 )
+        self._outer_slots = numpy.zeros( 0, dtype = numpy.int64 )
+        self._outer_populations = numpy.zeros( 0, dtype = numpy.int64 )
+        self._useful = numpy.zeros( 0, dtype = numpy.bool_ )
+        
+    
+    def _EnsureCapacity( self, num_nodes ):
+        
+        capacity = len( self._phash_ids )
+        
+        if num_nodes <= capacity:
+            
+            return
+            
+        
+        new_capacity = max( num_nodes, capacity * 2, 1024 )
+        
+        def grow( array, fill_value ):
+            
+            new_array = numpy.empty( new_capacity, dtype = array.dtype )
+            
+            new_array[ : self._num_nodes ] = array[ : self._num_nodes ]
+            new_array[ self._num_nodes : ] = fill_value
+            
+            return new_array
+            
+        
+        self._phash_ids = grow( self._phash_ids, NULL_ID )
+        self._phashes = grow( self._phashes, 0 )
+        self._radii = grow( self._radii, NULL_ID )
+        self._inner_slots = grow( self._inner_slots, NULL_ID )
+        self._inner_populations = grow( self._inner_populations, 0 )
+        self._outer_slots = grow( self._outer_slots, NULL_ID )
+        self._outer_populations = grow( self._outer_populations, 0 )
+        self._useful = grow( self._useful, True )
+        
+    
+    def _GetPHashId( self, slot ):
+        
+        if slot == NULL_ID:
+            
+            return None
+            
+        
+        return int( self._phash_ids[ slot ] )
+        
+    
+    def _GetSlot( self, phash_id ):
+        
+        if phash_id is None:
+            
+            return NULL_ID
+            
+        
+        slot = int( numpy.searchsorted( self._phash_ids[ : self._num_nodes ], phash_id ) )
+        
+        if slot == self._num_nodes or self._phash_ids[ slot ] != phash_id:
+            
+            raise HydrusExceptions.DataMissing( 'Could not find phash_id ' + str( phash_id ) + ' in the phash index!' )
+            
+        
+        return slot
+        
+    
+    def _GetSlots( self, phash_ids ):
+        
+        # callers often hand us sets, which numpy will not build an int array from
+        
+        phash_ids = numpy.array( sorted( phash_ids ), dtype = numpy.int64 )
+        
+        if len( phash_ids ) == 0:
+            
+            return phash_ids
+            
+        
+        slots = numpy.searchsorted( self._phash_ids[ : self._num_nodes ], phash_ids )
+        
+        slots = slots[ slots < self._num_nodes ]
+        
+        return slots[ numpy.in1d( self._phash_ids[ slots ], phash_ids ) ]
+        
+    
+    def _Search( self, search_phashes, search_owners, search_radius ):
+        
+        num_cycles = 0
+        
+        if self._root_slot is None or len( search_phashes ) == 0:
+            
+            empty = numpy.zeros( 0, dtype = numpy.int64 )
+            
+            return ( empty, empty, num_cycles )
+            
+        
+        search_phashes = ConvertPHashesToArray( search_phashes )
+        search_owners = numpy.array( search_owners, dtype = numpy.int64 )
+        node_slots = numpy.empty( len( search_phashes ), dtype = numpy.int64 )
+        node_slots.fill( self._root_slot )
+        
+        similar_slots = []
+        similar_owners = []
+        
+        while len( node_slots ) > 0:
+            
+            num_cycles += 1
+            
+            # every ( node, search_phash ) pair on this level of the tree at once
+            
+            node_hamming_distances = GetHammingDistances( self._phashes[ node_slots ], search_phashes )
+            
+            similar = node_hamming_distances <= search_radius
+            
+            similar_slots.append( node_slots[ similar ] )
+            similar_owners.append( search_owners[ similar ] )
+            
+            # see _CacheSimilarFilesSearch for the sphere logic here. a radius of NULL_ID means the node has no children
+            
+            node_radii = self._radii[ node_slots ]
+            inner_slots = self._inner_slots[ node_slots ]
+            outer_slots = self._outer_slots[ node_slots ]
+            
+            has_children = node_radii != NULL_ID
+            
+            spheres_disjoint = node_hamming_distances > ( node_radii + search_radius )
+            search_sphere_subset_of_node_sphere = ( node_hamming_distances + search_radius ) <= node_radii
+            
+            search_inner = has_children & ( inner_slots != NULL_ID ) & ~spheres_disjoint
+            search_outer = has_children & ( outer_slots != NULL_ID ) & ~search_sphere_subset_of_node_sphere
+            
+            node_slots = numpy.concatenate( ( inner_slots[ search_inner ], outer_slots[ search_outer ] ) )
+            search_phashes = numpy.concatenate( ( search_phashes[ search_inner ], search_phashes[ search_outer ] ) )
+            search_owners = numpy.concatenate( ( search_owners[ search_inner ], search_owners[ search_outer ] ) )
+            
+        
+        similar_slots = numpy.concatenate( similar_slots )
+        similar_owners = numpy.concatenate( similar_owners )
+        
+        useful = self._useful[ similar_slots ]
+        
+        return ( similar_slots[ useful ], similar_owners[ useful ], num_cycles )
+        
+    
+    def AddLeaf( self, phash_id, phash, parent_id, parent_radius, ancestor_ids_we_are_inside, ancestor_ids_we_are_outside ):
+        
+        if not self._loaded:
+            
+            return
+            
+        
+        if self._num_nodes > 0 and phash_id <= self._phash_ids[ self._num_nodes - 1 ]:
+            
+            # we can only append in phash_id order--this is very unusual, so just reload from the db next time
+            
+            self.Invalidate()
+            
+            return
+            
+        
+        self._EnsureCapacity( self._num_nodes + 1 )
+        
+        slot = self._num_nodes
+        
+        self._phash_ids[ slot ] = phash_id
+        self._phashes[ slot ] = ConvertPHashesToArray( [ phash ] )[0]
+        self._radii[ slot ] = NULL_ID
+        self._inner_slots[ slot ] = NULL_ID
+        self._inner_populations[ slot ] = 0
+        self._outer_slots[ slot ] = NULL_ID
+        self._outer_populations[ slot ] = 0
+        self._useful[ slot ] = True
+        
+        self._num_nodes += 1
+        
+        if parent_id is None:
+            
+            self._root_slot = slot
+            
+        else:
+            
+            parent_slot = self._GetSlot( parent_id )
+            
+            if parent_radius is None:
+                
+                self._outer_slots[ parent_slot ] = slot
+                
+            else:
+                
+                self._inner_slots[ parent_slot ] = slot
+                self._radii[ parent_slot ] = parent_radius
+                
+            
+            self._inner_populations[ self._GetSlots( ancestor_ids_we_are_inside ) ] += 1
+            self._outer_populations[ self._GetSlots( ancestor_ids_we_are_outside ) ] += 1
+            
+        
+    
+    def GetNode( self, phash_id ):
+        
+        slot = self._GetSlot( phash_id )
+        
+        radius = int( self._radii[ slot ] )
+        
+        if radius == NULL_ID:
+            
+            radius = None
+            
+        
+        phash = ConvertPHashIntToPHash( self._phashes[ slot ] )
+        
+        inner_id = self._GetPHashId( self._inner_slots[ slot ] )
+        inner_population = int( self._inner_populations[ slot ] )
+        outer_id = self._GetPHashId( self._outer_slots[ slot ] )
+        outer_population = int( self._outer_populations[ slot ] )
+        
+        return ( phash, radius, inner_id, inner_population, outer_id, outer_population )
+        
+    
+    def GetRootPHashId( self ):
+        
+        if self._root_slot is None:
+            
+            return None
+            
+        
+        return self._GetPHashId( self._root_slot )
+        
+    
+    def Invalidate( self ):
+        
+        self._Clear()
+        
+    
+    def IsLoaded( self ):
+        
+        return self._loaded
+        
+    
+    def Load( self, rows ):
+        
+        # rows are ( phash_id, phash, parent_id, radius, inner_id, inner_population, outer_id, outer_population ), with None ids and radii as NULL_ID
+        
+        self._Clear()
+        
+        rows.sort()
+        
+        self._num_nodes = len( rows )
+        
+        if self._num_nodes > 0:
+            
+            ( phash_ids, phashes, parent_ids, radii, inner_ids, inner_populations, outer_ids, outer_populations ) = zip( *rows )
+            
+            self._phash_ids = numpy.array( phash_ids, dtype = numpy.int64 )
+            self._phashes = ConvertPHashesToArray( phashes )
+            self._radii = numpy.array( radii, dtype = numpy.int32 )
+            self._inner_populations = numpy.array( inner_populations, dtype = numpy.int64 )
+            self._outer_populations = numpy.array( outer_populations, dtype = numpy.int64 )
+            self._useful = numpy.ones( self._num_nodes, dtype = numpy.bool_ )
+            
+            def convert_ids_to_slots( ids ):
+                
+                ids = numpy.array( ids, dtype = numpy.int64 )
+                
+                slots = numpy.searchsorted( self._phash_ids, ids )
+                
+                slots[ ids == NULL_ID ] = NULL_ID
+                
+                return slots
+                
+            
+            self._inner_slots = convert_ids_to_slots( inner_ids )
+            self._outer_slots = convert_ids_to_slots( outer_ids )
+            
+            root_slots = numpy.flatnonzero( numpy.array( parent_ids, dtype = numpy.int64 ) == NULL_ID )
+            
+            if len( root_slots ) > 0:
+                
+                self._root_slot = int( root_slots[0] )
+                
+            
+        
+        self._loaded = True
+        
+    
+    def Search( self, search_phashes, search_radius ):
+        
+        search_owners = [ 0 ] * len( search_phashes )
+        
+        ( similar_slots, similar_owners, num_cycles ) = self._Search( search_phashes, search_owners, search_radius )
+        
+        similar_phash_ids = set( self._phash_ids[ similar_slots ].tolist() )
+        
+        return ( similar_phash_ids, num_cycles )
+        
+    
+    def SearchBatch( self, owners_and_search_phashes, search_radius ):
+        
+        # owners are typically hash_ids. we walk the tree once for the whole batch, so the upper nodes are only visited once per level
+        
+        if len( owners_and_search_phashes ) == 0:
+            
+            return ( set(), 0 )
+            
+        
+        ( search_owners, search_phashes ) = zip( *owners_and_search_phashes )
+        
+        ( similar_slots, similar_owners, num_cycles ) = self._Search( search_phashes, search_owners, search_radius )
+        
+        owners_and_similar_phash_ids = set( zip( similar_owners.tolist(), self._phash_ids[ similar_slots ].tolist() ) )
+        
+        return ( owners_and_similar_phash_ids, num_cycles )
+        
+    
+    def SetUseful( self, phash_ids, useful ):
+        
+        if not self._loaded:
+            
+            return
+            
+        
+        self._useful[ self._GetSlots( phash_ids ) ] = useful
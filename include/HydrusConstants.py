@@ -48,8 +48,8 @@ options = {}
 
 # Misc
 
-NETWORK_VERSION = 18
-SOFTWARE_VERSION = 284
+NETWORK_VERSION = 19
+SOFTWARE_VERSION = 287
 
 UNSCALED_THUMBNAIL_DIMENSIONS = ( 200, 200 )
 
@@ -1,16 +1,20 @@
+import collections
 import cProfile
 import cStringIO
 import distutils.version
+import hashlib
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
 import HydrusGlobals as HG
 import HydrusPaths
+import math
 import os
 import psutil
 import Queue
 import random
 import sqlite3
+import struct
 import sys
 import tempfile
 import threading
@@ -19,6 +23,26 @@ import time
 
 CONNECTION_REFRESH_TIME = 60 * 30
 
+READ_CONNECTION_DENIED_ACTIONS = { sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE, sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_CREATE_INDEX, sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_DROP_INDEX }
+
+def ReadConnectionAuthoriser( action, arg_1, arg_2, db_name, trigger_or_view ):
+    
+    # read connections can still make temporary tables in mem, but any real write has to go through the main connection
+    
+    # fts4 checks it can update sqlite_master when it connects to its virtual table, which it never actually does for a select
+    
+    if action == sqlite3.SQLITE_UPDATE and arg_1 == 'sqlite_master':
+        
+        return sqlite3.SQLITE_OK
+        
+    
+    if action in READ_CONNECTION_DENIED_ACTIONS and db_name not in ( 'mem', 'temp' ):
+        
+        return sqlite3.SQLITE_DENY
+        
+    
+    return sqlite3.SQLITE_OK
+    
 def CanVacuum( db_path, stop_time = None ):
     
     try:
@@ -106,12 +130,23 @@ def VacuumDB( db_path ):
 class HydrusDB( object ):
     
     READ_WRITE_ACTIONS = []
+    CONCURRENT_READ_ACTIONS = []
+    # these can be served from the last commit even while a write is queued or going on, so a big search does not wait behind a long job
+    # they still see every write that finished before they were asked for, as the db commits after every write when it has any of these
+    STALE_TOLERANT_READ_ACTIONS = []
+    NUM_READ_CONNECTIONS = 2
+    COALESCABLE_WRITE_ACTIONS = []
+    WRITE_BATCH_LATENCY = 0.0
+    WRITE_BATCH_MAX_JOBS = 256
     UPDATE_WAIT = 2
     
     TRANSACTION_COMMIT_TIME = 10
     
     def __init__( self, controller, db_dir, db_name, no_wal = False ):
         
+        # every thread gets its own connection, so the read connections can run the same _c code as the main loop
+        self._thread_local = threading.local()
+        
         self._controller = controller
         self._db_dir = db_dir
         self._db_name = db_name
@@ -120,6 +155,7 @@ class HydrusDB( object ):
         self._transaction_started = 0
         self._in_transaction = False
         self._transaction_contains_writes = False
+        self._doing_write_job = False
         
         self._connection_timestamp = 0
         
@@ -153,8 +189,13 @@ class HydrusDB( object ):
         self._could_not_initialise = False
         
         self._jobs = Queue.PriorityQueue()
+        self._read_jobs = Queue.PriorityQueue()
         self._pubsubs = []
         
+        self._read_pool_lock = threading.Lock()
+        self._num_read_connections = 0
+        self._num_queued_writes = 0
+        
         self._currently_doing_job = False
         self._current_status = ''
         self._current_job_name = ''
@@ -241,6 +282,42 @@ class HydrusDB( object ):
             
         
     
+    @property
+    def _c( self ):
+        
+        return getattr( self._thread_local, 'c', None )
+        
+    
+    @_c.setter
+    def _c( self, c ):
+        
+        self._thread_local.c = c
+        
+    
+    @_c.deleter
+    def _c( self ):
+        
+        del self._thread_local.c
+        
+    
+    @property
+    def _db( self ):
+        
+        return getattr( self._thread_local, 'db', None )
+        
+    
+    @_db.setter
+    def _db( self, db ):
+        
+        self._thread_local.db = db
+        
+    
+    @_db.deleter
+    def _db( self ):
+        
+        del self._thread_local.db
+        
+    
     def _AttachExternalDatabases( self ):
         
         for ( name, filename ) in self._db_filenames.items():
@@ -265,7 +342,46 @@ class HydrusDB( object ):
             
             self._transaction_started = HydrusData.GetNow()
             self._in_transaction = True
-            self._transaction_contains_writes = False
+            
+            with self._read_pool_lock:
+                
+                # a write job that commits part way through is still writing, so the new transaction is dirty from the start
+                
+                self._transaction_contains_writes = self._doing_write_job
+                
+            
+        
+    
+    def _CanServeFromReadConnection( self, action ):
+        
+        if HG.db_profile_mode:
+            
+            return False
+            
+        
+        with self._read_pool_lock:
+            
+            if self._num_read_connections == 0:
+                
+                return False
+                
+            
+            if action in self.CONCURRENT_READ_ACTIONS:
+                
+                # the read connections only see committed data, so they cannot serve anything that should come after a write that is queued or not yet committed
+                
+                return self._num_queued_writes == 0 and not self._transaction_contains_writes
+                
+            elif action in self.STALE_TOLERANT_READ_ACTIONS:
+                
+                # a write that is queued or going on is fine, but one that has finished and is not yet committed has to be seen, so the main connection does it
+                
+                return self._doing_write_job or not self._transaction_contains_writes
+                
+            else:
+                
+                return False
+                
             
         
     
@@ -294,6 +410,53 @@ class HydrusDB( object ):
             
         
     
+    def _CloseReadCursor( self ):
+        
+        if self._db is not None:
+            
+            self._c.close()
+            self._db.close()
+            
+            self._db = None
+            self._c = None
+            
+        
+    
+    def _CommitIsDue( self ):
+        
+        if not self._transaction_contains_writes:
+            
+            return False
+            
+        
+        if len( self.STALE_TOLERANT_READ_ACTIONS ) > 0 and self._num_read_connections > 0:
+            
+            # stale tolerant reads go to the read connections whenever they can, so we keep what they see up to date
+            
+            return True
+            
+        
+        return HydrusData.TimeHasPassed( self._transaction_started + self.TRANSACTION_COMMIT_TIME )
+        
+    
+    def _CommitOrSave( self ):
+        
+        if self._CommitIsDue():
+            
+            self._current_status = 'db committing'
+            
+            self.publish_status_update()
+            
+            self._Commit()
+            
+            self._BeginImmediate()
+            
+        else:
+            
+            self._Save()
+            
+        
+    
     def _Commit( self ):
         
         if self._in_transaction:
@@ -342,6 +505,43 @@ class HydrusDB( object ):
         self._c.execute( statement )
         
     
+    def _FillWriteBatch( self, batch ):
+        
+        stop_time = HydrusData.GetNowPrecise() + self.WRITE_BATCH_LATENCY
+        
+        while len( batch ) < self.WRITE_BATCH_MAX_JOBS:
+            
+            try:
+                
+                timeout = stop_time - HydrusData.GetNowPrecise()
+                
+                if timeout > 0:
+                    
+                    ( priority, job ) = self._jobs.get( timeout = timeout )
+                    
+                else:
+                    
+                    ( priority, job ) = self._jobs.get_nowait()
+                    
+                
+            except Queue.Empty:
+                
+                return
+                
+            
+            if self._IsCoalescableWrite( job ):
+                
+                batch.append( ( priority, job ) )
+                
+            else:
+                
+                self._jobs.put( ( priority, job ) )
+                
+                return
+                
+            
+        
+    
     def _GetRowCount( self ):
         
         row_count = self._c.rowcount
@@ -487,11 +687,49 @@ class HydrusDB( object ):
         pass
         
     
+    def _InitReadCursor( self ):
+        
+        db_path = os.path.join( self._db_dir, self._db_filenames[ 'main' ] )
+        
+        self._db = sqlite3.connect( db_path, isolation_level = None, detect_types = sqlite3.PARSE_DECLTYPES )
+        
+        self._c = self._db.cursor()
+        
+        self._c.execute( 'PRAGMA temp_store = 2;' )
+        
+        self._c.execute( 'ATTACH ":memory:" AS mem;' )
+        
+        self._AttachExternalDatabases()
+        
+        db_names = [ name for ( index, name, path ) in self._c.execute( 'PRAGMA database_list;' ) if name not in ( 'mem', 'temp' ) ]
+        
+        for db_name in db_names:
+            
+            self._c.execute( 'PRAGMA ' + db_name + '.cache_size = -10000;' )
+            
+        
+        self._db.set_authorizer( ReadConnectionAuthoriser )
+        
+        self._thread_local.is_read_connection = True
+        
+    
     def _InitExternalDatabases( self ):
         
         pass
         
     
+    def _IsCoalescableWrite( self, job ):
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        return job.GetType() == 'write' and action in self.COALESCABLE_WRITE_ACTIONS
+        
+    
+    def _IsReadConnection( self ):
+        
+        return getattr( self._thread_local, 'is_read_connection', False )
+        
+    
     def _ManageDBError( self, job, e ):
         
         raise NotImplementedError()
@@ -509,7 +747,13 @@ class HydrusDB( object ):
                 
                 self._current_status = 'db write locked'
                 
-                self._transaction_contains_writes = True
+                with self._read_pool_lock:
+                    
+                    self._doing_write_job = True
+                    self._transaction_contains_writes = True
+                    
+                    self._num_queued_writes -= 1
+                    
                 
             else:
                 
@@ -527,20 +771,9 @@ class HydrusDB( object ):
                 result = self._Write( action, *args, **kwargs )
                 
             
-            if self._transaction_contains_writes and HydrusData.TimeHasPassed( self._transaction_started + self.TRANSACTION_COMMIT_TIME ):
-                
-                self._current_status = 'db committing'
-                
-                self.publish_status_update()
-                
-                self._Commit()
-                
-                self._BeginImmediate()
-                
-            else:
-                
-                self._Save()
-                
+            self._doing_write_job = False
+            
+            self._CommitOrSave()
             
             for ( topic, args, kwargs ) in self._pubsubs:
                 
@@ -569,6 +802,133 @@ class HydrusDB( object ):
             
         finally:
             
+            self._doing_write_job = False
+            
+            self._pubsubs = []
+            
+            self._current_status = ''
+            
+            self.publish_status_update()
+            
+        
+    
+    def _ProcessReadConnectionJob( self, priority, job ):
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        try:
+            
+            result = self._Read( action, *args, **kwargs )
+            
+        except Exception as e:
+            
+            # this read could not be served from the last commit, maybe because it wanted to write something, so let the main connection do it properly
+            
+            if HG.db_report_mode:
+                
+                HydrusData.ShowText( 'A db read connection could not do ' + action + ', so it was passed to the main connection: ' + HydrusData.ToUnicode( e ) )
+                
+            
+            self._jobs.put( ( priority + 1, job ) )
+            
+            return
+            
+        
+        job.PutResult( result )
+        
+    
+    def _ProcessWriteBatch( self, batch ):
+        
+        # these writes share one savepoint, status update and pubsub flush
+        # if any of them fails, we undo the lot and do them one at a time, so each error is handled as it normally would be
+        
+        start_time = HydrusData.GetNowPrecise()
+        
+        results = []
+        
+        try:
+            
+            self._current_status = 'db write locked'
+            
+            with self._read_pool_lock:
+                
+                self._doing_write_job = True
+                self._transaction_contains_writes = True
+                
+                self._num_queued_writes -= len( batch )
+                
+            
+            self.publish_status_update()
+            
+            try:
+                
+                for ( priority, job ) in batch:
+                    
+                    ( action, args, kwargs ) = job.GetCallableTuple()
+                    
+                    results.append( self._Write( action, *args, **kwargs ) )
+                    
+                
+                self._doing_write_job = False
+                
+            except Exception as e:
+                
+                try:
+                    
+                    self._Rollback()
+                    
+                except Exception as rollback_e:
+                    
+                    HydrusData.Print( 'When the write batch failed, attempting to rollback the database failed.' )
+                    
+                    HydrusData.PrintException( rollback_e )
+                    
+                
+                self._doing_write_job = False
+                
+                self._pubsubs = []
+                
+                with self._read_pool_lock:
+                    
+                    self._num_queued_writes += len( batch )
+                    
+                
+                for ( priority, job ) in batch:
+                    
+                    self._ProcessJob( job )
+                    
+                
+                return
+                
+            
+            self._CommitOrSave()
+            
+            for ( topic, args, kwargs ) in self._pubsubs:
+                
+                self._controller.pub( topic, *args, **kwargs )
+                
+            
+            for ( ( priority, job ), result ) in zip( batch, results ):
+                
+                if job.IsSynchronous():
+                    
+                    job.PutResult( result )
+                    
+                
+            
+            if HG.db_report_mode:
+                
+                actions_to_counts = collections.Counter( ( job.GetCallableTuple()[0] for ( priority, job ) in batch ) )
+                
+                summary = ', '.join( ( HydrusData.ConvertIntToPrettyString( count ) + ' ' + action for ( action, count ) in actions_to_counts.items() ) )
+                
+                HydrusData.ShowText( 'Wrote a batch of ' + summary + ' in ' + HydrusData.ConvertMillisecondsToPrettyTime( int( ( HydrusData.GetNowPrecise() - start_time ) * 1000 ) ) + '.' )
+                
+            
+        finally:
+            
+            self._doing_write_job = False
+            
             self._pubsubs = []
             
             self._current_status = ''
@@ -582,6 +942,21 @@ class HydrusDB( object ):
         raise NotImplementedError()
         
     
+    def _ReadMayBeStale( self ):
+        
+        # the main connection sees everything, but a read connection only sees the last commit, which is out of date while a write is going on
+        
+        if not self._IsReadConnection():
+            
+            return False
+            
+        
+        with self._read_pool_lock:
+            
+            return self._transaction_contains_writes
+            
+        
+    
     def _ReportStatus( self, text ):
         
         HydrusData.Print( text )
@@ -726,7 +1101,10 @@ class HydrusDB( object ):
     
     def LoopIsFinished( self ):
         
-        return self._loop_finished
+        with self._read_pool_lock:
+            
+            return self._loop_finished and self._num_read_connections == 0
+            
         
     
     def JobsQueueEmpty( self ):
@@ -753,6 +1131,14 @@ class HydrusDB( object ):
             return
             
         
+        if not self._no_wal and len( self.CONCURRENT_READ_ACTIONS ) + len( self.STALE_TOLERANT_READ_ACTIONS ) > 0:
+            
+            for i in range( self.NUM_READ_CONNECTIONS ):
+                
+                self._controller.CallToThreadLongRunning( self.ReadLoop )
+                
+            
+        
         self._ready_to_serve_requests = True
         
         error_count = 0
@@ -763,6 +1149,13 @@ class HydrusDB( object ):
                 
                 ( priority, job ) = self._jobs.get( timeout = 1 )
                 
+                batch = [ ( priority, job ) ]
+                
+                if self._IsCoalescableWrite( job ):
+                    
+                    self._FillWriteBatch( batch )
+                    
+                
                 self._currently_doing_job = True
                 self._current_job_name = job.ToString()
                 
@@ -770,13 +1163,31 @@ class HydrusDB( object ):
                 
                 try:
                     
+                    if len( batch ) > 1:
+                        
+                        call = 'self._ProcessWriteBatch( batch )'
+                        
+                    else:
+                        
+                        call = 'self._ProcessJob( job )'
+                        
+                    
                     if HG.db_profile_mode:
                         
                         summary = 'Profiling ' + job.ToString()
                         
+                        if len( batch ) > 1:
+                            
+                            summary += ' (batch of ' + HydrusData.ConvertIntToPrettyString( len( batch ) ) + ' jobs)'
+                            
+                        
                         HydrusData.ShowText( summary )
                         
-                        HydrusData.Profile( summary, 'self._ProcessJob( job )', globals(), locals() )
+                        HydrusData.Profile( summary, call, globals(), locals() )
+                        
+                    elif len( batch ) > 1:
+                        
+                        self._ProcessWriteBatch( batch )
                         
                     else:
                         
@@ -794,7 +1205,18 @@ class HydrusDB( object ):
                         raise
                         
                     
-                    self._jobs.put( ( priority, job ) ) # couldn't lock db; put job back on queue
+                    for ( priority, job ) in batch:
+                        
+                        if job.GetType() in ( 'read_write', 'write' ):
+                            
+                            with self._read_pool_lock:
+                                
+                                self._num_queued_writes += 1
+                                
+                            
+                        
+                        self._jobs.put( ( priority, job ) ) # couldn't lock db; put job back on queue
+                        
                     
                     time.sleep( 5 )
                     
@@ -806,7 +1228,7 @@ class HydrusDB( object ):
                 
             except Queue.Empty:
                 
-                if self._transaction_contains_writes and HydrusData.TimeHasPassed( self._transaction_started + self.TRANSACTION_COMMIT_TIME ):
+                if self._CommitIsDue():
                     
                     self._Commit()
                     
@@ -832,6 +1254,13 @@ class HydrusDB( object ):
         if action in self.READ_WRITE_ACTIONS: job_type = 'read_write'
         else: job_type = 'read'
         
+        if job_type == 'read' and self._c is not None:
+            
+            # this is one of our own threads, like a cache manager asking for something in the middle of a job, so it would wait on the queue behind itself
+            
+            return self._Read( action, *args, **kwargs )
+            
+        
         synchronous = True
         
         job = HydrusData.JobDatabase( job_type, synchronous, action, *args, **kwargs )
@@ -841,11 +1270,88 @@ class HydrusDB( object ):
             raise HydrusExceptions.ShutdownException( 'Application has shut down!' )
             
         
-        self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+        if job_type == 'read' and self._CanServeFromReadConnection( action ):
+            
+            self._read_jobs.put( ( priority, job ) )
+            
+        else:
+            
+            if job_type == 'read_write':
+                
+                with self._read_pool_lock:
+                    
+                    self._num_queued_writes += 1
+                    
+                
+            
+            self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+            
         
         return job.GetResult()
         
     
+    def ReadLoop( self ):
+        
+        try:
+            
+            self._InitReadCursor()
+            
+        except:
+            
+            HydrusData.Print( 'A db read connection could not be initialised:' )
+            HydrusData.Print( traceback.format_exc() )
+            
+            self._CloseReadCursor()
+            
+            return
+            
+        
+        with self._read_pool_lock:
+            
+            self._num_read_connections += 1
+            
+        
+        try:
+            
+            while not ( ( self._local_shutdown or self._controller.ModelIsShutdown() ) and self._read_jobs.empty() ):
+                
+                try:
+                    
+                    ( priority, job ) = self._read_jobs.get( timeout = 1 )
+                    
+                except Queue.Empty:
+                    
+                    continue
+                    
+                
+                self._ProcessReadConnectionJob( priority, job )
+                
+            
+        finally:
+            
+            with self._read_pool_lock:
+                
+                self._num_read_connections -= 1
+                
+                last_read_connection = self._num_read_connections == 0
+                
+            
+            if last_read_connection:
+                
+                # anything that slipped in as we were shutting down
+                
+                while not self._read_jobs.empty():
+                    
+                    ( priority, job ) = self._read_jobs.get()
+                    
+                    self._jobs.put( ( priority + 1, job ) )
+                    
+                
+            
+            self._CloseReadCursor()
+            
+        
+    
     def ReadyToServeRequests( self ):
         
         return self._ready_to_serve_requests
@@ -882,11 +1388,191 @@ class HydrusDB( object ):
             raise HydrusExceptions.ShutdownException( 'Application has shut down!' )
             
         
+        with self._read_pool_lock:
+            
+            self._num_queued_writes += 1
+            
+        
         self._jobs.put( ( priority, job ) )
         
         if synchronous: return job.GetResult()
         
     
+class BloomFilter( object ):
+    
+    # a compact in-memory set that can only say 'maybe' or 'definitely not'. it has no false negatives, so a 'definitely not' can skip a db lookup
+    # values added in a transaction that is later rolled back only add false positives, so this does not need to be cleared on rollback
+    
+    def __init__( self, capacity, error_rate = 0.01 ):
+        
+        self._capacity = max( capacity, 1 )
+        
+        self._num_bits = int( math.ceil( - self._capacity * math.log( error_rate ) / ( math.log( 2 ) ** 2 ) ) )
+        self._num_hashes = max( 1, int( round( float( self._num_bits ) / self._capacity * math.log( 2 ) ) ) )
+        
+        self._bits = bytearray( ( self._num_bits + 7 ) // 8 )
+        
+        self._num_values = 0
+        
+        self._lock = threading.Lock()
+        
+    
+    def _GetBitIndices( self, value ):
+        
+        # one md5 split into two 64-bit halves makes as many indices as we need
+        
+        ( h1, h2 ) = struct.unpack( '!QQ', hashlib.md5( HydrusData.ToByteString( value ) ).digest() )
+        
+        return [ ( h1 + i * h2 ) % self._num_bits for i in range( self._num_hashes ) ]
+        
+    
+    def Add( self, value ):
+        
+        with self._lock:
+            
+            for index in self._GetBitIndices( value ):
+                
+                self._bits[ index >> 3 ] |= 1 << ( index & 7 )
+                
+            
+            self._num_values += 1
+            
+        
+    
+    def IsFull( self ):
+        
+        # past capacity, the false positive rate climbs quickly, so the owner should build a bigger one
+        
+        with self._lock:
+            
+            return self._num_values > self._capacity
+            
+        
+    
+    def MightContain( self, value ):
+        
+        with self._lock:
+            
+            for index in self._GetBitIndices( value ):
+                
+                if not self._bits[ index >> 3 ] & ( 1 << ( index & 7 ) ):
+                    
+                    return False
+                    
+                
+            
+            return True
+            
+        
+    
+class IdLookupCache( object ):
+    
+    # a bounded, least-recently-used map of master table values, like hashes or tags, to their ids
+    # an id made in a transaction that is later rolled back may be reused for something else, so the db has to Clear this on rollback
+    
+    def __init__( self, max_size ):
+        
+        self._max_size = max_size
+        
+        self._values_to_ids = collections.OrderedDict()
+        
+        self._lock = threading.Lock()
+        
+    
+    def _AddId( self, value, value_id ):
+        
+        # have to delete first, rather than overwriting, so the ordereddict updates its internal order
+        if value in self._values_to_ids:
+            
+            del self._values_to_ids[ value ]
+            
+        
+        self._values_to_ids[ value ] = value_id
+        
+    
+    def _Cull( self ):
+        
+        while len( self._values_to_ids ) > self._max_size:
+            
+            self._values_to_ids.popitem( last = False )
+            
+        
+    
+    def AddId( self, value, value_id ):
+        
+        with self._lock:
+            
+            self._AddId( value, value_id )
+            
+            self._Cull()
+            
+        
+    
+    def AddIds( self, values_to_ids ):
+        
+        with self._lock:
+            
+            for ( value, value_id ) in values_to_ids.iteritems():
+                
+                self._AddId( value, value_id )
+                
+            
+            self._Cull()
+            
+        
+    
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._values_to_ids = collections.OrderedDict()
+            
+        
+    
+    def GetId( self, value ):
+        
+        with self._lock:
+            
+            if value in self._values_to_ids:
+                
+                value_id = self._values_to_ids.pop( value )
+                
+                self._values_to_ids[ value ] = value_id
+                
+                return value_id
+                
+            
+            return None
+            
+        
+    
+    def GetIds( self, values ):
+        
+        values_to_ids = {}
+        missing_values = set()
+        
+        with self._lock:
+            
+            for value in values:
+                
+                if value in self._values_to_ids:
+                    
+                    value_id = self._values_to_ids.pop( value )
+                    
+                    self._values_to_ids[ value ] = value_id
+                    
+                    values_to_ids[ value ] = value_id
+                    
+                else:
+                    
+                    missing_values.add( value )
+                    
+                
+            
+        
+        return ( values_to_ids, missing_values )
+        
+    
 class TemporaryIntegerTable( object ):
     
     def __init__( self, cursor, integer_iterable, column_name ):
@@ -914,3 +1600,33 @@ class TemporaryIntegerTable( object ):
         return False
         
     
+class TemporaryValueTable( object ):
+    
+    # like TemporaryIntegerTable, but for hashes, subtags or anything else we want to join against in bulk
+    
+    def __init__( self, cursor, value_iterable, column_name, column_type ):
+        
+        self._cursor = cursor
+        self._value_iterable = value_iterable
+        self._column_name = column_name
+        self._column_type = column_type
+        
+        self._table_name = 'mem.tempvalue' + os.urandom( 32 ).encode( 'hex' )
+        
+    
+    def __enter__( self ):
+        
+        self._cursor.execute( 'CREATE TABLE ' + self._table_name + ' ( ' + self._column_name + ' ' + self._column_type + ' PRIMARY KEY );' )
+        
+        self._cursor.executemany( 'INSERT OR IGNORE INTO ' + self._table_name + ' ( ' + self._column_name + ' ) VALUES ( ? );', ( ( value, ) for value in self._value_iterable ) )
+        
+        return self._table_name
+        
+    
+    def __exit__( self, exc_type, exc_val, exc_tb ):
+        
+        self._cursor.execute( 'DROP TABLE ' + self._table_name + ';' )
+        
+        return False
+        
+    
@@ -22,6 +22,8 @@ import HydrusData
 
 # Mime
 
+HEADER_SIZE = 256
+
 header_and_mime = [
     ( 0, '\xff\xd8', HC.IMAGE_JPEG ),
     ( 0, 'GIF87a', HC.IMAGE_GIF ),
@@ -156,6 +158,22 @@ def GenerateThumbnailFromStaticImagePIL( path, dimensions = HC.UNSCALED_THUMBNAI
     
 GenerateThumbnailFromStaticImage = GenerateThumbnailFromStaticImagePIL
 
+def GetAllHashesFromPath( path ):
+    
+    # one read of the file for sha256 and the extra hashes, rather than going back to disk for each
+    
+    stream_hasher = StreamHasher()
+    
+    with open( path, 'rb' ) as f:
+        
+        for block in HydrusPaths.ReadFileLikeAsBlocks( f ):
+            
+            stream_hasher.Update( block )
+            
+        
+    
+    return stream_hasher.GetHashes()
+    
 def GetExtraHashesFromPath( path ):
     
     h_md5 = hashlib.md5()
@@ -252,6 +270,20 @@ def GetHashFromPath( path ):
     
     return h.digest()
     
+def GetHeaderMime( bit_to_check ):
+    
+    for ( offset, header, mime ) in header_and_mime:
+        
+        offset_bit_to_check = bit_to_check[ offset: ]
+        
+        if offset_bit_to_check.startswith( header ):
+            
+            return mime
+            
+        
+    
+    return None
+    
 def GetMime( path ):
     
     size = os.path.getsize( path )
@@ -265,40 +297,34 @@ def GetMime( path ):
         
         f.seek( 0 )
         
-        bit_to_check = f.read( 256 )
+        bit_to_check = f.read( HEADER_SIZE )
         
     
-    for ( offset, header, mime ) in header_and_mime:
+    mime = GetHeaderMime( bit_to_check )
+    
+    if mime == HC.UNDETERMINED_WM:
         
-        offset_bit_to_check = bit_to_check[ offset: ]
+        if HydrusVideoHandling.HasVideoStream( path ):
+            
+            return HC.VIDEO_WMV
+            
         
-        if offset_bit_to_check.startswith( header ):
+        # we'll catch and verify wma later
+        
+    elif mime == HC.UNDETERMINED_PNG:
+        
+        if HydrusVideoHandling.HasVideoStream( path ):
             
-            if mime == HC.UNDETERMINED_WM:
-                
-                if HydrusVideoHandling.HasVideoStream( path ):
-                    
-                    return HC.VIDEO_WMV
-                    
-                
-                # we'll catch and verify wma later
-                
-            elif mime == HC.UNDETERMINED_PNG:
-                
-                if HydrusVideoHandling.HasVideoStream( path ):
-                    
-                    return HC.IMAGE_APNG
-                    
-                else:
-                    
-                    return HC.IMAGE_PNG
-                    
-                
-            else:
-                
-                return mime
-                
+            return HC.IMAGE_APNG
+            
+        else:
             
+            return HC.IMAGE_PNG
+            
+        
+    elif mime is not None:
+        
+        return mime
         
     
     try:
@@ -332,3 +358,67 @@ def GetMime( path ):
     
     return HC.APPLICATION_UNKNOWN
     
+class StreamHasher( object ):
+    
+    # fed a file's blocks in order as they are read or downloaded, so the file does not have to come off disk again to be hashed and sniffed
+    
+    def __init__( self ):
+        
+        self._h_sha256 = hashlib.sha256()
+        self._h_md5 = hashlib.md5()
+        self._h_sha1 = hashlib.sha1()
+        self._h_sha512 = hashlib.sha512()
+        
+        self._header = ''
+        self._num_bytes = 0
+        
+    
+    def GetHashes( self ):
+        
+        sha256 = self._h_sha256.digest()
+        md5 = self._h_md5.digest()
+        sha1 = self._h_sha1.digest()
+        sha512 = self._h_sha512.digest()
+        
+        return ( sha256, md5, sha1, sha512 )
+        
+    
+    def GetHeaderMime( self ):
+        
+        return GetHeaderMime( self._header )
+        
+    
+    def GetMime( self ):
+        
+        # only the mimes the header is enough for--anything else needs GetMime on the whole file
+        
+        mime = self.GetHeaderMime()
+        
+        if mime in ( HC.UNDETERMINED_WM, HC.UNDETERMINED_PNG ):
+            
+            return None
+            
+        
+        return mime
+        
+    
+    def GetNumBytes( self ):
+        
+        return self._num_bytes
+        
+    
+    def Update( self, block ):
+        
+        if len( self._header ) < HEADER_SIZE:
+            
+            self._header += block[ : HEADER_SIZE - len( self._header ) ]
+            
+        
+        self._h_sha256.update( block )
+        self._h_md5.update( block )
+        self._h_sha1.update( block )
+        self._h_sha512.update( block )
+        
+        self._num_bytes += len( block )
+        
+    
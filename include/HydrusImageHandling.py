@@ -125,68 +125,55 @@ def GeneratePILImage( path ):
         raise
         
     
-    if pil_image.format == 'JPEG' and hasattr( pil_image, '_getexif' ):
+    orientation = GetEXIFOrientation( pil_image )
+    
+    if orientation == 1:
         
-        exif_dict = pil_image._getexif()
+        pass # normal
         
-        if exif_dict is not None:
-            
-            EXIF_ORIENTATION = 274
-            
-            if EXIF_ORIENTATION in exif_dict:
-                
-                orientation = exif_dict[ EXIF_ORIENTATION ]
-                
-                if orientation == 1:
-                    
-                    pass # normal
-                    
-                elif orientation == 2:
-                    
-                    # mirrored horizontal
-                    
-                    pil_image = pil_image.transpose( PILImage.FLIP_LEFT_RIGHT )
-                    
-                elif orientation == 3:
-                    
-                    # 180
-                    
-                    pil_image = pil_image.transpose( PILImage.ROTATE_180 )
-                    
-                elif orientation == 4:
-                    
-                    # mirrored vertical
-                    
-                    pil_image = pil_image.transpose( PILImage.FLIP_TOP_BOTTOM )
-                    
-                elif orientation == 5:
-                    
-                    # seems like these 90 degree rotations are wrong, but fliping them works for my posh example images, so I guess the PIL constants are odd
-                    
-                    # mirrored horizontal, then 90 CCW
-                    
-                    pil_image = pil_image.transpose( PILImage.FLIP_LEFT_RIGHT ).transpose( PILImage.ROTATE_90 )
-                    
-                elif orientation == 6:
-                    
-                    # 90 CW
-                    
-                    pil_image = pil_image.transpose( PILImage.ROTATE_270 )
-                    
-                elif orientation == 7:
-                    
-                    # mirrored horizontal, then 90 CCW
-                    
-                    pil_image = pil_image.transpose( PILImage.FLIP_LEFT_RIGHT ).transpose( PILImage.ROTATE_270 )
-                    
-                elif orientation == 8:
-                    
-                    # 90 CCW
-                    
-                    pil_image = pil_image.transpose( PILImage.ROTATE_90 )
-                    
-                
-            
+    elif orientation == 2:
+        
+        # mirrored horizontal
+        
+        pil_image = pil_image.transpose( PILImage.FLIP_LEFT_RIGHT )
+        
+    elif orientation == 3:
+        
+        # 180
+        
+        pil_image = pil_image.transpose( PILImage.ROTATE_180 )
+        
+    elif orientation == 4:
+        
+        # mirrored vertical
+        
+        pil_image = pil_image.transpose( PILImage.FLIP_TOP_BOTTOM )
+        
+    elif orientation == 5:
+        
+        # seems like these 90 degree rotations are wrong, but fliping them works for my posh example images, so I guess the PIL constants are odd
+        
+        # mirrored horizontal, then 90 CCW
+        
+        pil_image = pil_image.transpose( PILImage.FLIP_LEFT_RIGHT ).transpose( PILImage.ROTATE_90 )
+        
+    elif orientation == 6:
+        
+        # 90 CW
+        
+        pil_image = pil_image.transpose( PILImage.ROTATE_270 )
+        
+    elif orientation == 7:
+        
+        # mirrored horizontal, then 90 CCW
+        
+        pil_image = pil_image.transpose( PILImage.FLIP_LEFT_RIGHT ).transpose( PILImage.ROTATE_270 )
+        
+    elif orientation == 8:
+        
+        # 90 CCW
+        
+        pil_image = pil_image.transpose( PILImage.ROTATE_90 )
         
     
     if pil_image is None:
@@ -213,6 +200,25 @@ def GeneratePILImageFromNumpyImage( numpy_image ):
     
     return pil_image
     
+def GetEXIFOrientation( pil_image ):
+    
+    if pil_image.format == 'JPEG' and hasattr( pil_image, '_getexif' ):
+        
+        exif_dict = pil_image._getexif()
+        
+        if exif_dict is not None:
+            
+            EXIF_ORIENTATION = 274
+            
+            if EXIF_ORIENTATION in exif_dict:
+                
+                return exif_dict[ EXIF_ORIENTATION ]
+                
+            
+        
+    
+    return 1
+    
 def GetGIFFrameDurations( path ):
     
     pil_image = GeneratePILImage( path )
@@ -266,6 +272,24 @@ def GetImageProperties( path ):
     
     return ( ( width, height ), duration, num_frames )
     
+def GetResolution( path ):
+    
+    # this only reads the header, so unlike GeneratePILImage, an exif-rotated jpeg is not decoded and transposed just to get its size
+    
+    with open( path, 'rb' ) as f:
+        
+        pil_image = PILImage.open( f )
+        
+        ( x, y ) = pil_image.size
+        
+        if GetEXIFOrientation( pil_image ) in ( 5, 6, 7, 8 ):
+            
+            ( x, y ) = ( y, x )
+            
+        
+    
+    return ( x, y )
+    
 def GetResolutionAndNumFrames( path ):
     
     pil_image = GeneratePILImage( path )
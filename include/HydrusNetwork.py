@@ -5,11 +5,19 @@ import HydrusExceptions
 import HydrusGlobals as HG
 import HydrusNetworking
 import HydrusSerialisable
+import numpy
+import struct
 import threading
 
 INT_PARAMS = { 'expires', 'num', 'since', 'content_type', 'action', 'status' }
 BYTE_PARAMS = { 'access_key', 'account_type_key', 'subject_account_key', 'hash', 'registration_key', 'subject_hash', 'subject_tag', 'share_key', 'update_hash' }
 
+# the binary update format is a run of packed integer columns, each stored at the smallest width that fits it
+
+COLUMN_DTYPES = [ '>u1', '>i1', '>u2', '>i2', '>u4', '>i4', '>i8' ]
+COLUMN_HEADER_STRUCT = struct.Struct( '>BBI' )
+UPDATE_SECTION_HEADER_STRUCT = struct.Struct( '>BBB' )
+
 def GenerateDefaultServiceDictionary( service_type ):
     
     dictionary = HydrusSerialisable.SerialisableDictionary()
@@ -208,6 +216,72 @@ def DumpToGETQuery( args ):
     
     return query
     
+def PackBytesColumn( byte_strings ):
+    
+    return PackIntColumn( [ len( byte_string ) for byte_string in byte_strings ] ) + ''.join( byte_strings )
+    
+def PackIdGroups( groups ):
+    
+    # groups of ids are sets, so we sort them and store the gaps between them, which are small and compress well
+    
+    groups = [ sorted( group ) for group in groups ]
+    
+    counts = [ len( group ) for group in groups ]
+    firsts = [ group[0] for group in groups if len( group ) > 0 ]
+    
+    gaps = []
+    
+    for group in groups:
+        
+        gaps.extend( numpy.diff( numpy.array( group, dtype = numpy.int64 ) ).tolist() )
+        
+    
+    return PackIntColumn( counts ) + PackIntColumn( firsts ) + PackIntColumn( gaps )
+    
+def PackIntColumn( values ):
+    
+    num_values = len( values )
+    
+    nulls = [ value is None for value in values ]
+    
+    has_nulls = True in nulls
+    
+    if has_nulls:
+        
+        values = [ 0 if value is None else value for value in values ]
+        
+    
+    array = numpy.array( values, dtype = numpy.int64 )
+    
+    dtype_index = len( COLUMN_DTYPES ) - 1
+    
+    if num_values > 0:
+        
+        min_value = array.min()
+        max_value = array.max()
+        
+        for ( i, dtype ) in enumerate( COLUMN_DTYPES ):
+            
+            dtype_info = numpy.iinfo( dtype )
+            
+            if dtype_info.min <= min_value and max_value <= dtype_info.max:
+                
+                dtype_index = i
+                
+                break
+                
+            
+        
+    
+    column_string = COLUMN_HEADER_STRUCT.pack( dtype_index, has_nulls, num_values ) + array.astype( COLUMN_DTYPES[ dtype_index ] ).tostring()
+    
+    if has_nulls:
+        
+        column_string += numpy.packbits( numpy.array( nulls, dtype = numpy.uint8 ) ).tostring()
+        
+    
+    return column_string
+    
 def ParseBodyString( json_string ):
     
     if json_string == '':
@@ -318,6 +392,101 @@ def ParseGETArgs( requests_args ):
     
     return args
     
+def UnpackBytesColumn( binary_string, offset ):
+    
+    ( lengths, offset ) = UnpackIntColumn( binary_string, offset )
+    
+    byte_strings = []
+    
+    for length in lengths:
+        
+        byte_strings.append( binary_string[ offset : offset + length ] )
+        
+        offset += length
+        
+    
+    return ( byte_strings, offset )
+    
+def UnpackIdGroups( binary_string, offset ):
+    
+    ( counts, offset ) = UnpackIntColumn( binary_string, offset, as_array = True )
+    ( firsts, offset ) = UnpackIntColumn( binary_string, offset, as_array = True )
+    ( gaps, offset ) = UnpackIntColumn( binary_string, offset, as_array = True )
+    
+    ends = numpy.cumsum( counts )
+    
+    num_ids = int( ends[ -1 ] ) if len( ends ) > 0 else 0
+    
+    # put each group's gaps after a zero, add them all up, and then rebase each group on its first id
+    
+    non_empty_counts = counts[ counts > 0 ]
+    starts = ( ends - counts )[ counts > 0 ]
+    
+    all_gaps = numpy.zeros( num_ids, dtype = numpy.int64 )
+    
+    is_gap = numpy.ones( num_ids, dtype = numpy.bool_ )
+    is_gap[ starts ] = False
+    
+    all_gaps[ is_gap ] = gaps
+    
+    running_totals = numpy.cumsum( all_gaps )
+    
+    ids = running_totals - numpy.repeat( running_totals[ starts ], non_empty_counts ) + numpy.repeat( firsts, non_empty_counts )
+    
+    ids = ids.tolist()
+    
+    groups = [ ids[ end - count : end ] for ( count, end ) in zip( counts.tolist(), ends.tolist() ) ]
+    
+    return ( groups, offset )
+    
+def UnpackIntColumn( binary_string, offset, as_array = False ):
+    
+    # sqlite won't take numpy ints, so by default we give back a flat list that can go straight to executemany
+    
+    ( dtype_index, has_nulls, num_values ) = COLUMN_HEADER_STRUCT.unpack_from( binary_string, offset )
+    
+    offset += COLUMN_HEADER_STRUCT.size
+    
+    if num_values == 0:
+        
+        array = numpy.zeros( 0, dtype = numpy.int64 )
+        
+    else:
+        
+        dtype = numpy.dtype( COLUMN_DTYPES[ dtype_index ] )
+        
+        array = numpy.frombuffer( binary_string, dtype = dtype, count = num_values, offset = offset ).astype( numpy.int64 )
+        
+        offset += num_values * dtype.itemsize
+        
+    
+    null_indices = []
+    
+    if has_nulls:
+        
+        num_null_bytes = ( num_values + 7 ) // 8
+        
+        nulls = numpy.unpackbits( numpy.frombuffer( binary_string, dtype = numpy.uint8, count = num_null_bytes, offset = offset ) )[ : num_values ]
+        
+        null_indices = numpy.flatnonzero( nulls ).tolist()
+        
+        offset += num_null_bytes
+        
+    
+    if as_array:
+        
+        return ( array, offset )
+        
+    
+    values = array.tolist()
+    
+    for i in null_indices:
+        
+        values[ i ] = None
+        
+    
+    return ( values, offset )
+    
 class Account( object ):
     
     def __init__( self, account_key, account_type, created, expires, banned_info = None, bandwidth_tracker = None ):
@@ -1204,6 +1373,7 @@ class ContentUpdate( HydrusSerialisable.SerialisableBase ):
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_CONTENT_UPDATE
     SERIALISABLE_NAME = 'Content Update'
     SERIALISABLE_VERSION = 1
+    SERIALISABLE_BINARY_VERSION = 1
     
     def __init__( self ):
         
@@ -1212,6 +1382,51 @@ class ContentUpdate( HydrusSerialisable.SerialisableBase ):
         self._content_data = {}
         
     
+    def _GetBinaryString( self ):
+        
+        # each ( content_type, action ) gets a section of columns. mappings are ( tag, group of files ), everything else is simple rows or tuple rows
+        
+        section_strings = []
+        
+        for ( content_type, actions_to_datas ) in self._content_data.items():
+            
+            for ( action, data ) in actions_to_datas.items():
+                
+                if len( data ) == 0:
+                    
+                    continue
+                    
+                
+                if content_type == HC.CONTENT_TYPE_MAPPINGS:
+                    
+                    ( service_tag_ids, groups_of_service_hash_ids ) = zip( *data )
+                    
+                    num_columns = 2
+                    
+                    columns_string = PackIntColumn( service_tag_ids ) + PackIdGroups( groups_of_service_hash_ids )
+                    
+                elif isinstance( data[0], ( tuple, list ) ):
+                    
+                    columns = zip( *data )
+                    
+                    num_columns = len( columns )
+                    
+                    columns_string = ''.join( ( PackIntColumn( column ) for column in columns ) )
+                    
+                else:
+                    
+                    num_columns = 0
+                    
+                    columns_string = PackIntColumn( data )
+                    
+                
+                section_strings.append( UPDATE_SECTION_HEADER_STRUCT.pack( content_type, action, num_columns ) + columns_string )
+                
+            
+        
+        return ''.join( section_strings )
+        
+    
     def _GetContent( self, content_type, action ):
         
         if content_type in self._content_data:
@@ -1239,6 +1454,50 @@ class ContentUpdate( HydrusSerialisable.SerialisableBase ):
         return serialisable_info
         
     
+    def _InitialiseFromBinaryString( self, binary_string ):
+        
+        offset = 0
+        
+        while offset < len( binary_string ):
+            
+            ( content_type, action, num_columns ) = UPDATE_SECTION_HEADER_STRUCT.unpack_from( binary_string, offset )
+            
+            offset += UPDATE_SECTION_HEADER_STRUCT.size
+            
+            if content_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                ( service_tag_ids, offset ) = UnpackIntColumn( binary_string, offset )
+                ( groups_of_service_hash_ids, offset ) = UnpackIdGroups( binary_string, offset )
+                
+                data = zip( service_tag_ids, groups_of_service_hash_ids )
+                
+            elif num_columns > 0:
+                
+                columns = []
+                
+                for i in range( num_columns ):
+                    
+                    ( column, offset ) = UnpackIntColumn( binary_string, offset )
+                    
+                    columns.append( column )
+                    
+                
+                data = zip( *columns )
+                
+            else:
+                
+                ( data, offset ) = UnpackIntColumn( binary_string, offset )
+                
+            
+            if content_type not in self._content_data:
+                
+                self._content_data[ content_type ] = {}
+                
+            
+            self._content_data[ content_type ][ action ] = data
+            
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         for ( content_type, serialisable_actions_to_datas ) in serialisable_info:
@@ -1515,6 +1774,7 @@ class DefinitionsUpdate( HydrusSerialisable.SerialisableBase ):
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_DEFINITIONS_UPDATE
     SERIALISABLE_NAME = 'Definitions Update'
     SERIALISABLE_VERSION = 1
+    SERIALISABLE_BINARY_VERSION = 1
     
     def __init__( self ):
         
@@ -1524,6 +1784,19 @@ class DefinitionsUpdate( HydrusSerialisable.SerialisableBase ):
         self._tag_ids_to_tags = {}
         
     
+    def _GetBinaryString( self ):
+        
+        # definition ids are mostly consecutive, so we store them in order as one id group
+        
+        hash_ids = sorted( self._hash_ids_to_hashes.keys() )
+        hashes = [ self._hash_ids_to_hashes[ hash_id ] for hash_id in hash_ids ]
+        
+        tag_ids = sorted( self._tag_ids_to_tags.keys() )
+        encoded_tags = [ HydrusData.ToUnicode( self._tag_ids_to_tags[ tag_id ] ).encode( 'utf-8' ) for tag_id in tag_ids ]
+        
+        return PackIdGroups( [ hash_ids ] ) + PackBytesColumn( hashes ) + PackIdGroups( [ tag_ids ] ) + PackBytesColumn( encoded_tags )
+        
+    
     def _GetSerialisableInfo( self ):
         
         serialisable_info = []
@@ -1541,6 +1814,20 @@ class DefinitionsUpdate( HydrusSerialisable.SerialisableBase ):
         return serialisable_info
         
     
+    def _InitialiseFromBinaryString( self, binary_string ):
+        
+        offset = 0
+        
+        ( ( hash_ids, ), offset ) = UnpackIdGroups( binary_string, offset )
+        ( hashes, offset ) = UnpackBytesColumn( binary_string, offset )
+        
+        ( ( tag_ids, ), offset ) = UnpackIdGroups( binary_string, offset )
+        ( encoded_tags, offset ) = UnpackBytesColumn( binary_string, offset )
+        
+        self._hash_ids_to_hashes = dict( zip( hash_ids, hashes ) )
+        self._tag_ids_to_tags = { tag_id : encoded_tag.decode( 'utf-8' ) for ( tag_id, encoded_tag ) in zip( tag_ids, encoded_tags ) }
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         for ( definition_type, definitions ) in serialisable_info:
@@ -1,5 +1,6 @@
 import json
 import lz4.block
+import struct
 import zlib
 
 SERIALISABLE_TYPE_BASE = 0
@@ -63,8 +64,31 @@ SERIALISABLE_TYPE_SEED = 57
 
 SERIALISABLE_TYPES_TO_OBJECT_TYPES = {}
 
+# binary network strings are for big objects like repository updates that are mostly packed columns of integers
+# the prefix cannot start a zlib stream, so old json network strings are still read as before
+
+BINARY_NETWORK_STRING_PREFIX = '\x00hydrus binary serialisable\x00'
+BINARY_HEADER_STRUCT = struct.Struct( '>HH' )
+
+def CreateFromBinaryNetworkString( network_string ):
+    
+    binary_string = lz4.block.decompress( network_string[ len( BINARY_NETWORK_STRING_PREFIX ) : ] )
+    
+    ( serialisable_type, binary_version ) = BINARY_HEADER_STRUCT.unpack_from( binary_string )
+    
+    obj = SERIALISABLE_TYPES_TO_OBJECT_TYPES[ serialisable_type ]()
+    
+    obj.InitialiseFromBinaryString( binary_version, binary_string[ BINARY_HEADER_STRUCT.size : ] )
+    
+    return obj
+    
 def CreateFromNetworkString( network_string ):
     
+    if network_string.startswith( BINARY_NETWORK_STRING_PREFIX ):
+        
+        return CreateFromBinaryNetworkString( network_string )
+        
+    
     try:
         
         obj_string = zlib.decompress( network_string )
@@ -106,12 +130,23 @@ class SerialisableBase( object ):
     SERIALISABLE_TYPE = SERIALISABLE_TYPE_BASE
     SERIALISABLE_NAME = 'Base Serialisable Object'
     SERIALISABLE_VERSION = 1
+    SERIALISABLE_BINARY_VERSION = None
+    
+    def _GetBinaryString( self ):
+        
+        raise NotImplementedError()
+        
     
     def _GetSerialisableInfo( self ):
         
         raise NotImplementedError()
         
     
+    def _InitialiseFromBinaryString( self, binary_string ):
+        
+        raise NotImplementedError()
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         raise NotImplementedError()
@@ -122,6 +157,13 @@ class SerialisableBase( object ):
         return old_serialisable_info
         
     
+    def DumpToBinaryNetworkString( self ):
+        
+        binary_string = BINARY_HEADER_STRUCT.pack( self.SERIALISABLE_TYPE, self.SERIALISABLE_BINARY_VERSION ) + self._GetBinaryString()
+        
+        return BINARY_NETWORK_STRING_PREFIX + lz4.block.compress( binary_string, mode = 'high_compression' )
+        
+    
     def DumpToNetworkString( self ):
         
         obj_string = self.DumpToString()
@@ -146,6 +188,16 @@ class SerialisableBase( object ):
         return ( self.SERIALISABLE_TYPE, self.SERIALISABLE_VERSION, self._GetSerialisableInfo() )
         
     
+    def InitialiseFromBinaryString( self, binary_version, binary_string ):
+        
+        if binary_version != self.SERIALISABLE_BINARY_VERSION:
+            
+            raise Exception( 'Cannot read version ' + str( binary_version ) + ' of the binary ' + self.SERIALISABLE_NAME + ' format! Please check you are running the latest version!' )
+            
+        
+        self._InitialiseFromBinaryString( binary_string )
+        
+    
     def InitialiseFromSerialisableInfo( self, version, serialisable_info ):
         
         while version < self.SERIALISABLE_VERSION:
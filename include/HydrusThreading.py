@@ -6,10 +6,14 @@ import traceback
 import HydrusData
 import HydrusGlobals as HG
 import os
+import sys
 
 THREADS_TO_THREAD_INFO = {}
 THREAD_INFO_LOCK = threading.Lock()
 
+# below the size of the controller's CallToThread pool, so a big machine's prefetch cannot crowd out everything else
+MAX_NUM_PREFETCH_THREADS = 8
+
 def GetThreadInfo( thread = None ):
     
     if thread is None:
@@ -48,6 +52,188 @@ def ShutdownThread( thread ):
     
     thread_info[ 'shutting_down' ] = True
     
+class BackgroundPrefetcher( object ):
+    
+    # calls func on each item in other threads, keeping up to num_to_prefetch results ready for the iterating thread
+    # results come out in order. if func raises, the exception is raised, with its original traceback, in the iterating thread when it gets to that item
+    # if results hold resources, like temp files, discard_func is called on any that are made but never yielded
+    # the workers wait on the iterating thread, so they get long running threads. in the CallToThread pool, they could sit on every thread and starve each other
+    
+    def __init__( self, controller, func, items, num_to_prefetch = 4, num_threads = 1, discard_func = None ):
+        
+        self._func = func
+        self._items = list( items )
+        self._discard_func = discard_func
+        
+        self._num_to_prefetch = max( 1, num_to_prefetch, num_threads )
+        
+        self._next_index_to_fetch = 0
+        self._num_consumed = 0
+        self._indices_to_results = {}
+        
+        self._condition = threading.Condition()
+        
+        self._cancelled = threading.Event()
+        
+        self._time_spent_waiting = 0.0
+        
+        num_threads = min( max( 1, num_threads ), MAX_NUM_PREFETCH_THREADS )
+        
+        for i in range( num_threads ):
+            
+            controller.CallToThreadLongRunning( self.THREADPrefetch )
+            
+        
+    
+    def __iter__( self ):
+        
+        try:
+            
+            for ( index, item ) in enumerate( self._items ):
+                
+                started_waiting = time.time()
+                
+                with self._condition:
+                    
+                    while index not in self._indices_to_results:
+                        
+                        self._condition.wait( 1 )
+                        
+                        if HG.model_shutdown:
+                            
+                            raise HydrusExceptions.ShutdownException( 'Application shutting down!' )
+                            
+                        
+                    
+                    ( success, result ) = self._indices_to_results.pop( index )
+                    
+                    self._num_consumed += 1
+                    
+                    self._condition.notify_all()
+                    
+                
+                self._time_spent_waiting += time.time() - started_waiting
+                
+                if not success:
+                    
+                    ( etype, value, tb ) = result
+                    
+                    raise etype, value, tb
+                    
+                
+                yield ( item, result )
+                
+            
+        finally:
+            
+            self.Cancel()
+            
+        
+    
+    def _Discard( self, results ):
+        
+        if self._discard_func is None:
+            
+            return
+            
+        
+        for ( success, result ) in results:
+            
+            if success:
+                
+                try:
+                    
+                    self._discard_func( result )
+                    
+                except Exception as e:
+                    
+                    HydrusData.PrintException( e, do_wait = False )
+                    
+                
+            
+        
+    
+    def Cancel( self ):
+        
+        with self._condition:
+            
+            self._cancelled.set()
+            
+            unconsumed_results = self._indices_to_results.values()
+            
+            self._indices_to_results = {}
+            
+            self._condition.notify_all()
+            
+        
+        self._Discard( unconsumed_results )
+        
+    
+    def GetTimeSpentWaiting( self ):
+        
+        return self._time_spent_waiting
+        
+    
+    def THREADPrefetch( self ):
+        
+        while True:
+            
+            with self._condition:
+                
+                # don't get more than num_to_prefetch ahead of the iterating thread
+                
+                while self._next_index_to_fetch >= self._num_consumed + self._num_to_prefetch:
+                    
+                    if self._cancelled.is_set() or HG.model_shutdown:
+                        
+                        return
+                        
+                    
+                    self._condition.wait( 1 )
+                    
+                
+                if self._cancelled.is_set() or HG.model_shutdown or self._next_index_to_fetch >= len( self._items ):
+                    
+                    return
+                    
+                
+                index = self._next_index_to_fetch
+                
+                self._next_index_to_fetch += 1
+                
+            
+            try:
+                
+                result = ( True, self._func( self._items[ index ] ) )
+                
+            except Exception:
+                
+                # keep the traceback so the iterating thread's error points at the real problem
+                
+                result = ( False, sys.exc_info() )
+                
+            
+            with self._condition:
+                
+                cancelled = self._cancelled.is_set()
+                
+                if not cancelled:
+                    
+                    self._indices_to_results[ index ] = result
+                    
+                    self._condition.notify_all()
+                    
+                
+            
+            if cancelled:
+                
+                self._Discard( ( result, ) )
+                
+                return
+                
+            
+        
+    
 class DAEMON( threading.Thread ):
     
     def __init__( self, controller, name, period = 1200 ):
@@ -1560,7 +1560,7 @@ class DB( HydrusDB.HydrusDB ):
                     total_content_rows += num_rows
                     
                 
-                update_bytes = update.DumpToNetworkString()
+                update_bytes = update.DumpToBinaryNetworkString()
                 
                 update_hash = hashlib.sha256( update_bytes ).digest()
                 
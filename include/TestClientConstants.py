@@ -8,10 +8,128 @@ import collections
 import HydrusConstants as HC
 import os
 import TestConstants
+import threading
+import time
 import unittest
 import HydrusData
 import HydrusGlobals as HG
 
+class TestDataCache( unittest.TestCase ):
+    
+    class _Data( object ):
+        
+        def __init__( self, memory_footprint ):
+            
+            self.memory_footprint = memory_footprint
+            
+        
+        def GetEstimatedMemoryFootprint( self ):
+            
+            return self.memory_footprint
+            
+        
+    
+    def test_eviction( self ):
+        
+        data_cache = ClientCaches.DataCache( HG.test_controller, 100 )
+        
+        for i in range( 5 ):
+            
+            data_cache.AddData( i, self._Data( 20 ) )
+            
+        
+        self.assertEqual( data_cache.GetStatistics()[:2], ( 5, 100 ) )
+        
+        # touching 0 makes 1 the least recently used
+        
+        data_cache.GetData( 0 )
+        
+        data_cache.AddData( 5, self._Data( 20 ) )
+        
+        self.assertTrue( data_cache.HasData( 0 ) )
+        self.assertFalse( data_cache.HasData( 1 ) )
+        self.assertTrue( data_cache.HasData( 5 ) )
+        
+        # a bigger item pushes out as many of the oldest as it needs
+        
+        data_cache.AddData( 6, self._Data( 50 ) )
+        
+        self.assertEqual( [ i for i in range( 7 ) if data_cache.HasData( i ) ], [ 0, 5, 6 ] )
+        
+        ( num_items, total_size, cache_size, num_hits, num_misses, num_evictions, num_overflows ) = data_cache.GetStatistics()
+        
+        self.assertEqual( ( num_items, total_size, num_evictions ), ( 3, 90, 4 ) )
+        
+        self.assertEqual( data_cache.GetIfHasData( 1 ), None )
+        
+        self.assertRaises( Exception, data_cache.GetData, 1 )
+        
+        # items that change size as they are used are reaccounted
+        
+        data_cache.GetData( 6 ).memory_footprint = 60
+        
+        data_cache.GetData( 6 )
+        
+        self.assertEqual( data_cache.GetStatistics()[:2], ( 3, 100 ) )
+        
+        data_cache.Clear()
+        
+        self.assertEqual( data_cache.GetStatistics()[:2], ( 0, 0 ) )
+        
+    
+    def test_max_item_size( self ):
+        
+        data_cache = ClientCaches.DataCache( HG.test_controller, 100, max_item_size = 30 )
+        
+        for i in range( 4 ):
+            
+            data_cache.AddData( i, self._Data( 20 ) )
+            
+        
+        big_data = self._Data( 90 )
+        
+        data_cache.AddData( 'big', big_data )
+        
+        # the big item does not push anything out, but it is still there for the next repaint
+        
+        self.assertEqual( data_cache.GetStatistics()[:2], ( 4, 80 ) )
+        
+        self.assertTrue( all( data_cache.HasData( i ) for i in range( 4 ) ) )
+        
+        self.assertIs( data_cache.GetData( 'big' ), big_data )
+        self.assertIs( data_cache.GetIfHasData( 'big' ), big_data )
+        
+        # but only the most recent big item is kept
+        
+        data_cache.AddData( 'bigger', self._Data( 95 ) )
+        
+        self.assertFalse( data_cache.HasData( 'big' ) )
+        self.assertTrue( data_cache.HasData( 'bigger' ) )
+        
+        ( num_items, total_size, cache_size, num_hits, num_misses, num_evictions, num_overflows ) = data_cache.GetStatistics()
+        
+        self.assertEqual( ( num_items, total_size, num_evictions, num_overflows ), ( 4, 80, 0, 2 ) )
+        
+        data_cache.Clear()
+        
+        self.assertFalse( data_cache.HasData( 'bigger' ) )
+        
+    
+    def test_timeout( self ):
+        
+        data_cache = ClientCaches.DataCache( HG.test_controller, 100, timeout = -1, max_item_size = 30 )
+        
+        data_cache.AddData( 'small', self._Data( 20 ) )
+        data_cache.AddData( 'big', self._Data( 50 ) )
+        
+        data_cache.MaintainCache()
+        
+        self.assertFalse( data_cache.HasData( 'small' ) )
+        self.assertFalse( data_cache.HasData( 'big' ) )
+        
+        self.assertEqual( data_cache.GetStatistics()[:2], ( 0, 0 ) )
+        
+    
 class TestFunctions( unittest.TestCase ):
     
     def test_multipart( self ):
@@ -162,3 +280,235 @@ class TestManagers( unittest.TestCase ):
         self.assertEqual( ( u'undo archive 2 files', None ), undo_manager.GetUndoRedoStrings() )
         
     
+class TestThumbnailCache( unittest.TestCase ):
+    
+    class _Controller( object ):
+        
+        def __init__( self, num_decode_threads ):
+            
+            self._new_options = ClientData.ClientOptions( HG.test_controller.GetDBDir() )
+            
+            self._new_options.SetInteger( 'thumbnail_decode_threads', num_decode_threads )
+            
+            self.threads = []
+            
+            self.published = []
+            
+        
+        def CallToThreadLongRunning( self, callable, *args, **kwargs ):
+            
+            thread = threading.Thread( target = callable, args = args, kwargs = kwargs )
+            
+            thread.daemon = True
+            
+            thread.start()
+            
+            self.threads.append( thread )
+            
+        
+        def GetNewOptions( self ):
+            
+            return self._new_options
+            
+        
+        def GetOptions( self ):
+            
+            return HC.options
+            
+        
+        def pub( self, topic, *args ):
+            
+            if topic == 'waterfall_thumbnails':
+                
+                ( page_key, medias ) = args
+                
+                self.published.extend( ( ( page_key, media ) for media in medias ) )
+                
+            
+        
+        def sub( self, object, method_name, topic ):
+            
+            pass
+            
+        
+    
+    class _Media( object ):
+        
+        def __init__( self, hash ):
+            
+            self._hash = hash
+            
+        
+        def GetDisplayMedia( self ):
+            
+            return self
+            
+        
+        def GetHash( self ):
+            
+            return self._hash
+            
+        
+    
+    def _GetThumbnailCache( self, num_decode_threads, get_thumbnail ):
+        
+        self._controller = self._Controller( num_decode_threads )
+        
+        thumbnail_cache = ClientCaches.ThumbnailCache( self._controller )
+        
+        thumbnail_cache.GetThumbnail = get_thumbnail
+        
+        self._thumbnail_cache = thumbnail_cache
+        
+        return thumbnail_cache
+        
+    
+    def _WaitForWaterfall( self ):
+        
+        for i in range( 500 ):
+            
+            if not self._thumbnail_cache.DoingWork():
+                
+                return
+                
+            
+            time.sleep( 0.01 )
+            
+        
+        raise Exception( 'The waterfall did not finish!' )
+        
+    
+    def tearDown( self ):
+        
+        HG.view_shutdown = True
+        
+        try:
+            
+            self._thumbnail_cache._waterfall_event.set()
+            
+            for thread in self._controller.threads:
+                
+                thread.join()
+                
+            
+        finally:
+            
+            HG.view_shutdown = False
+            
+        
+    
+    def test_doing_work( self ):
+        
+        page_key = HydrusData.GenerateKey()
+        
+        media = self._Media( HydrusData.GenerateKey() )
+        
+        release = threading.Event()
+        started = threading.Event()
+        
+        def get_thumbnail( media ):
+            
+            started.set()
+            
+            release.wait( 10 )
+            
+        
+        thumbnail_cache = self._GetThumbnailCache( 1, get_thumbnail )
+        
+        thumbnail_cache.Waterfall( page_key, [ media ] )
+        
+        started.wait( 5 )
+        
+        # the queue is empty, but the decode is not done, so we are still busy
+        
+        self.assertEqual( thumbnail_cache._waterfall_queue_random, [] )
+        self.assertTrue( thumbnail_cache.DoingWork() )
+        
+        release.set()
+        
+        self._WaitForWaterfall()
+        
+        self.assertEqual( self._controller.published, [ ( page_key, media ) ] )
+        
+    
+    def test_waterfall( self ):
+        
+        page_key = HydrusData.GenerateKey()
+        
+        medias = [ self._Media( HydrusData.GenerateKey() ) for i in range( 50 ) ]
+        
+        broken_medias = set( medias[ : 5 ] )
+        
+        decode_threads = set()
+        
+        def get_thumbnail( media ):
+            
+            decode_threads.add( threading.current_thread() )
+            
+            time.sleep( 0.005 )
+            
+            if media in broken_medias:
+                
+                raise Exception( 'Could not render that thumbnail!' )
+                
+            
+        
+        thumbnail_cache = self._GetThumbnailCache( 4, get_thumbnail )
+        
+        thumbnail_cache.Waterfall( page_key, medias )
+        
+        self._WaitForWaterfall()
+        
+        # everything that loaded is published once, in the waterfall's hash order, and broken thumbnails are not published
+        
+        expected = [ ( page_key, media ) for media in sorted( medias, key = lambda media: media.GetHash() ) if media not in broken_medias ]
+        
+        self.assertEqual( self._controller.published, expected )
+        
+        self.assertEqual( len( decode_threads ), 4 )
+        
+    
+    def test_waterfall_cancel( self ):
+        
+        page_key = HydrusData.GenerateKey()
+        
+        medias = [ self._Media( HydrusData.GenerateKey() ) for i in range( 50 ) ]
+        
+        release = threading.Event()
+        
+        loaded_medias = []
+        
+        def get_thumbnail( media ):
+            
+            loaded_medias.append( media )
+            
+            release.wait( 10 )
+            
+        
+        thumbnail_cache = self._GetThumbnailCache( 2, get_thumbnail )
+        
+        thumbnail_cache.Waterfall( page_key, medias )
+        
+        for i in range( 500 ):
+            
+            if len( loaded_medias ) == 2:
+                
+                break
+                
+            
+            time.sleep( 0.01 )
+            
+        
+        # both decode threads are now busy, and the rest of their batch is waiting in the decode queue
+        
+        thumbnail_cache.CancelWaterfall( page_key, medias )
+        
+        release.set()
+        
+        self._WaitForWaterfall()
+        
+        self.assertEqual( len( loaded_medias ), 2 )
+        
+        self.assertEqual( self._controller.published, [] )
+        
+    
@@ -0,0 +1,115 @@
+import ClientController
+import ClientSearch
+import ClientThreading
+import HydrusData
+import unittest
+
+class TestFileQuery( unittest.TestCase ):
+    
+    class _Controller( ClientController.Controller ):
+        
+        def __init__( self, num_results ):
+            
+            self._num_results = num_results
+            
+            self.job_key = ClientThreading.JobKey( cancellable = True )
+            
+            self.num_media_reads = 0
+            
+            self.pubs = []
+            
+        
+        def pub( self, topic, *args, **kwargs ):
+            
+            self.pubs.append( ( topic, args ) )
+            
+        
+        def Read( self, action, *args, **kwargs ):
+            
+            if action == 'file_query_ids':
+                
+                return range( self._num_results )
+                
+            elif action == 'media_results_from_ids':
+                
+                ( hash_ids, ) = args
+                
+                self.num_media_reads += 1
+                
+                return [ 'media ' + str( hash_id ) for hash_id in hash_ids ]
+                
+            
+        
+    
+    def setUp( self ):
+        
+        self._old_chunk_size = ClientController.FILE_QUERY_CHUNK_SIZE
+        
+        ClientController.FILE_QUERY_CHUNK_SIZE = 2
+        
+    
+    def tearDown( self ):
+        
+        ClientController.FILE_QUERY_CHUNK_SIZE = self._old_chunk_size
+        
+    
+    def _DoQuery( self, controller ):
+        
+        page_key = HydrusData.GenerateKey()
+        
+        search_context = ClientSearch.FileSearchContext()
+        
+        controller.THREADDoFileQuery( page_key, controller.job_key, search_context )
+        
+        return ( page_key, search_context )
+        
+    
+    def test_big_query( self ):
+        
+        controller = self._Controller( 11 )
+        
+        ( page_key, search_context ) = self._DoQuery( controller )
+        
+        # only the first chunk is loaded, and the rest of the ids, still in order, go to the page for it to fetch as it scrolls
+        
+        expected_pubs = []
+        
+        expected_pubs.append( ( 'file_query_done', ( page_key, controller.job_key, [ 'media 0', 'media 1' ], range( 2, 11 ) ) ) )
+        
+        self.assertEqual( controller.pubs, expected_pubs )
+        self.assertEqual( controller.num_media_reads, 1 )
+        
+        self.assertTrue( search_context.IsComplete() )
+        
+    
+    def test_cancel( self ):
+        
+        controller = self._Controller( 11 )
+        
+        controller.job_key.Cancel()
+        
+        ( page_key, search_context ) = self._DoQuery( controller )
+        
+        # a search that was replaced while the db was finding its ids loads and sends nothing
+        
+        self.assertEqual( controller.pubs, [] )
+        self.assertEqual( controller.num_media_reads, 0 )
+        
+        self.assertFalse( search_context.IsComplete() )
+        
+    
+    def test_small_query( self ):
+        
+        controller = self._Controller( 2 )
+        
+        ( page_key, search_context ) = self._DoQuery( controller )
+        
+        expected_pubs = []
+        
+        expected_pubs.append( ( 'file_query_done', ( page_key, controller.job_key, [ 'media 0', 'media 1' ], [] ) ) )
+        
+        self.assertEqual( controller.pubs, expected_pubs )
+        
+        self.assertTrue( search_context.IsComplete() )
+        
+    
@@ -0,0 +1,188 @@
+import ClientFiles
+import HydrusData
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestThumbnailBlobStore( unittest.TestCase ):
+    
+    def setUp( self ):
+        
+        self._dir = tempfile.mkdtemp()
+        
+        self._path = os.path.join( self._dir, 'client_thumbnail_store' )
+        
+    
+    def tearDown( self ):
+        
+        shutil.rmtree( self._dir )
+        
+    
+    def _GetData( self, i, length = 100 ):
+        
+        return chr( i % 256 ) * length
+        
+    
+    def test_compaction( self ):
+        
+        store = ClientFiles.ThumbnailBlobStore( self._path )
+        
+        store.MAX_SEGMENT_SIZE = 1000
+        store.MIN_COMPACTION_DEAD_BYTES = 500
+        
+        hashes = [ HydrusData.GenerateKey() for i in range( 30 ) ]
+        
+        for ( i, hash ) in enumerate( hashes ):
+            
+            store.AddThumbnail( hash, self._GetData( i ), ( i, i + 1 ), 3 )
+            
+        
+        # 100 byte thumbnails and 1000 byte segments
+        
+        self.assertTrue( os.path.exists( os.path.join( self._path, ClientFiles.ThumbnailBlobStore.SEGMENT_FILENAME_TEMPLATE.format( 2 ) ) ) )
+        
+        store.DiscardThumbnails( hashes[ : 4 ] )
+        
+        self.assertEqual( store.GetNumDeadBytes(), 400 )
+        self.assertFalse( store.NeedsCompaction() )
+        
+        store.DiscardThumbnails( hashes[ 4 : 10 ] )
+        
+        self.assertEqual( store.GetNumDeadBytes(), 1000 )
+        self.assertTrue( store.NeedsCompaction() )
+        
+        store.Compact()
+        
+        self.assertEqual( store.GetNumDeadBytes(), 0 )
+        self.assertFalse( store.NeedsCompaction() )
+        
+        def check_store( store ):
+            
+            for ( i, hash ) in enumerate( hashes ):
+                
+                if i < 10:
+                    
+                    self.assertEqual( store.GetThumbnail( hash ), None )
+                    
+                else:
+                    
+                    self.assertEqual( store.GetThumbnail( hash ), ( self._GetData( i ), ( i, i + 1 ), 3 ) )
+                    
+                
+            
+        
+        check_store( store )
+        
+        self.assertEqual( sorted( os.listdir( self._dir ) ), [ 'client_thumbnail_store' ] )
+        
+        self.assertFalse( os.path.exists( os.path.join( self._path, ClientFiles.ThumbnailBlobStore.SEGMENT_FILENAME_TEMPLATE.format( 2 ) ) ) )
+        
+        # the compacted store is still a working store
+        
+        store.AddThumbnail( hashes[0], self._GetData( 0 ), ( 0, 1 ), 3 )
+        
+        self.assertEqual( store.GetThumbnail( hashes[0] ), ( self._GetData( 0 ), ( 0, 1 ), 3 ) )
+        
+        store.DiscardThumbnails( ( hashes[0], ) )
+        
+        store.Close()
+        
+        check_store( ClientFiles.ThumbnailBlobStore( self._path ) )
+        
+    
+    def test_store( self ):
+        
+        store = ClientFiles.ThumbnailBlobStore( self._path )
+        
+        ( hash_1, hash_2, hash_3 ) = [ HydrusData.GenerateKey() for i in range( 3 ) ]
+        
+        # write and read back
+        
+        store.AddThumbnail( hash_1, self._GetData( 1 ), ( 100, 150 ), 3 )
+        store.AddThumbnail( hash_2, self._GetData( 2, 200 ), ( 150, 100 ), 4 )
+        
+        self.assertTrue( store.HasThumbnail( hash_1 ) )
+        self.assertFalse( store.HasThumbnail( hash_3 ) )
+        
+        self.assertEqual( store.GetThumbnail( hash_1 ), ( self._GetData( 1 ), ( 100, 150 ), 3 ) )
+        self.assertEqual( store.GetThumbnail( hash_2 ), ( self._GetData( 2, 200 ), ( 150, 100 ), 4 ) )
+        self.assertEqual( store.GetThumbnail( hash_3 ), None )
+        
+        # adding again does not overwrite--regeneration discards first
+        
+        store.AddThumbnail( hash_1, self._GetData( 3 ), ( 100, 150 ), 3 )
+        
+        self.assertEqual( store.GetThumbnail( hash_1 ), ( self._GetData( 1 ), ( 100, 150 ), 3 ) )
+        
+        store.DiscardThumbnails( ( hash_1, ) )
+        
+        store.AddThumbnail( hash_1, self._GetData( 3, 50 ), ( 100, 150 ), 3 )
+        
+        self.assertEqual( store.GetThumbnail( hash_1 ), ( self._GetData( 3, 50 ), ( 100, 150 ), 3 ) )
+        
+        # delete
+        
+        store.DiscardThumbnails( ( hash_2, hash_3 ) )
+        
+        self.assertEqual( store.GetThumbnail( hash_2 ), None )
+        
+        self.assertEqual( store.GetNumDeadBytes(), 300 )
+        
+        # reopen
+        
+        store.Close()
+        
+        store = ClientFiles.ThumbnailBlobStore( self._path )
+        
+        self.assertEqual( store.GetThumbnail( hash_1 ), ( self._GetData( 3, 50 ), ( 100, 150 ), 3 ) )
+        self.assertEqual( store.GetThumbnail( hash_2 ), None )
+        self.assertEqual( store.GetNumDeadBytes(), 300 )
+        
+        store.AddThumbnail( hash_3, self._GetData( 4 ), ( 10, 10 ), 3 )
+        
+        store.Close()
+        
+        # a record cut off mid-write is dropped
+        
+        index_path = os.path.join( self._path, ClientFiles.ThumbnailBlobStore.INDEX_FILENAME )
+        
+        index_size = os.path.getsize( index_path )
+        
+        with open( index_path, 'r+b' ) as f:
+            
+            f.truncate( index_size - 5 )
+            
+        
+        store = ClientFiles.ThumbnailBlobStore( self._path )
+        
+        self.assertEqual( store.GetThumbnail( hash_1 ), ( self._GetData( 3, 50 ), ( 100, 150 ), 3 ) )
+        self.assertEqual( store.GetThumbnail( hash_3 ), None )
+        
+        self.assertEqual( os.path.getsize( index_path ), index_size - ClientFiles.ThumbnailBlobStore.INDEX_RECORD.size )
+        
+        # and so is a record whose segment data never made it to disk
+        
+        store.AddThumbnail( hash_3, self._GetData( 4 ), ( 10, 10 ), 3 )
+        
+        store.Close()
+        
+        segment_path = os.path.join( self._path, ClientFiles.ThumbnailBlobStore.SEGMENT_FILENAME_TEMPLATE.format( 0 ) )
+        
+        with open( segment_path, 'r+b' ) as f:
+            
+            f.truncate( os.path.getsize( segment_path ) - 10 )
+            
+        
+        store = ClientFiles.ThumbnailBlobStore( self._path )
+        
+        self.assertEqual( store.GetThumbnail( hash_1 ), ( self._GetData( 3, 50 ), ( 100, 150 ), 3 ) )
+        self.assertEqual( store.GetThumbnail( hash_3 ), None )
+        
+        store.Clear()
+        
+        self.assertEqual( store.GetThumbnail( hash_1 ), None )
+        
+        store.Close()
+        
+    
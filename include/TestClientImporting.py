@@ -0,0 +1,801 @@
+import ClientCaches
+import ClientConstants as CC
+import ClientData
+import ClientDefaults
+import ClientImageHandling
+import ClientImporting
+import HydrusConstants as HC
+import HydrusData
+import HydrusExceptions
+import HydrusFileHandling
+import HydrusGlobals as HG
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from PIL import Image as PILImage
+
+class TestFileImportJob( unittest.TestCase ):
+    
+    def setUp( self ):
+        
+        self._dir = tempfile.mkdtemp()
+        
+    
+    def tearDown( self ):
+        
+        shutil.rmtree( self._dir )
+        
+    
+    def _GetStreamHasher( self, data ):
+        
+        stream_hasher = HydrusFileHandling.StreamHasher()
+        
+        stream_hasher.Update( data )
+        
+        return stream_hasher
+        
+    
+    def test_bmp_falls_back_to_disk( self ):
+        
+        HG.test_controller.SetRead( 'hash_status', CC.STATUS_NEW )
+        
+        path = os.path.join( self._dir, 'image.bmp' )
+        
+        PILImage.new( 'RGB', ( 16, 16 ), ( 0, 255, 0 ) ).save( path, 'BMP' )
+        
+        with open( path, 'rb' ) as f:
+            
+            stream_hasher = self._GetStreamHasher( f.read() )
+            
+        
+        self.assertEqual( stream_hasher.GetHeaderMime(), HC.IMAGE_BMP )
+        
+        file_import_job = ClientImporting.FileImportJob( path, stream_hasher = stream_hasher )
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        # the bmp is converted to png before it is hashed, so the hashes of the downloaded bytes are no good
+        
+        self.assertEqual( HydrusFileHandling.GetMime( path ), HC.IMAGE_PNG )
+        
+        self.assertNotEqual( file_import_job.GetHash(), stream_hasher.GetHashes()[0] )
+        
+        ( sha256, md5, sha1, sha512 ) = HydrusFileHandling.GetAllHashesFromPath( path )
+        
+        self.assertEqual( file_import_job.GetHash(), sha256 )
+        self.assertEqual( file_import_job.GetExtraHashes(), ( md5, sha1, sha512 ) )
+        self.assertEqual( file_import_job.GetPreImportStatus(), CC.STATUS_NEW )
+        
+        file_import_job.GenerateInfo()
+        
+        self.assertEqual( file_import_job.GetMime(), HC.IMAGE_PNG )
+        
+    
+    def test_hashes_from_stream( self ):
+        
+        HG.test_controller.SetRead( 'hash_status', CC.STATUS_NEW )
+        
+        path = os.path.join( self._dir, 'image.jpg' )
+        
+        shutil.copy2( os.path.join( HC.STATIC_DIR, 'testing', 'muh_jpg.jpg' ), path )
+        
+        # the same size as the file, but different bytes, so we can tell the file was not read again
+        
+        stream_hasher = self._GetStreamHasher( os.urandom( os.path.getsize( path ) ) )
+        
+        file_import_job = ClientImporting.FileImportJob( path, stream_hasher = stream_hasher )
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        ( sha256, md5, sha1, sha512 ) = stream_hasher.GetHashes()
+        
+        self.assertEqual( file_import_job.GetHash(), sha256 )
+        self.assertEqual( file_import_job.GetExtraHashes(), ( md5, sha1, sha512 ) )
+        self.assertEqual( file_import_job.GetPreImportStatus(), CC.STATUS_NEW )
+        
+    
+    def test_rotated_jpeg( self ):
+        
+        path = os.path.join( self._dir, 'rotated.jpg' )
+        
+        # stored as 40x20, but the exif says to show it turned 90 degrees clockwise
+        
+        pil_image = PILImage.new( 'RGB', ( 40, 20 ), ( 255, 0, 0 ) )
+        
+        exif = PILImage.Exif()
+        
+        exif[ 274 ] = 6
+        
+        pil_image.save( path, 'JPEG', exif = exif.tobytes() )
+        
+        ( size, mime, width, height, duration, num_frames, num_words ) = HydrusFileHandling.GetFileInfo( path )
+        
+        self.assertEqual( ( mime, width, height ), ( HC.IMAGE_JPEG, 20, 40 ) )
+        
+        old_flags = ClientImageHandling.CV_IMREAD_FLAGS_SUPPORTS_EXIF_REORIENTATION
+        
+        try:
+            
+            # the second of these is what old cv2 does, which decodes the jpeg without rotating it
+            
+            for ( flags, expected_shape ) in ( ( old_flags, ( 40, 20, 3 ) ), ( ClientImageHandling.CV_IMREAD_FLAGS_SUPPORTS_ALPHA, ( 20, 40, 3 ) ) ):
+                
+                ClientImageHandling.CV_IMREAD_FLAGS_SUPPORTS_EXIF_REORIENTATION = flags
+                
+                self.assertEqual( ClientImageHandling.GenerateNumpyImage( path, HC.IMAGE_JPEG ).shape, expected_shape )
+                
+                file_import_job = ClientImporting.FileImportJob( path )
+                
+                file_import_job.GenerateInfo()
+                
+                self.assertEqual( file_import_job.GetFileInfo(), ( size, HC.IMAGE_JPEG, 20, 40, None, None, None ) )
+                
+                ( temp_path, thumbnail ) = file_import_job.GetTempPathAndThumbnail()
+                
+                self.assertTrue( thumbnail is not None )
+                
+            
+        finally:
+            
+            ClientImageHandling.CV_IMREAD_FLAGS_SUPPORTS_EXIF_REORIENTATION = old_flags
+            
+        
+    
+    def test_size_mismatch_falls_back_to_disk( self ):
+        
+        HG.test_controller.SetRead( 'hash_status', CC.STATUS_NEW )
+        
+        path = os.path.join( self._dir, 'image.jpg' )
+        
+        shutil.copy2( os.path.join( HC.STATIC_DIR, 'testing', 'muh_jpg.jpg' ), path )
+        
+        with open( path, 'rb' ) as f:
+            
+            data = f.read()
+            
+        
+        # a download that was cut short, or went through something that changed it, is hashed from disk
+        
+        for stream_data in ( data[ : -100 ], data + 'extra' ):
+            
+            stream_hasher = self._GetStreamHasher( stream_data )
+            
+            file_import_job = ClientImporting.FileImportJob( path, stream_hasher = stream_hasher )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            ( sha256, md5, sha1, sha512 ) = HydrusFileHandling.GetAllHashesFromPath( path )
+            
+            self.assertNotEqual( stream_hasher.GetHashes()[0], sha256 )
+            
+            self.assertEqual( file_import_job.GetHash(), sha256 )
+            self.assertEqual( file_import_job.GetExtraHashes(), ( md5, sha1, sha512 ) )
+            
+            file_import_job.GenerateInfo()
+            
+            self.assertEqual( file_import_job.GetMime(), HC.IMAGE_JPEG )
+            
+        
+    
+class TestPreparedFileImport( unittest.TestCase ):
+    
+    class _Controller( object ):
+        
+        # the test controller, but it remembers what it has imported, like the db would
+        
+        def __init__( self, on_import = None, on_content_updates = None ):
+            
+            self._on_import = on_import
+            self._on_content_updates = on_content_updates
+            
+            self._lock = threading.Lock()
+            
+            self.imported_hashes = []
+            self.content_updates = []
+            self.pubs = []
+            
+            self.client_files_manager = ClientCaches.ClientFilesManager( self )
+            
+        
+        def __getattr__( self, name ):
+            
+            return getattr( HG.test_controller, name )
+            
+        
+        def pub( self, topic, *args, **kwargs ):
+            
+            self.pubs.append( ( topic, args ) )
+            
+        
+        def Read( self, action, *args, **kwargs ):
+            
+            if action == 'hash_status':
+                
+                ( hash, ) = args
+                
+                with self._lock:
+                    
+                    if hash in self.imported_hashes:
+                        
+                        return CC.STATUS_REDUNDANT
+                        
+                    else:
+                        
+                        return CC.STATUS_NEW
+                        
+                    
+                
+            elif action == 'media_results':
+                
+                ( hashes, ) = args
+                
+                return list( hashes )
+                
+            else:
+                
+                return HG.test_controller.Read( action, *args, **kwargs )
+                
+            
+        
+        def WriteSynchronous( self, action, *args, **kwargs ):
+            
+            if action == 'import_file':
+                
+                ( file_import_job, ) = args
+                
+                with self._lock:
+                    
+                    self.imported_hashes.append( file_import_job.GetHash() )
+                    
+                
+                if self._on_import is not None:
+                    
+                    self._on_import( len( self.imported_hashes ) )
+                    
+                
+                return CC.STATUS_SUCCESSFUL
+                
+            elif action == 'content_updates':
+                
+                ( service_keys_to_content_updates, ) = args
+                
+                if self._on_content_updates is not None:
+                    
+                    self._on_content_updates( service_keys_to_content_updates )
+                    
+                
+                self.content_updates.append( service_keys_to_content_updates )
+                
+            
+        
+    
+    class _ErrorPreparedFileImport( object ):
+        
+        def __init__( self, e ):
+            
+            self._e = e
+            
+        
+        def CleanUp( self ):
+            
+            pass
+            
+        
+        def GetFileImportJob( self ):
+            
+            raise self._e
+            
+        
+        def MimeIsUnwanted( self ):
+            
+            return False
+            
+        
+    
+    def setUp( self ):
+        
+        self._dir = tempfile.mkdtemp()
+        
+        self._temp_dir = os.path.join( self._dir, 'temp' )
+        
+        os.makedirs( self._temp_dir )
+        
+        self._old_tempdir = tempfile.tempdir
+        
+        tempfile.tempdir = self._temp_dir
+        
+        self._old_controller = HG.client_controller
+        
+        self._jpg_path = os.path.join( self._dir, 'a.jpg' )
+        self._png_path = os.path.join( self._dir, 'b.png' )
+        self._gif_path = os.path.join( self._dir, 'c.gif' )
+        self._jpg_copy_path = os.path.join( self._dir, 'd.jpg' )
+        
+        shutil.copy2( os.path.join( HC.STATIC_DIR, 'testing', 'muh_jpg.jpg' ), self._jpg_path )
+        shutil.copy2( os.path.join( HC.STATIC_DIR, 'testing', 'muh_png.png' ), self._png_path )
+        shutil.copy2( os.path.join( HC.STATIC_DIR, 'testing', 'muh_gif.gif' ), self._gif_path )
+        shutil.copy2( os.path.join( HC.STATIC_DIR, 'testing', 'muh_jpg.jpg' ), self._jpg_copy_path )
+        
+        self._jpg_hash = HydrusFileHandling.GetHashFromPath( self._jpg_path )
+        self._png_hash = HydrusFileHandling.GetHashFromPath( self._png_path )
+        self._gif_hash = HydrusFileHandling.GetHashFromPath( self._gif_path )
+        
+    
+    def tearDown( self ):
+        
+        HG.client_controller = self._old_controller
+        
+        tempfile.tempdir = self._old_tempdir
+        
+        shutil.rmtree( self._dir )
+        
+    
+    def _CheckTempFilesCleanedUp( self ):
+        
+        # workers that were cancelled mid-file clean up after themselves once they finish
+        
+        for i in range( 100 ):
+            
+            if len( os.listdir( self._temp_dir ) ) == 0:
+                
+                break
+                
+            
+            time.sleep( 0.05 )
+            
+        
+        self.assertEqual( os.listdir( self._temp_dir ), [] )
+        
+    
+    def _GetMediaResultPubs( self, controller ):
+        
+        return [ args for ( topic, args ) in controller.pubs if topic == 'add_media_results' ]
+        
+    
+    def _GetPathsToStatuses( self, seed_cache ):
+        
+        return { seed.seed_data : seed.status for seed in seed_cache.GetSeeds() }
+        
+    
+    def _SetController( self, on_import = None, on_content_updates = None ):
+        
+        controller = self._Controller( on_import = on_import, on_content_updates = on_content_updates )
+        
+        HG.client_controller = controller
+        
+        return controller
+        
+    
+    def test_hdd_import( self ):
+        
+        controller = self._SetController()
+        
+        missing_path = os.path.join( self._dir, 'missing.jpg' )
+        
+        paths = [ self._jpg_path, self._png_path, self._gif_path, self._jpg_copy_path, missing_path ]
+        
+        paths_to_tags = { path : { CC.LOCAL_TAG_SERVICE_KEY : [ 'file ' + str( i ) ] } for ( i, path ) in enumerate( paths ) }
+        
+        hdd_import = ClientImporting.HDDImport( paths = paths, file_import_options = ClientDefaults.GetDefaultFileImportOptions(), paths_to_tags = paths_to_tags, delete_after_success = False )
+        
+        page_key = HydrusData.GenerateKey()
+        
+        self.assertTrue( hdd_import._WorkOnFiles( page_key ) )
+        
+        # the copy of the jpg was prepared alongside the original, but it is still redundant, and it is only imported once
+        
+        expected_statuses = {}
+        
+        expected_statuses[ self._jpg_path ] = CC.STATUS_SUCCESSFUL
+        expected_statuses[ self._png_path ] = CC.STATUS_SUCCESSFUL
+        expected_statuses[ self._gif_path ] = CC.STATUS_SUCCESSFUL
+        expected_statuses[ self._jpg_copy_path ] = CC.STATUS_REDUNDANT
+        expected_statuses[ missing_path ] = CC.STATUS_FAILED
+        
+        self.assertEqual( self._GetPathsToStatuses( hdd_import.GetSeedCache() ), expected_statuses )
+        
+        self.assertEqual( controller.imported_hashes, [ self._jpg_hash, self._png_hash, self._gif_hash ] )
+        
+        # the whole batch's tags go in one write, and its media results in one pub
+        
+        self.assertEqual( len( controller.content_updates ), 1 )
+        
+        ( service_keys_to_content_updates, ) = controller.content_updates
+        
+        expected_content_updates = set()
+        
+        for ( path, hash ) in ( ( self._jpg_path, self._jpg_hash ), ( self._png_path, self._png_hash ), ( self._gif_path, self._gif_hash ), ( self._jpg_copy_path, self._jpg_hash ) ):
+            
+            expected_content_updates.update( ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, paths_to_tags[ path ] )[ CC.LOCAL_TAG_SERVICE_KEY ] )
+            
+        
+        self.assertEqual( service_keys_to_content_updates.keys(), [ CC.LOCAL_TAG_SERVICE_KEY ] )
+        self.assertEqual( len( service_keys_to_content_updates[ CC.LOCAL_TAG_SERVICE_KEY ] ), 4 )
+        self.assertEqual( set( service_keys_to_content_updates[ CC.LOCAL_TAG_SERVICE_KEY ] ), expected_content_updates )
+        
+        self.assertEqual( self._GetMediaResultPubs( controller ), [ ( page_key, [ self._jpg_hash, self._png_hash, self._gif_hash ] ) ] )
+        
+        self._CheckTempFilesCleanedUp()
+        
+        # nothing left to do
+        
+        self.assertFalse( hdd_import._WorkOnFiles( page_key ) )
+        
+    
+    def test_hdd_import_cancel( self ):
+        
+        paths = [ self._jpg_path, self._png_path, self._gif_path, self._jpg_copy_path ]
+        
+        hdd_import = ClientImporting.HDDImport( paths = paths, file_import_options = ClientDefaults.GetDefaultFileImportOptions(), paths_to_tags = {}, delete_after_success = False )
+        
+        def on_import( num_imported ):
+            
+            if num_imported == 2:
+                
+                hdd_import.PausePlay()
+                
+            
+        
+        controller = self._SetController( on_import = on_import )
+        
+        page_key = HydrusData.GenerateKey()
+        
+        self.assertTrue( hdd_import._WorkOnFiles( page_key ) )
+        
+        # it stopped after the file it was on, and the rest of the batch is still to do, with no temp files left behind
+        
+        expected_statuses = {}
+        
+        expected_statuses[ self._jpg_path ] = CC.STATUS_SUCCESSFUL
+        expected_statuses[ self._png_path ] = CC.STATUS_SUCCESSFUL
+        expected_statuses[ self._gif_path ] = CC.STATUS_UNKNOWN
+        expected_statuses[ self._jpg_copy_path ] = CC.STATUS_UNKNOWN
+        
+        self.assertEqual( self._GetPathsToStatuses( hdd_import.GetSeedCache() ), expected_statuses )
+        
+        self.assertEqual( controller.imported_hashes, [ self._jpg_hash, self._png_hash ] )
+        
+        self.assertEqual( self._GetMediaResultPubs( controller ), [ ( page_key, [ self._jpg_hash, self._png_hash ] ) ] )
+        
+        self._CheckTempFilesCleanedUp()
+        
+        # and it picks up where it left off
+        
+        hdd_import.PausePlay()
+        
+        self.assertTrue( hdd_import._WorkOnFiles( page_key ) )
+        
+        expected_statuses[ self._gif_path ] = CC.STATUS_SUCCESSFUL
+        expected_statuses[ self._jpg_copy_path ] = CC.STATUS_REDUNDANT
+        
+        self.assertEqual( self._GetPathsToStatuses( hdd_import.GetSeedCache() ), expected_statuses )
+        
+        self.assertEqual( controller.imported_hashes, [ self._jpg_hash, self._png_hash, self._gif_hash ] )
+        
+    
+    def test_hdd_import_delete_after_success( self ):
+        
+        txt_path = self._jpg_path + '.txt'
+        
+        with open( txt_path, 'wb' ) as f:
+            
+            f.write( 'sidecar tag' )
+            
+        
+        paths = [ self._jpg_path, self._png_path ]
+        
+        paths_to_tags = { path : { CC.LOCAL_TAG_SERVICE_KEY : [ 'file ' + str( i ) ] } for ( i, path ) in enumerate( paths ) }
+        
+        paths_existing_at_write = []
+        
+        def on_content_updates( service_keys_to_content_updates ):
+            
+            paths_existing_at_write.extend( ( path for path in ( self._jpg_path, txt_path, self._png_path ) if os.path.exists( path ) ) )
+            
+        
+        controller = self._SetController( on_content_updates = on_content_updates )
+        
+        hdd_import = ClientImporting.HDDImport( paths = paths, file_import_options = ClientDefaults.GetDefaultFileImportOptions(), paths_to_tags = paths_to_tags, delete_after_success = True )
+        
+        page_key = HydrusData.GenerateKey()
+        
+        self.assertTrue( hdd_import._WorkOnFiles( page_key ) )
+        
+        # the files and the sidecar were all still there when the batch's tags went in, and only deleted afterwards
+        
+        self.assertEqual( len( controller.content_updates ), 1 )
+        
+        self.assertEqual( paths_existing_at_write, [ self._jpg_path, txt_path, self._png_path ] )
+        
+        for path in ( self._jpg_path, txt_path, self._png_path ):
+            
+            self.assertFalse( os.path.exists( path ) )
+            
+        
+    
+    def test_hdd_import_delete_after_success_write_fails( self ):
+        
+        txt_path = self._jpg_path + '.txt'
+        
+        with open( txt_path, 'wb' ) as f:
+            
+            f.write( 'sidecar tag' )
+            
+        
+        paths = [ self._jpg_path, self._png_path ]
+        
+        paths_to_tags = { path : { CC.LOCAL_TAG_SERVICE_KEY : [ 'file ' + str( i ) ] } for ( i, path ) in enumerate( paths ) }
+        
+        def on_content_updates( service_keys_to_content_updates ):
+            
+            raise Exception( 'db is locked!' )
+            
+        
+        controller = self._SetController( on_content_updates = on_content_updates )
+        
+        hdd_import = ClientImporting.HDDImport( paths = paths, file_import_options = ClientDefaults.GetDefaultFileImportOptions(), paths_to_tags = paths_to_tags, delete_after_success = True )
+        
+        page_key = HydrusData.GenerateKey()
+        
+        # the error is reported rather than raised, so the import carries on, but nothing is deleted
+        
+        self.assertTrue( hdd_import._WorkOnFiles( page_key ) )
+        
+        expected_statuses = {}
+        
+        expected_statuses[ self._jpg_path ] = CC.STATUS_SUCCESSFUL
+        expected_statuses[ self._png_path ] = CC.STATUS_SUCCESSFUL
+        
+        self.assertEqual( self._GetPathsToStatuses( hdd_import.GetSeedCache() ), expected_statuses )
+        
+        for path in ( self._jpg_path, txt_path, self._png_path ):
+            
+            self.assertTrue( os.path.exists( path ) )
+            
+        
+        self.assertEqual( self._GetMediaResultPubs( controller ), [ ( page_key, [ self._jpg_hash, self._png_hash ] ) ] )
+        
+    
+    def test_import_folder( self ):
+        
+        controller = self._SetController()
+        
+        import_folder_dir = os.path.join( self._dir, 'import folder' )
+        
+        os.makedirs( import_folder_dir )
+        
+        for path in ( self._jpg_path, self._png_path, self._gif_path, self._jpg_copy_path ):
+            
+            shutil.copy2( path, import_folder_dir )
+            
+        
+        import_folder = ClientImporting.ImportFolder( 'test', path = import_folder_dir, mimes = ( HC.IMAGE_JPEG, HC.IMAGE_PNG ), open_popup = False )
+        
+        import_folder.CheckNow()
+        
+        import_folder.DoWork()
+        
+        # an unwanted mime is not an error, and of the two copies of the jpg, whichever came second is redundant
+        
+        paths_to_statuses = self._GetPathsToStatuses( import_folder.GetSeedCache() )
+        
+        jpg_statuses = sorted( ( paths_to_statuses[ os.path.join( import_folder_dir, filename ) ] for filename in ( 'a.jpg', 'd.jpg' ) ) )
+        
+        self.assertEqual( jpg_statuses, sorted( [ CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ] ) )
+        self.assertEqual( paths_to_statuses[ os.path.join( import_folder_dir, 'b.png' ) ], CC.STATUS_SUCCESSFUL )
+        self.assertEqual( paths_to_statuses[ os.path.join( import_folder_dir, 'c.gif' ) ], CC.STATUS_UNINTERESTING_MIME )
+        
+        self.assertEqual( sorted( controller.imported_hashes ), sorted( [ self._jpg_hash, self._png_hash ] ) )
+        
+        self._CheckTempFilesCleanedUp()
+        
+    
+    def test_import_folder_cancel( self ):
+        
+        import_folder_dir = os.path.join( self._dir, 'import folder' )
+        
+        os.makedirs( import_folder_dir )
+        
+        for path in ( self._jpg_path, self._png_path, self._gif_path ):
+            
+            shutil.copy2( path, import_folder_dir )
+            
+        
+        def on_import( num_imported ):
+            
+            HC.options[ 'pause_import_folders_sync' ] = True
+            
+        
+        controller = self._SetController( on_import = on_import )
+        
+        actions = {}
+        
+        actions[ CC.STATUS_SUCCESSFUL ] = CC.IMPORT_FOLDER_DELETE
+        actions[ CC.STATUS_REDUNDANT ] = CC.IMPORT_FOLDER_DELETE
+        actions[ CC.STATUS_DELETED ] = CC.IMPORT_FOLDER_IGNORE
+        actions[ CC.STATUS_FAILED ] = CC.IMPORT_FOLDER_IGNORE
+        
+        import_folder = ClientImporting.ImportFolder( 'test', path = import_folder_dir, mimes = HC.IMAGES, actions = actions, open_popup = False )
+        
+        import_folder.CheckNow()
+        
+        try:
+            
+            import_folder.DoWork()
+            
+        finally:
+            
+            HC.options[ 'pause_import_folders_sync' ] = False
+            
+        
+        # it stopped after the first file, which was still actioned, so it and its seed are gone, and the other two are still to do
+        
+        paths_to_statuses = self._GetPathsToStatuses( import_folder.GetSeedCache() )
+        
+        self.assertEqual( paths_to_statuses.values(), [ CC.STATUS_UNKNOWN, CC.STATUS_UNKNOWN ] )
+        
+        self.assertEqual( len( controller.imported_hashes ), 1 )
+        
+        self.assertEqual( sorted( os.listdir( import_folder_dir ) ), sorted( os.path.basename( path ) for path in paths_to_statuses.keys() ) )
+        
+        self._CheckTempFilesCleanedUp()
+        
+    
+    def test_import_folder_errors( self ):
+        
+        self._SetController()
+        
+        import_folder = ClientImporting.ImportFolder( 'test', path = self._dir, open_popup = False )
+        
+        # only an unwanted mime is uninteresting. any other error, even a MimeException, is a failure, as it was before files were prepared in batches
+        
+        for ( e, expected_status ) in ( ( HydrusExceptions.MimeException( 'Filetype is not permitted!' ), CC.STATUS_FAILED ), ( Exception( 'Source file does not exist!' ), CC.STATUS_FAILED ) ):
+            
+            seed = ClientImporting.Seed( ClientImporting.SEED_TYPE_HDD, self._jpg_path )
+            
+            import_folder._WorkOnPreparedFile( seed, self._ErrorPreparedFileImport( e ), set(), {} )
+            
+            self.assertEqual( seed.status, expected_status )
+            
+        
+        prepared_file_import = ClientImporting.PreparedFileImport( self._gif_path, ClientDefaults.GetDefaultFileImportOptions(), allowed_mimes = ( HC.IMAGE_JPEG, ) ).Prepare()
+        
+        seed = ClientImporting.Seed( ClientImporting.SEED_TYPE_HDD, self._gif_path )
+        
+        import_folder._WorkOnPreparedFile( seed, prepared_file_import, set(), {} )
+        
+        self.assertEqual( seed.status, CC.STATUS_UNINTERESTING_MIME )
+        
+    
+    def test_prepare( self ):
+        
+        self._SetController()
+        
+        prepared_file_import = ClientImporting.PreparedFileImport( self._jpg_path, ClientDefaults.GetDefaultFileImportOptions(), allowed_mimes = ( HC.IMAGE_JPEG, ) ).Prepare()
+        
+        self.assertFalse( prepared_file_import.MimeIsUnwanted() )
+        
+        file_import_job = prepared_file_import.GetFileImportJob()
+        
+        self.assertEqual( file_import_job.GetHash(), self._jpg_hash )
+        self.assertEqual( file_import_job.GetPreImportStatus(), CC.STATUS_NEW )
+        self.assertEqual( file_import_job.GetFileInfo(), ( 42296, HC.IMAGE_JPEG, 392, 498, None, None, None ) )
+        
+        ( temp_path, thumbnail ) = file_import_job.GetTempPathAndThumbnail()
+        
+        self.assertEqual( os.listdir( self._temp_dir ), [ os.path.basename( temp_path ) ] )
+        
+        prepared_file_import.CleanUp()
+        prepared_file_import.CleanUp()
+        
+        self.assertEqual( os.listdir( self._temp_dir ), [] )
+        
+    
+    def test_prepare_errors( self ):
+        
+        self._SetController()
+        
+        file_import_options = ClientDefaults.GetDefaultFileImportOptions()
+        
+        # errors are kept for the importing thread, and leave no temp file
+        
+        prepared_file_import = ClientImporting.PreparedFileImport( os.path.join( self._dir, 'missing.jpg' ), file_import_options ).Prepare()
+        
+        with self.assertRaises( Exception ):
+            
+            prepared_file_import.GetFileImportJob()
+            
+        
+        self.assertEqual( os.listdir( self._temp_dir ), [] )
+        
+        # an unwanted mime is not an error, and is not copied
+        
+        prepared_file_import = ClientImporting.PreparedFileImport( self._gif_path, file_import_options, allowed_mimes = ( HC.IMAGE_JPEG, ) ).Prepare()
+        
+        self.assertTrue( prepared_file_import.MimeIsUnwanted() )
+        self.assertEqual( prepared_file_import.GetFileImportJob(), None )
+        
+        self.assertEqual( os.listdir( self._temp_dir ), [] )
+        
+    
+class TestStreamHasher( unittest.TestCase ):
+    
+    def _GetStreamHasher( self, path, chunk_size ):
+        
+        stream_hasher = HydrusFileHandling.StreamHasher()
+        
+        with open( path, 'rb' ) as f:
+            
+            while True:
+                
+                block = f.read( chunk_size )
+                
+                if block == '':
+                    
+                    break
+                    
+                
+                stream_hasher.Update( block )
+                
+            
+        
+        return stream_hasher
+        
+    
+    def test_hashes( self ):
+        
+        for filename in ( 'muh_gif.gif', 'muh_jpg.jpg', 'muh_png.png', 'muh_swf.swf' ):
+            
+            path = os.path.join( HC.STATIC_DIR, 'testing', filename )
+            
+            with open( path, 'rb' ) as f:
+                
+                data = f.read()
+                
+            
+            expected_hashes = ( hashlib.sha256( data ).digest(), hashlib.md5( data ).digest(), hashlib.sha1( data ).digest(), hashlib.sha512( data ).digest() )
+            
+            self.assertEqual( HydrusFileHandling.GetAllHashesFromPath( path ), expected_hashes )
+            
+            # small chunks split the header, and big ones cover it in one go
+            
+            for chunk_size in ( 1, 7, 100, 255, 256, 257, 65536 ):
+                
+                stream_hasher = self._GetStreamHasher( path, chunk_size )
+                
+                self.assertEqual( stream_hasher.GetHashes(), expected_hashes )
+                self.assertEqual( stream_hasher.GetNumBytes(), len( data ) )
+                
+            
+        
+    
+    def test_mime( self ):
+        
+        for filename in ( 'muh_apng.png', 'muh_gif.gif', 'muh_jpg.jpg', 'muh_png.png', 'muh_swf.swf' ):
+            
+            path = os.path.join( HC.STATIC_DIR, 'testing', filename )
+            
+            for chunk_size in ( 1, 7, 256, 65536 ):
+                
+                stream_hasher = self._GetStreamHasher( path, chunk_size )
+                
+                mime = stream_hasher.GetMime()
+                
+                if filename.endswith( '.png' ):
+                    
+                    # png or apng needs the whole file, so the path has to decide
+                    
+                    self.assertEqual( mime, None )
+                    
+                else:
+                    
+                    self.assertEqual( mime, HydrusFileHandling.GetMime( path ) )
+                    
+                
+            
+        
+    
@@ -0,0 +1,378 @@
+import ClientConstants as CC
+import ClientMedia
+import ClientRatings
+import HydrusConstants as HC
+import HydrusData
+import HydrusExceptions
+import os
+import random
+import unittest
+
+class TestCompactMediaResults( unittest.TestCase ):
+    
+    def _GetMediaResult( self, hash, tags, current ):
+        
+        file_info_manager = ClientMedia.FileInfoManager( hash, 5270, HC.IMAGE_PNG, 200, 200 )
+        
+        service_keys_to_statuses_to_tags = { CC.LOCAL_TAG_SERVICE_KEY : { HC.CONTENT_STATUS_CURRENT : set( tags ), HC.CONTENT_STATUS_PENDING : set() } }
+        
+        tags_manager = ClientMedia.TagsManager( service_keys_to_statuses_to_tags )
+        
+        locations_manager = ClientMedia.LocationsManager( set( current ), set(), set(), set(), inbox = True )
+        
+        ratings_manager = ClientRatings.RatingsManager( {} )
+        
+        return ClientMedia.MediaResult( file_info_manager, tags_manager, locations_manager, ratings_manager )
+        
+    
+    def _GetTag( self, *parts ):
+        
+        # a fresh string each time, so we can see whether it was swapped for the shared copy
+        
+        return u''.join( parts )
+        
+    
+    def test_intern_limit( self ):
+        
+        old_max_interned_tags = ClientMedia.MAX_INTERNED_TAGS
+        
+        ClientMedia.MAX_INTERNED_TAGS = 2
+        
+        try:
+            
+            ClientMedia.interned_tags.clear()
+            
+            ClientMedia.InternTags( [ u'a', u'b', u'c' ] )
+            
+            self.assertEqual( len( ClientMedia.interned_tags ), 3 )
+            
+            # past the limit, the table starts again rather than growing forever
+            
+            tags = ClientMedia.InternTags( [ self._GetTag( u'd', u'e' ) ] )
+            
+            self.assertEqual( tags, frozenset( [ u'de' ] ) )
+            self.assertEqual( set( ClientMedia.interned_tags.keys() ), { u'de' } )
+            
+        finally:
+            
+            ClientMedia.MAX_INTERNED_TAGS = old_max_interned_tags
+            
+            ClientMedia.interned_tags.clear()
+            
+        
+    def test_interned_tags( self ):
+        
+        media_result_1 = self._GetMediaResult( os.urandom( 32 ), [ self._GetTag( u'series:', u'metroid' ), self._GetTag( u'sam', u'us' ) ], [ CC.LOCAL_FILE_SERVICE_KEY ] )
+        media_result_2 = self._GetMediaResult( os.urandom( 32 ), [ self._GetTag( u'series:', u'metroid' ) ], [ CC.LOCAL_FILE_SERVICE_KEY ] )
+        
+        tags_manager_1 = media_result_1.GetTagsManager()
+        tags_manager_2 = media_result_2.GetTagsManager()
+        
+        ( tag_1, ) = [ tag for tag in tags_manager_1.GetStatusesToTags( CC.LOCAL_TAG_SERVICE_KEY )[ HC.CONTENT_STATUS_CURRENT ] if tag == u'series:metroid' ]
+        ( tag_2, ) = tags_manager_2.GetStatusesToTags( CC.LOCAL_TAG_SERVICE_KEY )[ HC.CONTENT_STATUS_CURRENT ]
+        
+        self.assertIs( tag_1, tag_2 )
+        
+        # empty statuses are not stored, and reading them does not store them
+        
+        statuses_to_tags = tags_manager_1.GetStatusesToTags( CC.LOCAL_TAG_SERVICE_KEY )
+        
+        self.assertEqual( set( statuses_to_tags.keys() ), { HC.CONTENT_STATUS_CURRENT } )
+        
+        self.assertEqual( statuses_to_tags[ HC.CONTENT_STATUS_PENDING ], set() )
+        self.assertEqual( tags_manager_1.GetPending( CC.LOCAL_TAG_SERVICE_KEY ), set() )
+        self.assertEqual( tags_manager_1.GetCurrent( CC.LOCAL_FILE_SERVICE_KEY ), set() )
+        
+        self.assertEqual( set( statuses_to_tags.keys() ), { HC.CONTENT_STATUS_CURRENT } )
+        self.assertEqual( set( tags_manager_1.GetServiceKeysToStatusesToTags().keys() ), { CC.LOCAL_TAG_SERVICE_KEY, CC.COMBINED_TAG_SERVICE_KEY } )
+        
+        # the tag sets are frozen, so a duplicate shares them until one of them changes
+        
+        dupe_tags_manager = tags_manager_1.Duplicate()
+        
+        self.assertIs( dupe_tags_manager.GetStatusesToTags( CC.LOCAL_TAG_SERVICE_KEY )[ HC.CONTENT_STATUS_CURRENT ], statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ] )
+        
+        dupe_tags_manager.ProcessContentUpdate( CC.LOCAL_TAG_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( self._GetTag( u'ri', u'dley' ), set() ) ) )
+        dupe_tags_manager.ProcessContentUpdate( CC.LOCAL_TAG_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( u'samus', set() ) ) )
+        
+        self.assertEqual( dupe_tags_manager.GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ), { u'series:metroid', u'ridley' } )
+        self.assertEqual( dupe_tags_manager.GetDeleted( CC.LOCAL_TAG_SERVICE_KEY ), { u'samus' } )
+        self.assertEqual( dupe_tags_manager.GetCurrent( CC.COMBINED_TAG_SERVICE_KEY ), { u'series:metroid', u'ridley' } )
+        
+        self.assertEqual( tags_manager_1.GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ), { u'series:metroid', u'samus' } )
+        self.assertEqual( tags_manager_1.GetDeleted( CC.LOCAL_TAG_SERVICE_KEY ), set() )
+        
+        # a tag added later is shared too
+        
+        tags_manager_2.ProcessContentUpdate( CC.LOCAL_TAG_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( self._GetTag( u'ri', u'dley' ), set() ) ) )
+        
+        ( tag_1, ) = [ tag for tag in dupe_tags_manager.GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ) if tag == u'ridley' ]
+        ( tag_2, ) = [ tag for tag in tags_manager_2.GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ) if tag == u'ridley' ]
+        
+        self.assertIs( tag_1, tag_2 )
+        
+        # removing the last tag of a status removes the status
+        
+        tags_manager_2.ProcessContentUpdate( CC.LOCAL_TAG_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_PEND, ( u'kraid', set() ) ) )
+        tags_manager_2.ProcessContentUpdate( CC.LOCAL_TAG_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_RESCIND_PEND, ( u'kraid', set() ) ) )
+        
+        self.assertNotIn( HC.CONTENT_STATUS_PENDING, tags_manager_2.GetStatusesToTags( CC.LOCAL_TAG_SERVICE_KEY ) )
+        
+    
+    def test_shared_locations( self ):
+        
+        media_result_1 = self._GetMediaResult( os.urandom( 32 ), [], [ CC.LOCAL_FILE_SERVICE_KEY, CC.COMBINED_LOCAL_FILE_SERVICE_KEY ] )
+        media_result_2 = self._GetMediaResult( os.urandom( 32 ), [], [ CC.COMBINED_LOCAL_FILE_SERVICE_KEY, CC.LOCAL_FILE_SERVICE_KEY ] )
+        
+        locations_manager_1 = media_result_1.GetLocationsManager()
+        locations_manager_2 = media_result_2.GetLocationsManager()
+        
+        self.assertIs( locations_manager_1.GetCurrent(), locations_manager_2.GetCurrent() )
+        self.assertIs( locations_manager_1.GetDeleted(), locations_manager_2.GetDeleted() )
+        self.assertIs( locations_manager_1.GetURLs(), locations_manager_2.GetURLs() )
+        
+        # a change moves one file to another shared set and leaves the other file alone
+        
+        media_result_1.ProcessContentUpdate( CC.LOCAL_FILE_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, ( media_result_1.GetHash(), ) ) )
+        
+        self.assertEqual( locations_manager_1.GetCurrent(), { CC.TRASH_SERVICE_KEY, CC.COMBINED_LOCAL_FILE_SERVICE_KEY } )
+        self.assertEqual( locations_manager_1.GetDeleted(), { CC.LOCAL_FILE_SERVICE_KEY } )
+        
+        self.assertEqual( locations_manager_2.GetCurrent(), { CC.LOCAL_FILE_SERVICE_KEY, CC.COMBINED_LOCAL_FILE_SERVICE_KEY } )
+        self.assertEqual( locations_manager_2.GetDeleted(), set() )
+        
+        media_result_3 = self._GetMediaResult( os.urandom( 32 ), [], [ CC.TRASH_SERVICE_KEY, CC.COMBINED_LOCAL_FILE_SERVICE_KEY ] )
+        
+        self.assertIs( locations_manager_1.GetCurrent(), media_result_3.GetLocationsManager().GetCurrent() )
+        
+        # urls are copied on write as well
+        
+        url = 'http://example.com/metroid'
+        
+        locations_manager_2.ProcessContentUpdate( CC.COMBINED_LOCAL_FILE_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_URLS, HC.CONTENT_UPDATE_ADD, ( media_result_2.GetHash(), ( url, ) ) ) )
+        
+        self.assertEqual( locations_manager_2.GetURLs(), { url } )
+        self.assertEqual( locations_manager_1.GetURLs(), set() )
+        self.assertEqual( media_result_3.GetLocationsManager().GetURLs(), set() )
+        
+        # a duplicate shares everything until it changes
+        
+        dupe_media_result = media_result_2.Duplicate()
+        
+        dupe_locations_manager = dupe_media_result.GetLocationsManager()
+        
+        self.assertIs( dupe_locations_manager.GetCurrent(), locations_manager_2.GetCurrent() )
+        
+        dupe_locations_manager.ProcessContentUpdate( CC.COMBINED_LOCAL_FILE_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ARCHIVE, ( media_result_2.GetHash(), ) ) )
+        
+        self.assertFalse( dupe_locations_manager.GetInbox() )
+        self.assertTrue( locations_manager_2.GetInbox() )
+        
+        dupe_locations_manager.ResetService( CC.LOCAL_FILE_SERVICE_KEY )
+        
+        self.assertEqual( dupe_locations_manager.GetCurrent(), { CC.COMBINED_LOCAL_FILE_SERVICE_KEY } )
+        self.assertEqual( locations_manager_2.GetCurrent(), { CC.LOCAL_FILE_SERVICE_KEY, CC.COMBINED_LOCAL_FILE_SERVICE_KEY } )
+        
+    
+    def test_slots( self ):
+        
+        media_result = self._GetMediaResult( os.urandom( 32 ), [ u'samus' ], [ CC.LOCAL_FILE_SERVICE_KEY ] )
+        
+        for obj in ( media_result, media_result.GetFileInfoManager(), media_result.GetTagsManager(), media_result.GetLocationsManager() ):
+            
+            self.assertFalse( hasattr( obj, '__dict__' ) )
+            
+            with self.assertRaises( AttributeError ):
+                
+                obj.some_new_attribute = 1
+                
+            
+        
+    
+class TestSortedList( unittest.TestCase ):
+    
+    def _CheckIndices( self, sorted_list, expected_items ):
+        
+        self.assertEqual( list( sorted_list ), expected_items )
+        
+        for ( i, item ) in enumerate( expected_items ):
+            
+            self.assertIn( item, sorted_list )
+            
+            self.assertEqual( sorted_list.index( item ), i )
+            
+        
+    
+    def _GetItems( self, r, num_items, start_id = 0 ):
+        
+        # few distinct keys, so plenty of ties for the stable ordering to get right
+        
+        return [ ( r.randint( 0, 20 ), item_id ) for item_id in range( start_id, start_id + num_items ) ]
+        
+    
+    def test_append_then_insert( self ):
+        
+        r = random.Random( 1 )
+        
+        sort_key = lambda item: item[0]
+        
+        items = self._GetItems( r, 100 )
+        
+        sorted_list = ClientMedia.SortedList( items )
+        
+        sorted_list.sort( sort_key )
+        
+        appended_items = self._GetItems( r, 3, start_id = 100 )
+        
+        sorted_list.append_items( appended_items )
+        
+        self._CheckIndices( sorted_list, sorted( items, key = sort_key ) + appended_items )
+        
+        # the appended items are not in order yet, so an insert cannot bisect and sorts everything
+        
+        inserted_items = self._GetItems( r, 1, start_id = 200 )
+        
+        sorted_list.insert_items( inserted_items )
+        
+        self._CheckIndices( sorted_list, sorted( items + appended_items + inserted_items, key = sort_key ) )
+        
+    
+    def test_insert( self ):
+        
+        r = random.Random( 2 )
+        
+        num_key_calls = [ 0 ]
+        
+        def sort_key( item ):
+            
+            num_key_calls[0] += 1
+            
+            return item[0]
+            
+        
+        for reverse in ( False, True ):
+            
+            items = self._GetItems( r, 1000 )
+            
+            sorted_list = ClientMedia.SortedList( items )
+            
+            sorted_list.sort( sort_key, reverse = reverse )
+            
+            expected_items = sorted( items, key = lambda item: item[0], reverse = reverse )
+            
+            self._CheckIndices( sorted_list, expected_items )
+            
+            # a few at a time bisect, and new items go after existing ones with the same key, just like a stable sort
+            
+            for i in range( 10 ):
+                
+                new_items = self._GetItems( r, 3, start_id = 1000 + i * 3 )
+                
+                num_key_calls[0] = 0
+                
+                sorted_list.insert_items( new_items )
+                
+                self.assertTrue( num_key_calls[0] < 3 * 2 * 12 )
+                
+                expected_items = sorted( expected_items + new_items, key = lambda item: item[0], reverse = reverse )
+                
+                self.assertEqual( list( sorted_list ), expected_items )
+                
+            
+            self._CheckIndices( sorted_list, expected_items )
+            
+            # lots at once is just a full sort
+            
+            new_items = self._GetItems( r, 500, start_id = 2000 )
+            
+            sorted_list.insert_items( new_items )
+            
+            expected_items = sorted( expected_items + new_items, key = lambda item: item[0], reverse = reverse )
+            
+            self._CheckIndices( sorted_list, expected_items )
+            
+        
+    
+    def test_lazy_indices( self ):
+        
+        r = random.Random( 3 )
+        
+        sort_key = lambda item: item[0]
+        
+        items = self._GetItems( r, 1000 )
+        
+        sorted_list = ClientMedia.SortedList( items )
+        
+        sorted_list.sort( sort_key )
+        
+        expected_items = sorted( items, key = sort_key )
+        
+        self._CheckIndices( sorted_list, expected_items )
+        
+        # inserts and removes only mark the indices after them as stale, and any lookup after that repairs them
+        
+        for i in range( 20 ):
+            
+            if r.random() < 0.5:
+                
+                new_items = self._GetItems( r, 2, start_id = 1000 + i * 2 )
+                
+                sorted_list.insert_items( new_items )
+                
+                expected_items = sorted( expected_items + new_items, key = sort_key )
+                
+            else:
+                
+                deletee_items = r.sample( expected_items, 3 )
+                
+                sorted_list.remove_items( deletee_items )
+                
+                expected_items = [ item for item in expected_items if item not in deletee_items ]
+                
+            
+            item = r.choice( expected_items )
+            
+            self.assertEqual( sorted_list.index( item ), expected_items.index( item ) )
+            
+        
+        self._CheckIndices( sorted_list, expected_items )
+        
+    
+    def test_remove( self ):
+        
+        r = random.Random( 4 )
+        
+        sort_key = lambda item: item[0]
+        
+        items = self._GetItems( r, 100 )
+        
+        sorted_list = ClientMedia.SortedList( items )
+        
+        sorted_list.sort( sort_key )
+        
+        expected_items = sorted( items, key = sort_key )
+        
+        # a few are deleted in place, lots at once rebuild the list
+        
+        for num_to_remove in ( 2, 60 ):
+            
+            deletee_items = r.sample( expected_items, num_to_remove )
+            
+            sorted_list.remove_items( deletee_items )
+            
+            expected_items = [ item for item in expected_items if item not in deletee_items ]
+            
+            self._CheckIndices( sorted_list, expected_items )
+            
+            for item in deletee_items:
+                
+                self.assertNotIn( item, sorted_list )
+                
+                with self.assertRaises( HydrusExceptions.DataMissing ):
+                    
+                    sorted_list.index( item )
+                    
+                
+            
+        
+    
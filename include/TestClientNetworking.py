@@ -218,6 +218,184 @@ class TestBandwidthManager( unittest.TestCase ):
     
 class TestNetworkingEngine( unittest.TestCase ):
     
+    class _FakeJob( object ):
+        
+        # just enough of a network job for the engine to schedule. it downloads nothing, and holds its slot until it is released
+        
+        def __init__( self, name, start_log, priority = ClientNetworking.JOB_PRIORITY_INTERACTIVE, domain = None, bandwidth_ok = True, blocking = True ):
+            
+            self.PRIORITY = priority
+            
+            self.engine = None
+            
+            self.name = name
+            
+            self._start_log = start_log
+            
+            self._network_contexts = [ ClientNetworking.GLOBAL_NETWORK_CONTEXT ]
+            
+            if domain is not None:
+                
+                self._network_contexts.append( ClientNetworking.NetworkContext( CC.NETWORK_CONTEXT_DOMAIN, domain ) )
+                
+            
+            self.bandwidth_ok = bandwidth_ok
+            
+            self.started = threading.Event()
+            self.release = threading.Event()
+            
+            self._is_done = threading.Event()
+            
+            if not blocking:
+                
+                self.release.set()
+                
+            
+        
+        def BandwidthOK( self ):
+            
+            return self.bandwidth_ok
+            
+        
+        def CanValidateInPopup( self ):
+            
+            return False
+            
+        
+        def GetNetworkContexts( self ):
+            
+            return list( self._network_contexts )
+            
+        
+        def GetWakeTime( self ):
+            
+            if self.bandwidth_ok:
+                
+                return 0
+                
+            else:
+                
+                # a long way off, so only a bandwidth change will get the engine to ask again
+                
+                return HydrusData.GetNow() + 3600
+                
+            
+        
+        def IsAsleep( self ):
+            
+            return False
+            
+        
+        def IsDone( self ):
+            
+            return self._is_done.is_set()
+            
+        
+        def IsValid( self ):
+            
+            return True
+            
+        
+        def NeedsLogin( self ):
+            
+            return False
+            
+        
+        def SetStatus( self, text ):
+            
+            pass
+            
+        
+        def Start( self ):
+            
+            self._start_log.append( self.name )
+            
+            self.started.set()
+            
+            self.release.wait( 10 )
+            
+            self._is_done.set()
+            
+        
+    
+    def _GetEngine( self ):
+        
+        mock_controller = TestConstants.MockController()
+        bandwidth_manager = ClientNetworking.NetworkBandwidthManager()
+        session_manager = ClientNetworking.NetworkSessionManager()
+        domain_manager = ClientNetworkingDomain.NetworkDomainManager()
+        login_manager = ClientNetworkingLogin.NetworkLoginManager()
+        
+        engine = ClientNetworking.NetworkEngine( mock_controller, bandwidth_manager, session_manager, domain_manager, login_manager )
+        
+        mock_controller.CallToThread( engine.MainLoop )
+        
+        return engine
+        
+    
+    def _ReleaseJobs( self, engine, jobs ):
+        
+        for job in jobs:
+            
+            job.release.set()
+            
+        
+        engine.Shutdown()
+        
+    
+    def _WaitUntil( self, condition ):
+        
+        timeout = time.time() + 5
+        
+        while not condition():
+            
+            if time.time() > timeout:
+                
+                raise Exception( 'Timed out waiting for the engine!' )
+                
+            
+            time.sleep( 0.01 )
+            
+        
+    
+    def test_bandwidth_changed_wakes_engine( self ):
+        
+        engine = self._GetEngine()
+        
+        start_log = []
+        
+        job = self._FakeJob( 'throttled', start_log, bandwidth_ok = False )
+        
+        try:
+            
+            engine.AddJob( job )
+            
+            self._WaitUntil( lambda: len( engine._jobs_bandwidth_throttled ) == 1 )
+            
+            # the job will not be asked again for an hour, so bandwidth freeing up on its own is not noticed
+            
+            job.bandwidth_ok = True
+            
+            time.sleep( 0.3 )
+            
+            self.assertFalse( job.started.is_set() )
+            
+            # but a rules change or override wakes the engine straight away, and it asks every throttled job again
+            
+            engine.NotifyBandwidthChanged()
+            
+            job.started.wait( 1 )
+            
+            self.assertTrue( job.started.is_set() )
+            
+            self.assertEqual( len( engine._jobs_bandwidth_throttled ), 0 )
+            
+        finally:
+            
+            self._ReleaseJobs( engine, [ job ] )
+            
+        
+    
     def test_engine_shutdown_app( self ):
         
         mock_controller = TestConstants.MockController()
@@ -322,6 +500,180 @@ class TestNetworkingEngine( unittest.TestCase ):
         engine.Shutdown()
         
     
+    def test_max_jobs_per_context( self ):
+        
+        engine = self._GetEngine()
+        
+        start_log = []
+        
+        wew_jobs = [ self._FakeJob( 'wew ' + str( i ), start_log, domain = 'wew.lad' ) for i in range( 5 ) ]
+        other_job = self._FakeJob( 'other', start_log, domain = 'other.lad' )
+        
+        try:
+            
+            for job in wew_jobs:
+                
+                engine.AddJob( job )
+                
+            
+            engine.AddJob( other_job )
+            
+            # only three from one domain at once, and the two waiting do not hold up the other domain's job behind them
+            
+            self._WaitUntil( lambda: len( start_log ) == 4 )
+            
+            time.sleep( 0.2 )
+            
+            self.assertEqual( sorted( start_log ), sorted( [ 'wew 0', 'wew 1', 'wew 2', 'other' ] ) )
+            
+            self.assertEqual( len( engine._jobs_ready_to_start ), 2 )
+            
+            # when one finishes, the next of that domain gets its slot
+            
+            wew_jobs[0].release.set()
+            
+            self._WaitUntil( lambda: len( start_log ) == 5 )
+            
+            time.sleep( 0.2 )
+            
+            self.assertEqual( start_log[ -1 ], 'wew 3' )
+            self.assertEqual( len( start_log ), 5 )
+            
+            self.assertEqual( engine._network_contexts_to_num_jobs_downloading[ ClientNetworking.NetworkContext( CC.NETWORK_CONTEXT_DOMAIN, 'wew.lad' ) ], 3 )
+            
+        finally:
+            
+            self._ReleaseJobs( engine, wew_jobs + [ other_job ] )
+            
+        
+    
+    def test_priorities_to_max_jobs( self ):
+        
+        engine = self._GetEngine()
+        
+        start_log = []
+        
+        # each on its own domain, so only the priority limits matter
+        
+        interactive_jobs = [ self._FakeJob( 'interactive ' + str( i ), start_log, domain = 'interactive' + str( i ) + '.lad' ) for i in range( 9 ) ]
+        
+        watcher_jobs = [ self._FakeJob( 'watcher ' + str( i ), start_log, priority = ClientNetworking.JOB_PRIORITY_WATCHER, domain = 'watcher' + str( i ) + '.lad' ) for i in range( 2 ) ]
+        
+        subscription_job = self._FakeJob( 'subscription', start_log, priority = ClientNetworking.JOB_PRIORITY_SUBSCRIPTION, domain = 'subscription.lad' )
+        
+        all_jobs = interactive_jobs + watcher_jobs + [ subscription_job ]
+        
+        try:
+            
+            for job in interactive_jobs[ : 8 ]:
+                
+                engine.AddJob( job )
+                
+            
+            self._WaitUntil( lambda: len( start_log ) == 8 )
+            
+            # with eight going, a subscription cannot start, but a watcher can take the ninth slot
+            
+            engine.AddJob( subscription_job )
+            engine.AddJob( watcher_jobs[0] )
+            
+            watcher_jobs[0].started.wait( 1 )
+            
+            self.assertTrue( watcher_jobs[0].started.is_set() )
+            
+            # and then only an interactive job can take the last one
+            
+            engine.AddJob( watcher_jobs[1] )
+            engine.AddJob( interactive_jobs[8] )
+            
+            interactive_jobs[8].started.wait( 1 )
+            
+            self.assertTrue( interactive_jobs[8].started.is_set() )
+            
+            time.sleep( 0.2 )
+            
+            self.assertFalse( watcher_jobs[1].started.is_set() )
+            self.assertFalse( subscription_job.started.is_set() )
+            
+            self.assertEqual( len( engine._jobs_downloading ), ClientNetworking.NetworkEngine.MAX_JOBS )
+            
+            # as slots free up, the watcher goes first, and the subscription only once it would leave two free
+            
+            interactive_jobs[0].release.set()
+            interactive_jobs[1].release.set()
+            
+            watcher_jobs[1].started.wait( 1 )
+            
+            self.assertTrue( watcher_jobs[1].started.is_set() )
+            
+            time.sleep( 0.2 )
+            
+            self.assertFalse( subscription_job.started.is_set() )
+            
+            interactive_jobs[2].release.set()
+            interactive_jobs[3].release.set()
+            
+            subscription_job.started.wait( 1 )
+            
+            self.assertTrue( subscription_job.started.is_set() )
+            
+        finally:
+            
+            self._ReleaseJobs( engine, all_jobs )
+            
+        
+    
+    def test_priority_order( self ):
+        
+        engine = self._GetEngine()
+        
+        # one slot, so they have to queue
+        
+        engine.MAX_JOBS = 1
+        engine.PRIORITIES_TO_MAX_JOBS = { priority : 1 for priority in ClientNetworking.NetworkEngine.PRIORITIES_TO_MAX_JOBS.keys() }
+        
+        start_log = []
+        
+        blocking_job = self._FakeJob( 'blocking', start_log )
+        
+        rows = []
+        
+        rows.append( ( 'subscription 1', ClientNetworking.JOB_PRIORITY_SUBSCRIPTION ) )
+        rows.append( ( 'interactive 1', ClientNetworking.JOB_PRIORITY_INTERACTIVE ) )
+        rows.append( ( 'repository 1', ClientNetworking.JOB_PRIORITY_REPOSITORY ) )
+        rows.append( ( 'watcher 1', ClientNetworking.JOB_PRIORITY_WATCHER ) )
+        rows.append( ( 'interactive 2', ClientNetworking.JOB_PRIORITY_INTERACTIVE ) )
+        rows.append( ( 'subscription 2', ClientNetworking.JOB_PRIORITY_SUBSCRIPTION ) )
+        
+        jobs = [ self._FakeJob( name, start_log, priority = priority, blocking = False ) for ( name, priority ) in rows ]
+        
+        try:
+            
+            engine.AddJob( blocking_job )
+            
+            blocking_job.started.wait( 1 )
+            
+            for job in jobs:
+                
+                engine.AddJob( job )
+                
+            
+            self._WaitUntil( lambda: len( engine._jobs_ready_to_start ) == len( jobs ) )
+            
+            blocking_job.release.set()
+            
+            self._WaitUntil( lambda: len( start_log ) == len( jobs ) + 1 )
+            
+            # highest priority first, and oldest first within a priority
+            
+            self.assertEqual( start_log, [ 'blocking', 'interactive 1', 'interactive 2', 'watcher 1', 'subscription 1', 'subscription 2', 'repository 1' ] )
+            
+        finally:
+            
+            self._ReleaseJobs( engine, jobs + [ blocking_job ] )
+            
+        
+    
 class TestNetworkingJob( unittest.TestCase ):
     
     def _GetJob( self, for_login = False ):
@@ -0,0 +1,190 @@
+import ClientSimilarFiles
+import HydrusData
+import random
+import struct
+import unittest
+
+class TestPHashIndex( unittest.TestCase ):
+    
+    def _AddLeaf( self, phash_index, phash_id, phash ):
+        
+        # this is the same walk _CacheSimilarFilesAddLeaf does
+        
+        parent_id = None
+        parent_radius = None
+        
+        ancestors_we_are_inside = []
+        ancestors_we_are_outside = []
+        
+        next_ancestor_id = phash_index.GetRootPHashId()
+        
+        while next_ancestor_id is not None:
+            
+            ancestor_id = next_ancestor_id
+            
+            ( ancestor_phash, ancestor_radius, ancestor_inner_id, ancestor_inner_population, ancestor_outer_id, ancestor_outer_population ) = phash_index.GetNode( ancestor_id )
+            
+            distance_to_ancestor = HydrusData.Get64BitHammingDistance( phash, ancestor_phash )
+            
+            if ancestor_radius is None or distance_to_ancestor <= ancestor_radius:
+                
+                ancestors_we_are_inside.append( ancestor_id )
+                next_ancestor_id = ancestor_inner_id
+                
+                if ancestor_inner_id is None:
+                    
+                    parent_id = ancestor_id
+                    parent_radius = distance_to_ancestor
+                    
+                
+            else:
+                
+                ancestors_we_are_outside.append( ancestor_id )
+                next_ancestor_id = ancestor_outer_id
+                
+                if ancestor_outer_id is None:
+                    
+                    parent_id = ancestor_id
+                    
+                
+            
+        
+        phash_index.AddLeaf( phash_id, phash, parent_id, parent_radius, ancestors_we_are_inside, ancestors_we_are_outside )
+        
+    
+    def _GetPHashes( self ):
+        
+        r = random.Random( 42 )
+        
+        centres = [ r.getrandbits( 64 ) for i in range( 20 ) ]
+        
+        phashes = []
+        
+        for i in range( 1000 ):
+            
+            phash_int = r.choice( centres )
+            
+            for j in range( r.randint( 0, 12 ) ):
+                
+                phash_int ^= 1 << r.randint( 0, 63 )
+                
+            
+            phashes.append( struct.pack( '!Q', phash_int ) )
+            
+        
+        return phashes
+        
+    
+    def test_search_batch( self ):
+        
+        phashes = self._GetPHashes()
+        
+        phash_index = ClientSimilarFiles.PHashIndex()
+        
+        phash_index.Load( [] )
+        
+        for ( i, phash ) in enumerate( phashes ):
+            
+            self._AddLeaf( phash_index, i + 1, phash )
+            
+        
+        owners_and_search_phashes = [ ( owner, phashes[ owner ] ) for owner in range( 0, 200, 3 ) ]
+        
+        for search_radius in ( 0, 4, 8 ):
+            
+            ( owners_and_similar_phash_ids, num_cycles ) = phash_index.SearchBatch( owners_and_search_phashes, search_radius )
+            
+            expected = set()
+            
+            for ( owner, search_phash ) in owners_and_search_phashes:
+                
+                ( similar_phash_ids, single_num_cycles ) = phash_index.Search( [ search_phash ], search_radius )
+                
+                expected.update( ( ( owner, phash_id ) for phash_id in similar_phash_ids ) )
+                
+            
+            self.assertEqual( owners_and_similar_phash_ids, expected )
+            
+        
+        self.assertEqual( phash_index.SearchBatch( [], 8 ), ( set(), 0 ) )
+        
+    
+    def test_search( self ):
+        
+        phashes = self._GetPHashes()
+        
+        phash_index = ClientSimilarFiles.PHashIndex()
+        
+        phash_index.Load( [] )
+        
+        for ( i, phash ) in enumerate( phashes ):
+            
+            self._AddLeaf( phash_index, i + 1, phash )
+            
+        
+        for search_phash in phashes[ : 50 ]:
+            
+            for search_radius in ( 0, 4, 8, 16 ):
+                
+                ( similar_phash_ids, num_cycles ) = phash_index.Search( [ search_phash ], search_radius )
+                
+                expected_phash_ids = { i + 1 for ( i, phash ) in enumerate( phashes ) if HydrusData.Get64BitHammingDistance( search_phash, phash ) <= search_radius }
+                
+                self.assertEqual( similar_phash_ids, expected_phash_ids )
+                
+            
+        
+        # a reload from db-style rows should give the same tree
+        
+        null_id = ClientSimilarFiles.NULL_ID
+        
+        def null( value ):
+            
+            if value is None:
+                
+                return null_id
+                
+            
+            return value
+            
+        
+        rows = []
+        
+        for phash_id in range( 1, len( phashes ) + 1 ):
+            
+            ( phash, radius, inner_id, inner_population, outer_id, outer_population ) = phash_index.GetNode( phash_id )
+            
+            if phash_id == phash_index.GetRootPHashId():
+                
+                parent_id = null_id
+                
+            else:
+                
+                parent_id = 0 # only the root's parent matters to the index
+                
+            
+            rows.append( ( phash_id, phash, parent_id, null( radius ), null( inner_id ), inner_population, null( outer_id ), outer_population ) )
+            
+        
+        loaded_phash_index = ClientSimilarFiles.PHashIndex()
+        
+        loaded_phash_index.Load( rows )
+        
+        for phash_id in range( 1, len( phashes ) + 1 ):
+            
+            self.assertEqual( loaded_phash_index.GetNode( phash_id ), phash_index.GetNode( phash_id ) )
+            
+        
+        search_phash = phashes[0]
+        
+        self.assertEqual( loaded_phash_index.Search( [ search_phash ], 8 ), phash_index.Search( [ search_phash ], 8 ) )
+        
+        # useless nodes stay in the tree but are not reported
+        
+        ( similar_phash_ids, num_cycles ) = loaded_phash_index.Search( [ search_phash ], 8 )
+        
+        loaded_phash_index.SetUseful( [ 1 ], False )
+        
+        ( fewer_similar_phash_ids, num_cycles ) = loaded_phash_index.Search( [ search_phash ], 8 )
+        
+        self.assertEqual( fewer_similar_phash_ids, similar_phash_ids.difference( { 1 } ) )
@@ -8,6 +8,7 @@ import ClientFiles
 import ClientGUIManagement
 import ClientGUIPages
 import ClientImporting
+import ClientMedia
 import ClientRatings
 import ClientSearch
 import ClientServices
@@ -19,8 +20,10 @@ import HydrusVideoHandling
 import HydrusGlobals as HG
 import HydrusNetwork
 import HydrusSerialisable
+import HydrusTags
 import itertools
 import os
+import random
 import ServerDB
 import shutil
 import sqlite3
@@ -79,6 +82,36 @@ class TestClientDB( unittest.TestCase ):
         cls._delete_db()
         
     
+    def _do_db_job( self, func ):
+        
+        # runs func( db ) as a write job on the db thread, so it can get at the private id lookups in a real transaction
+        
+        db = TestClientDB._db
+        
+        original_write = db._Write
+        
+        def write( action, *args, **kwargs ):
+            
+            if action == 'test_job':
+                
+                return func( db )
+                
+            
+            return original_write( action, *args, **kwargs )
+            
+        
+        db._Write = write
+        
+        try:
+            
+            return self._write( 'test_job' )
+            
+        finally:
+            
+            del db._Write
+            
+        
+    
     def _read( self, action, *args, **kwargs ): return TestClientDB._db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
     def _write( self, action, *args, **kwargs ): return TestClientDB._db.Write( action, HC.HIGH_PRIORITY, True, *args, **kwargs )
     
@@ -113,7 +146,7 @@ class TestClientDB( unittest.TestCase ):
         service_keys_to_content_updates = {}
         
         content_updates = []
-
+        
         content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'car', ( hash, ) ) ) )
         content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'series:cars', ( hash, ) ) ) )
         content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'maker:ford', ( hash, ) ) ) )
@@ -170,6 +203,49 @@ class TestClientDB( unittest.TestCase ):
         
         self.assertEqual( pred, read_pred )
         
+        #
+        
+        result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = '*ord*' )
+        
+        pred = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'maker:ford', min_current_count = 1 )
+        
+        ( read_pred, ) = result
+        
+        self.assertEqual( pred, read_pred )
+        
+        #
+        
+        result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = '*ars' )
+        
+        pred = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'series:cars', min_current_count = 1 )
+        
+        ( read_pred, ) = result
+        
+        self.assertEqual( pred, read_pred )
+        
+        #
+        
+        # when there are too many trigrams to intersect, the rarest are used
+        
+        ClientDB.MAX_WILDCARD_TRIGRAMS = 1
+        
+        try:
+            
+            result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = '*cars' )
+            
+            ( read_pred, ) = result
+            
+            self.assertEqual( pred, read_pred )
+            
+            result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = '*carsxyz*' )
+            
+            self.assertEqual( result, [] )
+            
+        finally:
+            
+            ClientDB.MAX_WILDCARD_TRIGRAMS = 16
+            
+        
         #
         
         result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = 'car', exact_match = True )
@@ -189,6 +265,73 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( result, [] )
         
     
+    def test_autocomplete_during_write( self ):
+        
+        TestClientDB._clear_db()
+        
+        file_import_job = ClientImporting.FileImportJob( os.path.join( HC.STATIC_DIR, 'hydrus.png' ) )
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        file_import_job.GenerateInfo()
+        
+        self._write( 'import_file', file_import_job )
+        
+        hash = file_import_job.GetHash()
+        
+        content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'car', ( hash, ) ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+        
+        reached_event = threading.Event()
+        release_event = threading.Event()
+        
+        def long_write( db ):
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'cat', ( hash, ) ) )
+            
+            db._Write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+            
+            reached_event.set()
+            
+            release_event.wait( 60 )
+            
+        
+        writer = threading.Thread( target = self._do_db_job, args = ( long_write, ) )
+        
+        writer.start()
+        
+        try:
+            
+            self.assertTrue( reached_event.wait( 10 ) )
+            
+            # the write is still going, but the search does not wait for it. it sees the last commit, which has the tag added before it started
+            
+            result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = 'c*' )
+            
+            self.assertTrue( writer.is_alive() )
+            
+            self.assertEqual( set( result ), { ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'car', min_current_count = 1 ) } )
+            
+            ( media_result, ) = self._read( 'media_results', ( hash, ) )
+            
+            self.assertEqual( media_result.GetHash(), hash )
+            self.assertEqual( media_result.GetTagsManager().GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ), { 'car' } )
+            
+        finally:
+            
+            release_event.set()
+            
+            writer.join( 10 )
+            
+        
+        # and once it is done, it is seen
+        
+        result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = 'c*' )
+        
+        self.assertEqual( set( result ), { ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'car', min_current_count = 1 ), ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'cat', min_current_count = 1 ) } )
+        
+    
     def test_booru( self ):
         
         default_boorus = ClientDefaults.GetDefaultBoorus()
@@ -207,7 +350,7 @@ class TestClientDB( unittest.TestCase ):
         for ( name, booru ) in default_boorus.items(): self.assertEqual( result[ name ].GetData(), booru.GetData() )
         
         #
-    
+        
         name = 'blah'
         search_url = 'url'
         search_separator = '%20'
@@ -415,7 +558,7 @@ class TestClientDB( unittest.TestCase ):
         tests.append( ( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( u'\u2248', 0, HydrusData.ConvertUnitToInt( 'B' ) ), 0 ) )
         tests.append( ( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 5270, HydrusData.ConvertUnitToInt( 'B' ) ), 0 ) )
         tests.append( ( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 5269, HydrusData.ConvertUnitToInt( 'B' ) ), 1 ) )
-        tests.append( ( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 0, HydrusData.ConvertUnitToInt( 'B' ) ), 1 ) )
+        tests.append( ( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 0, 1 ), 1 ) )
         tests.append( ( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 0, HydrusData.ConvertUnitToInt( 'KB' ) ), 1 ) )
         tests.append( ( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 0, HydrusData.ConvertUnitToInt( 'MB' ) ), 1 ) )
         tests.append( ( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 0, HydrusData.ConvertUnitToInt( 'GB' ) ), 1 ) )
@@ -517,6 +660,27 @@ class TestClientDB( unittest.TestCase ):
         
         run_namespace_predicate_tests( tests )
         
+        #
+        
+        tests = []
+        
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'maker:ford', True ), ( HC.PREDICATE_TYPE_TAG, 'series:cars', True ), ( HC.PREDICATE_TYPE_NAMESPACE, 'series', True ) ], 1 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'maker:ford', True ), ( HC.PREDICATE_TYPE_TAG, 'car', True ) ], 1 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'maker:ford', True ), ( HC.PREDICATE_TYPE_TAG, 'bus', True ) ], 0 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'maker:ford', True ), ( HC.PREDICATE_TYPE_TAG, 'series:cars', False ) ], 0 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'maker:ford', True ), ( HC.PREDICATE_TYPE_NAMESPACE, 'character', False ) ], 1 ) )
+        
+        for ( predicates_info, result ) in tests:
+            
+            predicates = [ ClientSearch.Predicate( predicate_type, value, inclusive ) for ( predicate_type, value, inclusive ) in predicates_info ]
+            
+            search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+            
+            file_query_ids = self._read( 'file_query_ids', search_context )
+            
+            self.assertEqual( len( file_query_ids ), result )
+            
+        
         #
         
         like_rating_service_key = HydrusData.GenerateKey()
@@ -590,6 +754,201 @@ class TestClientDB( unittest.TestCase ):
         run_system_predicate_tests( tests )
         
     
+    def test_file_query_sort( self ):
+        
+        TestClientDB._clear_db()
+        
+        # distinct sizes, resolutions, mimes and import times, and two files without a duration to check the fallback sort
+        
+        hash_ids = []
+        
+        for ( filename, tags ) in ( ( 'muh_gif.gif', [ 'a' ] ), ( 'muh_jpg.jpg', [ 'a', 'b', 'c' ] ), ( 'muh_swf.swf', [ 'a', 'b' ] ), ( 'muh_png.png', [] ) ):
+            
+            path = os.path.join( HC.STATIC_DIR, 'testing', filename )
+            
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            file_import_job.GenerateInfo()
+            
+            self._write( 'import_file', file_import_job )
+            
+            hash = file_import_job.GetHash()
+            
+            if len( tags ) > 0:
+                
+                self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( tag, ( hash, ) ) ) for tag in tags ] } )
+                
+            
+            search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_HASH, ( hash, 'sha256' ) ) ] )
+            
+            ( hash_id, ) = self._read( 'file_query_ids', search_context )
+            
+            hash_ids.append( hash_id )
+            
+            # import time is in seconds
+            
+            time.sleep( 1.1 )
+            
+        
+        ( gif, jpg, swf, png ) = hash_ids
+        
+        search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, None ) ] )
+        
+        unsorted_hash_ids = self._read( 'file_query_ids', search_context )
+        
+        self.assertItemsEqual( unsorted_hash_ids, hash_ids )
+        
+        tests = []
+        
+        tests.append( ( CC.SORT_FILES_BY_FILESIZE, [ gif, png, jpg, swf ], [ swf, jpg, png, gif ] ) )
+        tests.append( ( CC.SORT_FILES_BY_HEIGHT, [ png, gif, swf, jpg ], [ jpg, swf, gif, png ] ) )
+        tests.append( ( CC.SORT_FILES_BY_WIDTH, [ png, gif, jpg, swf ], [ swf, jpg, gif, png ] ) )
+        tests.append( ( CC.SORT_FILES_BY_RATIO, [ jpg, png, swf, gif ], [ gif, swf, png, jpg ] ) )
+        tests.append( ( CC.SORT_FILES_BY_NUM_PIXELS, [ png, gif, swf, jpg ], [ jpg, swf, gif, png ] ) )
+        tests.append( ( CC.SORT_FILES_BY_MIME, [ jpg, png, gif, swf ], [ swf, gif, png, jpg ] ) )
+        tests.append( ( CC.SORT_FILES_BY_IMPORT_TIME, [ gif, jpg, swf, png ], [ png, swf, jpg, gif ] ) )
+        
+        # no duration sorts as -1, and the tie is broken by the fallback sort, oldest import first, in both directions
+        
+        tests.append( ( CC.SORT_FILES_BY_DURATION, [ jpg, png, swf, gif ], [ gif, swf, jpg, png ] ) )
+        
+        # the db cannot sort by number of tags, so it leaves those for the page
+        
+        tests.append( ( CC.SORT_FILES_BY_NUM_TAGS, unsorted_hash_ids, unsorted_hash_ids ) )
+        
+        for ( sort_data, asc_hash_ids, desc_hash_ids ) in tests:
+            
+            for ( sort_asc, expected_hash_ids ) in ( ( CC.SORT_ASC, asc_hash_ids ), ( CC.SORT_DESC, desc_hash_ids ) ):
+                
+                media_sort = ClientMedia.MediaSort( ( 'system', sort_data ), sort_asc )
+                
+                file_query_ids = self._read( 'file_query_ids', search_context, media_sort = media_sort )
+                
+                self.assertEqual( ( sort_data, sort_asc, file_query_ids ), ( sort_data, sort_asc, expected_hash_ids ) )
+                
+            
+        
+    
+    def test_file_search_cache( self ):
+        
+        TestClientDB._clear_db()
+        
+        hashes = []
+        
+        for filename in ( 'hydrus.png', 'archive.png' ):
+            
+            path = os.path.join( HC.STATIC_DIR, filename )
+            
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            file_import_job.GenerateInfo()
+            
+            self._write( 'import_file', file_import_job )
+            
+            hashes.append( file_import_job.GetHash() )
+            
+        
+        ( hash_1, hash_2 ) = hashes
+        
+        file_search_cache = TestClientDB._db._file_search_cache
+        
+        def search( predicate_type, value, file_service_key = CC.LOCAL_FILE_SERVICE_KEY ):
+            
+            search_context = ClientSearch.FileSearchContext( file_service_key = file_service_key, predicates = [ ClientSearch.Predicate( predicate_type, value ) ] )
+            
+            num_hits = file_search_cache._num_hits
+            
+            hash_ids = self._read( 'file_query_ids', search_context )
+            
+            was_hit = file_search_cache._num_hits > num_hits
+            
+            return ( set( hash_ids ), was_hit )
+            
+        
+        def write( service_key, content_update ):
+            
+            self._write( 'content_updates', { service_key : [ content_update ] } )
+            
+        
+        ( ( hash_id_1, ), was_hit ) = search( HC.PREDICATE_TYPE_SYSTEM_HASH, ( hash_1, 'sha256' ) )
+        ( ( hash_id_2, ), was_hit ) = search( HC.PREDICATE_TYPE_SYSTEM_HASH, ( hash_2, 'sha256' ) )
+        
+        # the first search runs, the second is served from the cache
+        
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'car' ), ( set(), False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'car' ), ( set(), True ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'bus' ), ( set(), False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_INBOX, None ), ( { hash_id_1, hash_id_2 }, False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, None ), ( { hash_id_1, hash_id_2 }, False ) )
+        
+        # mappings only clear the searches for that tag
+        
+        write( CC.LOCAL_TAG_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'car', ( hash_1, ) ) ) )
+        
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'car' ), ( { hash_id_1 }, False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'bus' ), ( set(), True ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_INBOX, None ), ( { hash_id_1, hash_id_2 }, True ) )
+        
+        # archiving only clears inbox and archive searches
+        
+        write( CC.COMBINED_LOCAL_FILE_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ARCHIVE, ( hash_1, ) ) )
+        
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_INBOX, None ), ( { hash_id_2 }, False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, None ), ( { hash_id_1, hash_id_2 }, True ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'car' ), ( { hash_id_1 }, True ) )
+        
+        # a new parent is added to the child's files
+        
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'vehicle' ), ( set(), False ) )
+        
+        write( CC.LOCAL_TAG_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, ( 'car', 'vehicle' ) ) )
+        
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'vehicle' ), ( { hash_id_1 }, False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_INBOX, None ), ( { hash_id_2 }, True ) )
+        
+        # siblings clear every tag search
+        
+        write( CC.LOCAL_TAG_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, ( 'bus', 'vehicle' ) ) )
+        
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'car' ), ( { hash_id_1 }, False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'bus' )[1], False )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_INBOX, None ), ( { hash_id_2 }, True ) )
+        
+        # deleting a file can change anything
+        
+        write( CC.LOCAL_FILE_SERVICE_KEY, HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, ( hash_2, ) ) )
+        
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_INBOX, None ), ( set(), False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, None ), ( { hash_id_1 }, False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'car' ), ( { hash_id_1 }, False ) )
+        
+        # but an import only clears searches that look at local files
+        
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'car', file_service_key = CC.COMBINED_FILE_SERVICE_KEY ), ( { hash_id_1 }, False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 0, 1 ), file_service_key = CC.COMBINED_FILE_SERVICE_KEY )[1], False )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, None, file_service_key = CC.TRASH_SERVICE_KEY ), ( { hash_id_2 }, False ) )
+        
+        file_import_job = ClientImporting.FileImportJob( os.path.join( HC.STATIC_DIR, 'hydrus_small.png' ) )
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        file_import_job.GenerateInfo()
+        
+        self._write( 'import_file', file_import_job )
+        
+        ( ( hash_id_3, ), was_hit ) = search( HC.PREDICATE_TYPE_SYSTEM_HASH, ( file_import_job.GetHash(), 'sha256' ) )
+        
+        self.assertEqual( search( HC.PREDICATE_TYPE_TAG, 'car', file_service_key = CC.COMBINED_FILE_SERVICE_KEY ), ( { hash_id_1 }, True ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 0, 1 ), file_service_key = CC.COMBINED_FILE_SERVICE_KEY )[1], False )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, None, file_service_key = CC.TRASH_SERVICE_KEY ), ( { hash_id_2 }, False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_INBOX, None ), ( { hash_id_3 }, False ) )
+        self.assertEqual( search( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, None ), ( { hash_id_1, hash_id_3 }, False ) )
+        
+    
     def test_file_system_predicates( self ):
         
         TestClientDB._clear_db()
@@ -752,56 +1111,229 @@ class TestClientDB( unittest.TestCase ):
             
         
     
-    def test_import( self ):
+    def test_id_lookups( self ):
         
         TestClientDB._clear_db()
         
-        test_files = []
-        
-        test_files.append( ( 'muh_swf.swf', 'edfef9905fdecde38e0752a5b6ab7b6df887c3968d4246adc9cffc997e168cdf', 456774, HC.APPLICATION_FLASH, 400, 400, 33, 1, None ) )
-        test_files.append( ( 'muh_mp4.mp4', '2fa293907144a046d043d74e9570b1c792cbfd77ee3f5c93b2b1a1cb3e4c7383', 570534, HC.VIDEO_MP4, 480, 480, 'mp4_duration', 151, None ) )
-        test_files.append( ( 'muh_mpeg.mpeg', 'aebb10aaf3b27a5878fd2732ea28aaef7bbecef7449eaa759421c4ba4efff494', 772096, HC.VIDEO_MPEG, 720, 480, 2966, 105, None ) )
-        test_files.append( ( 'muh_webm.webm', '55b6ce9d067326bf4b2fbe66b8f51f366bc6e5f776ba691b0351364383c43fcb', 84069, HC.VIDEO_WEBM, 640, 360, 4010, 120, None ) )
-        test_files.append( ( 'muh_jpg.jpg', '5d884d84813beeebd59a35e474fa3e4742d0f2b6679faa7609b245ddbbd05444', 42296, HC.IMAGE_JPEG, 392, 498, None, None, None ) )
-        test_files.append( ( 'muh_png.png', 'cdc67d3b377e6e1397ffa55edc5b50f6bdf4482c7a6102c6f27fa351429d6f49', 31452, HC.IMAGE_PNG, 191, 196, None, None, None ) )
-        
-        if '3.2.4' in HydrusVideoHandling.GetFFMPEGVersion():
-            apng_duration = 3133
-        else:
-            apng_duration = 1880
-        
-        test_files.append( ( 'muh_apng.png', '9e7b8b5abc7cb11da32db05671ce926a2a2b701415d1b2cb77a28deea51010c3', 616956, HC.IMAGE_APNG, 500, 500, apng_duration, 47, None ) )
-        test_files.append( ( 'muh_gif.gif', '00dd9e9611ebc929bfc78fde99a0c92800bbb09b9d18e0946cea94c099b211c2', 15660, HC.IMAGE_GIF, 329, 302, 600, 5, None ) )
+        # either side of MIN_TEMP_TABLE_ID_LOOKUP, so both the one-by-one and the temp table lookups get checked
         
-        for ( filename, hex_hash, size, mime, width, height, duration, num_frames, num_words ) in test_files:
+        for num_values in ( 10, 100 ):
             
-            path = os.path.join( HC.STATIC_DIR, 'testing', filename )
+            # a third already exist and are cached, a third exist but are not cached, and the rest are new
             
-            hash = hex_hash.decode( 'hex' )
+            hashes = [ HydrusData.GenerateKey() for i in range( num_values ) ]
             
-            file_import_job = ClientImporting.FileImportJob( path )
+            def prepare_hashes( db ):
+                
+                hash_ids = [ db._GetHashId( hash ) for hash in hashes[ : num_values * 2 // 3 ] ]
+                
+                db._hash_ids_cache.Clear()
+                
+                for hash in hashes[ : num_values // 3 ]:
+                    
+                    db._GetHashId( hash )
+                    
+                
+                return hash_ids
+                
             
-            file_import_job.GenerateHashAndStatus()
+            def resolve_hashes( db ):
+                
+                hashes_to_hash_ids = db._GetHashesToHashIds( hashes + [ None ] + hashes[ : 3 ] )
+                
+                hash_ids_to_hashes = { hash_id : db._GetHash( hash_id ) for hash_id in hashes_to_hash_ids.values() }
+                
+                return ( hashes_to_hash_ids, hash_ids_to_hashes, db._hash_ids_cache.GetIds( hashes ) )
+                
             
-            file_import_job.GenerateInfo()
+            existing_hash_ids = self._do_db_job( prepare_hashes )
             
-            written_result = self._write( 'import_file', file_import_job )
+            ( hashes_to_hash_ids, hash_ids_to_hashes, cache_result ) = self._do_db_job( resolve_hashes )
             
-            self.assertEqual( written_result, CC.STATUS_SUCCESSFUL )
-            self.assertEqual( file_import_job.GetHash(), hash )
+            self.assertEqual( set( hashes_to_hash_ids.keys() ), set( hashes ) )
+            self.assertEqual( [ hashes_to_hash_ids[ hash ] for hash in hashes[ : num_values * 2 // 3 ] ], existing_hash_ids )
+            self.assertEqual( len( hash_ids_to_hashes ), num_values )
             
-            file_import_job = ClientImporting.FileImportJob( path )
+            for ( hash, hash_id ) in hashes_to_hash_ids.items():
+                
+                self.assertEqual( hash_ids_to_hashes[ hash_id ], hash )
+                
             
-            file_import_job.GenerateHashAndStatus()
+            self.assertEqual( cache_result, ( hashes_to_hash_ids, set() ) )
             
-            file_import_job.GenerateInfo()
+            # tags come in pairs that share a subtag, and there are some that need cleaning or clean to nothing
             
-            written_result = self._write( 'import_file', file_import_job )
+            tags = [ ( 'lookup %d' if i % 2 == 0 else 'series:lookup %d' ) % ( num_values + i // 2 ) for i in range( num_values ) ]
             
-            self.assertEqual( written_result, CC.STATUS_REDUNDANT )
-            self.assertEqual( file_import_job.GetHash(), hash )
+            messy_tags = [ ' Series:Lookup %d' % num_values, '   ' ]
             
-            written_hash = file_import_job.GetHash()
+            def prepare_tags( db ):
+                
+                tag_ids = [ db._GetTagId( tag ) for tag in tags[ : num_values * 2 // 3 ] ]
+                
+                db._namespace_ids_cache.Clear()
+                db._tag_ids_cache.Clear()
+                
+                for tag in tags[ : num_values // 3 ]:
+                    
+                    db._GetTagId( tag )
+                    
+                
+                return tag_ids
+                
+            
+            def resolve_tags( db ):
+                
+                tags_to_tag_ids = db._GetTagsToTagIds( tags + messy_tags )
+                
+                tag_ids_to_tags = { tag_id : db._GetTag( tag_id ) for tag_id in tags_to_tag_ids.values() }
+                
+                return ( tags_to_tag_ids, tag_ids_to_tags, db._tag_ids_cache.GetIds( tags ) )
+                
+            
+            existing_tag_ids = self._do_db_job( prepare_tags )
+            
+            ( tags_to_tag_ids, tag_ids_to_tags, cache_result ) = self._do_db_job( resolve_tags )
+            
+            self.assertEqual( set( tags_to_tag_ids.keys() ), set( tags + messy_tags[ : 1 ] ) )
+            self.assertEqual( [ tags_to_tag_ids[ tag ] for tag in tags[ : num_values * 2 // 3 ] ], existing_tag_ids )
+            self.assertEqual( tags_to_tag_ids[ messy_tags[0] ], tags_to_tag_ids[ tags[1] ] )
+            self.assertEqual( len( tag_ids_to_tags ), num_values )
+            
+            for ( tag, tag_id ) in tags_to_tag_ids.items():
+                
+                self.assertEqual( tag_ids_to_tags[ tag_id ], HydrusTags.CleanTag( tag ) )
+                
+            
+            self.assertEqual( cache_result, ( { tag : tags_to_tag_ids[ tag ] for tag in tags }, set() ) )
+            
+            # subtags have no cache, but new ones need their search data
+            
+            subtags = [ u'bulk subtag %d' % ( num_values + i ) for i in range( num_values ) ]
+            
+            def resolve_subtags( db ):
+                
+                existing_subtag_ids = [ db._GetSubtagId( subtag ) for subtag in subtags[ : num_values // 2 ] ]
+                
+                subtags_to_subtag_ids = db._GetSubtagsToSubtagIds( subtags + subtags[ : 3 ] )
+                
+                subtag_ids_to_subtags = dict( db._c.execute( 'SELECT subtag_id, subtag FROM subtags WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtags_to_subtag_ids.values() ) + ';' ) )
+                
+                num_searchable = db._c.execute( 'SELECT COUNT( * ) FROM subtags_fts4 WHERE docid IN ' + HydrusData.SplayListForDB( subtags_to_subtag_ids.values() ) + ';' ).fetchone()[0]
+                
+                num_with_trigrams = db._c.execute( 'SELECT COUNT( DISTINCT subtag_id ) FROM subtag_trigrams WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtags_to_subtag_ids.values() ) + ';' ).fetchone()[0]
+                
+                return ( existing_subtag_ids, subtags_to_subtag_ids, subtag_ids_to_subtags, num_searchable, num_with_trigrams )
+                
+            
+            ( existing_subtag_ids, subtags_to_subtag_ids, subtag_ids_to_subtags, num_searchable, num_with_trigrams ) = self._do_db_job( resolve_subtags )
+            
+            self.assertEqual( set( subtags_to_subtag_ids.keys() ), set( subtags ) )
+            self.assertEqual( [ subtags_to_subtag_ids[ subtag ] for subtag in subtags[ : num_values // 2 ] ], existing_subtag_ids )
+            self.assertEqual( subtag_ids_to_subtags, { subtag_id : subtag for ( subtag, subtag_id ) in subtags_to_subtag_ids.items() } )
+            self.assertEqual( num_searchable, num_values )
+            self.assertEqual( num_with_trigrams, num_values )
+            
+        
+    
+    def test_id_lookups_rollback( self ):
+        
+        TestClientDB._clear_db()
+        
+        # ids made in a job that fails are rolled back, and sqlite hands them out again, so the caches must not keep them
+        
+        for num_values in ( 1, 100 ):
+            
+            rolled_back_hashes = [ HydrusData.GenerateKey() for i in range( num_values ) ]
+            rolled_back_tags = [ 'rollback %d:tag %d' % ( num_values, i ) for i in range( num_values ) ]
+            
+            def fail( db ):
+                
+                db._GetHashesToHashIds( rolled_back_hashes )
+                db._GetTagsToTagIds( rolled_back_tags )
+                
+                raise Exception( 'rolling back' )
+                
+            
+            with self.assertRaises( HydrusExceptions.DBException ):
+                
+                self._do_db_job( fail )
+                
+            
+            other_hashes = [ HydrusData.GenerateKey() for i in range( num_values ) ]
+            other_tags = [ 'other %d:other tag %d' % ( num_values, i ) for i in range( num_values ) ]
+            
+            def resolve( db ):
+                
+                hashes_to_hash_ids = db._GetHashesToHashIds( other_hashes )
+                hashes_to_hash_ids.update( db._GetHashesToHashIds( rolled_back_hashes ) )
+                
+                tags_to_tag_ids = db._GetTagsToTagIds( other_tags )
+                tags_to_tag_ids.update( db._GetTagsToTagIds( rolled_back_tags ) )
+                
+                hash_ids_to_hashes = { hash_id : db._GetHash( hash_id ) for hash_id in hashes_to_hash_ids.values() }
+                tag_ids_to_tags = { tag_id : db._GetTag( tag_id ) for tag_id in tags_to_tag_ids.values() }
+                
+                return ( hashes_to_hash_ids, hash_ids_to_hashes, tags_to_tag_ids, tag_ids_to_tags )
+                
+            
+            ( hashes_to_hash_ids, hash_ids_to_hashes, tags_to_tag_ids, tag_ids_to_tags ) = self._do_db_job( resolve )
+            
+            self.assertEqual( { hash_ids_to_hashes[ hash_id ] : hash_id for ( hash, hash_id ) in hashes_to_hash_ids.items() }, hashes_to_hash_ids )
+            self.assertEqual( { tag_ids_to_tags[ tag_id ] : tag_id for ( tag, tag_id ) in tags_to_tag_ids.items() }, tags_to_tag_ids )
+            
+        
+    
+    def test_import( self ):
+        
+        TestClientDB._clear_db()
+        
+        test_files = []
+        
+        test_files.append( ( 'muh_swf.swf', 'edfef9905fdecde38e0752a5b6ab7b6df887c3968d4246adc9cffc997e168cdf', 456774, HC.APPLICATION_FLASH, 400, 400, 33, 1, None ) )
+        test_files.append( ( 'muh_mp4.mp4', '2fa293907144a046d043d74e9570b1c792cbfd77ee3f5c93b2b1a1cb3e4c7383', 570534, HC.VIDEO_MP4, 480, 480, 'mp4_duration', 151, None ) )
+        test_files.append( ( 'muh_mpeg.mpeg', 'aebb10aaf3b27a5878fd2732ea28aaef7bbecef7449eaa759421c4ba4efff494', 772096, HC.VIDEO_MPEG, 720, 480, 2966, 105, None ) )
+        test_files.append( ( 'muh_webm.webm', '55b6ce9d067326bf4b2fbe66b8f51f366bc6e5f776ba691b0351364383c43fcb', 84069, HC.VIDEO_WEBM, 640, 360, 4010, 120, None ) )
+        test_files.append( ( 'muh_jpg.jpg', '5d884d84813beeebd59a35e474fa3e4742d0f2b6679faa7609b245ddbbd05444', 42296, HC.IMAGE_JPEG, 392, 498, None, None, None ) )
+        test_files.append( ( 'muh_png.png', 'cdc67d3b377e6e1397ffa55edc5b50f6bdf4482c7a6102c6f27fa351429d6f49', 31452, HC.IMAGE_PNG, 191, 196, None, None, None ) )
+        
+        if '3.2.4' in HydrusVideoHandling.GetFFMPEGVersion():
+            apng_duration = 3133
+        else:
+            apng_duration = 1880
+            
+        test_files.append( ( 'muh_apng.png', '9e7b8b5abc7cb11da32db05671ce926a2a2b701415d1b2cb77a28deea51010c3', 616956, HC.IMAGE_APNG, 500, 500, apng_duration, 47, None ) )
+        test_files.append( ( 'muh_gif.gif', '00dd9e9611ebc929bfc78fde99a0c92800bbb09b9d18e0946cea94c099b211c2', 15660, HC.IMAGE_GIF, 329, 302, 600, 5, None ) )
+        
+        for ( filename, hex_hash, size, mime, width, height, duration, num_frames, num_words ) in test_files:
+            
+            path = os.path.join( HC.STATIC_DIR, 'testing', filename )
+            
+            hash = hex_hash.decode( 'hex' )
+            
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            file_import_job.GenerateInfo()
+            
+            written_result = self._write( 'import_file', file_import_job )
+            
+            self.assertEqual( written_result, CC.STATUS_SUCCESSFUL )
+            self.assertEqual( file_import_job.GetHash(), hash )
+            
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            file_import_job.GenerateInfo()
+            
+            written_result = self._write( 'import_file', file_import_job )
+            
+            self.assertEqual( written_result, CC.STATUS_REDUNDANT )
+            self.assertEqual( file_import_job.GetHash(), hash )
+            
+            written_hash = file_import_job.GetHash()
             
             ( media_result, ) = self._read( 'media_results', ( written_hash, ) )
             
@@ -821,7 +1353,7 @@ class TestClientDB( unittest.TestCase ):
             self.assertEqual( mr_height, height )
             
             if duration == 'mp4_duration': # diff ffmpeg versions report differently
-                
+            
                 self.assertIn( mr_duration, ( 6266, 6290 ) )
                 
             else:
@@ -889,6 +1421,161 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def test_mappings_cache_regeneration( self ):
+        
+        TestClientDB._clear_db()
+        
+        hashes = []
+        
+        for filename in ( 'hydrus.png', 'archive.png', 'collection.png' ):
+            
+            path = os.path.join( HC.STATIC_DIR, filename )
+            
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            file_import_job.GenerateInfo()
+            
+            self._write( 'import_file', file_import_job )
+            
+            hashes.append( file_import_job.GetHash() )
+            
+        
+        ( hash_1, hash_2, hash_3 ) = hashes
+        
+        def add_mappings( rows ):
+            
+            content_updates = [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( tag, tag_hashes ) ) for ( tag, tag_hashes ) in rows ]
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+            
+        
+        def get_counts( file_service_key ):
+            
+            counts = {}
+            
+            for tag in ( 'apple', 'banana', 'cherry', 'durian' ):
+                
+                result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, file_service_key = file_service_key, search_text = tag, exact_match = True )
+                
+                for p in result:
+                    
+                    counts[ p.GetValue() ] = p.GetCount( HC.CONTENT_STATUS_CURRENT )
+                    
+                
+            
+            return counts
+            
+        
+        add_mappings( [ ( 'apple', ( hash_1, hash_2, hash_3 ) ), ( 'banana', ( hash_1, hash_2 ) ), ( 'cherry', ( hash_1, ) ) ] )
+        
+        file_service_keys = ( CC.COMBINED_FILE_SERVICE_KEY, CC.LOCAL_FILE_SERVICE_KEY )
+        
+        for file_service_key in file_service_keys:
+            
+            self.assertEqual( get_counts( file_service_key ), { 'apple' : 3, 'banana' : 2, 'cherry' : 1 } )
+            
+        
+        # one tag or file per chunk, so every chunk is an opportunity to stop
+        
+        TestClientDB._db.MAPPINGS_CACHE_REGENERATION_TAG_CHUNK_SIZE = 1
+        TestClientDB._db.MAPPINGS_CACHE_REGENERATION_FILE_CHUNK_SIZE = 1
+        
+        job_keys = []
+        
+        def cancel_modal_messages( topic, *args, **kwargs ):
+            
+            if topic == 'modal_message':
+                
+                ( job_key, ) = args
+                
+                job_key.Cancel()
+                
+                job_keys.append( job_key )
+                
+            
+        
+        idle_checks = [ 0 ]
+        
+        def currently_idle():
+            
+            idle_checks[0] += 1
+            
+            return idle_checks[0] <= 3
+            
+        
+        try:
+            
+            # cancelling as soon as the popup appears leaves the caches reset but unfilled
+            
+            HG.test_controller.pub = cancel_modal_messages
+            
+            self._write( 'regenerate_ac_cache' )
+            
+            self.assertEqual( len( job_keys ), 1 )
+            
+            for file_service_key in file_service_keys:
+                
+                self.assertEqual( get_counts( file_service_key ), {} )
+                
+            
+            # idle maintenance does a few chunks and then stops as soon as the client is busy again
+            
+            HG.test_controller.CurrentlyIdle = currently_idle
+            
+            self._write( 'maintain_mappings_caches', only_when_idle = True )
+            
+            self.assertEqual( idle_checks[0], 4 )
+            
+            true_counts = { 'apple' : 3, 'banana' : 2, 'cherry' : 1 }
+            
+            partial_counts = [ get_counts( file_service_key ) for file_service_key in file_service_keys ]
+            
+            self.assertTrue( 0 < sum( ( len( counts ) for counts in partial_counts ) ) < 6 )
+            
+            for counts in partial_counts:
+                
+                for ( tag, count ) in counts.items():
+                    
+                    self.assertEqual( count, true_counts[ tag ] )
+                    
+                
+            
+            # new mappings during regeneration go into the done part of the cache now and into the rest when it is reached
+            
+            add_mappings( [ ( 'cherry', ( hash_2, hash_3 ) ), ( 'durian', ( hash_3, ) ) ] )
+            
+            self._write( 'maintain_mappings_caches', only_when_idle = True )
+            
+            self.assertEqual( idle_checks[0], 5 )
+            
+        finally:
+            
+            del HG.test_controller.pub
+            del HG.test_controller.CurrentlyIdle
+            
+            del TestClientDB._db.MAPPINGS_CACHE_REGENERATION_TAG_CHUNK_SIZE
+            del TestClientDB._db.MAPPINGS_CACHE_REGENERATION_FILE_CHUNK_SIZE
+            
+        
+        self._write( 'maintain_mappings_caches' )
+        
+        for file_service_key in file_service_keys:
+            
+            self.assertEqual( get_counts( file_service_key ), { 'apple' : 3, 'banana' : 2, 'cherry' : 3, 'durian' : 1 } )
+            
+        
+        # and once it is done, there is nothing left to pick up
+        
+        self._write( 'maintain_mappings_caches', only_when_idle = True )
+        
+        for file_service_key in file_service_keys:
+            
+            self.assertEqual( get_counts( file_service_key ), { 'apple' : 3, 'banana' : 2, 'cherry' : 3, 'durian' : 1 } )
+            
+        
+    
     def test_md5_status( self ):
         
         TestClientDB._clear_db()
@@ -1030,6 +1717,259 @@ class TestClientDB( unittest.TestCase ):
         
         self.assertEqual( result, ( False, [ ':', 'series:' ] ) )
         
+        # the tag lookups are censored in the db, so don't leave this for the tests that come after
+        
+        self._write( 'tag_censorship', [] )
+        
+    
+    def test_tag_lookups( self ):
+        
+        service_keys_to_content_updates = {}
+        
+        content_updates = []
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, ( 'lookup_bad', 'lookup_good' ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, ( 'lookup_child', 'lookup_bad' ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, ( 'lookup_good', 'lookup_grandparent' ) ) )
+        
+        service_keys_to_content_updates[ CC.LOCAL_TAG_SERVICE_KEY ] = content_updates
+        
+        self._write( 'content_updates', service_keys_to_content_updates )
+        
+        #
+        
+        for service_key in ( CC.LOCAL_TAG_SERVICE_KEY, CC.COMBINED_TAG_SERVICE_KEY ):
+            
+            # asking about any tag in a network gets the whole network
+            
+            self.assertEqual( self._read( 'tag_siblings_lookup', service_key, [ 'lookup_bad' ] ), { service_key : { 'lookup_bad' : 'lookup_good' } } )
+            self.assertEqual( self._read( 'tag_siblings_lookup', service_key, [ 'lookup_good' ] ), { service_key : { 'lookup_bad' : 'lookup_good' } } )
+            
+            self.assertEqual( self._read( 'tag_parents_lookup', service_key, [ 'lookup_child', 'lookup_good' ] ), { service_key : { 'lookup_child' : [ 'lookup_good', 'lookup_grandparent' ], 'lookup_good' : [ 'lookup_grandparent' ] } } )
+            
+        
+        # tags that have never been seen have nothing, and are not made by looking
+        
+        self.assertEqual( self._read( 'tag_siblings_lookup', CC.LOCAL_TAG_SERVICE_KEY, [ 'lookup_never_seen' ] ), { CC.LOCAL_TAG_SERVICE_KEY : {} } )
+        self.assertEqual( self._read( 'tag_parents_lookup', CC.LOCAL_TAG_SERVICE_KEY, [ 'lookup_never_seen' ] ), { CC.LOCAL_TAG_SERVICE_KEY : {} } )
+        
+        self.assertFalse( self._do_db_job( lambda db: db._TagExists( 'lookup_never_seen' ) ) )
+        
+        #
+        
+        service_keys_to_content_updates = {}
+        
+        content_updates = []
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, ( 'lookup_bad', 'lookup_good' ) ) )
+        
+        service_keys_to_content_updates[ CC.LOCAL_TAG_SERVICE_KEY ] = content_updates
+        
+        self._write( 'content_updates', service_keys_to_content_updates )
+        
+        #
+        
+        result = self._read( 'tag_siblings_lookup', CC.LOCAL_TAG_SERVICE_KEY, [ 'lookup_bad' ] )
+        
+        self.assertEqual( result, { CC.LOCAL_TAG_SERVICE_KEY : {} } )
+        
+        result = self._read( 'tag_parents_lookup', CC.LOCAL_TAG_SERVICE_KEY, [ 'lookup_child' ] )
+        
+        self.assertEqual( result, { CC.LOCAL_TAG_SERVICE_KEY : { 'lookup_child' : [ 'lookup_bad' ] } } )
+        
+    
+    def test_tag_lookups_consistency( self ):
+        
+        def check():
+            
+            service_keys_to_statuses_to_pairs = self._read( 'tag_siblings' )
+            
+            expected_siblings = ClientData.BuildServiceKeysToSiblings( service_keys_to_statuses_to_pairs )
+            
+            service_keys_to_statuses_to_pairs = self._read( 'tag_parents' )
+            
+            expected_parents = ClientData.BuildServiceKeysToParents( service_keys_to_statuses_to_pairs, expected_siblings, apply_all_siblings_to_all_services )
+            
+            for service_key in ( CC.LOCAL_TAG_SERVICE_KEY, repo_service_key, CC.COMBINED_TAG_SERVICE_KEY ):
+                
+                # the consistency tags' networks and closures only ever hold other consistency tags
+                
+                siblings = self._read( 'tag_siblings_lookup', service_key, all_tags ).get( service_key, {} )
+                parents = self._read( 'tag_parents_lookup', service_key, all_tags ).get( service_key, {} )
+                
+                expected = { bad : good for ( bad, good ) in expected_siblings.get( service_key, {} ).items() if bad in all_tags }
+                
+                self.assertEqual( siblings, expected )
+                
+                result = { child : set( ancestors ) for ( child, ancestors ) in parents.items() if len( ancestors ) > 0 }
+                expected = { child : set( ancestors ) for ( child, ancestors ) in expected_parents.get( service_key, {} ).items() if len( ancestors ) > 0 and child in all_tags }
+                
+                self.assertEqual( result, expected )
+                
+            
+        
+        services = self._read( 'services' )
+        
+        old_services = list( services )
+        
+        repo_service_key = HydrusData.GenerateKey()
+        
+        services.append( ClientServices.GenerateService( repo_service_key, HC.TAG_REPOSITORY, 'lookup consistency repo' ) )
+        
+        self._write( 'update_services', services )
+        
+        apply_all_siblings_to_all_services = False
+        
+        # siblings stay within a level and parents always go up a level, so nothing ever loops and the expected collapse does not depend on set order
+        
+        levels = [ [ 'consistency_' + str( level ) + '_' + str( i ) for i in range( 3 ) ] for level in range( 4 ) ]
+        
+        all_tags = set( itertools.chain.from_iterable( levels ) )
+        
+        r = random.Random( 42 )
+        
+        try:
+            
+            for i in range( 60 ):
+                
+                content_type = r.choice( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_TYPE_TAG_PARENTS ) )
+                
+                if content_type == HC.CONTENT_TYPE_TAG_SIBLINGS:
+                    
+                    level = r.choice( levels )
+                    
+                    ( a, b ) = sorted( r.sample( range( len( level ) ), 2 ) )
+                    
+                    pair = ( level[ a ], level[ b ] )
+                    
+                else:
+                    
+                    ( a, b ) = sorted( r.sample( range( len( levels ) ), 2 ) )
+                    
+                    pair = ( r.choice( levels[ a ] ), r.choice( levels[ b ] ) )
+                    
+                
+                if r.random() < 0.5:
+                    
+                    service_key = CC.LOCAL_TAG_SERVICE_KEY
+                    
+                    content_update = HydrusData.ContentUpdate( content_type, r.choice( ( HC.CONTENT_UPDATE_ADD, HC.CONTENT_UPDATE_ADD, HC.CONTENT_UPDATE_DELETE ) ), pair )
+                    
+                else:
+                    
+                    service_key = repo_service_key
+                    
+                    if r.random() < 0.7:
+                        
+                        content_update = HydrusData.ContentUpdate( content_type, HC.CONTENT_UPDATE_PEND, ( pair, 'reason' ) )
+                        
+                    else:
+                        
+                        content_update = HydrusData.ContentUpdate( content_type, HC.CONTENT_UPDATE_RESCIND_PEND, pair )
+                        
+                    
+                
+                self._write( 'content_updates', { service_key : [ content_update ] } )
+                
+                check()
+                
+                if i == 30:
+                    
+                    apply_all_siblings_to_all_services = True
+                    
+                    new_options = self._read( 'serialisable', HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+                    
+                    new_options.SetBoolean( 'apply_all_siblings_to_all_services', True )
+                    
+                    self._write( 'serialisable', new_options )
+                    
+                    check()
+                    
+                
+            
+            self._write( 'delete_pending', repo_service_key )
+            
+            check()
+            
+        finally:
+            
+            new_options = self._read( 'serialisable', HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+            
+            new_options.SetBoolean( 'apply_all_siblings_to_all_services', False )
+            
+            self._write( 'serialisable', new_options )
+            
+            self._write( 'update_services', old_services )
+            
+        
+        apply_all_siblings_to_all_services = False
+        
+        check()
+        
+        for content_type in ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_TYPE_TAG_PARENTS ):
+            
+            service_keys_to_statuses_to_pairs = self._read( 'tag_siblings' if content_type == HC.CONTENT_TYPE_TAG_SIBLINGS else 'tag_parents' )
+            
+            content_updates = [ HydrusData.ContentUpdate( content_type, HC.CONTENT_UPDATE_DELETE, pair ) for pair in service_keys_to_statuses_to_pairs[ CC.LOCAL_TAG_SERVICE_KEY ][ HC.CONTENT_STATUS_CURRENT ] if pair[0].startswith( 'consistency_' ) ]
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+            
+        
+        check()
+        
+    
+    def test_tag_sibling_autocomplete( self ):
+        
+        pairs = [ ( 'ishygddt', 'i sure hope you guys don\'t do that' ), ( 'character:rei ayanami', 'character:ayanami rei' ), ( 'ac_chain_a', 'ac_chain_b' ), ( 'ac_chain_b', 'ac_chain_c' ), ( 'ac_deleted_a', 'ac_deleted_b' ) ]
+        
+        content_updates = [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, pair ) for pair in pairs ]
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, ( 'ac_deleted_a', 'ac_deleted_b' ) ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+        
+        def get_tags( service_key, search_text, exact_match = False ):
+            
+            def do_it( db ):
+                
+                tag_ids = db._GetAutocompleteTagIds( service_key, search_text, exact_match )
+                
+                return set( db._GetTagIdsToTags( tag_ids ).values() )
+                
+            
+            return self._do_db_job( do_it )
+            
+        
+        try:
+            
+            # a search that matches any tag in a sibling network gets the whole network
+            
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 'ishy*' ), { 'ishygddt', 'i sure hope you guys don\'t do that' } )
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 'i su*' ), { 'ishygddt', 'i sure hope you guys don\'t do that' } )
+            
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 'ayan*' ), { 'character:rei ayanami', 'character:ayanami rei' } )
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 'character:rei*' ), { 'character:rei ayanami', 'character:ayanami rei' } )
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 'rei' ), { 'character:rei ayanami', 'character:ayanami rei' } )
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 're' ), set() )
+            
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 'ac_chain_c' ), { 'ac_chain_a', 'ac_chain_b', 'ac_chain_c' } )
+            
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 'ishygddt', exact_match = True ), { 'ishygddt', 'i sure hope you guys don\'t do that' } )
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 'ishy', exact_match = True ), set() )
+            
+            # a deleted pair is no network, and the combined service has everyone's siblings
+            
+            self.assertEqual( get_tags( CC.LOCAL_TAG_SERVICE_KEY, 'ac_deleted_a' ), { 'ac_deleted_a' } )
+            
+            self.assertEqual( get_tags( CC.COMBINED_TAG_SERVICE_KEY, 'ishygddt' ), { 'ishygddt', 'i sure hope you guys don\'t do that' } )
+            
+        finally:
+            
+            content_updates = [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, pair ) for pair in pairs ]
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+            
+        
     
     def test_nums_pending( self ):
         
@@ -1231,6 +2171,171 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def test_similar_files( self ):
+        
+        TestClientDB._clear_db()
+        
+        def run_similar_to_test( hash, result ):
+            
+            predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_SIMILAR_TO, ( hash, 0 ) ) ]
+            
+            search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+            
+            file_query_ids = self._read( 'file_query_ids', search_context )
+            
+            self.assertEqual( len( file_query_ids ), result )
+            
+        
+        def import_file( filename ):
+            
+            path = os.path.join( HC.STATIC_DIR, filename )
+            
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            file_import_job.GenerateInfo()
+            
+            self._write( 'import_file', file_import_job )
+            
+            return file_import_job.GetHash()
+            
+        
+        first_hash = import_file( 'hydrus.png' )
+        
+        # the search loads the in-memory phash index, so the next imports have to add their leaves to a live index
+        
+        run_similar_to_test( first_hash, 1 )
+        
+        self.assertTrue( TestClientDB._db._phash_index.IsLoaded() )
+        
+        hashes = [ first_hash ]
+        
+        for filename in ( 'archive.png', 'collection.png', 'hydrus_32.png' ):
+            
+            hashes.append( import_file( filename ) )
+            
+        
+        self.assertTrue( TestClientDB._db._phash_index.IsLoaded() )
+        
+        for hash in hashes:
+            
+            run_similar_to_test( hash, 1 )
+            
+        
+        # and the index agrees with the db after a reload
+        
+        TestClientDB._db._phash_index.Invalidate()
+        
+        for hash in hashes:
+            
+            run_similar_to_test( hash, 1 )
+            
+        
+    
+    def test_url_statuses( self ):
+        
+        TestClientDB._clear_db()
+        
+        HC.options[ 'exclude_deleted_files' ] = True
+        
+        old_min_capacity = ClientDB.MIN_URL_BLOOM_FILTER_CAPACITY
+        
+        # a small filter, so adding urls fills it up
+        
+        ClientDB.MIN_URL_BLOOM_FILTER_CAPACITY = 8
+        
+        try:
+            
+            def import_file( filename ):
+                
+                file_import_job = ClientImporting.FileImportJob( os.path.join( HC.STATIC_DIR, 'testing', filename ) )
+                
+                file_import_job.GenerateHashAndStatus()
+                
+                file_import_job.GenerateInfo()
+                
+                self._write( 'import_file', file_import_job )
+                
+                return file_import_job.GetHash()
+                
+            
+            def add_urls( hash, urls ):
+                
+                content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_URLS, HC.CONTENT_UPDATE_ADD, ( hash, urls ) )
+                
+                self._write( 'content_updates', { CC.COMBINED_LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
+                
+            
+            def check_statuses( urls ):
+                
+                urls_to_statuses = self._read( 'url_statuses', urls )
+                
+                self.assertEqual( set( urls_to_statuses.keys() ), set( urls ) )
+                
+                for url in urls:
+                    
+                    self.assertEqual( urls_to_statuses[ url ], self._read( 'url_status', url ) )
+                    
+                
+                return urls_to_statuses
+                
+            
+            jpg_hash = import_file( 'muh_jpg.jpg' )
+            png_hash = import_file( 'muh_png.png' )
+            
+            add_urls( jpg_hash, ( 'http://example.com/jpg', 'https://example.com/jpg_https' ) )
+            add_urls( png_hash, ( 'http://example.com/png', ) )
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, ( png_hash, ) )
+            
+            self._write( 'content_updates', { CC.LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
+            
+            # the https and http versions of a known url are found as well
+            
+            urls = [ 'http://example.com/jpg', 'https://example.com/jpg', 'http://example.com/jpg_https', 'http://example.com/png', 'http://example.com/new', 'https://example.com/new' ]
+            
+            urls_to_statuses = check_statuses( urls )
+            
+            self.assertEqual( [ urls_to_statuses[ url ][ : 2 ] for url in urls ], [ ( CC.STATUS_REDUNDANT, jpg_hash ) ] * 3 + [ ( CC.STATUS_DELETED, png_hash ) ] + [ ( CC.STATUS_NEW, None ) ] * 2 )
+            
+            self.assertTrue( TestClientDB._db._url_bloom_filter is not None )
+            
+            # urls added after the filter is built go in it, and once it is full, it is rebuilt from the db on the next read
+            
+            new_urls = [ 'http://example.com/new/' + str( i ) for i in range( 10 ) ]
+            
+            for url in new_urls[ : 5 ]:
+                
+                add_urls( jpg_hash, ( url, ) )
+                
+                self.assertTrue( TestClientDB._db._url_bloom_filter is not None )
+                
+                self.assertEqual( check_statuses( [ url ] )[ url ][ : 2 ], ( CC.STATUS_REDUNDANT, jpg_hash ) )
+                
+            
+            add_urls( jpg_hash, new_urls[ 5 : ] )
+            
+            self.assertEqual( TestClientDB._db._url_bloom_filter, None )
+            
+            urls_to_statuses = check_statuses( urls + new_urls + [ 'http://example.com/new/10' ] )
+            
+            self.assertTrue( TestClientDB._db._url_bloom_filter is not None )
+            self.assertFalse( TestClientDB._db._url_bloom_filter.IsFull() )
+            
+            for url in new_urls:
+                
+                self.assertEqual( urls_to_statuses[ url ][ : 2 ], ( CC.STATUS_REDUNDANT, jpg_hash ) )
+                
+            
+            self.assertEqual( urls_to_statuses[ 'http://example.com/new/10' ], ( CC.STATUS_NEW, None, '' ) )
+            
+        finally:
+            
+            ClientDB.MIN_URL_BLOOM_FILTER_CAPACITY = old_min_capacity
+            
+        
+    
 class TestServerDB( unittest.TestCase ):
     
     def _read( self, action, *args, **kwargs ): return TestServerDB._db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
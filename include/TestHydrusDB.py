@@ -0,0 +1,720 @@
+import HydrusConstants as HC
+import HydrusDB
+import HydrusGlobals as HG
+import collections
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+class DummyDB( HydrusDB.HydrusDB ):
+    
+    CONCURRENT_READ_ACTIONS = [ 'value' ]
+    COALESCABLE_WRITE_ACTIONS = [ 'append' ]
+    
+    def __init__( self, *args, **kwargs ):
+        
+        self.batch_sizes = []
+        
+        HydrusDB.HydrusDB.__init__( self, *args, **kwargs )
+        
+    
+    def _Append( self, value ):
+        
+        if value < 0:
+            
+            raise Exception( 'Negative values are not allowed!' )
+            
+        
+        self._c.execute( 'INSERT INTO test_log ( value ) VALUES ( ? );', ( value, ) )
+        
+        return value
+        
+    
+    def _Block( self, reached_event, release_event ):
+        
+        reached_event.set()
+        
+        release_event.wait( 10 )
+        
+    
+    def _CreateDB( self ):
+        
+        self._c.execute( 'CREATE TABLE version ( version INTEGER );' )
+        
+        self._c.execute( 'INSERT INTO version ( version ) VALUES ( ? );', ( HC.SOFTWARE_VERSION, ) )
+        
+        self._c.execute( 'CREATE TABLE test_value ( value INTEGER );' )
+        
+        self._c.execute( 'INSERT INTO test_value ( value ) VALUES ( ? );', ( 0, ) )
+        
+        self._c.execute( 'CREATE TABLE test_log ( value INTEGER );' )
+        
+    
+    def _GetValue( self, set_value = None ):
+        
+        if set_value is not None:
+            
+            self._SetValue( set_value )
+            
+        
+        ( value, ) = self._c.execute( 'SELECT value FROM test_value;' ).fetchone()
+        
+        return ( value, self._IsReadConnection() )
+        
+    
+    def _ManageDBError( self, job, e ):
+        
+        job.PutResult( e )
+        
+    
+    def _ProcessWriteBatch( self, batch ):
+        
+        self.batch_sizes.append( len( batch ) )
+        
+        HydrusDB.HydrusDB._ProcessWriteBatch( self, batch )
+        
+    
+    def _Read( self, action, *args, **kwargs ):
+        
+        if action == 'log': result = [ value for ( value, ) in self._c.execute( 'SELECT value FROM test_log;' ) ]
+        elif action in ( 'stale_value', 'value', 'value_main_connection' ): result = self._GetValue( *args, **kwargs )
+        else: raise Exception( 'db received an unknown read command: ' + action )
+        
+        return result
+        
+    
+    def _ReadFromJob( self, value ):
+        
+        # like a cache manager that needs something from the db to finish a job
+        
+        self._SetValue( value )
+        
+        return self.Read( 'value', HC.HIGH_PRIORITY )
+        
+    
+    def _SetValue( self, value ):
+        
+        self._c.execute( 'UPDATE test_value SET value = ?;', ( value, ) )
+        
+    
+    def _SetValueAcrossCommit( self, value, reached_event, release_event ):
+        
+        # like the big maintenance jobs, this commits part way through and then keeps writing
+        
+        self._c.execute( 'UPDATE test_value SET value = ?;', ( value - 1, ) )
+        
+        self._Commit()
+        
+        self._BeginImmediate()
+        
+        self._c.execute( 'UPDATE test_value SET value = ?;', ( value, ) )
+        
+        reached_event.set()
+        
+        release_event.wait( 10 )
+        
+    
+    def _Write( self, action, *args, **kwargs ):
+        
+        if action == 'append': result = self._Append( *args, **kwargs )
+        elif action == 'block': result = self._Block( *args, **kwargs )
+        elif action == 'read_from_job': result = self._ReadFromJob( *args, **kwargs )
+        elif action == 'value': result = self._SetValue( *args, **kwargs )
+        elif action == 'value_across_commit': result = self._SetValueAcrossCommit( *args, **kwargs )
+        else: raise Exception( 'db received an unknown write command: ' + action )
+        
+        return result
+        
+    
+class TestBloomFilter( unittest.TestCase ):
+    
+    def _GetValues( self, prefix, num ):
+        
+        return [ prefix + str( i ) for i in range( num ) ]
+        
+    
+    def test_false_positives( self ):
+        
+        bloom_filter = HydrusDB.BloomFilter( 1000 )
+        
+        for value in self._GetValues( 'http://example.com/', 1000 ):
+            
+            bloom_filter.Add( value )
+            
+        
+        num_false_positives = len( [ value for value in self._GetValues( 'http://example.net/', 10000 ) if bloom_filter.MightContain( value ) ] )
+        
+        # it is made for 1%, so this has plenty of slack
+        
+        self.assertTrue( num_false_positives < 300 )
+        
+    
+    def test_is_full( self ):
+        
+        bloom_filter = HydrusDB.BloomFilter( 10 )
+        
+        for value in self._GetValues( 'a', 10 ):
+            
+            bloom_filter.Add( value )
+            
+        
+        self.assertFalse( bloom_filter.IsFull() )
+        
+        bloom_filter.Add( 'b' )
+        
+        self.assertTrue( bloom_filter.IsFull() )
+        
+        # a full one still has no false negatives, it just gives more false positives
+        
+        for value in self._GetValues( 'a', 10 ) + [ 'b' ]:
+            
+            self.assertTrue( bloom_filter.MightContain( value ) )
+            
+        
+    
+    def test_no_false_negatives( self ):
+        
+        values = self._GetValues( 'http://example.com/', 2000 ) + [ u'http://example.com/\u30c6\u30b9\u30c8', '' ]
+        
+        for capacity in ( 0, 10, 2000, 100000 ):
+            
+            bloom_filter = HydrusDB.BloomFilter( capacity )
+            
+            for value in values:
+                
+                bloom_filter.Add( value )
+                
+            
+            for value in values:
+                
+                self.assertTrue( bloom_filter.MightContain( value ) )
+                
+            
+        
+    
+    def test_rebuild( self ):
+        
+        # what the client db does--once the filter is full, a bigger one is built from everything
+        
+        values = []
+        
+        bloom_filter = HydrusDB.BloomFilter( 100 )
+        
+        num_rebuilds = 0
+        
+        for value in self._GetValues( 'http://example.com/', 1000 ):
+            
+            values.append( value )
+            
+            bloom_filter.Add( value )
+            
+            if bloom_filter.IsFull():
+                
+                bloom_filter = HydrusDB.BloomFilter( len( values ) * 2 )
+                
+                for existing_value in values:
+                    
+                    bloom_filter.Add( existing_value )
+                    
+                
+                num_rebuilds += 1
+                
+                self.assertFalse( bloom_filter.IsFull() )
+                
+            
+            self.assertTrue( bloom_filter.MightContain( value ) )
+            
+        
+        self.assertTrue( num_rebuilds > 0 )
+        
+        for value in values:
+            
+            self.assertTrue( bloom_filter.MightContain( value ) )
+            
+        
+        num_false_positives = len( [ value for value in self._GetValues( 'http://example.net/', 10000 ) if bloom_filter.MightContain( value ) ] )
+        
+        self.assertTrue( num_false_positives < 300 )
+        
+    
+class StaleTolerantDummyDB( DummyDB ):
+    
+    STALE_TOLERANT_READ_ACTIONS = [ 'stale_value' ]
+    
+class TestIdLookupCache( unittest.TestCase ):
+    
+    def test_clear( self ):
+        
+        cache = HydrusDB.IdLookupCache( 10 )
+        
+        cache.AddIds( { 'a' : 1, 'b' : 2 } )
+        
+        cache.Clear()
+        
+        self.assertEqual( cache.GetId( 'a' ), None )
+        self.assertEqual( cache.GetIds( [ 'a', 'b' ] ), ( {}, { 'a', 'b' } ) )
+        
+    
+    def test_get( self ):
+        
+        cache = HydrusDB.IdLookupCache( 10 )
+        
+        cache.AddId( 'a', 1 )
+        cache.AddIds( { 'b' : 2, 'c' : 3 } )
+        
+        self.assertEqual( cache.GetId( 'a' ), 1 )
+        self.assertEqual( cache.GetId( 'd' ), None )
+        
+        self.assertEqual( cache.GetIds( [ 'a', 'b', 'd', 'e' ] ), ( { 'a' : 1, 'b' : 2 }, { 'd', 'e' } ) )
+        self.assertEqual( cache.GetIds( ( value for value in [ 'c' ] ) ), ( { 'c' : 3 }, set() ) )
+        
+        # a new id for the same value replaces the old one
+        
+        cache.AddId( 'a', 4 )
+        
+        self.assertEqual( cache.GetId( 'a' ), 4 )
+        
+    
+    def test_lru( self ):
+        
+        cache = HydrusDB.IdLookupCache( 3 )
+        
+        for ( value_id, value ) in enumerate( [ 'a', 'b', 'c' ] ):
+            
+            cache.AddId( value, value_id )
+            
+        
+        # 'a' is the oldest, but it gets used, so 'b' is the one to go
+        
+        cache.GetId( 'a' )
+        
+        cache.AddId( 'd', 3 )
+        
+        self.assertEqual( cache.GetIds( [ 'a', 'b', 'c', 'd' ] ), ( { 'a' : 0, 'c' : 2, 'd' : 3 }, { 'b' } ) )
+        
+        # GetIds also counts as a use, and it went through a, c, d in that order
+        
+        cache.GetIds( [ 'a', 'd' ] )
+        
+        cache.AddIds( { 'e' : 4 } )
+        
+        self.assertEqual( cache.GetIds( [ 'a', 'c', 'd', 'e' ] ), ( { 'a' : 0, 'd' : 3, 'e' : 4 }, { 'c' } ) )
+        
+        # a bulk add bigger than the cache keeps only the newest
+        
+        cache.AddIds( collections.OrderedDict( ( ( str( i ), i ) for i in range( 10 ) ) ) )
+        
+        self.assertEqual( cache.GetIds( [ '7', '8', '9' ] ), ( { '7' : 7, '8' : 8, '9' : 9 }, set() ) )
+        self.assertEqual( cache.GetIds( [ '0', 'a', 'e' ] ), ( {}, { '0', 'a', 'e' } ) )
+        
+    
+    def test_readding( self ):
+        
+        cache = HydrusDB.IdLookupCache( 2 )
+        
+        cache.AddId( 'a', 1 )
+        cache.AddId( 'b', 2 )
+        
+        # adding an existing value again makes it the newest, so 'b' is the one to go
+        
+        cache.AddId( 'a', 1 )
+        cache.AddId( 'c', 3 )
+        
+        self.assertEqual( cache.GetIds( [ 'a', 'b', 'c' ] ), ( { 'a' : 1, 'c' : 3 }, { 'b' } ) )
+        
+    
+
+class TestReadConnections( unittest.TestCase ):
+    
+    def setUp( self ):
+        
+        self._db_dir = tempfile.mkdtemp()
+        
+        self._db = DummyDB( HG.test_controller, self._db_dir, 'test' )
+        
+        for i in range( 100 ):
+            
+            if self._db._num_read_connections == DummyDB.NUM_READ_CONNECTIONS:
+                
+                break
+                
+            
+            time.sleep( 0.05 )
+            
+        
+    
+    def tearDown( self ):
+        
+        self._db.Shutdown()
+        
+        while not self._db.LoopIsFinished():
+            
+            time.sleep( 0.1 )
+            
+        
+        shutil.rmtree( self._db_dir )
+        
+    
+    def _Read( self, action, *args, **kwargs ):
+        
+        return self._db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
+        
+    
+    def _Write( self, action, *args, **kwargs ):
+        
+        return self._db.Write( action, HC.HIGH_PRIORITY, True, *args, **kwargs )
+        
+    
+    def test_read_after_write( self ):
+        
+        self._Write( 'value', 1 )
+        
+        # the write is not committed yet, so only the main connection can see it
+        
+        self.assertEqual( self._Read( 'value' ), ( 1, False ) )
+        
+        # once the transaction is committed, the pool can take reads again
+        
+        self._db.TRANSACTION_COMMIT_TIME = -1
+        
+        self._Write( 'value', 2 )
+        
+        self.assertEqual( self._Read( 'value' ), ( 2, True ) )
+        
+    
+    def test_read_from_db_thread( self ):
+        
+        # the job is done on its own connection, rather than waiting on the queue behind itself, so it sees its own write
+        
+        self.assertEqual( self._Write( 'read_from_job', 6 ), ( 6, False ) )
+        
+    
+    def test_read_during_write_that_commits( self ):
+        
+        reached_event = threading.Event()
+        release_event = threading.Event()
+        
+        self._db.Write( 'value_across_commit', HC.HIGH_PRIORITY, False, 5, reached_event, release_event )
+        
+        self.assertTrue( reached_event.wait( 10 ) )
+        
+        # 4 is committed, but the job is still writing, so the read has to wait for the main connection and see 5
+        
+        results = []
+        
+        reader = threading.Thread( target = lambda: results.append( self._Read( 'value' ) ) )
+        
+        reader.start()
+        
+        time.sleep( 0.2 )
+        
+        self.assertEqual( results, [] )
+        
+        release_event.set()
+        
+        reader.join( 10 )
+        
+        self.assertEqual( results, [ ( 5, False ) ] )
+        
+    
+    def test_routing( self ):
+        
+        self.assertEqual( self._db._num_read_connections, DummyDB.NUM_READ_CONNECTIONS )
+        
+        self.assertEqual( self._Read( 'value' ), ( 0, True ) )
+        self.assertEqual( self._Read( 'value_main_connection' ), ( 0, False ) )
+        
+        # a read that tries to write is refused by the read connection and redone on the main one
+        
+        self.assertEqual( self._Read( 'value', set_value = 3 ), ( 3, False ) )
+        
+        self.assertEqual( self._Read( 'value_main_connection' ), ( 3, False ) )
+        
+    
+class TestStaleTolerantReads( unittest.TestCase ):
+    
+    def setUp( self ):
+        
+        self._db_dir = tempfile.mkdtemp()
+        
+        self._db = StaleTolerantDummyDB( HG.test_controller, self._db_dir, 'test' )
+        
+        for i in range( 100 ):
+            
+            if self._db._num_read_connections == StaleTolerantDummyDB.NUM_READ_CONNECTIONS:
+                
+                break
+                
+            
+            time.sleep( 0.05 )
+            
+        
+    
+    def tearDown( self ):
+        
+        self._db.Shutdown()
+        
+        while not self._db.LoopIsFinished():
+            
+            time.sleep( 0.1 )
+            
+        
+        shutil.rmtree( self._db_dir )
+        
+    
+    def _Read( self, action, *args, **kwargs ):
+        
+        return self._db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
+        
+    
+    def _Write( self, action, *args, **kwargs ):
+        
+        return self._db.Write( action, HC.HIGH_PRIORITY, True, *args, **kwargs )
+        
+    
+    def test_read_after_write( self ):
+        
+        # the db commits after every write, so a finished write is seen straight away, from the pool
+        
+        self._Write( 'value', 1 )
+        
+        self.assertEqual( self._Read( 'stale_value' ), ( 1, True ) )
+        
+        self._Write( 'value', 2 )
+        
+        self.assertEqual( self._Read( 'stale_value' ), ( 2, True ) )
+        
+        # the normal concurrent reads are unchanged, and can use the pool again now it is committed
+        
+        self.assertEqual( self._Read( 'value' ), ( 2, True ) )
+        
+    
+    def test_read_during_write( self ):
+        
+        self._Write( 'value', 1 )
+        
+        reached_event = threading.Event()
+        release_event = threading.Event()
+        
+        self._db.Write( 'value_across_commit', HC.HIGH_PRIORITY, False, 5, reached_event, release_event )
+        
+        self.assertTrue( reached_event.wait( 10 ) )
+        
+        # the job is still writing, but this does not wait for it, and gets the last commit
+        
+        self.assertEqual( self._Read( 'stale_value' ), ( 4, True ) )
+        
+        # and a write queued behind it does not hold it up either
+        
+        self._db.Write( 'value', HC.HIGH_PRIORITY, False, 7 )
+        
+        self.assertEqual( self._Read( 'stale_value' ), ( 4, True ) )
+        
+        release_event.set()
+        
+        self._Write( 'append', 1 )
+        
+        self.assertEqual( self._Read( 'stale_value' ), ( 7, True ) )
+        
+    
+class TestTemporaryValueTable( unittest.TestCase ):
+    
+    def setUp( self ):
+        
+        self._db = sqlite3.connect( ':memory:', isolation_level = None )
+        
+        self._c = self._db.cursor()
+        
+        self._c.execute( 'ATTACH ":memory:" AS mem;' )
+        
+        self._c.execute( 'CREATE TABLE hashes ( hash_id INTEGER PRIMARY KEY, hash BLOB UNIQUE );' )
+        
+        self._hashes = [ os.urandom( 32 ) for i in range( 10 ) ]
+        
+        self._c.executemany( 'INSERT INTO hashes ( hash ) VALUES ( ? );', ( ( sqlite3.Binary( hash ), ) for hash in self._hashes ) )
+        
+    
+    def tearDown( self ):
+        
+        self._db.close()
+        
+    
+    def test_exception( self ):
+        
+        try:
+            
+            with HydrusDB.TemporaryValueTable( self._c, [ u'a' ], 'subtag', 'TEXT' ) as temp_table_name:
+                
+                raise ValueError()
+                
+            
+            self.fail( 'The exception was not raised!' )
+            
+        except ValueError:
+            
+            pass
+            
+        
+        self.assertEqual( self._c.execute( 'SELECT name FROM mem.sqlite_master;' ).fetchall(), [] )
+        
+    
+    def test_join( self ):
+        
+        values = [ sqlite3.Binary( hash ) for hash in self._hashes[ 2 : 5 ] ]
+        
+        # duplicates are fine, and it can take a generator
+        
+        values.append( sqlite3.Binary( self._hashes[2] ) )
+        values.append( sqlite3.Binary( os.urandom( 32 ) ) )
+        
+        with HydrusDB.TemporaryValueTable( self._c, ( value for value in values ), 'hash', 'BLOB' ) as temp_table_name:
+            
+            self.assertTrue( temp_table_name.startswith( 'mem.' ) )
+            
+            self.assertEqual( self._c.execute( 'SELECT COUNT( * ) FROM ' + temp_table_name + ';' ).fetchone(), ( 4, ) )
+            
+            result = { str( hash ) : hash_id for ( hash, hash_id ) in self._c.execute( 'SELECT hash, hash_id FROM hashes WHERE hash IN ( SELECT hash FROM ' + temp_table_name + ' );' ) }
+            
+        
+        self.assertEqual( result, { self._hashes[2] : 3, self._hashes[3] : 4, self._hashes[4] : 5 } )
+        
+        # and it is gone afterwards
+        
+        self.assertEqual( self._c.execute( 'SELECT name FROM mem.sqlite_master;' ).fetchall(), [] )
+        
+    
+    def test_text( self ):
+        
+        subtags = [ u'blue eyes', u'\u30b5\u30e0\u30b9', u'blue eyes' ]
+        
+        with HydrusDB.TemporaryValueTable( self._c, subtags, 'subtag', 'TEXT' ) as temp_table_name:
+            
+            result = { subtag for ( subtag, ) in self._c.execute( 'SELECT subtag FROM ' + temp_table_name + ';' ) }
+            
+        
+        self.assertEqual( result, set( subtags ) )
+        
+    
+
+class TestWriteBatches( unittest.TestCase ):
+    
+    def setUp( self ):
+        
+        self._db_dir = tempfile.mkdtemp()
+        
+        self._db = DummyDB( HG.test_controller, self._db_dir, 'test' )
+        
+    
+    def tearDown( self ):
+        
+        self._db.Shutdown()
+        
+        while not self._db.LoopIsFinished():
+            
+            time.sleep( 0.1 )
+            
+        
+        shutil.rmtree( self._db_dir )
+        
+    
+    def _QueueBehindBlock( self, writes ):
+        
+        # the main loop is held on a block job while we queue, so the writes are all waiting when it next looks
+        
+        reached_event = threading.Event()
+        release_event = threading.Event()
+        
+        self._db.Write( 'block', HC.HIGH_PRIORITY, False, reached_event, release_event )
+        
+        self.assertTrue( reached_event.wait( 10 ) )
+        
+        threads = []
+        results = {}
+        
+        for ( action, value ) in writes:
+            
+            def do_it( action, value ):
+                
+                try:
+                    
+                    results[ value ] = self._db.Write( action, HC.HIGH_PRIORITY, True, value )
+                    
+                except Exception as e:
+                    
+                    results[ value ] = e
+                    
+                
+            
+            thread = threading.Thread( target = do_it, args = ( action, value ) )
+            
+            thread.start()
+            
+            threads.append( thread )
+            
+        
+        while self._db._jobs.qsize() < len( writes ):
+            
+            time.sleep( 0.01 )
+            
+        
+        release_event.set()
+        
+        for thread in threads:
+            
+            thread.join( 10 )
+            
+        
+        return results
+        
+    
+    def test_batch( self ):
+        
+        results = self._QueueBehindBlock( [ ( 'append', i ) for i in range( 10 ) ] )
+        
+        self.assertEqual( results, { i : i for i in range( 10 ) } )
+        
+        self.assertEqual( self._db.batch_sizes, [ 10 ] )
+        
+        self.assertEqual( sorted( self._db.Read( 'log', HC.HIGH_PRIORITY ) ), range( 10 ) )
+        
+    
+    def test_batch_failure( self ):
+        
+        # one bad job undoes the batch, which is then redone one job at a time
+        
+        results = self._QueueBehindBlock( [ ( 'append', i ) for i in range( -1, 5 ) ] )
+        
+        self.assertEqual( self._db.batch_sizes, [ 6 ] )
+        
+        self.assertTrue( isinstance( results.pop( -1 ), Exception ) )
+        
+        self.assertEqual( results, { i : i for i in range( 5 ) } )
+        
+        self.assertEqual( sorted( self._db.Read( 'log', HC.HIGH_PRIORITY ) ), range( 5 ) )
+        
+    
+    def test_batch_limits( self ):
+        
+        self._db.WRITE_BATCH_MAX_JOBS = 4
+        
+        results = self._QueueBehindBlock( [ ( 'append', i ) for i in range( 10 ) ] )
+        
+        self.assertEqual( results, { i : i for i in range( 10 ) } )
+        
+        self.assertEqual( self._db.batch_sizes, [ 4, 4, 2 ] )
+        
+        # other writes are not batched
+        
+        self._db.batch_sizes = []
+        
+        results = self._QueueBehindBlock( [ ( 'value', i ) for i in range( 5 ) ] )
+        
+        self.assertEqual( self._db.batch_sizes, [] )
+        
+        self.assertEqual( sorted( self._db.Read( 'log', HC.HIGH_PRIORITY ) ), range( 10 ) )
+        
+    
@@ -146,6 +146,39 @@ class TestSerialisables( unittest.TestCase ):
             
         
     
+    def test_SERIALISABLE_TYPE_CONTENT_UPDATE( self ):
+        
+        content_update = HydrusNetwork.ContentUpdate()
+        
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, ( 5, 65535, HC.IMAGE_JPEG, 1500000000, 640, 480, None, None, None ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, 7 ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 3, [ 9, 1, 5000000 ] ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 4, [ 2 ] ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, ( 3, 4 ) ) )
+        
+        dupe_content_update = HydrusSerialisable.CreateFromNetworkString( content_update.DumpToBinaryNetworkString() )
+        
+        self.assertEqual( dupe_content_update.GetNewFiles(), [ ( 5, 65535, HC.IMAGE_JPEG, 1500000000, 640, 480, None, None, None ) ] )
+        self.assertEqual( dupe_content_update.GetDeletedFiles(), [ 7 ] )
+        self.assertEqual( dupe_content_update.GetNewMappings(), [ ( 3, [ 1, 9, 5000000 ] ), ( 4, [ 2 ] ) ] )
+        self.assertEqual( dupe_content_update.GetDeletedTagSiblings(), [ ( 3, 4 ) ] )
+        self.assertEqual( dupe_content_update.GetNumRows(), content_update.GetNumRows() )
+        
+        #
+        
+        definitions_update = HydrusNetwork.DefinitionsUpdate()
+        
+        hash = HydrusData.GenerateKey()
+        
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_HASHES, 5, hash ) )
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_TAGS, 3, u'series:test' ) )
+        
+        dupe_definitions_update = HydrusSerialisable.CreateFromNetworkString( definitions_update.DumpToBinaryNetworkString() )
+        
+        self.assertEqual( dupe_definitions_update.GetHashIdsToHashes(), { 5 : hash } )
+        self.assertEqual( dupe_definitions_update.GetTagIdsToTags(), { 3 : u'series:test' } )
+        
+    
     def test_SERIALISABLE_TYPE_DUPLICATE_ACTION_OPTIONS( self ):
         
         def test( obj, dupe_obj ):
@@ -533,6 +533,144 @@ class TestTagObjects( unittest.TestCase ):
         self.assertEqual( p.GetUnicode(), u'    series:game of thrones' )
         
     
+class TestTagLookupCache( unittest.TestCase ):
+    
+    class _Controller( object ):
+        
+        def __init__( self, reads ):
+            
+            self._reads = reads
+            
+            self.read_calls = []
+            
+        
+        def GetNewOptions( self ):
+            
+            return HG.test_controller.GetNewOptions()
+            
+        
+        def pub( self, *args, **kwargs ):
+            
+            pass
+            
+        
+        def Read( self, action, *args, **kwargs ):
+            
+            self.read_calls.append( ( action, args ) )
+            
+            return self._reads[ action ]
+            
+        
+        def sub( self, *args, **kwargs ):
+            
+            pass
+            
+        
+    
+    def test_generation( self ):
+        
+        lookup_cache = ClientCaches.TagLookupCache()
+        
+        generation = lookup_cache.GetGeneration()
+        
+        # a lookup that started before a clear may have read the old data
+        
+        lookup_cache.Clear()
+        
+        lookup_cache.AddValues( generation, { ( 'service', 'a' ) : 1 } )
+        
+        self.assertEqual( lookup_cache.GetValues( [ ( 'service', 'a' ) ] ), ( {}, { ( 'service', 'a' ) } ) )
+        
+        lookup_cache.AddValues( lookup_cache.GetGeneration(), { ( 'service', 'a' ) : 1 } )
+        
+        self.assertEqual( lookup_cache.GetValues( [ ( 'service', 'a' ) ] ), ( { ( 'service', 'a' ) : 1 }, set() ) )
+        
+    
+    def test_least_recently_used( self ):
+        
+        lookup_cache = ClientCaches.TagLookupCache( max_size = 2 )
+        
+        lookup_cache.AddValues( lookup_cache.GetGeneration(), { ( 'service', 'a' ) : 1 } )
+        lookup_cache.AddValues( lookup_cache.GetGeneration(), { ( 'service', 'b' ) : 2 } )
+        
+        # using a makes b the oldest
+        
+        lookup_cache.GetValues( [ ( 'service', 'a' ) ] )
+        
+        lookup_cache.AddValues( lookup_cache.GetGeneration(), { ( 'service', 'c' ) : 3 } )
+        
+        self.assertEqual( lookup_cache.GetValues( [ ( 'service', 'a' ), ( 'service', 'b' ), ( 'service', 'c' ) ] ), ( { ( 'service', 'a' ) : 1, ( 'service', 'c' ) : 3 }, { ( 'service', 'b' ) } ) )
+        
+    
+    def test_parents_manager( self ):
+        
+        service_key = HydrusData.GenerateKey()
+        
+        controller = self._Controller( { 'tag_parents_lookup' : { service_key : { 'child' : [ 'mother', 'grandmother' ] } } } )
+        
+        tag_parents_manager = ClientCaches.TagParentsManager( controller )
+        
+        # nothing is loaded until it is needed
+        
+        self.assertEqual( controller.read_calls, [] )
+        
+        self.assertEqual( tag_parents_manager.ExpandTags( service_key, [ 'child', 'orphan' ] ), { 'child', 'mother', 'grandmother', 'orphan' } )
+        
+        ( ( action, ( read_service_key, read_tags ) ), ) = controller.read_calls
+        
+        self.assertEqual( ( action, read_service_key, set( read_tags ) ), ( 'tag_parents_lookup', service_key, { 'child', 'orphan' } ) )
+        
+        # and only the tags it has not seen are asked for again
+        
+        self.assertEqual( tag_parents_manager.GetParents( service_key, 'child' ), [ 'mother', 'grandmother' ] )
+        self.assertEqual( tag_parents_manager.GetParents( service_key, 'orphan' ), [] )
+        
+        self.assertEqual( len( controller.read_calls ), 1 )
+        
+        self.assertEqual( tag_parents_manager.GetParents( service_key, 'mother' ), [] )
+        
+        self.assertEqual( controller.read_calls[1], ( 'tag_parents_lookup', ( service_key, [ 'mother' ] ) ) )
+        
+        # a refresh forgets everything
+        
+        tag_parents_manager.RefreshParents()
+        
+        self.assertEqual( tag_parents_manager.GetParents( service_key, 'child' ), [ 'mother', 'grandmother' ] )
+        
+        self.assertEqual( len( controller.read_calls ), 3 )
+        
+    
+    def test_siblings_manager( self ):
+        
+        service_key = HydrusData.GenerateKey()
+        
+        controller = self._Controller( { 'tag_siblings_lookup' : { service_key : { 'chain_a' : 'chain_c', 'chain_b' : 'chain_c' } } } )
+        
+        tag_siblings_manager = ClientCaches.TagSiblingsManager( controller )
+        
+        self.assertEqual( controller.read_calls, [] )
+        
+        self.assertEqual( tag_siblings_manager.CollapseTags( service_key, [ 'chain_a', 'chain_c', 'other' ] ), { 'chain_c', 'other' } )
+        
+        self.assertEqual( len( controller.read_calls ), 1 )
+        
+        self.assertEqual( set( tag_siblings_manager.GetAllSiblings( service_key, 'chain_c' ) ), { 'chain_a', 'chain_b', 'chain_c' } )
+        self.assertEqual( tag_siblings_manager.GetSibling( service_key, 'chain_a' ), 'chain_c' )
+        self.assertEqual( tag_siblings_manager.GetSibling( service_key, 'other' ), None )
+        
+        self.assertEqual( len( controller.read_calls ), 1 )
+        
+        self.assertEqual( tag_siblings_manager.CollapseTag( service_key, 'chain_b' ), 'chain_c' )
+        
+        self.assertEqual( controller.read_calls[1], ( 'tag_siblings_lookup', ( service_key, [ 'chain_b' ] ) ) )
+        
+        tag_siblings_manager.RefreshSiblings()
+        
+        self.assertEqual( tag_siblings_manager.CollapseTag( service_key, 'chain_b' ), 'chain_c' )
+        
+        self.assertEqual( len( controller.read_calls ), 3 )
+        
+    
 class TestTagParents( unittest.TestCase ):
     
     @classmethod
@@ -565,7 +703,7 @@ class TestTagParents( unittest.TestCase ):
         tag_parents[ cls._second_key ] = second_dict
         tag_parents[ cls._third_key ] = third_dict
         
-        HG.test_controller.SetRead( 'tag_parents', tag_parents )
+        HG.test_controller.SetRead( 'tag_parents_lookup', ClientData.BuildServiceKeysToParents( tag_parents, {}, False ) )
         
         cls._tag_parents_manager = ClientCaches.TagParentsManager( HG.client_controller )
         
@@ -703,24 +841,11 @@ class TestTagSiblings( unittest.TestCase ):
         tag_siblings[ cls._first_key ] = first_dict
         tag_siblings[ cls._second_key ] = second_dict
         
-        HG.test_controller.SetRead( 'tag_siblings', tag_siblings )
+        HG.test_controller.SetRead( 'tag_siblings_lookup', ClientData.BuildServiceKeysToSiblings( tag_siblings ) )
         
         cls._tag_siblings_manager = ClientCaches.TagSiblingsManager( HG.client_controller )
         
     
-    def test_autocomplete( self ):
-        
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'ishy*' ) ), set( [ 'ishygddt', 'i sure hope you guys don\'t do that' ] ) )
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'i su*' ) ), set( [ 'ishygddt', 'i sure hope you guys don\'t do that' ] ) )
-        
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'ayan*' ) ), set( [ 'character:rei ayanami', 'character:ayanami rei' ] ) )
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'rei*' ) ), set( [ 'character:rei ayanami', 'character:ayanami rei' ] ) )
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'character:ayan*' ) ), set( [ 'character:rei ayanami', 'character:ayanami rei' ] ) )
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'character:rei*' ) ), set( [ 'character:rei ayanami', 'character:ayanami rei' ] ) )
-        
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._second_key, 'ishy*' ) ), set() )
-        
-    
     def test_collapse_predicates( self ):
         
         predicates = []
@@ -747,8 +872,6 @@ class TestTagSiblings( unittest.TestCase ):
     
     def test_chain( self ):
         
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'chai*' ) ), set( [ 'chain_a', 'chain_b', 'chain_c' ] ) )
-        
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._first_key, 'chain_a' ), 'chain_c' )
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._first_key, 'chain_b' ), 'chain_c' )
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._first_key, 'chain_c' ), None )
@@ -763,8 +886,6 @@ class TestTagSiblings( unittest.TestCase ):
     
     def test_current( self ):
         
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._second_key, 'curr*' ) ), set( [ 'current_a', 'current_b' ] ) )
-        
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._second_key, 'current_a' ), 'current_b' )
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._second_key, 'current_b' ), None )
         
@@ -780,8 +901,6 @@ class TestTagSiblings( unittest.TestCase ):
     
     def test_deleted( self ):
         
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'dele*' ) ), set() )
-        
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._first_key, 'deleted_a' ), None )
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._first_key, 'deleted_b' ), None )
         
@@ -795,8 +914,6 @@ class TestTagSiblings( unittest.TestCase ):
     
     def test_no_loop( self ):
         
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'loop*' ) ), set( [ 'loop_a', 'loop_b', 'loop_c' ] ) )
-        
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._first_key, 'closed_loop' ), None )
         
         self.assertEqual( set( self._tag_siblings_manager.GetAllSiblings( self._first_key, 'closed_loop' ) ), set( [ 'closed_loop' ] ) )
@@ -808,8 +925,6 @@ class TestTagSiblings( unittest.TestCase ):
     
     def test_not_exist( self ):
         
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._second_key, 'not_*' ) ), set() )
-        
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._second_key, 'not_exist' ), None )
         
         self.assertEqual( set( self._tag_siblings_manager.GetAllSiblings( self._second_key, 'not_exist' ) ), set( [ 'not_exist' ] ) )
@@ -821,8 +936,6 @@ class TestTagSiblings( unittest.TestCase ):
     
     def test_pending_overwrite( self ):
         
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._second_key, 'pend*' ) ), set( [ 'pending_a', 'pending_b' ] ) )
-        
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._second_key, 'pending_a' ), 'pending_b' )
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._second_key, 'pending_b' ), None )
         
@@ -838,8 +951,6 @@ class TestTagSiblings( unittest.TestCase ):
     
     def test_petitioned_no_overwrite( self ):
         
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._second_key, 'petitioned_a*' ) ), set( [ 'petitioned_a', 'petitioned_b' ] ) )
-        
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._second_key, 'petitioned_a' ), 'petitioned_b' )
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._second_key, 'petitioned_b' ), None )
         
@@ -855,8 +966,6 @@ class TestTagSiblings( unittest.TestCase ):
     
     def test_tree( self ):
         
-        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( self._first_key, 'tree*' ) ), set( [ 'tree_1', 'tree_2', 'tree_3', 'tree_4', 'tree_5', 'tree_6' ] ) )
-        
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._first_key, 'tree_1' ), 'tree_6' )
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._first_key, 'tree_2' ), 'tree_6' )
         self.assertEqual( self._tag_siblings_manager.GetSibling( self._first_key, 'tree_3' ), 'tree_6' )
@@ -0,0 +1,241 @@
+import HydrusThreading
+import random
+import sys
+import threading
+import time
+import traceback
+import unittest
+
+class TestBackgroundPrefetcher( unittest.TestCase ):
+    
+    class _Controller( object ):
+        
+        def __init__( self ):
+            
+            self.threads = []
+            
+        
+        # no CallToThread, so the prefetcher cannot use the capped pool
+        
+        def CallToThreadLongRunning( self, callable, *args, **kwargs ):
+            
+            thread = threading.Thread( target = callable, args = args, kwargs = kwargs )
+            
+            thread.daemon = True
+            
+            thread.start()
+            
+            self.threads.append( thread )
+            
+        
+        def JoinThreads( self ):
+            
+            for thread in self.threads:
+                
+                thread.join( 10 )
+                
+                if thread.is_alive():
+                    
+                    raise Exception( 'Prefetch thread did not finish!' )
+                    
+                
+            
+        
+    
+    def test_cancel( self ):
+        
+        controller = self._Controller()
+        
+        lock = threading.Lock()
+        
+        called = set()
+        discarded = []
+        
+        def func( item ):
+            
+            with lock:
+                
+                called.add( item )
+                
+            
+            return item * 2
+            
+        
+        def discard_func( result ):
+            
+            with lock:
+                
+                discarded.append( result )
+                
+            
+        
+        prefetcher = HydrusThreading.BackgroundPrefetcher( controller, func, range( 20 ), num_to_prefetch = 4, num_threads = 2, discard_func = discard_func )
+        
+        iterator = iter( prefetcher )
+        
+        yielded = [ iterator.next(), iterator.next() ]
+        
+        self.assertEqual( yielded, [ ( 0, 0 ), ( 1, 2 ) ] )
+        
+        time.sleep( 0.2 )
+        
+        # stopping early cancels, and the workers stop without going through the whole list
+        
+        iterator.close()
+        
+        controller.JoinThreads()
+        
+        self.assertTrue( len( called ) < 20 )
+        
+        # everything that was made but never yielded was handed to discard_func, exactly once
+        
+        self.assertEqual( sorted( discarded ), sorted( item * 2 for item in called if item not in ( 0, 1 ) ) )
+        
+    
+    def test_exception( self ):
+        
+        controller = self._Controller()
+        
+        def func( item ):
+            
+            if item == 3:
+                
+                raise ValueError( 'bad item ' + str( item ) )
+                
+            
+            return item
+            
+        
+        prefetcher = HydrusThreading.BackgroundPrefetcher( controller, func, range( 10 ), num_threads = 2 )
+        
+        yielded = []
+        
+        try:
+            
+            for ( item, result ) in prefetcher:
+                
+                yielded.append( item )
+                
+            
+            self.fail( 'The exception was not raised!' )
+            
+        except ValueError as e:
+            
+            self.assertEqual( str( e ), 'bad item 3' )
+            
+            # the traceback still goes back to the worker's call
+            
+            ( filename, line_number, function_name, text ) = traceback.extract_tb( sys.exc_info()[2] )[-1]
+            
+            self.assertEqual( function_name, 'func' )
+            
+        
+        self.assertEqual( yielded, [ 0, 1, 2 ] )
+        
+        controller.JoinThreads()
+        
+    
+    def test_order( self ):
+        
+        for num_threads in ( 1, 4 ):
+            
+            controller = self._Controller()
+            
+            def func( item ):
+                
+                time.sleep( random.random() * 0.01 )
+                
+                return item * 2
+                
+            
+            prefetcher = HydrusThreading.BackgroundPrefetcher( controller, func, range( 50 ), num_to_prefetch = 8, num_threads = num_threads )
+            
+            results = list( prefetcher )
+            
+            self.assertEqual( results, [ ( item, item * 2 ) for item in range( 50 ) ] )
+            
+            self.assertEqual( len( controller.threads ), num_threads )
+            
+            controller.JoinThreads()
+            
+        
+    
+    def test_num_threads( self ):
+        
+        controller = self._Controller()
+        
+        prefetcher = HydrusThreading.BackgroundPrefetcher( controller, lambda item: item, range( 100 ), num_to_prefetch = 100, num_threads = 64 )
+        
+        self.assertEqual( list( prefetcher ), [ ( item, item ) for item in range( 100 ) ] )
+        
+        self.assertEqual( len( controller.threads ), HydrusThreading.MAX_NUM_PREFETCH_THREADS )
+        
+        controller.JoinThreads()
+        
+    
+    def test_parallel( self ):
+        
+        controller = self._Controller()
+        
+        second_started = threading.Event()
+        
+        def func( item ):
+            
+            if item == 0:
+                
+                # only returns promptly if another thread is working on item 1 at the same time
+                
+                second_started.wait( 5 )
+                
+                return second_started.is_set()
+                
+            else:
+                
+                second_started.set()
+                
+                return True
+                
+            
+        
+        prefetcher = HydrusThreading.BackgroundPrefetcher( controller, func, range( 2 ), num_threads = 2 )
+        
+        self.assertEqual( list( prefetcher ), [ ( 0, True ), ( 1, True ) ] )
+        
+        controller.JoinThreads()
+        
+    
+    def test_prefetch_limit( self ):
+        
+        controller = self._Controller()
+        
+        lock = threading.Lock()
+        
+        called = []
+        
+        def func( item ):
+            
+            with lock:
+                
+                called.append( item )
+                
+            
+            return item
+            
+        
+        prefetcher = HydrusThreading.BackgroundPrefetcher( controller, func, range( 20 ), num_to_prefetch = 3, num_threads = 2 )
+        
+        iterator = iter( prefetcher )
+        
+        iterator.next()
+        
+        time.sleep( 0.2 )
+        
+        # one consumed, three ready and waiting, and no more
+        
+        self.assertEqual( sorted( called ), [ 0, 1, 2, 3 ] )
+        
+        self.assertEqual( [ item for ( item, result ) in iterator ], range( 1, 20 ) )
+        
+        controller.JoinThreads()
+        
+    
@@ -16,21 +16,28 @@ from include import HydrusSessions
 from include import HydrusTags
 from include import HydrusThreading
 from include import TestClientConstants
+from include import TestClientController
 from include import TestClientDaemons
 from include import TestClientData
+from include import TestClientFiles
+from include import TestClientImporting
 from include import TestClientListBoxes
+from include import TestClientMedia
 from include import TestClientNetworking
+from include import TestClientSimilarFiles
 from include import TestConstants
 from include import TestDialogs
 from include import TestDB
 from include import TestFunctions
 from include import TestClientImageHandling
+from include import TestHydrusDB
 from include import TestHydrusNATPunch
 from include import TestHydrusNetworking
 from include import TestHydrusSerialisable
 from include import TestHydrusServer
 from include import TestHydrusSessions
 from include import TestHydrusTags
+from include import TestHydrusThreading
 import collections
 import os
 import random
@@ -123,7 +130,9 @@ class Controller( object ):
         
         self._reads[ 'sessions' ] = []
         self._reads[ 'tag_parents' ] = {}
+        self._reads[ 'tag_parents_lookup' ] = {}
         self._reads[ 'tag_siblings' ] = {}
+        self._reads[ 'tag_siblings_lookup' ] = {}
         
         HC.options = ClientDefaults.GetClientDefaultOptions()
         
@@ -206,6 +215,11 @@ class Controller( object ):
         return False
         
     
+    def GetDBDir( self ):
+        
+        return self.db_dir
+        
+    
     def GetFilesDir( self ):
         
         return self._server_files_dir
@@ -308,15 +322,22 @@ class Controller( object ):
         if run_all or only_run == 'data':
             
             suites.append( unittest.TestLoader().loadTestsFromModule( TestClientConstants ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientController ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestClientData ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientFiles ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientImporting ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientMedia ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientSimilarFiles ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestFunctions ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusSerialisable ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusSessions ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusTags ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusThreading ) )
             
         if run_all or only_run == 'db':
             
             suites.append( unittest.TestLoader().loadTestsFromModule( TestDB ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusDB ) )
             
         if run_all or only_run == 'networking':
             